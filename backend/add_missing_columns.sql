@@ -1,4 +1,8 @@
 -- 为 test_scenarios 表添加缺失的字段
 ALTER TABLE test_scenarios ADD COLUMN login_config VARCHAR(50) DEFAULT 'no_login' COMMENT '登录配置';
 ALTER TABLE test_scenarios ADD COLUMN session_id INT COMMENT '关联的会话ID';
-ALTER TABLE test_scenarios ADD COLUMN save_session BOOLEAN DEFAULT FALSE COMMENT '是否保存会话';
\ No newline at end of file
+ALTER TABLE test_scenarios ADD COLUMN save_session BOOLEAN DEFAULT FALSE COMMENT '是否保存会话';
+ALTER TABLE test_scenarios ADD COLUMN resource_profile VARCHAR(50) DEFAULT 'none' COMMENT '资源拦截方案';
+
+-- 为 test_reports 表添加失败产物目录字段
+ALTER TABLE test_reports ADD COLUMN artifact_dir VARCHAR(500) COMMENT '失败产物目录（trace.zip、失败截图）';
@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update
-from typing import List
+from typing import List, Optional
 
 from ..core.database import get_db
 from ..models.global_config import GlobalConfig, ConfigKeys
@@ -50,6 +50,9 @@ async def get_settings(db: AsyncSession = Depends(get_db)):
         browser_headless=config_dict.get(ConfigKeys.BROWSER_HEADLESS, "true") == "true",
         use_computer_use=config_dict.get(ConfigKeys.USE_COMPUTER_USE, "false") == "true",
         use_agent_browser=config_dict.get(ConfigKeys.USE_AGENT_BROWSER, "false") == "true",
+        dom_batch_codegen=config_dict.get(ConfigKeys.DOM_BATCH_CODEGEN, "false") == "true",
+        dom_live_tracking=config_dict.get(ConfigKeys.DOM_LIVE_TRACKING, "false") == "true",
+        shared_login_prefix=config_dict.get(ConfigKeys.SHARED_LOGIN_PREFIX, "true") == "true",
         browser_timeout=int(config_dict.get(ConfigKeys.BROWSER_TIMEOUT, "30000"))
     )
 
@@ -72,6 +75,9 @@ async def update_settings(
         (ConfigKeys.BROWSER_HEADLESS, str(settings.browser_headless).lower(), "浏览器无头模式", "boolean"),
         (ConfigKeys.USE_COMPUTER_USE, str(settings.use_computer_use).lower(), "使用Computer-Use方案", "boolean"),
         (ConfigKeys.USE_AGENT_BROWSER, str(settings.use_agent_browser).lower(), "使用agent-browser方案", "boolean"),
+        (ConfigKeys.DOM_BATCH_CODEGEN, str(settings.dom_batch_codegen).lower(), "DOM模式批量生成代码", "boolean"),
+        (ConfigKeys.DOM_LIVE_TRACKING, str(settings.dom_live_tracking).lower(), "DOM模式实时跟踪页面", "boolean"),
+        (ConfigKeys.SHARED_LOGIN_PREFIX, str(settings.shared_login_prefix).lower(), "场景执行共享登录前置步骤", "boolean"),
         (ConfigKeys.BROWSER_TIMEOUT, str(settings.browser_timeout), "浏览器超时时间", "number"),
     ]
     
@@ -111,6 +117,23 @@ async def update_settings(
     return {"message": "配置更新成功"}
 
 
+@router.get("/captcha-locators")
+async def list_captcha_locators():
+    """查看按页面记住的验证码定位（见 app/utils/captcha_memory.py）"""
+    from ..utils import captcha_memory
+
+    return {"path": captcha_memory.memory_path(), "locators": captcha_memory.load_all()}
+
+
+@router.delete("/captcha-locators")
+async def clear_captcha_locators(page: Optional[str] = None):
+    """清除记住的验证码定位（page 为页面 URL 或记录的键，不传时清除全部），页面改版后定位不准时使用"""
+    from ..utils import captcha_memory
+
+    count = captcha_memory.forget(page)
+    return {"message": f"已清除 {count} 条验证码定位", "count": count}
+
+
 @router.get("/{config_key}", response_model=GlobalConfigResponse)
 async def get_config(
     config_key: str,
@@ -2,6 +2,7 @@ import asyncio
 import sys
 import logging
 import json
+from contextlib import ExitStack
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update, delete
@@ -18,14 +19,16 @@ from ..schemas.test_case import (
     TestScenarioWithCases,
     ScenarioGenerateRequest,
     ScenarioExecuteRequest,
+    NetworkMode,
     QuickGenerateRequest,
     TestCaseResponse,
     TestReportResponse,
     TestStepResultResponse,
     GenerationStrategy
 )
-from ..services.executor.test_executor import test_executor
-from ..services.generator.test_generator import test_generator
+
+# 生成/执行服务依赖 langchain、openai、playwright，在需要它们的接口内延迟导入，
+# 保持 CRUD 接口和进程启动轻量
 
 router = APIRouter(prefix="/api/scenarios", tags=["测试场景"])
 
@@ -102,6 +105,7 @@ async def get_scenario(
         "target_url": scenario.target_url,
         "user_query": scenario.user_query,
         "generation_strategy": scenario.generation_strategy,
+        "resource_profile": scenario.resource_profile or "none",
         "total_cases": scenario.total_cases,
         "status": scenario.status,
         "created_at": scenario.created_at,
@@ -162,6 +166,10 @@ async def generate_scenario_cases(
     db: AsyncSession = Depends(get_db)
 ):
     """为场景生成测试用例"""
+    from ..services.executor.test_executor import test_executor
+    from ..services.generator.codegen_memo import codegen_memo_scope
+    from ..services.generator.test_generator import test_generator
+
     result = await db.execute(
         select(TestScenario).where(TestScenario.id == scenario_id)
     )
@@ -170,6 +178,8 @@ async def generate_scenario_cases(
     if not scenario:
         raise HTTPException(status_code=404, detail="测试场景不存在")
 
+    # 同一场景的用例共享代码生成复用表（见 codegen_memo），在生成用例前进入
+    memo_scope = ExitStack()
     try:
         # 先删除该场景下所有测试用例关联的测试报告
         print(f"   Deleting existing test reports for scenario {scenario_id}")
@@ -204,6 +214,11 @@ async def generate_scenario_cases(
         await db.commit()
         print(f"   Existing test cases deleted")
 
+        # 删除旧用例录制的 HAR
+        from ..utils import har_replay
+        for test_case_id in test_case_ids:
+            har_replay.forget(test_case_id)
+
         # 获取场景的load_saved_storage配置
         load_saved_storage = scenario.load_saved_storage if hasattr(scenario, 'load_saved_storage') else True
         print(f"   Load saved storage from scenario: {load_saved_storage}")
@@ -211,6 +226,9 @@ async def generate_scenario_cases(
         # 从场景配置读取公共参数
         use_captcha = scenario.use_captcha if hasattr(scenario, 'use_captcha') else False
         auto_cookie_localstorage = scenario.auto_cookie_localstorage if hasattr(scenario, 'auto_cookie_localstorage') else True
+        # 页面内容获取和生成的脚本按场景的资源拦截方案拦截请求（agent-browser 方案不支持）
+        resource_profile = getattr(scenario, 'resource_profile', None) or "none"
+        print(f"   Resource profile from scenario: {resource_profile}")
 
         # 提前读取模式配置（只查一次）
         use_agent_browser = False
@@ -248,11 +266,14 @@ async def generate_scenario_cases(
                 scenario.user_query,
                 scenario.target_url,
                 strategy,
-                load_saved_storage
+                load_saved_storage,
+                resource_profile
             )
             print(f"   Page content fetched: {page_content.get('title', 'N/A')}")
 
         # 为每个用例生成操作步骤和脚本
+        # 同一场景的用例共享代码生成复用表，相同的开头步骤（打开页面、登录等）只调用一次LLM
+        memo_scope.enter_context(codegen_memo_scope())
         generated_cases = []
         print(f"   开始处理 {len(test_cases_data)} 个测试用例数据...")
         for idx, case_data in enumerate(test_cases_data, 1):
@@ -289,7 +310,8 @@ async def generate_scenario_cases(
                     auto_detect_captcha=use_captcha,
                     auto_cookie_localstorage=auto_cookie_localstorage,
                     load_saved_storage=load_saved_storage,
-                    page_content=page_content
+                    page_content=page_content,
+                    resource_profile=resource_profile
                 )
             else:
                 print(f"   Using HTML approach for: {case_data['name']}")
@@ -299,7 +321,8 @@ async def generate_scenario_cases(
                     auto_detect_captcha=use_captcha,
                     auto_cookie_localstorage=auto_cookie_localstorage,
                     load_saved_storage=load_saved_storage,
-                    page_content=page_content
+                    page_content=page_content,
+                    resource_profile=resource_profile
                 )
             
             # 检查脚本生成是否成功
@@ -309,6 +332,10 @@ async def generate_scenario_cases(
             
             script = script_result.get("script", "")
             print(f"   Script generated: {len(script)} chars")
+            codegen_stats = script_result.get("codegen_stats")
+            if codegen_stats and codegen_stats.get("mode") == "batch":
+                print(f"   Batch codegen: {codegen_stats['llm_calls']} LLM calls, "
+                      f"saved ~{codegen_stats['prompt_tokens_saved']} prompt tokens, ~{codegen_stats['time_saved_ms']}ms")
 
             # 将 expected_result 转换为 JSON 字符串
             expected_result = case_data.get("expected_result")
@@ -338,6 +365,7 @@ async def generate_scenario_cases(
 
             db.add(db_case)
             generated_cases.append(db_case)
+        memo_scope.close()  # 输出代码复用的命中统计
 
 
 
@@ -375,6 +403,7 @@ async def generate_scenario_cases(
             use_captcha=scenario.use_captcha,
             auto_cookie_localstorage=scenario.auto_cookie_localstorage,
             load_saved_storage=scenario.load_saved_storage,
+            resource_profile=resource_profile,
             test_cases=test_cases
         )
 
@@ -389,14 +418,23 @@ async def generate_scenario_cases(
         print(f"错误堆栈:\n{error_detail}")
         
         raise HTTPException(status_code=500, detail=f"生成测试用例失败: {str(e)}")
+    finally:
+        memo_scope.close()
 
 
 @router.post("/{scenario_id}/execute")
 async def execute_scenario_cases(
     scenario_id: int,
+    network_mode: NetworkMode = NetworkMode.LIVE,
     db: AsyncSession = Depends(get_db)
 ):
-    """执行场景下的所有测试用例"""
+    """
+    执行场景下的所有测试用例
+    network_mode: live 正常访问网络 / record 录制每个用例的 HAR / replay 从录制的 HAR 回放
+    """
+    from ..services.executor.login_prefix import hit_login_wall
+    from ..services.executor.test_executor import test_executor
+
     result = await db.execute(
         select(TestScenario).where(TestScenario.id == scenario_id)
     )
@@ -421,132 +459,206 @@ async def execute_scenario_cases(
     passed_count = 0
     failed_count = 0
 
-    for test_case in test_cases:
-        try:
-            # 更新用例状态
-            await db.execute(
-                update(TestCase)
-                .where(TestCase.id == test_case.id)
-                .values(status="executing")
-            )
-            await db.commit()
+    # 共享登录前置步骤：登录步骤相同的用例只登录一次，其余用例从登录后的状态开始
+    # 录制和回放 HAR 时每个用例按完整脚本执行，录制内容覆盖整个用例
+    shared_prefix = {}
+    config_result = await db.execute(
+        select(GlobalConfig).where(GlobalConfig.config_key == ConfigKeys.SHARED_LOGIN_PREFIX)
+    )
+    config = config_result.scalar_one_or_none()
+    if network_mode == NetworkMode.LIVE and (not config or config.config_value.lower() == "true"):
+        shared_prefix = await test_executor.prepare_shared_login_prefix({
+            c.id: c.script for c in test_cases if c.script and c.script.strip()
+        }, scenario_id=scenario.id)
 
-            # 使用已保存的脚本执行（脚本在"生成用例"时已生成）
-            if test_case.script and test_case.script.strip():
-                print(f"   Using saved script for test case {test_case.id}")
-                execution_result = await test_executor.execute_saved_script(test_case.script)
-            else:
-                print(f"   No saved script found for test case {test_case.id}, skipping (please generate first)")
-                execution_result = {
-                    "status": "error",
-                    "error": "测试脚本为空，请先点击'生成用例'生成测试脚本"
-                }
+    # 出现异常时也要删除保存的登录状态（包含凭据）、归还租用的会话
+    try:
+        for test_case in test_cases:
+            try:
+                # 更新用例状态
+                await db.execute(
+                    update(TestCase)
+                    .where(TestCase.id == test_case.id)
+                    .values(status="executing")
+                )
+                await db.commit()
+
+                # 使用已保存的脚本执行（脚本在"生成用例"时已生成）
+                shared = shared_prefix.get(test_case.id)
+                execution_result = None
+                if shared:
+                    print(f"   Using shared login prefix for test case {test_case.id}, running remaining steps only")
+                    execution_result = await test_executor.execute_saved_script(shared["script"])
+                    prefix = shared["prefix"]
+                    if execution_result.get("status") != "success" and hit_login_wall(
+                        execution_result.get("execution_output", ""), prefix["url"], prefix["start_url"]
+                    ):
+                        # 被登录页拦下（登录状态已失效）：按完整脚本重新执行，租用的会话归还时标记为失效
+                        print(f"   Test case {test_case.id} hit a login wall with the shared login state, rerunning full script")
+                        prefix["login_wall"] = True
+                        shared = None
+                        execution_result = None
+                    else:
+                        execution_result["script"] = test_case.script
+                        # 后续脚本的第 0 步是打开登录后的页面，前置步骤的结果只记录在组内第一个用例的报告中
+                        suffix_steps = [s for s in execution_result.get("step_results", []) if s.get("step_number") != 0]
+                        if prefix["report_id"] is None:
+                            suffix_steps = prefix["result"].get("step_results", []) + suffix_steps
+                        execution_result["step_results"] = suffix_steps
+                if execution_result is None and test_case.script and test_case.script.strip():
+                    print(f"   Using saved script for test case {test_case.id}")
+                    execution_result = await test_executor.execute_saved_script(
+                        test_case.script, network_mode=network_mode.value, case_id=test_case.id
+                    )
+                elif execution_result is None:
+                    print(f"   No saved script found for test case {test_case.id}, skipping (please generate first)")
+                    execution_result = {
+                        "status": "error",
+                        "error": "测试脚本为空，请先点击'生成用例'生成测试脚本"
+                    }
+
+                # 更新用例
+                status = "completed" if execution_result.get("status") == "success" else "failed"
+                await db.execute(
+                    update(TestCase)
+                    .where(TestCase.id == test_case.id)
+                    .values(
+                        script=execution_result.get("script") or test_case.script,
+                        status=status,
+                        execution_count=test_case.execution_count + 1
+                    )
+                )
 
-            # 更新用例
-            status = "completed" if execution_result.get("status") == "success" else "failed"
-            await db.execute(
-                update(TestCase)
-                .where(TestCase.id == test_case.id)
-                .values(
-                    script=execution_result.get("script") or test_case.script,
-                    status=status,
-                    execution_count=test_case.execution_count + 1
+                # 创建测试报告
+                test_report = TestReport(
+                    test_case_id=test_case.id,
+                    scenario_id=scenario.id,
+                    status="passed" if execution_result.get("status") == "success" else "failed",
+                    result=execution_result.get("report"),
+                    error_message=execution_result.get("error"),
+                    artifact_dir=(execution_result.get("artifacts") or {}).get("dir")
                 )
-            )
+                db.add(test_report)
+                await db.flush()  # 获取 test_report.id
 
-            # 创建测试报告
-            test_report = TestReport(
-                test_case_id=test_case.id,
-                scenario_id=scenario.id,
-                status="passed" if execution_result.get("status") == "success" else "failed",
-                result=execution_result.get("report"),
-                error_message=execution_result.get("error")
-            )
-            db.add(test_report)
-            await db.flush()  # 获取 test_report.id
-
-            # 保存步骤结果到 TestStepResult
-            step_results_data = execution_result.get("step_results", [])
-            if step_results_data:
-                from datetime import datetime
-                # 将 step_start/step_end 事件配对后写入数据库
-                step_starts = {s["step_number"]: s for s in step_results_data if s.get("event") == "step_start"}
-                step_ends = {s["step_number"]: s for s in step_results_data if s.get("event") == "step_end"}
-                # 收集 VL 验证结果
-                step_verifications = {s["step_number"]: s for s in step_results_data if s.get("event") == "step_verification"}
-                for step_num, start_data in step_starts.items():
-                    end_data = step_ends.get(step_num, {})
-                    verification = step_verifications.get(step_num, {})
-                    start_time = None
-                    end_time = None
-                    try:
-                        if start_data.get("start_time"):
-                            start_time = datetime.fromisoformat(start_data["start_time"])
-                        if end_data.get("end_time"):
-                            end_time = datetime.fromisoformat(end_data["end_time"])
-                    except Exception:
-                        pass
-
-                    # 从 output_data 提取 screenshot_path
-                    output_data = end_data.get("output_data")
-                    screenshot_path = None
-                    if isinstance(output_data, dict):
-                        screenshot_path = output_data.get("screenshot_path")
-
-                    # 合并 VL 验证结果到 output_data
-                    if verification:
-                        if output_data is None:
-                            output_data = {}
-                        elif not isinstance(output_data, dict):
-                            output_data = {}
-                        output_data["vl_verified"] = verification.get("verified")
-                        output_data["vl_reason"] = verification.get("reason")
-
-                    step_record = TestStepResult(
+                if shared and shared["prefix"].get("lease"):
+                    # 租用了会话池中的登录会话，没有执行登录步骤
+                    lease = shared["prefix"]["lease"]
+                    db.add(TestStepResult(
                         test_report_id=test_report.id,
-                        step_number=step_num,
-                        step_name=start_data.get("step_name", f"Step {step_num}"),
-                        step_type=start_data.get("step_type", "action"),
-                        status=end_data.get("status", start_data.get("status", "unknown")),
-                        start_time=start_time,
-                        end_time=end_time,
-                        execution_duration=end_data.get("execution_duration_ms"),
-                        output_data=output_data,
-                        error_message=end_data.get("error_message"),
-                        screenshot_path=screenshot_path,
-                    )
-                    db.add(step_record)
-
-            execution_results.append({
-                "test_case_id": test_case.id,
-                "test_case_name": test_case.name,
-                "status": status,
-                "result": execution_result.get("report")
-            })
+                        step_number=0,
+                        step_name=f"使用会话池中的登录会话 #{lease['session_id']}（跳过登录步骤）",
+                        step_type="shared_prefix",
+                        status="passed",
+                        execution_duration=0,
+                        output_data={"session_id": lease["session_id"], "url": lease["url"]},
+                    ))
+                elif shared:
+                    prefix = shared["prefix"]
+                    if prefix["report_id"] is None:
+                        prefix["report_id"] = test_report.id
+                    else:
+                        # 引用记录了前置步骤结果的报告
+                        prefix_steps = prefix["result"].get("step_results", [])
+                        db.add(TestStepResult(
+                            test_report_id=test_report.id,
+                            step_number=0,
+                            step_name=f"共享登录前置步骤（见报告 #{prefix['report_id']}）",
+                            step_type="shared_prefix",
+                            status="passed",
+                            execution_duration=prefix["duration_ms"],
+                            output_data={
+                                "shared_prefix_report_id": prefix["report_id"],
+                                "url": prefix["url"],
+                                "steps": [s.get("step_name") for s in prefix_steps if s.get("event") == "step_start"],
+                            },
+                        ))
+
+                # 保存步骤结果到 TestStepResult
+                step_results_data = execution_result.get("step_results", [])
+                if step_results_data:
+                    from datetime import datetime
+                    # 将 step_start/step_end 事件配对后写入数据库
+                    step_starts = {s["step_number"]: s for s in step_results_data if s.get("event") == "step_start"}
+                    step_ends = {s["step_number"]: s for s in step_results_data if s.get("event") == "step_end"}
+                    # 收集 VL 验证结果
+                    step_verifications = {s["step_number"]: s for s in step_results_data if s.get("event") == "step_verification"}
+                    for step_num, start_data in step_starts.items():
+                        end_data = step_ends.get(step_num, {})
+                        verification = step_verifications.get(step_num, {})
+                        start_time = None
+                        end_time = None
+                        try:
+                            if start_data.get("start_time"):
+                                start_time = datetime.fromisoformat(start_data["start_time"])
+                            if end_data.get("end_time"):
+                                end_time = datetime.fromisoformat(end_data["end_time"])
+                        except Exception:
+                            pass
+
+                        # 从 output_data 提取 screenshot_path
+                        output_data = end_data.get("output_data")
+                        screenshot_path = None
+                        if isinstance(output_data, dict):
+                            screenshot_path = output_data.get("screenshot_path")
+
+                        # 合并 VL 验证结果到 output_data
+                        if verification:
+                            if output_data is None:
+                                output_data = {}
+                            elif not isinstance(output_data, dict):
+                                output_data = {}
+                            output_data["vl_verified"] = verification.get("verified")
+                            output_data["vl_reason"] = verification.get("reason")
+
+                        step_record = TestStepResult(
+                            test_report_id=test_report.id,
+                            step_number=step_num,
+                            step_name=start_data.get("step_name", f"Step {step_num}"),
+                            step_type=start_data.get("step_type", "action"),
+                            status=end_data.get("status", start_data.get("status", "unknown")),
+                            start_time=start_time,
+                            end_time=end_time,
+                            execution_duration=end_data.get("execution_duration_ms"),
+                            output_data=output_data,
+                            error_message=end_data.get("error_message"),
+                            screenshot_path=screenshot_path,
+                        )
+                        db.add(step_record)
+
+                execution_results.append({
+                    "test_case_id": test_case.id,
+                    "test_case_name": test_case.name,
+                    "status": status,
+                    "result": execution_result.get("report"),
+                    "har": execution_result.get("har")
+                })
+
+                if execution_result.get("status") == "success":
+                    passed_count += 1
+                else:
+                    failed_count += 1
+
+            except Exception as e:
+                # 更新用例状态为失败
+                await db.execute(
+                    update(TestCase)
+                    .where(TestCase.id == test_case.id)
+                    .values(status="failed")
+                )
+                await db.commit()
 
-            if execution_result.get("status") == "success":
-                passed_count += 1
-            else:
+                execution_results.append({
+                    "test_case_id": test_case.id,
+                    "test_case_name": test_case.name,
+                    "status": "error",
+                    "error": str(e)
+                })
                 failed_count += 1
 
-        except Exception as e:
-            # 更新用例状态为失败
-            await db.execute(
-                update(TestCase)
-                .where(TestCase.id == test_case.id)
-                .values(status="failed")
-            )
-            await db.commit()
-
-            execution_results.append({
-                "test_case_id": test_case.id,
-                "test_case_name": test_case.name,
-                "status": "error",
-                "error": str(e)
-            })
-            failed_count += 1
-
-    await db.commit()
+        await db.commit()
+    finally:
+        await test_executor.release_shared_login_prefix(shared_prefix)
 
     return {
         "message": f"执行完成，通过 {passed_count} 个，失败 {failed_count} 个",
@@ -626,6 +738,11 @@ async def quick_generate_scenario(
     db: AsyncSession = Depends(get_db)
 ):
     """快速生成场景和测试用例（不保存到数据库）"""
+    from ..services.executor.test_executor import test_executor
+    from ..services.generator.codegen_memo import codegen_memo_scope
+    from ..services.generator.test_generator import test_generator
+
+    memo_scope = ExitStack()
     try:
         # 如果未提供目标URL，从全局配置中获取
         target_url = request.target_url
@@ -654,6 +771,7 @@ async def quick_generate_scenario(
         )
 
         # 为每个用例生成操作步骤和脚本
+        memo_scope.enter_context(codegen_memo_scope())
         generated_cases = []
         for case_data in test_cases_data:
             # 生成操作步骤
@@ -701,6 +819,7 @@ async def quick_generate_scenario(
                 "report": execution_result.get("report"),
                 "status": execution_result.get("status")
             })
+        memo_scope.close()  # 输出代码复用的命中统计
 
         return {
             "scenario": {
@@ -722,3 +841,5 @@ async def quick_generate_scenario(
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"生成失败: {str(e)}")
+    finally:
+        memo_scope.close()
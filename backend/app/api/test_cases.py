@@ -15,8 +15,8 @@ from ..schemas.test_case import (
     TestReportResponse,
     TestStepResultResponse
 )
-from ..services.executor.test_executor import test_executor
-from ..services.generator.test_generator import test_generator
+
+# 生成/执行服务依赖 langchain、openai、playwright，在需要它们的接口内延迟导入
 
 router = APIRouter(prefix="/api/test-cases", tags=["测试用例"])
 
@@ -107,6 +107,9 @@ async def delete_test_case(
 
     await db.delete(test_case)
     await db.commit()
+
+    from ..utils import har_replay
+    har_replay.forget(test_case_id)
     return {"message": "测试用例已删除"}
 
 
@@ -116,6 +119,8 @@ async def generate_test_case(
     db: AsyncSession = Depends(get_db)
 ):
     """生成测试用例"""
+    from ..services.generator.test_generator import test_generator
+
     result = await db.execute(
         select(TestCase).where(TestCase.id == test_case_id)
     )
@@ -153,6 +158,8 @@ async def execute_test_case(
     db: AsyncSession = Depends(get_db)
 ):
     """执行测试用例"""
+    from ..services.executor.test_executor import test_executor
+
     result = await db.execute(
         select(TestCase).where(TestCase.id == test_case_id)
     )
@@ -191,7 +198,8 @@ async def execute_test_case(
             test_case_id=test_case_id,
             status="passed" if execution_result.get("status") == "success" else "failed",
             result=execution_result.get("report"),
-            error_message=execution_result.get("error")
+            error_message=execution_result.get("error"),
+            artifact_dir=(execution_result.get("artifacts") or {}).get("dir")
         )
         db.add(test_report)
         await db.commit()
@@ -265,6 +273,35 @@ async def execute_test_case(
         raise HTTPException(status_code=500, detail=f"测试执行失败: {str(e)}")
 
 
+@router.get("/{test_case_id}/har")
+async def get_test_case_har(
+    test_case_id: int,
+    db: AsyncSession = Depends(get_db)
+):
+    """获取测试用例的 HAR 录制状态（是否存在、录制时间、是否过期及原因）"""
+    from ..utils import har_replay
+
+    result = await db.execute(
+        select(TestCase).where(TestCase.id == test_case_id)
+    )
+    test_case = result.scalar_one_or_none()
+
+    if not test_case:
+        raise HTTPException(status_code=404, detail="测试用例不存在")
+
+    return har_replay.staleness(test_case_id, test_case.script or "")
+
+
+@router.delete("/{test_case_id}/har")
+async def delete_test_case_har(test_case_id: int):
+    """删除测试用例的 HAR 录制"""
+    from ..utils import har_replay
+
+    if not har_replay.forget(test_case_id):
+        raise HTTPException(status_code=404, detail="该用例没有 HAR 录制")
+    return {"message": "HAR 录制已删除"}
+
+
 @router.get("/{test_case_id}/reports", response_model=List[TestReportResponse])
 async def get_test_case_reports(
     test_case_id: int,
@@ -333,6 +370,8 @@ async def quick_generate_test_case(
     target_url: str
 ):
     """快速生成测试用例（不保存到数据库）"""
+    from ..services.executor.test_executor import test_executor
+
     try:
         result = await test_executor.execute_workflow(user_query, target_url)
         return result
@@ -348,6 +387,8 @@ async def quick_generate_with_captcha(
     captcha_input_selector: str = None
 ):
     """快速生成带验证码的测试用例"""
+    from ..services.executor.test_executor import test_executor
+
     try:
         result = await test_executor.execute_with_captcha(
             user_query,
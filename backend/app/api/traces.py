@@ -0,0 +1,113 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import HTMLResponse
+from html import escape
+
+from ..core.tracing import list_traces, load_trace
+
+router = APIRouter(prefix="/api/traces", tags=["链路追踪"])
+
+
+def _build_waterfall(spans):
+    """计算每个 span 相对 trace 开始的偏移和层级"""
+    trace_start = min(s["start_ns"] for s in spans)
+    trace_end = max((s["end_ns"] or s["start_ns"]) for s in spans)
+    by_id = {s["span_id"]: s for s in spans}
+
+    def depth(span):
+        level = 0
+        parent = by_id.get(span["parent_span_id"])
+        while parent is not None and level < 50:
+            level += 1
+            parent = by_id.get(parent["parent_span_id"])
+        return level
+
+    # 按父子关系深度优先排序，兄弟节点按开始时间
+    children = {}
+    for s in spans:
+        parent_id = s["parent_span_id"] if s["parent_span_id"] in by_id else None
+        children.setdefault(parent_id, []).append(s)
+    ordered = []
+
+    def walk(parent_id):
+        for child in sorted(children.get(parent_id, []), key=lambda s: s["start_ns"]):
+            ordered.append(child)
+            walk(child["span_id"])
+
+    walk(None)
+
+    rows = []
+    for s in ordered:
+        end_ns = s["end_ns"] or trace_end
+        rows.append({
+            "span_id": s["span_id"],
+            "parent_span_id": s["parent_span_id"],
+            "name": s["name"],
+            "depth": depth(s),
+            "offset_ms": round((s["start_ns"] - trace_start) / 1e6, 1),
+            "duration_ms": round((end_ns - s["start_ns"]) / 1e6, 1),
+            "status": s["status"],
+            "in_progress": s["end_ns"] is None,
+            "error": s["error"],
+            "attributes": s["attributes"],
+        })
+    return {
+        "total_ms": round((trace_end - trace_start) / 1e6, 1),
+        "span_count": len(rows),
+        "spans": rows,
+    }
+
+
+@router.get("/")
+async def get_traces(limit: int = 50):
+    """列出最近的 trace"""
+    return list_traces(limit)
+
+
+@router.get("/{trace_id}")
+async def get_trace(trace_id: str):
+    """获取 trace 的瀑布图数据"""
+    spans = load_trace(trace_id)
+    if not spans:
+        raise HTTPException(status_code=404, detail="Trace 不存在")
+    return {"trace_id": trace_id, **_build_waterfall(spans)}
+
+
+@router.get("/{trace_id}/view", response_class=HTMLResponse)
+async def view_trace(trace_id: str):
+    """以 HTML 瀑布图展示 trace"""
+    spans = load_trace(trace_id)
+    if not spans:
+        raise HTTPException(status_code=404, detail="Trace 不存在")
+    waterfall = _build_waterfall(spans)
+    total = waterfall["total_ms"] or 1
+
+    rows = []
+    for s in waterfall["spans"]:
+        left = s["offset_ms"] / total * 100
+        width = max(s["duration_ms"] / total * 100, 0.3)
+        color = "#e5534b" if s["status"] == "error" else ("#d4a72c" if s["in_progress"] else "#4c8eda")
+        attrs = ", ".join(f"{k}={v}" for k, v in s["attributes"].items())
+        title = escape(f"{s['name']} {s['duration_ms']}ms {attrs} {s['error'] or ''}".strip())
+        rows.append(
+            f'<tr title="{title}">'
+            f'<td style="padding-left:{s["depth"] * 16 + 4}px">{escape(s["name"])}</td>'
+            f'<td class="ms">{s["duration_ms"]}ms</td>'
+            f'<td class="bar"><div style="margin-left:{left:.2f}%;width:{width:.2f}%;background:{color}"></div></td>'
+            f'</tr>'
+        )
+
+    html = f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Trace {escape(trace_id)}</title>
+<style>
+body {{ font-family: -apple-system, "Segoe UI", sans-serif; font-size: 13px; margin: 16px; }}
+table {{ width: 100%; border-collapse: collapse; table-layout: fixed; }}
+td {{ padding: 3px 4px; border-bottom: 1px solid #eee; white-space: nowrap; overflow: hidden; text-overflow: ellipsis; }}
+td:first-child {{ width: 32%; }}
+td.ms {{ width: 90px; text-align: right; color: #555; }}
+td.bar div {{ height: 12px; border-radius: 2px; }}
+</style></head><body>
+<h3>Trace {escape(trace_id)}</h3>
+<p>总耗时 {waterfall["total_ms"]}ms，共 {waterfall["span_count"]} 个 span</p>
+<table>{"".join(rows)}</table>
+</body></html>"""
+    return HTMLResponse(html)
@@ -24,12 +24,74 @@ class Settings(BaseSettings):
     BROWSER_HEADLESS: bool = True
     BROWSER_TIMEOUT: int = 30000
 
+    # 提示词中 DOM 的精简（见 app/services/generator/dom_distiller.py）
+    DOM_PROMPT_TOKEN_BUDGET: int = 1500  # 单次代码生成中 DOM 部分的 token 预算
+    DOM_CHUNK_MAX_CHARS: int = 800  # 单个 DOM 片段的最大字符数
+    # 提示词中的页面表示：page_model 为可交互元素清单（见 app/services/generator/page_model.py），html 为精简后的 HTML
+    PROMPT_DOM_FORMAT: str = "page_model"
+    # 生成代码的离线选择器校验（见 app/services/generator/selector_validator.py）
+    SELECTOR_VALIDATION: bool = True
+    SELECTOR_VALIDATION_RETRIES: int = 1  # 选择器匹配不到元素时带错误信息重新生成的次数
+
+    # 浏览器池配置（DOM 实时跟踪生成模式使用，见 app/services/executor/browser_pool.py）
+    BROWSER_POOL_SIZE: int = 2  # 同时租用的最大页面数
+    LIVE_CODEGEN_STEP_TIMEOUT_MS: int = 20000  # 实时执行单个代码片段的超时
+    LIVE_CODEGEN_MAX_RETRIES: int = 2  # 片段执行失败后带错误信息重新生成的次数
+
     # 会话存储配置
     SESSION_STORAGE_PATH: str = ""  # cookies、localStorage、sessionStorage文件的存储路径
+    # 会话池配置（见 app/services/session/session_pool.py）
+    SESSION_POOL_SIZE: int = 2  # 每个登录前置步骤保持的已登录会话数，0 表示不使用会话池
+    SESSION_POOL_PROBE_INTERVAL: int = 300  # 后台检查会话有效性的间隔（秒）
+    SESSION_POOL_REFRESH_MARGIN: int = 600  # 距离过期不足该秒数的会话提前刷新
+    SESSION_POOL_MAX_AGE: int = 7200  # 无法从 cookie / token 得到过期时间时会话的有效期（秒）
+    SESSION_POOL_IDLE_TIMEOUT: int = 86400  # 超过该秒数没有被租用的登录前置步骤不再维护，删除池中的会话
+
+    # 本地验证码识别配置（见 app/utils/captcha_recognizer.py，测试脚本子进程从环境变量读取）
+    CAPTCHA_LOCAL_RECOGNIZER: bool = True  # 先用本地 CPU 识别，置信度不足时才调用 VL 模型
+    CAPTCHA_LOCAL_MIN_CONFIDENCE: float = 0.8  # 直接使用本地识别结果的最低置信度
+    CAPTCHA_GLYPH_PATH: str = ""  # 从 VL 识别结果学到的字形文件，留空为 SESSION_STORAGE_PATH/captcha_glyphs.json
+    # 按图片内容缓存 VL 识别的验证码答案（见 app/utils/captcha_cache.py），登录失败时清除
+    CAPTCHA_ANSWER_CACHE_TTL: int = 300  # 缓存有效期（秒），0 表示不缓存
+    CAPTCHA_ANSWER_CACHE_PATH: str = ""  # 留空为 SESSION_STORAGE_PATH/captcha_answers.json
+
+    # 资源拦截方案（见 app/utils/resource_profiles.py）始终放行的请求 URL 正则，
+    # 验证码接口地址不含 captcha 等关键字时在这里配置，如 /api/getImage|/login/code
+    RESOURCE_ALLOW_PATTERN: str = ""
+    # HAR 录制/回放执行模式（见 app/utils/har_replay.py）
+    HAR_STORAGE_PATH: str = ""  # 留空为 SESSION_STORAGE_PATH/har
+    HAR_MAX_AGE_DAYS: float = 7  # 录制超过该天数视为过期，0 表示不按时间判断
+    HAR_MAX_MISS_RATIO: float = 0.1  # 回放时没有录到的请求比例超过该值视为过期
+    # 失败产物（见 app/utils/run_artifacts.py）：测试脚本始终记录 Playwright trace，只在失败时保存
+    FAILURE_TRACE_ENABLED: bool = True  # 关闭后失败时只保存截图
+    ARTIFACT_STORAGE_PATH: str = ""  # 留空为 SESSION_STORAGE_PATH/artifacts
+    # 步骤截图存储（见 app/services/screenshot/screenshot_store.py）：按内容去重、重新编码，缩略图按需生成
+    SCREENSHOT_FORMAT: str = "webp"  # webp / jpeg / png（Pillow 不支持 WebP 时用 jpeg）
+    SCREENSHOT_QUALITY: int = 80  # webp / jpeg 的编码质量
+    SCREENSHOT_THUMB_WIDTH: int = 320  # 缩略图宽度（像素）
+    SCREENSHOT_GC_INTERVAL: int = 3600  # 后台清理没有步骤结果引用的截图的间隔（秒），0 表示不清理
+    SCREENSHOT_GC_GRACE: int = 3600  # 修改时间在该秒数以内的文件不清理
 
     # Python路径配置（用于测试脚本导入app模块）
     PYTHON_PATH: str = ""  # 项目根目录路径
 
+    # 日志配置（异步队列写出，见 app/core/logging_config.py）
+    LOG_LEVEL: str = "INFO"
+    LOG_DIR: str = "logs"
+    LOG_QUEUE_SIZE: int = 10000  # 队列中最多的日志条数，队列满时丢弃新日志，不阻塞请求
+    LOG_QUEUE_MAX_CHARS: int = 32 * 1024 * 1024  # 队列中消息和 LLM 消息文件的总字符数上限，超出时先丢弃消息文件
+    LOG_MAX_MESSAGE_CHARS: int = 4000  # 单条日志消息的最大字符数
+    LOG_FILE_MAX_BYTES: int = 10 * 1024 * 1024
+    LOG_FILE_BACKUP_COUNT: int = 5
+    LOG_REQUESTS: bool = True  # 是否记录每个 HTTP 请求
+    LOG_ACCESS_SAMPLE_RATE: float = 1.0  # 请求日志采样率，WARNING 及以上不采样
+    LLM_LOG_PAYLOADS: bool = True  # 是否把 LLM 请求的完整消息写入 logs/request_* 目录
+    LLM_LOG_PAYLOAD_MAX_CHARS: int = 200000  # 单个消息文件的最大字符数
+
+    # 链路追踪配置（trace 写入 LOG_DIR/traces，见 app/core/tracing.py）
+    TRACING_ENABLED: bool = True
+    TRACE_MIN_SPANS: int = 2  # span 数少于该值的 trace（如普通 CRUD 请求）不落盘
+
     # 工作目录
     BASE_DIR: str = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
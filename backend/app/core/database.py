@@ -4,6 +4,7 @@ from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, JSON, t
 from datetime import datetime
 import logging
 from .config import settings
+from .metrics import instrument_engine
 
 # SQLAlchemy engine 日志：仅输出 WARNING 及以上（屏蔽大量 SQL INFO 日志）
 logging.getLogger("sqlalchemy.engine").setLevel(logging.WARNING)
@@ -38,6 +39,7 @@ engine = create_async_engine(
     settings.DATABASE_URL,
     **engine_kwargs
 )
+instrument_engine(engine)
 
 # 创建异步会话工厂
 async_session_maker = async_sessionmaker(
@@ -1,27 +1,56 @@
 
+import itertools
 import logging
-import sys
+import os
 import re
+import sys
 from pathlib import Path
 
-log_dir = Path('logs')
-log_dir.mkdir(exist_ok=True)
+from .config import settings
+from .logging_config import LLM_LOGGER_NAME, setup_logging, truncate_text
+from .metrics import record_llm_call
+from .tracing import current_span
+
+log_dir = Path(settings.LOG_DIR)
+_request_seq = itertools.count(1)
+
+# 通用的模型调用封装，统计调用点时跳过它们，记到真正发起调用的函数上
+_GENERIC_WRAPPERS = {'generate_text', 'generate_text_with_image'}
+
+
+def _find_call_site() -> str:
+    """返回发起 LLM 调用的 模块.函数 名，用作指标标签"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = os.path.basename(frame.f_code.co_filename)
+        name = frame.f_code.co_name
+        if filename != 'llm_logger.py' and not (filename == 'bailian_client.py' and name in _GENERIC_WRAPPERS):
+            return f"{os.path.splitext(filename)[0]}.{name}"
+        frame = frame.f_back
+    return 'unknown'
+
+
+def extract_token_usage(response):
+    """从 openai / langchain 响应中提取 (prompt_tokens, completion_tokens)"""
+    usage = getattr(response, 'usage', None)
+    if usage is not None and getattr(usage, 'prompt_tokens', None) is not None:
+        return usage.prompt_tokens, usage.completion_tokens
+    usage_metadata = getattr(response, 'usage_metadata', None)
+    if usage_metadata:
+        return usage_metadata.get('input_tokens'), usage_metadata.get('output_tokens')
+    return None, None
 
 class LLMLogger:
-    def __init__(self, name='llm_interactions'):
+    """
+    LLM 交互日志
+
+    日志记录和消息文件都经由异步日志队列写出（见 logging_config），
+    调用方只负责组装内容，不在事件循环上做文件 IO。
+    """
+    def __init__(self, name=LLM_LOGGER_NAME):
+        setup_logging()
         self.logger = logging.getLogger(name)
         self.logger.setLevel(logging.DEBUG)
-        
-        if not self.logger.handlers:
-            file_handler = logging.FileHandler(log_dir / 'llm_interactions.log', encoding='utf-8')
-            file_handler.setLevel(logging.DEBUG)
-            file_handler.setFormatter(logging.Formatter('%(asctime)s | %(levelname)s | %(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
-            self.logger.addHandler(file_handler)
-            
-            console_handler = logging.StreamHandler(sys.stdout)
-            console_handler.setLevel(logging.INFO)
-            console_handler.setFormatter(logging.Formatter('%(asctime)s | %(message)s', datefmt='%H:%M:%S'))
-            self.logger.addHandler(console_handler)
     
     def _truncate_content(self, content, max_length=100):
         """截断内容，对于长内容只显示前max_length个字符"""
@@ -56,10 +85,12 @@ class LLMLogger:
         self.logger.info(f'LLM REQUEST | Model: {model}')
         self.logger.debug(f'Messages count: {len(messages)}')
         
-        # 创建请求专属的日志目录
+        # 请求专属的日志目录，由日志线程创建；序号避免同一秒内的请求互相覆盖
         request_time = time.strftime('%Y%m%d_%H%M%S')
-        request_dir = log_dir / f'request_{request_time}'
-        request_dir.mkdir(exist_ok=True)
+        request_dir = log_dir / f'request_{request_time}_{next(_request_seq)}'
+        payload_files = []
+        save_payloads = settings.LLM_LOG_PAYLOADS
+        max_payload = settings.LLM_LOG_PAYLOAD_MAX_CHARS
         
         for i, msg in enumerate(messages):
             role = msg.get('role', 'unknown')
@@ -87,49 +118,63 @@ class LLMLogger:
                 content_length = len(content)
                 base64_count = len(re.findall(r'data:image/[^;]+;base64,', content))
                 
-                # 保存HTML内容到文件
-                html_file = request_dir / f'message_{i+1}_{role}.html'
-                try:
+                if save_payloads:
                     # 截断base64图片数据以减小文件大小
-                    truncated_html = self._truncate_base64_in_html(content)
-                    with open(html_file, 'w', encoding='utf-8') as f:
-                        f.write(truncated_html)
+                    html_file = request_dir / f'message_{i+1}_{role}.html'
+                    payload_files.append((html_file, truncate_text(self._truncate_base64_in_html(content), max_payload)))
                     self.logger.debug(f'Content: [HTML content, length: {content_length} chars, base64 images: {base64_count}, saved to: {html_file}]')
-                except Exception as e:
-                    self.logger.debug(f'Content: [HTML content, length: {content_length} chars, base64 images: {base64_count}, save failed: {e}]')
+                else:
+                    self.logger.debug(f'Content: [HTML content, length: {content_length} chars, base64 images: {base64_count}]')
             else:
                 # 普通文本内容，也保存到文件
-                text_file = request_dir / f'message_{i+1}_{role}.txt'
-                try:
-                    with open(text_file, 'w', encoding='utf-8') as f:
-                        f.write(str(content))
+                if save_payloads:
+                    text_file = request_dir / f'message_{i+1}_{role}.txt'
+                    payload_files.append((text_file, truncate_text(content, max_payload)))
                     self.logger.debug(f'Content: {self._truncate_content(content, 500)} [full content saved to: {text_file}]')
-                except Exception as e:
-                    self.logger.debug(f'Content: {self._truncate_content(content, 500)} [save failed: {e}]')
+                else:
+                    self.logger.debug(f'Content: {self._truncate_content(content, 500)}')
             
             self.logger.debug(f'--- End Message {i+1} ---')
         
         total_chars = sum(len(str(msg.get('content', ''))) for msg in messages)
         estimated_tokens = total_chars // 4
-        self.logger.info(f'Estimated input tokens: {estimated_tokens}')
+        self.logger.info(f'Estimated input tokens: {estimated_tokens}', extra={'payload_files': payload_files})
     
     def log_response(self, model: str, response, duration_ms: float):
         self.logger.info(f'LLM RESPONSE | Model: {model} | Duration: {duration_ms:.2f}ms')
         
+        estimated_tokens = None
         if hasattr(response, 'content'):
             content = response.content
             self.logger.debug(f'Response content: {content}')
             estimated_tokens = len(content) // 4
             self.logger.info(f'Estimated output tokens: {estimated_tokens}')
         
-        if hasattr(response, 'usage'):
+        if hasattr(response, 'usage') and response.usage is not None:
             usage = response.usage
             self.logger.info(f'Token usage: prompt_tokens={usage.prompt_tokens}, completion_tokens={usage.completion_tokens}, total_tokens={usage.total_tokens}')
         
         self.logger.info('=' * 80)
+
+        prompt_tokens, completion_tokens = extract_token_usage(response)
+        span = current_span()
+        if span is not None:
+            span.set_attribute('llm.model', model)
+            if prompt_tokens is not None:
+                span.set_attribute('llm.prompt_tokens', prompt_tokens)
+            if completion_tokens is not None:
+                span.set_attribute('llm.completion_tokens', completion_tokens)
+        record_llm_call(
+            model=model,
+            call_site=_find_call_site(),
+            duration_ms=duration_ms,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens if completion_tokens is not None else estimated_tokens
+        )
     
-    def log_error(self, model: str, error: Exception):
+    def log_error(self, model: str, error: Exception, duration_ms: float = 0):
         self.logger.error(f'LLM ERROR | Model: {model} | Error: {str(error)}')
         self.logger.error('=' * 80)
+        record_llm_call(model=model, call_site=_find_call_site(), duration_ms=duration_ms, status='error')
 
 llm_logger = LLMLogger()
@@ -0,0 +1,230 @@
+"""
+异步日志管道
+
+所有日志记录先进入内存队列，由后台 QueueListener 线程统一写控制台和文件，
+请求处理协程里只做一次入队操作，不直接触碰磁盘。
+
+- 级别：LOG_LEVEL 控制根日志级别
+- 采样：访问日志按 LOG_ACCESS_SAMPLE_RATE 采样，WARNING 及以上不采样
+- 大小上限：单条消息超过 LOG_MAX_MESSAGE_CHARS 截断，日志文件按 LOG_FILE_MAX_BYTES 轮转
+- 队列满时丢弃新记录并计数，不阻塞调用方：LOG_QUEUE_SIZE 限制记录条数，
+  LOG_QUEUE_MAX_CHARS 限制队列中消息和附带文件（LLM 请求的完整 prompt、HTML）的总字符数，
+  超出时先丢弃附带的文件、只保留日志行，仍超出时丢弃整条记录
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from .config import settings
+
+ACCESS_LOGGER_NAME = "app.access"
+LLM_LOGGER_NAME = "llm_interactions"
+
+_log_queue: Optional[queue.Queue] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[logging.Handler] = None
+_dropped_records = 0
+_dropped_payloads = 0
+_queued_chars = 0
+_queued_chars_lock = threading.Lock()
+
+
+def truncate_text(text, max_chars: Optional[int] = None) -> str:
+    """按字符数截断长文本，保留总长度信息"""
+    text = str(text)
+    limit = settings.LOG_MAX_MESSAGE_CHARS if max_chars is None else max_chars
+    if limit <= 0 or len(text) <= limit:
+        return text
+    return text[:limit] + f"... [truncated, total {len(text)} chars]"
+
+
+class SizeCapFilter(logging.Filter):
+    """在入队前格式化消息并截断，避免大块文本占用队列内存"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        message = record.getMessage()
+        capped = truncate_text(message)
+        if capped is not message:
+            record.msg = capped
+            record.args = None
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """对指定日志器的低级别记录按比例采样"""
+
+    def __init__(self, logger_name: str, rate: float):
+        super().__init__()
+        self.logger_name = logger_name
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.rate >= 1.0:
+            return True
+        if record.name != self.logger_name and not record.name.startswith(self.logger_name + "."):
+            return True
+        return random.random() < self.rate
+
+
+def _record_chars(record: logging.LogRecord) -> int:
+    """记录在队列中占用的字符数（消息和附带的文件内容）"""
+    files = getattr(record, "payload_files", None) or []
+    return len(str(record.msg)) + sum(len(content) for _, content in files)
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """队列满（条数或字符数超限）时直接丢弃，保证调用方永不阻塞"""
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        global _dropped_records, _dropped_payloads, _queued_chars
+        size = _record_chars(record)
+        with _queued_chars_lock:
+            if _queued_chars + size > settings.LOG_QUEUE_MAX_CHARS and getattr(record, "payload_files", None):
+                record.payload_files = []
+                _dropped_payloads += 1
+                size = _record_chars(record)
+            if _queued_chars + size > settings.LOG_QUEUE_MAX_CHARS:
+                _dropped_records += 1
+                return
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                _dropped_records += 1
+                return
+            record.queued_chars = size
+            _queued_chars += size
+
+
+class _BudgetQueueListener(logging.handlers.QueueListener):
+    """取出记录时归还它占用的字符数"""
+
+    def dequeue(self, block: bool) -> Optional[logging.LogRecord]:
+        global _queued_chars
+        record = super().dequeue(block)
+        size = getattr(record, "queued_chars", 0)
+        if size:
+            with _queued_chars_lock:
+                _queued_chars -= size
+        return record
+
+
+class PayloadFileHandler(logging.Handler):
+    """
+    在监听线程中写出日志记录附带的大文件内容。
+
+    记录通过 extra={"payload_files": [(路径, 内容), ...]} 携带待写文件，
+    例如 LLM 请求的完整 prompt 和 HTML。
+    """
+
+    def emit(self, record: logging.LogRecord) -> None:
+        files: List[Tuple[Path, str]] = getattr(record, "payload_files", None) or []
+        for path, content in files:
+            try:
+                path = Path(path)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(content)
+            except Exception:
+                self.handleError(record)
+
+
+class _NameFilter(logging.Filter):
+    """只放行（或排除）指定日志器的记录"""
+
+    def __init__(self, name: str, exclude: bool = False):
+        super().__init__()
+        self.target = name
+        self.exclude = exclude
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        matched = record.name == self.target or record.name.startswith(self.target + ".")
+        return not matched if self.exclude else matched
+
+
+def _build_handlers() -> List[logging.Handler]:
+    log_dir = Path(settings.LOG_DIR)
+    log_dir.mkdir(parents=True, exist_ok=True)
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setLevel(logging.INFO)
+    console.setFormatter(logging.Formatter(
+        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    ))
+
+    app_file = logging.handlers.RotatingFileHandler(
+        log_dir / "app.log",
+        maxBytes=settings.LOG_FILE_MAX_BYTES,
+        backupCount=settings.LOG_FILE_BACKUP_COUNT,
+        encoding="utf-8",
+    )
+    app_file.setFormatter(logging.Formatter(
+        "%(asctime)s | %(name)s | %(levelname)s | %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
+    ))
+    app_file.addFilter(_NameFilter(LLM_LOGGER_NAME, exclude=True))
+
+    llm_file = logging.handlers.RotatingFileHandler(
+        log_dir / "llm_interactions.log",
+        maxBytes=settings.LOG_FILE_MAX_BYTES,
+        backupCount=settings.LOG_FILE_BACKUP_COUNT,
+        encoding="utf-8",
+    )
+    llm_file.setFormatter(logging.Formatter(
+        "%(asctime)s | %(levelname)s | %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
+    ))
+    llm_file.addFilter(_NameFilter(LLM_LOGGER_NAME))
+
+    return [console, app_file, llm_file, PayloadFileHandler()]
+
+
+def setup_logging() -> logging.Handler:
+    """
+    初始化异步日志管道（幂等）
+
+    Returns:
+        挂在根日志器上的队列处理器
+    """
+    global _log_queue, _listener, _queue_handler
+    if _queue_handler is not None:
+        return _queue_handler
+
+    _log_queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    _queue_handler = _NonBlockingQueueHandler(_log_queue)
+    _queue_handler.addFilter(SamplingFilter(ACCESS_LOGGER_NAME, settings.LOG_ACCESS_SAMPLE_RATE))
+    _queue_handler.addFilter(SizeCapFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(getattr(logging, settings.LOG_LEVEL.upper(), logging.INFO))
+
+    _listener = _BudgetQueueListener(_log_queue, *_build_handlers(), respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+    return _queue_handler
+
+
+def shutdown_logging() -> None:
+    """停止监听线程并刷新队列中剩余的日志"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logging_stats() -> dict:
+    """返回日志队列状态"""
+    return {
+        "queue_size": _log_queue.qsize() if _log_queue is not None else 0,
+        "queue_capacity": settings.LOG_QUEUE_SIZE,
+        "queued_chars": _queued_chars,
+        "queue_max_chars": settings.LOG_QUEUE_MAX_CHARS,
+        "dropped_records": _dropped_records,
+        "dropped_payloads": _dropped_payloads,
+    }
@@ -0,0 +1,350 @@
+"""
+进程内指标收集，以 Prometheus 文本格式通过 /metrics 暴露
+
+不依赖 prometheus_client，只实现本项目用到的 Counter / Gauge / Histogram。
+生成的测试脚本运行在子进程里，子进程内的 LLM/VL 调用会以
+{"event": "metric", ...} 的 JSON 行输出到 stdout，由执行器解析后汇总到主进程。
+"""
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# 执行器为测试脚本子进程设置该环境变量，子进程中的指标改为输出事件行
+METRICS_EVENTS_ENV = "E2E_METRICS_EVENTS"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+BYTE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+PAGE_BYTE_BUCKETS = (65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    metric_type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, func: Callable[[], float], **labels) -> None:
+        """抓取时才计算的取值，例如队列长度"""
+        with self._lock:
+            self._functions[self._key(labels)] = func
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+            functions = list(self._functions.items())
+        for key, func in functions:
+            try:
+                items.append((key, float(func())))
+            except Exception:
+                continue
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # key -> [各桶计数..., 总和, 总数]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """计时上下文，异常时 status 标签记为 error（若该指标有 status 标签）"""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            if "status" in self.labelnames:
+                labels["status"] = "error"
+            raise
+        finally:
+            if "status" in self.labelnames:
+                labels.setdefault("status", "success")
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        lines = []
+        for key, state in items:
+            cumulative = 0
+            for i, bound in enumerate(self.buckets):
+                cumulative += state[i]
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+metrics = MetricsRegistry()
+
+# ---- 指标定义 ----
+
+PAGE_CAPTURE_SECONDS = metrics.histogram(
+    "e2e_page_capture_seconds", "页面内容（HTML+截图）获取耗时", ("method", "status"))
+LLM_REQUEST_SECONDS = metrics.histogram(
+    "e2e_llm_request_duration_seconds", "LLM/VL 模型调用耗时", ("model", "call_site", "status"))
+LLM_TOKENS = metrics.histogram(
+    "e2e_llm_tokens", "LLM/VL 单次调用的 token 数", ("model", "call_site", "kind"), TOKEN_BUCKETS)
+LLM_TOKENS_TOTAL = metrics.counter(
+    "e2e_llm_tokens_total", "LLM/VL token 累计数", ("model", "call_site", "kind"))
+SCRIPT_GENERATION_SECONDS = metrics.histogram(
+    "e2e_script_generation_seconds", "测试脚本生成耗时", ("mode", "status"))
+SCRIPT_EXECUTION_SECONDS = metrics.histogram(
+    "e2e_script_execution_seconds", "测试脚本子进程执行耗时", ("status",))
+STEP_DURATION_SECONDS = metrics.histogram(
+    "e2e_step_duration_seconds", "测试步骤耗时（即 TestStepResult.execution_duration）", ("status",))
+BROWSER_LAUNCHES = metrics.counter(
+    "e2e_browser_launches_total", "浏览器启动次数", ("source",))
+CAPTCHA_RECOGNITION_SECONDS = metrics.histogram(
+    "e2e_captcha_recognition_seconds", "验证码识别耗时（status: accepted 直接采用 / low_confidence 转交 VL / failed）",
+    ("backend", "status", "capture"))
+CAPTCHA_UPLOAD_BYTES = metrics.histogram(
+    "e2e_captcha_upload_bytes", "验证码识别上传给 VL 模型的图片大小（base64 字节数）", ("capture",), BYTE_BUCKETS)
+PAGE_TRANSFER_BYTES = metrics.histogram(
+    "e2e_page_transfer_bytes", "单次运行（测试脚本/页面内容获取）的网络传输字节数", ("source", "profile"), PAGE_BYTE_BUCKETS)
+PAGE_LOAD_SECONDS = metrics.histogram(
+    "e2e_page_load_seconds", "单次运行中首个页面的加载耗时（load 事件）", ("source", "profile"))
+BLOCKED_REQUESTS_TOTAL = metrics.counter(
+    "e2e_blocked_requests_total", "资源拦截方案拦截的请求数", ("source", "profile"))
+DB_QUERY_SECONDS = metrics.histogram(
+    "e2e_db_query_duration_seconds", "数据库语句执行耗时", ("operation",))
+QUEUE_DEPTH = metrics.gauge(
+    "e2e_queue_depth", "内部队列当前长度", ("queue",))
+INFLIGHT_JOBS = metrics.gauge(
+    "e2e_inflight_jobs", "正在进行的生成/执行任务数", ("kind",))
+
+
+def _emit_event(name: str, **fields) -> bool:
+    """子进程中把指标作为事件行输出，返回是否已输出"""
+    if os.environ.get(METRICS_EVENTS_ENV) != "1":
+        return False
+    print(json.dumps({"event": "metric", "name": name, **fields}, ensure_ascii=False), file=sys.stdout, flush=True)
+    return True
+
+
+def record_llm_call(model: str, call_site: str, duration_ms: float, status: str = "success",
+                    prompt_tokens: Optional[int] = None, completion_tokens: Optional[int] = None) -> None:
+    """记录一次 LLM/VL 调用"""
+    if _emit_event("llm_call", model=model, call_site=call_site, duration_ms=duration_ms, status=status,
+                   prompt_tokens=prompt_tokens, completion_tokens=completion_tokens):
+        return
+    LLM_REQUEST_SECONDS.observe(duration_ms / 1000, model=model, call_site=call_site, status=status)
+    for kind, tokens in (("prompt", prompt_tokens), ("completion", completion_tokens)):
+        if tokens is not None:
+            LLM_TOKENS.observe(tokens, model=model, call_site=call_site, kind=kind)
+            LLM_TOKENS_TOTAL.inc(tokens, model=model, call_site=call_site, kind=kind)
+
+
+def record_captcha_recognition(backend: str, duration_ms: float, status: str,
+                               capture: str = "element", upload_bytes: Optional[int] = None) -> None:
+    """
+    记录一次验证码识别
+    backend: local / vl；capture: element 元素截图 / crop 从截图中裁剪 / full_page 整页截图
+    upload_bytes: 上传给 VL 模型的图片大小（调用 VL 时）
+    """
+    if _emit_event("captcha_recognition", backend=backend, duration_ms=duration_ms, status=status,
+                   capture=capture, upload_bytes=upload_bytes):
+        return
+    CAPTCHA_RECOGNITION_SECONDS.observe(duration_ms / 1000, backend=backend, status=status, capture=capture)
+    if upload_bytes is not None:
+        CAPTCHA_UPLOAD_BYTES.observe(upload_bytes, capture=capture)
+
+
+def record_page_resources(source: str, profile: str, transfer_bytes: int, load_ms: Optional[float] = None,
+                          blocked: int = 0, **details) -> None:
+    """
+    记录一次运行的资源统计（见 app/utils/resource_profiles.py）
+    source: test_script 测试脚本 / page_capture 页面内容获取；profile: 资源拦截方案
+    """
+    if _emit_event("page_resources", source=source, profile=profile, transfer_bytes=transfer_bytes,
+                   load_ms=load_ms, blocked=blocked, **details):
+        return
+    PAGE_TRANSFER_BYTES.observe(transfer_bytes, source=source, profile=profile)
+    if load_ms is not None:
+        PAGE_LOAD_SECONDS.observe(load_ms / 1000, source=source, profile=profile)
+    if blocked:
+        BLOCKED_REQUESTS_TOTAL.inc(blocked, source=source, profile=profile)
+
+
+def ingest_metric_event(event: dict) -> None:
+    """汇总测试脚本子进程输出的指标事件"""
+    if event.get("name") == "captcha_recognition":
+        record_captcha_recognition(
+            backend=event.get("backend", "unknown"),
+            duration_ms=float(event.get("duration_ms") or 0),
+            status=event.get("status", "failed"),
+            capture=event.get("capture", "element"),
+            upload_bytes=event.get("upload_bytes"),
+        )
+    if event.get("name") == "page_resources":
+        record_page_resources(
+            source=event.get("source", "test_script"),
+            profile=event.get("profile", "none"),
+            transfer_bytes=int(event.get("transfer_bytes") or 0),
+            load_ms=event.get("load_ms"),
+            blocked=int(event.get("blocked") or 0),
+        )
+    if event.get("name") == "llm_call":
+        record_llm_call(
+            model=event.get("model", "unknown"),
+            call_site=event.get("call_site", "unknown"),
+            duration_ms=float(event.get("duration_ms") or 0),
+            status=event.get("status", "success"),
+            prompt_tokens=event.get("prompt_tokens"),
+            completion_tokens=event.get("completion_tokens"),
+        )
+
+
+def instrument_engine(engine) -> None:
+    """为 SQLAlchemy 引擎注册语句耗时统计"""
+    from sqlalchemy import event
+
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("_query_start")
+        if not starts:
+            return
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+        DB_QUERY_SECONDS.observe(time.perf_counter() - starts.pop(), operation=operation)
+
+
+def render_metrics() -> str:
+    """生成 Prometheus 文本格式"""
+    return metrics.render()
@@ -0,0 +1,330 @@
+"""
+轻量级链路追踪
+
+用 contextvars 维护当前 span，span 开始时登记在所属 trace 中（查看器可以看到进行中的 span），
+根 span 结束时整条 trace 交给后台线程写入 logs/traces/<trace_id>.jsonl。每行是一个 OTLP/JSON
+（ExportTraceServiceRequest）对象，可直接被 OpenTelemetry Collector 的 otlpjsonfile
+receiver 或 Jaeger/Tempo 导入工具读取。
+
+用法:
+    with start_span("page_capture", url=url):
+        ...
+
+    @traced("llm.generate_text")
+    async def generate_text(...):
+        ...
+"""
+import contextvars
+import functools
+import inspect
+import json
+import queue
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .config import settings
+
+SERVICE_NAME = "e2e-webtest-backend"
+TRACE_ID_HEADER = "X-Trace-Id"
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+# 未结束的 trace：trace_id -> 已开始的 span 列表（包括进行中的，供查看器展示进行中的任务）
+_active_traces: Dict[str, List["Span"]] = {}
+_active_lock = threading.Lock()
+
+_export_queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+_writer_thread: Optional[threading.Thread] = None
+
+
+def _trace_dir() -> Path:
+    return Path(settings.LOG_DIR) / "traces"
+
+
+class Span:
+    """一次操作的耗时记录"""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_span_id", "start_ns", "end_ns",
+                 "attributes", "status", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_span_id: Optional[str] = None,
+                 attributes: Optional[Dict[str, Any]] = None, start_ns: Optional[int] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent_span_id
+        self.start_ns = start_ns if start_ns is not None else time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.status = "unset"
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_error(self, error: BaseException) -> None:
+        self.status = "error"
+        self.error = f"{type(error).__name__}: {error}"
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """转换为 OTLP/JSON 的 span 结构"""
+        status = {"code": 2, "message": self.error or ""} if self.status == "error" else {"code": 1 if self.status == "ok" else 0}
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": status,
+        }
+        if self.parent_span_id:
+            span["parentSpanId"] = self.parent_span_id
+        return span
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)[:1000]}
+    return {"key": key, "value": typed}
+
+
+def _otlp_value(value: Dict[str, Any]) -> Any:
+    if "intValue" in value:
+        return int(value["intValue"])
+    for key in ("stringValue", "boolValue", "doubleValue"):
+        if key in value:
+            return value[key]
+    return None
+
+
+# ---- 导出 ----
+
+def _writer_loop():
+    while True:
+        item = _export_queue.get()
+        if item is None:
+            _export_queue.task_done()
+            break
+        trace_id, spans = item
+        try:
+            trace_dir = _trace_dir()
+            trace_dir.mkdir(parents=True, exist_ok=True)
+            payload = {
+                "resourceSpans": [{
+                    "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+                    "scopeSpans": [{
+                        "scope": {"name": "app.core.tracing"},
+                        "spans": [span.to_otlp() for span in spans],
+                    }],
+                }]
+            }
+            with open(trace_dir / f"{trace_id}.jsonl", "a", encoding="utf-8") as f:
+                f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+        except Exception as e:
+            print(f"[Tracing] 写入 trace {trace_id} 失败: {e}")
+        finally:
+            _export_queue.task_done()
+
+
+def _export(trace_id: str, spans: List[Span]) -> None:
+    global _writer_thread
+    if _writer_thread is None or not _writer_thread.is_alive():
+        _writer_thread = threading.Thread(target=_writer_loop, name="trace-exporter", daemon=True)
+        _writer_thread.start()
+    _export_queue.put((trace_id, spans))
+
+
+def flush(timeout: float = 5.0) -> None:
+    """等待已提交的 trace 写盘完成（用于测试和进程退出前）"""
+    deadline = time.time() + timeout
+    while _export_queue.unfinished_tasks and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def _register(span: Span) -> bool:
+    """
+    span 开始时登记到所属 trace
+    根 span 结束后 trace 已经导出，之后才开始的子 span（如根 span 结束后仍在运行的后台任务）不再登记
+    """
+    with _active_lock:
+        if span.parent_span_id is None:
+            _active_traces[span.trace_id] = [span]
+            return True
+        spans = _active_traces.get(span.trace_id)
+        if spans is None:
+            return False
+        spans.append(span)
+        return True
+
+
+def _finish(span: Span) -> None:
+    span.end_ns = time.time_ns()
+    if span.status == "unset":
+        span.status = "ok"
+    with _active_lock:
+        spans = _active_traces.get(span.trace_id)
+        if spans is not None and span.parent_span_id is not None:
+            return
+        if spans is not None:
+            # 根 span 结束，整条 trace 导出（还没结束的子 span 结束时单独追加）
+            del _active_traces[span.trace_id]
+            spans = [s for s in spans if s.end_ns is not None]
+    if spans is None:
+        # 根 span 结束之后才结束的子 span，追加到已导出的 trace 文件
+        _export(span.trace_id, [span])
+    elif len(spans) >= settings.TRACE_MIN_SPANS:
+        # 只有一个 span 的 trace（例如普通 CRUD 请求）不落盘
+        _export(span.trace_id, spans)
+
+
+# ---- 公共接口 ----
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current_span.get()
+    return span.trace_id if span else None
+
+
+@contextmanager
+def start_span(name: str, **attributes):
+    """开启一个 span；没有父 span 时开启新的 trace"""
+    if not settings.TRACING_ENABLED:
+        yield None
+        return
+
+    parent = _current_span.get()
+    trace_id = parent.trace_id if parent else secrets.token_hex(16)
+    span = Span(name, trace_id, parent.span_id if parent else None, attributes)
+    _register(span)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.set_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        _finish(span)
+
+
+def record_span(name: str, start_time: float, duration_ms: float, status: str = "ok", **attributes) -> None:
+    """
+    补录一个已经结束的子 span（挂在当前 span 下）
+
+    用于测试脚本子进程里的步骤：子进程通过 step_start/step_end 事件上报时间，
+    执行结束后在主进程中补录。
+    """
+    parent = _current_span.get()
+    if parent is None or not settings.TRACING_ENABLED:
+        return
+    start_ns = int(start_time * 1e9)
+    span = Span(name, parent.trace_id, parent.span_id, attributes, start_ns=start_ns)
+    span.end_ns = start_ns + int(duration_ms * 1e6)
+    span.status = "error" if status in ("failed", "error") else "ok"
+    if not _register(span):
+        _export(span.trace_id, [span])
+
+
+def traced(name: Optional[str] = None, **static_attributes):
+    """为同步或异步函数包一层 span"""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with start_span(span_name, **static_attributes):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with start_span(span_name, **static_attributes):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def load_trace(trace_id: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    读取一条 trace 的所有 span（已导出的文件 + 进行中的缓存）
+
+    Returns:
+        按开始时间排序的 span 字典列表，不存在时返回 None
+    """
+    if not trace_id or not all(c in "0123456789abcdef" for c in trace_id):
+        return None
+
+    spans: List[Dict[str, Any]] = []
+    path = _trace_dir() / f"{trace_id}.jsonl"
+    if path.exists():
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                payload = json.loads(line)
+                for resource_spans in payload.get("resourceSpans", []):
+                    for scope_spans in resource_spans.get("scopeSpans", []):
+                        for raw in scope_spans.get("spans", []):
+                            spans.append({
+                                "span_id": raw["spanId"],
+                                "parent_span_id": raw.get("parentSpanId"),
+                                "name": raw["name"],
+                                "start_ns": int(raw["startTimeUnixNano"]),
+                                "end_ns": int(raw["endTimeUnixNano"]),
+                                "status": {0: "unset", 1: "ok", 2: "error"}.get(raw.get("status", {}).get("code", 0)),
+                                "error": raw.get("status", {}).get("message") or None,
+                                "attributes": {a["key"]: _otlp_value(a["value"]) for a in raw.get("attributes", [])},
+                            })
+
+    with _active_lock:
+        active = list(_active_traces.get(trace_id, []))
+    for span in active:
+        spans.append({
+            "span_id": span.span_id,
+            "parent_span_id": span.parent_span_id,
+            "name": span.name,
+            "start_ns": span.start_ns,
+            "end_ns": span.end_ns,
+            "status": span.status,
+            "error": span.error,
+            "attributes": dict(span.attributes),
+        })
+
+    if not spans:
+        return None
+    spans.sort(key=lambda s: s["start_ns"])
+    return spans
+
+
+def list_traces(limit: int = 50) -> List[Dict[str, Any]]:
+    """列出最近导出的 trace"""
+    trace_dir = _trace_dir()
+    if not trace_dir.exists():
+        return []
+    files = sorted(trace_dir.glob("*.jsonl"), key=lambda p: p.stat().st_mtime, reverse=True)[:limit]
+    return [
+        {"trace_id": p.stem, "updated_at": p.stat().st_mtime, "size": p.stat().st_size}
+        for p in files
+    ]
@@ -1,10 +1,11 @@
 import asyncio
 import sys
 import os
+import time
 import logging
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, PlainTextResponse
 from contextlib import asynccontextmanager
 
 # 添加项目根目录到Python路径，确保测试脚本可以导入app模块
@@ -14,15 +15,16 @@ if project_root not in sys.path:
 
 from app.core.config import settings
 from app.core.database import init_db
-from app.api import test_cases, scenarios, configs
+from app.core.logging_config import setup_logging, get_logging_stats, ACCESS_LOGGER_NAME
+from app.core.metrics import QUEUE_DEPTH, render_metrics
+from app.core.tracing import start_span, TRACE_ID_HEADER
+from app.api import test_cases, scenarios, configs, traces
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[logging.StreamHandler(sys.stdout)]
-)
+# 配置日志：所有记录经内存队列由后台线程写出，请求协程不做 IO
+setup_logging()
 logger = logging.getLogger(__name__)
+access_logger = logging.getLogger(ACCESS_LOGGER_NAME)
+QUEUE_DEPTH.set_function(lambda: get_logging_stats()["queue_size"], queue="logging")
 
 # 配置 uvicorn 的日志
 uvicorn_logger = logging.getLogger("uvicorn")
@@ -69,6 +71,13 @@ async def lifespan(app: FastAPI):
     await init_db()
     print("Database initialization complete")
 
+    # 会话池后台检查（见 app/services/session/session_pool.py）
+    from .services.session.session_pool import session_pool
+    session_pool.start()
+    # 截图存储后台清理（见 app/services/screenshot/screenshot_store.py）
+    from .services.screenshot.screenshot_store import screenshot_store
+    screenshot_store.start()
+
     # Output actual config from database
     from .models.global_config import GlobalConfig, ConfigKeys
     from sqlalchemy import select
@@ -90,6 +99,10 @@ async def lifespan(app: FastAPI):
 
     yield
     # Cleanup on shutdown
+    from .services.executor.browser_pool import browser_pool
+    await browser_pool.close()
+    await session_pool.stop()
+    await screenshot_store.stop()
     print("Application shutdown")
 
 
@@ -108,47 +121,93 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[TRACE_ID_HEADER],
 )
 
 # Request logging middleware
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     """Log all HTTP requests"""
-    print(f"[REQUEST] {request.method} {request.url.path} - Client: {request.client.host}")
-    logger.info(f"[REQUEST] {request.method} {request.url.path} - Client: {request.client.host}")
-    
+    if not settings.LOG_REQUESTS:
+        return await call_next(request)
+
+    start = time.perf_counter()
+    client = request.client.host if request.client else "-"
     try:
         response = await call_next(request)
-        print(f"[RESPONSE] {request.method} {request.url.path} - Status: {response.status_code}")
-        logger.info(f"[RESPONSE] {request.method} {request.url.path} - Status: {response.status_code}")
-        return response
     except Exception as e:
-        print(f"[ERROR] {request.method} {request.url.path} - {type(e).__name__}: {str(e)}")
-        logger.error(f"[ERROR] {request.method} {request.url.path} - {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        access_logger.exception(
+            "[ERROR] %s %s - Client: %s - %s: %s",
+            request.method, request.url.path, client, type(e).__name__, e
+        )
         raise
 
+    duration_ms = (time.perf_counter() - start) * 1000
+    level = logging.WARNING if response.status_code >= 500 else logging.INFO
+    access_logger.log(
+        level, "[REQUEST] %s %s - Client: %s - Status: %s - %.1fms",
+        request.method, request.url.path, client, response.status_code, duration_ms
+    )
+    return response
+
+# 链路追踪：每个请求一个根 span，trace id 通过响应头返回，可在 /api/traces/{trace_id}/view 查看
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    with start_span(f"{request.method} {request.url.path}", **{
+        "http.method": request.method,
+        "http.target": request.url.path,
+    }) as span:
+        response = await call_next(request)
+        if span is not None:
+            span.set_attribute("http.status_code", response.status_code)
+            response.headers[TRACE_ID_HEADER] = span.trace_id
+        return response
+
 # 注册路由
 app.include_router(test_cases.router)
 app.include_router(scenarios.router)
 app.include_router(configs.router)
+app.include_router(traces.router)
 
 
 @app.get("/api/screenshots/{file_path:path}")
-async def serve_screenshot(file_path: str):
-    """提供截图文件访问"""
-    from fastapi import HTTPException
-    screenshots_dir = os.path.join(settings.SESSION_STORAGE_PATH or ".", "screenshots")
+async def serve_screenshot(file_path: str, request: Request, thumb: bool = False):
+    """提供截图文件访问（thumb=true 时返回缩略图），带 ETag 和 Cache-Control"""
+    from fastapi import HTTPException, Response
+    from app.services.screenshot.screenshot_store import screenshot_store
+    screenshots_dir = screenshot_store.root
     full_path = os.path.join(screenshots_dir, file_path)
     # 安全检查：防止路径遍历
     real_screenshots_dir = os.path.realpath(screenshots_dir)
     real_full_path = os.path.realpath(full_path)
     if not real_full_path.startswith(real_screenshots_dir):
         raise HTTPException(status_code=403, detail="Access denied")
-    if not os.path.exists(full_path):
+    if not os.path.isfile(full_path):
         raise HTTPException(status_code=404, detail="Screenshot not found")
-    return FileResponse(full_path, media_type="image/png")
+    if thumb:
+        full_path = await asyncio.to_thread(screenshot_store.thumbnail, full_path)
+    headers = screenshot_store.cache_headers(full_path)
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(full_path, media_type=screenshot_store.media_type(full_path), headers=headers)
+
+
+@app.get("/api/artifacts/{file_path:path}")
+async def serve_artifact(file_path: str):
+    """提供失败产物访问（trace.zip 用 playwright show-trace 或 trace.playwright.dev 打开）"""
+    from fastapi import HTTPException
+    from app.utils import run_artifacts
+    artifacts_dir = run_artifacts.storage_dir()
+    full_path = os.path.join(artifacts_dir, file_path)
+    # 安全检查：防止路径遍历
+    real_artifacts_dir = os.path.realpath(artifacts_dir)
+    real_full_path = os.path.realpath(full_path)
+    if not real_full_path.startswith(real_artifacts_dir + os.sep):
+        raise HTTPException(status_code=403, detail="Access denied")
+    if not os.path.isfile(full_path):
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    media_type = "image/png" if full_path.endswith(".png") else "application/zip"
+    return FileResponse(full_path, media_type=media_type, filename=os.path.basename(full_path))
 
 
 @app.get("/")
@@ -163,6 +222,12 @@ async def root():
     }
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus 指标"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/health")
 async def health_check():
     """健康检查"""
@@ -177,13 +242,11 @@ async def health_check():
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     """全局异常处理，记录所有未捕获的异常"""
-    error_msg = f"❌ Unhandled exception: {request.method} {request.url.path} - {type(exc).__name__}: {str(exc)}"
-    print(error_msg)
-    logger.error(error_msg)
-    import traceback
-    traceback_str = traceback.format_exc()
-    print(traceback_str)
-    logger.error(traceback_str)
+    logger.error(
+        "❌ Unhandled exception: %s %s - %s: %s",
+        request.method, request.url.path, type(exc).__name__, exc,
+        exc_info=exc
+    )
     return JSONResponse(
         status_code=500,
         content={"error": f"Internal Server Error: {str(exc)}"}
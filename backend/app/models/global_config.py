@@ -32,3 +32,6 @@ class ConfigKeys:
     BROWSER_TIMEOUT = "browser_timeout"  # 浏览器超时时间
     USE_COMPUTER_USE = "use_computer_use"  # 使用 Computer-Use 方案（截图+坐标）
     USE_AGENT_BROWSER = "use_agent_browser"  # 使用 agent-browser 方案（无障碍树+ref）
+    DOM_BATCH_CODEGEN = "dom_batch_codegen"  # DOM 模式一次调用生成所有操作的代码
+    DOM_LIVE_TRACKING = "dom_live_tracking"  # DOM 模式生成时在实时页面上逐步执行代码
+    SHARED_LOGIN_PREFIX = "shared_login_prefix"  # 执行场景时相同的登录前置步骤只执行一次
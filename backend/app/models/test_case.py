@@ -49,6 +49,9 @@ class TestScenario(Base):
     use_captcha = Column(Boolean, default=False, comment="是否使用验证码")
     auto_cookie_localstorage = Column(Boolean, default=True, comment="自动加载和保存 cookie/localstorage")
     load_saved_storage = Column(Boolean, default=True, comment="是否加载保存的cookie/localstorage/sessionstorage")
+
+    # 资源拦截方案（见 app/utils/resource_profiles.py）
+    resource_profile = Column(String(50), default="none", comment="资源拦截方案: none, no-media, no-third-party, aggressive")
     
     created_at = Column(DateTime, default=datetime.utcnow, comment="创建时间")
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, comment="更新时间")
@@ -97,6 +100,7 @@ class TestReport(Base):
     error_message = Column(Text, comment="错误信息")
     execution_time = Column(Integer, comment="执行时间(毫秒)")
     screenshot_path = Column(String(500), comment="截图路径")
+    artifact_dir = Column(String(500), comment="失败产物目录（trace.zip、失败截图），相对 ARTIFACT_STORAGE_PATH")
     created_at = Column(DateTime, default=datetime.utcnow, comment="创建时间")
 
     # 关系
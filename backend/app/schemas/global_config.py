@@ -44,4 +44,7 @@ class GlobalConfigSettings(BaseModel):
     browser_headless: bool = Field(True, description="浏览器无头模式")
     use_computer_use: bool = Field(False, description="使用Computer-Use方案（截图+坐标定位）")
     use_agent_browser: bool = Field(False, description="使用agent-browser方案（无障碍树+ref定位）")
+    dom_batch_codegen: bool = Field(False, description="DOM模式一次调用生成所有操作代码（失败的操作再逐个生成）")
+    dom_live_tracking: bool = Field(False, description="DOM模式生成时在实时页面上逐步执行代码，后续步骤使用执行后的DOM")
+    shared_login_prefix: bool = Field(True, description="执行场景时相同的登录前置步骤只执行一次，其余用例从登录后的状态开始")
     browser_timeout: int = Field(30000, description="浏览器超时时间(毫秒)")
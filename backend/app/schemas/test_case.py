@@ -30,6 +30,21 @@ class TestCaseType(str, Enum):
     COMPATIBILITY = "compatibility"
 
 
+class ResourceProfile(str, Enum):
+    """资源拦截方案（见 app/utils/resource_profiles.py）"""
+    NONE = "none"  # 不拦截
+    NO_MEDIA = "no-media"  # 拦截图片、音视频、字体
+    NO_THIRD_PARTY = "no-third-party"  # 拦截第三方请求和统计上报
+    AGGRESSIVE = "aggressive"  # 以上全部拦截
+
+
+class NetworkMode(str, Enum):
+    """执行时的网络模式（见 app/utils/har_replay.py）"""
+    LIVE = "live"  # 正常访问网络
+    RECORD = "record"  # 录制 HAR
+    REPLAY = "replay"  # 从录制的 HAR 回放
+
+
 # ==================== 场景相关 Schemas ====================
 
 class TestScenarioBase(BaseModel):
@@ -42,6 +57,7 @@ class TestScenarioBase(BaseModel):
     use_captcha: bool = Field(False, description="是否使用验证码")
     auto_cookie_localstorage: bool = Field(True, description="自动加载和保存 cookie/localstorage")
     load_saved_storage: bool = Field(True, description="是否加载保存的 cookie/localstorage/sessionstorage")
+    resource_profile: ResourceProfile = Field(ResourceProfile.NONE, description="资源拦截方案（验证码图片始终放行）")
 
 
 class TestScenarioCreate(TestScenarioBase):
@@ -60,6 +76,7 @@ class TestScenarioUpdate(BaseModel):
     use_captcha: Optional[bool] = None
     auto_cookie_localstorage: Optional[bool] = None
     load_saved_storage: Optional[bool] = None
+    resource_profile: Optional[ResourceProfile] = None
 
 
 class TestScenarioResponse(TestScenarioBase):
@@ -182,6 +199,7 @@ class TestReportResponse(BaseModel):
     error_message: Optional[str] = None
     execution_time: Optional[int] = None
     screenshot_path: Optional[str] = None
+    artifact_dir: Optional[str] = None
     created_at: datetime
     step_results: Optional[List[TestStepResultResponse]] = None
 
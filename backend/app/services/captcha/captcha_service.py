@@ -1,10 +1,17 @@
 from typing import Optional, Tuple, Dict, Any
 from playwright.async_api import Page, Locator
+import asyncio
 import base64
 import re
 import json
+import time
 from ..llm.bailian_client import bailian_client
+from ..generator.dom_distiller import distill_dom
 from ...core.config import settings
+from ...core.metrics import record_captcha_recognition
+from ...utils import captcha_cache
+from ...utils.captcha_memory import page_key
+from ...utils.captcha_recognizer import get_local_recognizer
 
 
 class CaptchaService:
@@ -82,7 +89,7 @@ class CaptchaService:
         prompt = f"""分析以下 HTML 页面，找出验证码图片元素和验证码输入框。
 
 HTML 内容:
-{dom_content[:5000]}
+{distill_dom(dom_content, "验证码 captcha 图片 img 输入框 input code verify")}
 
 请以 JSON 格式返回分析结果，包含以下字段：
 - "captcha_selector": 验证码图片元素的 CSS 选择器（例如：#captcha-img, img.captcha）
@@ -193,18 +200,49 @@ HTML 内容:
             return None
 
     @staticmethod
-    async def recognize_captcha(image_base64: str) -> str:
+    async def recognize_captcha(image_base64: str, scope: str = "") -> str:
         """
         识别验证码
         Args:
             image_base64: base64编码的验证码图片
+            scope: 作用域（页面），同一作用域再次处理验证码时清除这次使用的缓存答案（见 captcha_cache）
         Returns:
             识别的验证码内容
         """
         if not image_base64:
             return ""
 
+        image_bytes = base64.b64decode(image_base64)
+        cached = captcha_cache.lookup(image_bytes)
+        if cached:
+            print(f"使用缓存的验证码答案: {cached['answer']}（{cached['age']} 秒前识别）")
+            captcha_cache.mark_used(cached["key"], scope, emit_event=False)
+            return cached["answer"]
+
+        # 先用本地识别器（CPU，约几十毫秒），置信度足够时不调用 VL 模型
+        local = None
+        if settings.CAPTCHA_LOCAL_RECOGNIZER:
+            try:
+                local = await asyncio.get_running_loop().run_in_executor(
+                    None, get_local_recognizer().recognize, image_bytes
+                )
+            except Exception as e:
+                print(f"本地验证码识别失败: {e}")
+        if local is not None:
+            accepted = bool(local["answer"]) and local["confidence"] >= settings.CAPTCHA_LOCAL_MIN_CONFIDENCE
+            record_captcha_recognition("local", local["duration_ms"], "accepted" if accepted else "low_confidence")
+            if accepted:
+                print(f"本地识别验证码: {local['text']} -> {local['answer']}（置信度 {local['confidence']}）")
+                return local["answer"]
+
+        start = time.perf_counter()
         captcha_text = await bailian_client.recognize_captcha(image_base64)
+        record_captcha_recognition("vl", (time.perf_counter() - start) * 1000,
+                                   "accepted" if captcha_text and captcha_text != "CAPTCHA_NOT_FOUND" else "failed",
+                                   upload_bytes=len(image_base64))
+        if captcha_text and captcha_text != "CAPTCHA_NOT_FOUND":
+            # 后端服务中无法确认答案是否正确（登录是否成功），不用于学习字形（见 captcha_cache.confirm）
+            captcha_cache.mark_used(captcha_cache.store(image_bytes, captcha_text, "vl"), scope, emit_event=False)
         return captcha_text
 
     @staticmethod
@@ -233,7 +271,11 @@ HTML 内容:
             return True, ""
         
         print(f"自动检测到验证码: 图片选择器={captcha_selector}, 输入框选择器={input_selector}")
-        
+
+        # 同一页面上再次出现验证码，说明上一次填写的答案没能登录成功，不再复用
+        scope = page_key(page.url)
+        captcha_cache.evict_used(scope)
+
         # 处理验证码
         for attempt in range(max_retries):
             # 截取验证码
@@ -243,7 +285,7 @@ HTML 内容:
                 continue
 
             # 识别验证码
-            captcha_text = await CaptchaService.recognize_captcha(captcha_image)
+            captcha_text = await CaptchaService.recognize_captcha(captcha_image, scope)
             if not captcha_text or captcha_text == "CAPTCHA_NOT_FOUND":
                 print(f"尝试 {attempt + 1}: 无法识别验证码")
                 continue
@@ -282,6 +324,8 @@ HTML 内容:
         Returns:
             是否成功处理验证码
         """
+        scope = page_key(page.url)
+        captcha_cache.evict_used(scope)
         for attempt in range(max_retries):
             # 截取验证码
             captcha_image = await CaptchaService.screenshot_captcha(page, captcha_selector)
@@ -290,7 +334,7 @@ HTML 内容:
                 continue
 
             # 识别验证码
-            captcha_text = await CaptchaService.recognize_captcha(captcha_image)
+            captcha_text = await CaptchaService.recognize_captcha(captcha_image, scope)
             if not captcha_text or captcha_text == "CAPTCHA_NOT_FOUND":
                 print(f"尝试 {attempt + 1}: 无法识别验证码")
                 continue
@@ -0,0 +1,197 @@
+"""
+长驻浏览器池
+
+Playwright 浏览器在独立线程的事件循环中启动并保持运行（与 _run_playwright_in_thread
+的做法一致，Windows 下该线程使用 ProactorEventLoop 以支持浏览器子进程）。
+调用方通过 lease() 租用一个全新的 BrowserContext + Page，页面上的操作被派发到
+浏览器线程执行，调用方所在的事件循环只负责等待结果，因此 LLM 调用仍在主事件循环中进行。
+
+用法:
+    async with browser_pool.lease(headless=True) as page:
+        await page.goto(url)
+        ok, error = await page.run_snippet('await page.fill("#username", "admin")')
+        html = await page.content()
+"""
+import asyncio
+import sys
+import threading
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from ...core.config import settings
+from ...core.metrics import BROWSER_LAUNCHES
+from .live_snippet import SnippetRejected, parse_snippet, run_snippet
+
+
+class PooledPage:
+    """租用的页面，所有操作都在浏览器线程中执行"""
+
+    def __init__(self, pool: "BrowserPool", context, page):
+        self._pool = pool
+        self.context = context
+        self.page = page
+        # 片段之间共享的变量（生成的代码可能引用前面操作定义的常量）
+        self.namespace: Dict[str, Any] = {}
+
+    async def call(self, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """在浏览器线程中执行 func(page, *args, **kwargs)"""
+        return await self._pool.submit(func(self.page, *args, **kwargs))
+
+    async def goto(self, url: str, wait_until: str = "networkidle") -> None:
+        async def _goto(page):
+            await page.goto(url)
+            try:
+                await page.wait_for_load_state(wait_until, timeout=15000)
+            except Exception:
+                pass
+        await self.call(_goto)
+
+    async def content(self) -> Tuple[str, str]:
+        """返回 (当前URL, 页面HTML)"""
+        async def _content(page):
+            return page.url, await page.content()
+        return await self.call(_content)
+
+    async def run_snippet(self, code: str, timeout_ms: Optional[int] = None) -> Tuple[bool, str]:
+        """
+        在页面上执行一段生成的 Playwright 代码
+        代码不经过 exec，只解释执行白名单内的 page / 定位器 / expect 调用（见 live_snippet.py），
+        白名单以外的写法不执行，直接返回错误
+
+        Returns:
+            (是否成功, 错误信息)
+        """
+        timeout_ms = timeout_ms or settings.LIVE_CODEGEN_STEP_TIMEOUT_MS
+        try:
+            tree = parse_snippet(code)
+        except (SyntaxError, SnippetRejected) as e:
+            return False, f"{type(e).__name__}: {e}"
+
+        async def _run(page):
+            from playwright.async_api import expect
+
+            assigned = await asyncio.wait_for(run_snippet(tree, page, expect, self.namespace), timeout_ms / 1000)
+            self.namespace.update(assigned)
+            try:
+                await page.wait_for_load_state("networkidle", timeout=5000)
+            except Exception:
+                pass
+
+        try:
+            await self.call(_run)
+            return True, ""
+        except asyncio.TimeoutError:
+            return False, f"执行超时（{timeout_ms}ms）"
+        except Exception as e:
+            return False, f"{type(e).__name__}: {e}"
+
+
+class BrowserPool:
+    """在后台线程中保持浏览器进程，按需创建隔离的 context/page"""
+
+    def __init__(self, max_pages: int = None):
+        self.max_pages = max_pages or settings.BROWSER_POOL_SIZE
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._playwright = None
+        self._browsers: Dict[bool, Any] = {}  # headless -> Browser
+        self._slots: Optional[threading.BoundedSemaphore] = None
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is not None and self._thread.is_alive():
+                return self._loop
+            ready = threading.Event()
+
+            def run():
+                if sys.platform == 'win32':
+                    asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+                loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(loop)
+                self._loop = loop
+                ready.set()
+                loop.run_forever()
+
+            self._thread = threading.Thread(target=run, name="browser-pool", daemon=True)
+            self._thread.start()
+            ready.wait()
+            self._slots = threading.BoundedSemaphore(self.max_pages)
+            return self._loop
+
+    async def submit(self, coro) -> Any:
+        """把协程派发到浏览器线程执行并等待结果"""
+        loop = self._ensure_loop()
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+    async def _get_browser(self, headless: bool):
+        browser = self._browsers.get(headless)
+        if browser is not None and browser.is_connected():
+            return browser
+        if self._playwright is None:
+            from playwright.async_api import async_playwright
+            self._playwright = await async_playwright().start()
+        BROWSER_LAUNCHES.inc(source="browser_pool")
+        browser = await self._playwright.chromium.launch(headless=headless)
+        self._browsers[headless] = browser
+        return browser
+
+    async def acquire(self, headless: bool = True) -> PooledPage:
+        self._ensure_loop()
+        await asyncio.get_running_loop().run_in_executor(None, self._slots.acquire)
+
+        async def _open():
+            browser = await self._get_browser(headless)
+            context = await browser.new_context(viewport={"width": 1280, "height": 720})
+            return context, await context.new_page()
+
+        try:
+            context, page = await self.submit(_open())
+        except BaseException:
+            self._slots.release()
+            raise
+        return PooledPage(self, context, page)
+
+    async def release(self, pooled: PooledPage) -> None:
+        async def _close():
+            try:
+                await pooled.context.close()
+            except Exception:
+                pass
+        try:
+            await self.submit(_close())
+        finally:
+            self._slots.release()
+
+    @asynccontextmanager
+    async def lease(self, headless: bool = True):
+        pooled = await self.acquire(headless)
+        try:
+            yield pooled
+        finally:
+            await self.release(pooled)
+
+    async def close(self) -> None:
+        """关闭所有浏览器（应用关闭时调用）"""
+        if self._loop is None:
+            return
+
+        async def _shutdown():
+            for browser in self._browsers.values():
+                try:
+                    await browser.close()
+                except Exception:
+                    pass
+            self._browsers.clear()
+            if self._playwright is not None:
+                await self._playwright.stop()
+                self._playwright = None
+
+        try:
+            await self.submit(_shutdown())
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = None
+
+
+browser_pool = BrowserPool()
@@ -0,0 +1,319 @@
+"""
+实时跟踪模式的代码片段解释执行
+
+LLM 生成的代码片段在后端进程的长驻浏览器上执行（见 browser_pool.py），不能用 exec：
+片段可以导入任意模块、读写文件，阻塞的代码还会卡住整个浏览器线程，asyncio.wait_for 也无法取消。
+这里把片段解析为 AST，只解释执行白名单内的写法：
+
+- 语句：表达式、给变量赋值、if、try/except、pass，以及 import re / asyncio / playwright（忽略）
+- 调用：page / 定位器 / keyboard / mouse 上白名单内的方法（PLAYWRIGHT_METHODS），expect(...) 的
+  to_* / not_to_* 断言，re.compile / re.escape，asyncio.sleep，print / str / int / len
+- 属性：first、last、keyboard、mouse、url、not_，re 的标志位
+- 表达式：常量、f-string、字符串拼接和比较、列表/元组/字典字面量、下标、and/or/not、条件表达式
+
+没有循环和任意函数调用，片段里的等待都是 Playwright 或 asyncio 的协程，超时可以取消。
+page.goto 只允许 http(s) 地址，set_input_files、screenshot、route、context 等会接触服务器文件
+或浏览器上下文的接口不在白名单内。不支持的写法在执行前报错，由调用方带着错误重新生成。
+"""
+import ast
+import asyncio
+import operator
+import re
+from typing import Any, Dict, Optional
+
+# 定位器、页面、keyboard、mouse 上可以调用的方法
+PLAYWRIGHT_METHODS = {
+    # 定位
+    "locator", "get_by_role", "get_by_text", "get_by_label", "get_by_placeholder", "get_by_test_id",
+    "get_by_title", "get_by_alt_text", "filter", "nth", "frame_locator", "and_", "or_",
+    # 操作
+    "click", "dblclick", "tap", "fill", "type", "press", "press_sequentially", "clear", "check",
+    "uncheck", "set_checked", "hover", "focus", "blur", "select_option", "select_text",
+    "dispatch_event", "drag_to", "scroll_into_view_if_needed", "evaluate",
+    "down", "up", "insert_text", "move", "wheel",
+    # 读取
+    "text_content", "inner_text", "inner_html", "input_value", "get_attribute", "is_visible",
+    "is_hidden", "is_enabled", "is_disabled", "is_checked", "is_editable", "bounding_box", "count",
+    "all_text_contents", "all_inner_texts", "title",
+    # 等待和导航
+    "wait_for", "wait_for_selector", "wait_for_timeout", "wait_for_load_state", "wait_for_url",
+    "goto", "reload", "go_back", "go_forward",
+}
+PLAYWRIGHT_ATTRS = {"first", "last", "keyboard", "mouse", "url", "not_"}
+MODULE_ATTRS = {
+    "re": {"compile", "escape", "I", "IGNORECASE", "S", "DOTALL", "M", "MULTILINE"},
+    "asyncio": {"sleep"},
+}
+IGNORED_IMPORTS = {"re", "asyncio", "playwright", "playwright.async_api"}
+EXCEPTION_NAMES = {"Exception", "TimeoutError", "PlaywrightTimeoutError", "AssertionError"}
+
+_BIN_OPS = {ast.Add: operator.add, ast.Sub: operator.sub}
+_COMPARE_OPS = {
+    ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt, ast.LtE: operator.le,
+    ast.Gt: operator.gt, ast.GtE: operator.ge, ast.In: lambda a, b: a in b, ast.NotIn: lambda a, b: a not in b,
+    ast.Is: operator.is_, ast.IsNot: operator.is_not,
+}
+
+
+class SnippetRejected(Exception):
+    """片段包含白名单以外的写法"""
+
+
+def _reject(node: ast.AST, what: str):
+    raise SnippetRejected(f"第 {getattr(node, 'lineno', '?')} 行{what} 不允许在实时跟踪中执行")
+
+
+def _check_expr(node: ast.AST) -> None:
+    if isinstance(node, ast.Constant):
+        if not isinstance(node.value, (str, int, float, bool, type(None))):
+            _reject(node, "的常量类型")
+    elif isinstance(node, ast.Name):
+        if node.id in MODULE_ATTRS:
+            _reject(node, f"直接使用 {node.id} 模块")
+    elif isinstance(node, ast.JoinedStr):
+        for value in node.values:
+            _check_expr(value)
+    elif isinstance(node, ast.FormattedValue):
+        if node.format_spec is not None:
+            _reject(node, "的格式说明")
+        _check_expr(node.value)
+    elif isinstance(node, ast.BinOp):
+        if type(node.op) not in _BIN_OPS:
+            _reject(node, f"的运算符 {type(node.op).__name__}")
+        _check_expr(node.left)
+        _check_expr(node.right)
+    elif isinstance(node, ast.UnaryOp):
+        if not isinstance(node.op, (ast.Not, ast.USub)):
+            _reject(node, f"的运算符 {type(node.op).__name__}")
+        _check_expr(node.operand)
+    elif isinstance(node, ast.BoolOp):
+        for value in node.values:
+            _check_expr(value)
+    elif isinstance(node, ast.Compare):
+        if any(type(op) not in _COMPARE_OPS for op in node.ops):
+            _reject(node, "的比较运算")
+        for value in [node.left, *node.comparators]:
+            _check_expr(value)
+    elif isinstance(node, ast.IfExp):
+        for value in (node.test, node.body, node.orelse):
+            _check_expr(value)
+    elif isinstance(node, (ast.List, ast.Tuple)):
+        for value in node.elts:
+            _check_expr(value)
+    elif isinstance(node, ast.Dict):
+        if any(key is None for key in node.keys):
+            _reject(node, "的 ** 展开")
+        for value in [*node.keys, *node.values]:
+            _check_expr(value)
+    elif isinstance(node, ast.Subscript):
+        if isinstance(node.slice, ast.Slice):
+            _reject(node, "的切片")
+        _check_expr(node.value)
+        _check_expr(node.slice)
+    elif isinstance(node, ast.Await):
+        _check_expr(node.value)
+    elif isinstance(node, ast.Attribute):
+        _check_attribute(node, call=False)
+    elif isinstance(node, ast.Call):
+        if isinstance(node.func, ast.Attribute):
+            _check_attribute(node.func, call=True)
+        elif not (isinstance(node.func, ast.Name) and node.func.id in _CALLABLE_NAMES):
+            _reject(node, "的函数调用")
+        for arg in node.args:
+            if isinstance(arg, ast.Starred):
+                _reject(node, "的 * 展开")
+            _check_expr(arg)
+        for keyword in node.keywords:
+            if keyword.arg is None:
+                _reject(node, "的 ** 展开")
+            _check_expr(keyword.value)
+    else:
+        _reject(node, f"的 {type(node).__name__} 表达式")
+
+
+def _check_attribute(node: ast.Attribute, call: bool) -> None:
+    if isinstance(node.value, ast.Name) and node.value.id in MODULE_ATTRS:
+        if node.attr not in MODULE_ATTRS[node.value.id]:
+            _reject(node, f"的 {node.value.id}.{node.attr}")
+        return
+    allowed = node.attr in PLAYWRIGHT_METHODS or node.attr.startswith(("to_", "not_to_")) if call \
+        else node.attr in PLAYWRIGHT_ATTRS
+    if not allowed:
+        _reject(node, f"的 .{node.attr}")
+    _check_expr(node.value)
+
+
+def _check_body(body) -> None:
+    for node in body:
+        if isinstance(node, ast.Expr):
+            _check_expr(node.value)
+        elif isinstance(node, ast.Assign):
+            if len(node.targets) != 1 or not isinstance(node.targets[0], ast.Name):
+                _reject(node, "的赋值目标")
+            if node.targets[0].id in _RESERVED:
+                _reject(node, f"给 {node.targets[0].id} 赋值")
+            _check_expr(node.value)
+        elif isinstance(node, ast.If):
+            _check_expr(node.test)
+            _check_body(node.body)
+            _check_body(node.orelse)
+        elif isinstance(node, ast.Try):
+            if node.finalbody or node.orelse:
+                _reject(node, "的 try 的 else / finally")
+            _check_body(node.body)
+            for handler in node.handlers:
+                names = handler.type.elts if isinstance(handler.type, ast.Tuple) else [handler.type]
+                if any(n is not None and not (isinstance(n, ast.Name) and n.id in EXCEPTION_NAMES) for n in names):
+                    _reject(handler, "捕获的异常类型")
+                if handler.name in _RESERVED:
+                    _reject(handler, f"给 {handler.name} 赋值")
+                _check_body(handler.body)
+        elif isinstance(node, ast.Import):
+            if any(alias.name not in IGNORED_IMPORTS or alias.asname for alias in node.names):
+                _reject(node, "的 import")
+        elif isinstance(node, ast.ImportFrom):
+            if node.module not in IGNORED_IMPORTS:
+                _reject(node, "的 import")
+        elif not isinstance(node, ast.Pass):
+            _reject(node, f"的 {type(node).__name__} 语句")
+
+
+def parse_snippet(code: str) -> ast.Module:
+    """解析并检查片段，包含白名单以外的写法时抛出 SnippetRejected（语法错误抛出 SyntaxError）"""
+    tree = ast.parse(code.strip() or "pass")
+    _check_body(tree.body)
+    return tree
+
+
+def _check_url(url: Any) -> None:
+    if not isinstance(url, str) or not re.match(r"https?://", url, re.IGNORECASE):
+        raise SnippetRejected(f"page.goto 只允许 http(s) 地址: {url!r}")
+
+
+_BUILTINS = {"print": print, "str": str, "int": int, "len": len}
+_CALLABLE_NAMES = {"expect", *_BUILTINS}
+_RESERVED = {"page", "re", "asyncio", *_CALLABLE_NAMES}
+
+
+class _Interpreter:
+    def __init__(self, page, expect, variables: Dict[str, Any]):
+        self.scope: Dict[str, Any] = {**variables, **_BUILTINS, "page": page, "expect": expect}
+        self.assigned: Dict[str, Any] = {}
+
+    async def run(self, body) -> None:
+        for node in body:
+            if isinstance(node, ast.Expr):
+                result = await self.eval(node.value)
+                if asyncio.iscoroutine(result):
+                    result.close()
+                    raise SnippetRejected(f"第 {node.lineno} 行调用 Playwright 方法时缺少 await")
+            elif isinstance(node, ast.Assign):
+                name = node.targets[0].id
+                self.scope[name] = self.assigned[name] = await self.eval(node.value)
+            elif isinstance(node, ast.If):
+                await self.run(node.body if await self.eval(node.test) else node.orelse)
+            elif isinstance(node, ast.Try):
+                await self._run_try(node)
+
+    async def _run_try(self, node: ast.Try) -> None:
+        try:
+            await self.run(node.body)
+        except SnippetRejected:
+            raise
+        except Exception as e:
+            for handler in node.handlers:
+                names = handler.type.elts if isinstance(handler.type, ast.Tuple) else [handler.type]
+                if any(n is None or self._catches(n.id, e) for n in names):
+                    if handler.name:
+                        self.scope[handler.name] = e
+                    await self.run(handler.body)
+                    return
+            raise
+
+    @staticmethod
+    def _catches(name: str, error: Exception) -> bool:
+        if name == "Exception":
+            return True
+        if name == "AssertionError":
+            return isinstance(error, AssertionError)
+        from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+        return isinstance(error, (PlaywrightTimeoutError, asyncio.TimeoutError))
+
+    async def eval(self, node: ast.AST) -> Any:
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, ast.Name):
+            if node.id not in self.scope:
+                raise NameError(f"name '{node.id}' is not defined")
+            return self.scope[node.id]
+        if isinstance(node, ast.JoinedStr):
+            return "".join([str(await self.eval(value)) for value in node.values])
+        if isinstance(node, ast.FormattedValue):
+            value = await self.eval(node.value)
+            return repr(value) if node.conversion == ord("r") else str(value)
+        if isinstance(node, ast.BinOp):
+            return _BIN_OPS[type(node.op)](await self.eval(node.left), await self.eval(node.right))
+        if isinstance(node, ast.UnaryOp):
+            operand = await self.eval(node.operand)
+            return not operand if isinstance(node.op, ast.Not) else -operand
+        if isinstance(node, ast.BoolOp):
+            result = None
+            for value in node.values:
+                result = await self.eval(value)
+                if bool(result) == isinstance(node.op, ast.Or):
+                    return result
+            return result
+        if isinstance(node, ast.Compare):
+            left = await self.eval(node.left)
+            for op, comparator in zip(node.ops, node.comparators):
+                right = await self.eval(comparator)
+                if not _COMPARE_OPS[type(op)](left, right):
+                    return False
+                left = right
+            return True
+        if isinstance(node, ast.IfExp):
+            return await self.eval(node.body if await self.eval(node.test) else node.orelse)
+        if isinstance(node, ast.List):
+            return [await self.eval(value) for value in node.elts]
+        if isinstance(node, ast.Tuple):
+            return tuple([await self.eval(value) for value in node.elts])
+        if isinstance(node, ast.Dict):
+            return {await self.eval(key): await self.eval(value) for key, value in zip(node.keys, node.values)}
+        if isinstance(node, ast.Subscript):
+            return (await self.eval(node.value))[await self.eval(node.slice)]
+        if isinstance(node, ast.Await):
+            return await (await self.eval(node.value))
+        if isinstance(node, ast.Attribute):
+            return getattr(await self._base(node), node.attr)
+        if isinstance(node, ast.Call):
+            return await self._call(node)
+        raise SnippetRejected(f"第 {getattr(node, 'lineno', '?')} 行的 {type(node).__name__} 表达式不允许在实时跟踪中执行")
+
+    async def _base(self, node: ast.Attribute) -> Any:
+        if isinstance(node.value, ast.Name) and node.value.id in MODULE_ATTRS:
+            return {"re": re, "asyncio": asyncio}[node.value.id]
+        return await self.eval(node.value)
+
+    async def _call(self, node: ast.Call) -> Any:
+        if isinstance(node.func, ast.Name):
+            func = self.scope[node.func.id]
+        else:
+            func = getattr(await self._base(node.func), node.func.attr)
+        args = [await self.eval(arg) for arg in node.args]
+        kwargs = {keyword.arg: await self.eval(keyword.value) for keyword in node.keywords}
+        if isinstance(node.func, ast.Attribute) and node.func.attr == "goto":
+            _check_url(args[0] if args else kwargs.get("url"))
+        return func(*args, **kwargs)
+
+
+async def run_snippet(tree: ast.Module, page, expect, variables: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    在 page 上解释执行 parse_snippet 检查过的片段
+    Args:
+        variables: 之前的片段定义的变量（生成的代码可能引用前面操作定义的常量）
+    Returns:
+        本片段赋值的变量
+    """
+    interpreter = _Interpreter(page, expect, variables or {})
+    await interpreter.run(tree.body)
+    return interpreter.assigned
@@ -0,0 +1,227 @@
+"""
+场景执行的共享登录前置步骤
+
+同一个场景的用例通常以相同的登录步骤开头（打开页面、输入用户名密码、识别验证码、点击登录），
+逐个执行时每个用例都要重新登录一遍，验证码识别还要调用 VL 模型，往往比用例本身的断言步骤还慢。
+
+执行场景前比较各用例保存的脚本（DOM 和 Computer-Use 方案生成的 Playwright 脚本）：
+- 按 "# Action N: ..." 注释把操作区切成代码块，到第一个登录操作（点击登录/提交）为止的代码块
+  作为登录前置步骤，前置步骤完全相同的用例分为一组
+- 每组的前置脚本执行一次，登录后用 storage_state.save_state 保存登录状态（包括 sessionStorage）和当前 URL
+- 每个用例的后续脚本用 new_page_with_saved_state 恢复登录状态后打开该 URL，只执行剩下的代码块
+- 只有两个及以上的用例共用前置步骤、且前置步骤登录后离开了起始页面时才这样拆分，其余用例按完整脚本执行
+- 后续脚本打开登录后的 URL 后输出实际到达的页面，失败时据此判断是否被登录页拦下（hit_login_wall），
+  被拦下的用例按完整脚本重新执行
+
+agent-browser 方案的脚本通过 --profile 共享浏览器状态，不在这里处理。
+"""
+import hashlib
+import json
+import re
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+ACTIONS_START = "# Execute all actions"
+STATE_EVENT = "shared_prefix_state"
+LANDING_EVENT = "shared_prefix_landing"
+LOGIN_PATH_RE = re.compile(r"login|signin|sign-in|sso|auth|passport", re.IGNORECASE)
+
+_MARKER_RE = re.compile(r"^\s*# (?:\[自动验证码处理\]|Action \d+:)")
+# 加载保存的登录状态的脚本用 new_page_with_saved_state 创建页面（见 app/utils/storage_state.py）
+_NEW_PAGE_RE = re.compile(r"^(?P<indent>\s*)page = await (?:browser\.new_page\(\)|new_page_with_saved_state\(browser\b.*\))\s*$")
+_GOTO_RE = re.compile(r"^(?P<indent>\s*)await page\.goto\((?P<url>.*)\)\s*$")
+_DEBUG_WAIT_RE = re.compile(r"^\s*await asyncio\.sleep\(30\)")
+_LOGIN_WORDS = ("登录", "登入", "login", "sign in", "signin", "submit", "提交")
+_SUBMIT_CODE_RE = re.compile(r"click\(|\.press\(")
+
+
+def _indent_of(line: str) -> int:
+    return len(line) - len(line.lstrip())
+
+
+def split_script(script: str) -> Optional[Dict[str, Any]]:
+    """
+    把生成的 Playwright 脚本切成 头部 / 操作区前导代码 / 操作代码块 / 尾部
+    Returns:
+        {"header": [行], "preamble": [行], "blocks": [{"lines", "text", "login"}], "footer": [行],
+         "indent": 操作区缩进, "url": 打开的页面}，不是可以切分的 Playwright 脚本时返回 None
+    """
+    lines = (script or "").replace("\r\n", "\n").split("\n")
+    start = next((k for k, line in enumerate(lines) if line.strip() == ACTIONS_START), None)
+    if start is None:
+        return None
+    header = lines[:start + 1]
+    goto = next((m for m in map(_GOTO_RE.match, header) if m), None)
+    if not any(_NEW_PAGE_RE.match(line) for line in header) or goto is None:
+        return None
+    url = goto.group("url").strip().strip("'\"")
+
+    indent = _indent_of(lines[start])
+    end = next(
+        (k for k in range(start + 1, len(lines)) if lines[k].strip() and _indent_of(lines[k]) < indent),
+        len(lines)
+    )
+    preamble: List[str] = []
+    blocks: List[Dict[str, Any]] = []
+    for line in lines[start + 1:end]:
+        if _indent_of(line) == indent and _MARKER_RE.match(line):
+            blocks.append({"lines": [line]})
+        elif blocks:
+            blocks[-1]["lines"].append(line)
+        else:
+            preamble.append(line)
+
+    for block in blocks:
+        block["text"] = "\n".join(block["lines"]).strip()
+        description = block["lines"][0].lower()
+        block["login"] = any(w in description for w in _LOGIN_WORDS) and bool(_SUBMIT_CODE_RE.search(block["text"]))
+    return {"header": header, "preamble": preamble, "blocks": blocks, "footer": lines[end:], "indent": indent, "url": url}
+
+
+def plan_shared_prefix(scripts: Dict[Any, str], min_cases: int = 2) -> List[Dict[str, Any]]:
+    """
+    按登录前置步骤给用例分组
+    每个用例的前置步骤为第一个登录代码块及之前的代码块，前置步骤（连同脚本头部）完全相同的用例分为一组；
+    登录数据不同的用例（如错误密码的反向用例）自成一组，按完整脚本执行
+    Args:
+        scripts: 用例ID -> 保存的脚本
+        min_cases: 组内最少的用例数（会话池重新登录时取单个用例脚本的登录步骤，传 1）
+    Returns:
+        [{"case_ids": [用例ID], "prefix_len": 前置代码块数, "login_key": 前置步骤的指纹,
+          "parts": 用例ID -> split_script 结果}]
+    """
+    groups: Dict[str, Dict[str, Any]] = {}
+    for case_id, script in scripts.items():
+        parts = split_script(script)
+        if parts is None:
+            continue
+        login_end = next((k for k, block in enumerate(parts["blocks"]) if block["login"]), None)
+        if login_end is None:
+            continue
+        key = _join(parts["header"] + parts["preamble"] + [block["text"] for block in parts["blocks"][:login_end + 1]])
+        group = groups.setdefault(key, {
+            "case_ids": [], "prefix_len": login_end + 1, "parts": {},
+            "login_key": hashlib.sha1(key.encode("utf-8")).hexdigest()[:16],
+        })
+        group["case_ids"].append(case_id)
+        group["parts"][case_id] = parts
+    return [group for group in groups.values() if len(group["case_ids"]) >= min_cases]
+
+
+def build_login_script(script: str, state_path: str) -> Optional[Dict[str, Any]]:
+    """
+    从一个用例脚本得到只执行登录前置步骤并保存 storage_state 的脚本（会话池刷新会话时使用）
+    Returns:
+        {"script": 登录脚本, "login_key": 前置步骤的指纹}，脚本中没有登录步骤时返回 None
+    """
+    groups = plan_shared_prefix({0: script}, min_cases=1)
+    if not groups:
+        return None
+    group = groups[0]
+    return {
+        "script": build_prefix_script(group["parts"][0], group["prefix_len"], state_path),
+        "login_key": group["login_key"],
+    }
+
+
+def _join(lines: List[str]) -> str:
+    return "\n".join(lines)
+
+
+def _storage_state_import(pad: str) -> List[str]:
+    """在函数内导入 app/utils/storage_state.py（本功能之前生成的脚本头部没有导入）"""
+    from ...core.config import settings
+
+    return [
+        f"{pad}import os as _os, sys as _sys",
+        f"{pad}_app_path = _os.getenv('PYTHON_PATH', '') or {settings.BASE_DIR!r}",
+        f"{pad}if _app_path not in _sys.path:",
+        f"{pad}    _sys.path.insert(0, _app_path)",
+        f"{pad}from app.utils.storage_state import new_page_with_saved_state as _new_page_with_saved_state, save_state as _save_state",
+    ]
+
+
+def build_prefix_script(parts: Dict[str, Any], prefix_len: int, state_path: str) -> str:
+    """前置脚本：执行共享的代码块，然后保存登录状态（cookies、localStorage、sessionStorage）并输出当前 URL"""
+    pad = " " * parts["indent"]
+    capture = [
+        f"{pad}# [共享登录前置] 保存登录后的状态，后续用例从这里开始",
+        f"{pad}try:",
+        f"{pad}    await page.wait_for_load_state('networkidle', timeout=10000)",
+        f"{pad}except Exception:",
+        f"{pad}    pass",
+        *_storage_state_import(pad),
+        f"{pad}await _save_state(page, {state_path!r})",
+        f"{pad}import json as _json",
+        f"{pad}print(_json.dumps({{'event': {STATE_EVENT!r}, 'url': page.url}}, ensure_ascii=False))",
+    ]
+    blocks = [line for block in parts["blocks"][:prefix_len] for line in block["lines"]]
+    footer = [line for line in parts["footer"] if not _DEBUG_WAIT_RE.match(line)]
+    return _join(parts["header"] + parts["preamble"] + blocks + capture + footer)
+
+
+def build_suffix_script(parts: Dict[str, Any], prefix_len: int, state_path: str, url: str) -> str:
+    """
+    后续脚本：用保存的登录状态创建新上下文（sessionStorage 由 new_page_with_saved_state 的初始化脚本写入），
+    打开登录后的 URL 并输出实际到达的页面，只执行剩下的代码块
+    """
+    header = []
+    for line in parts["header"]:
+        new_page = _NEW_PAGE_RE.match(line)
+        goto = _GOTO_RE.match(line)
+        if new_page:
+            pad = new_page.group("indent")
+            header.extend(_storage_state_import(pad))
+            header.append(f"{pad}page = await _new_page_with_saved_state(browser, {state_path!r}, {url!r})")
+        elif goto:
+            header.append(f"{goto.group('indent')}await page.goto({url!r})")
+        else:
+            header.append(line)
+    pad = " " * parts["indent"]
+    landing = [
+        f"{pad}import json as _json",
+        f"{pad}print(_json.dumps({{'event': {LANDING_EVENT!r}, 'url': page.url}}, ensure_ascii=False))",
+    ]
+    blocks = [line for block in parts["blocks"][prefix_len:] for line in block["lines"]]
+    return _join(header + landing + parts["preamble"] + blocks + parts["footer"])
+
+
+def _parse_url_event(execution_output: str, event: str) -> Optional[str]:
+    for line in (execution_output or "").split("\n"):
+        line = line.strip()
+        if line.startswith("{") and event in line:
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if data.get("event") == event and data.get("url"):
+                return data["url"]
+    return None
+
+
+def parse_state_event(execution_output: str) -> Optional[str]:
+    """从前置脚本的输出中读取登录后的 URL（脚本成功保存 storage_state 后才会输出）"""
+    return _parse_url_event(execution_output, STATE_EVENT)
+
+
+def hit_login_wall(execution_output: str, url: str, start_url: str) -> bool:
+    """
+    后续脚本执行失败时判断是否被登录页拦下（登录状态已失效）：
+    没有打开登录后的页面，或打开后被重定向到其它源、起始页面或登录页
+    （到达了登录后的页面说明是用例本身的失败，按完整脚本重跑也一样）
+    """
+    landing = _parse_url_event(execution_output, LANDING_EVENT)
+    if landing is None:
+        return True
+    landed, expected = urlparse(landing), urlparse(url)
+    if (landed.scheme, landed.netloc) != (expected.scheme, expected.netloc):
+        return True
+    # 路由按 路径 + #片段 比较（hash 路由的单页应用登录前后路径相同）
+    route = _route(landed)
+    if route == _route(expected):
+        return False
+    return route == _route(urlparse(start_url)) or bool(LOGIN_PATH_RE.search(route))
+
+
+def _route(parsed) -> str:
+    return parsed.path.rstrip("/") + ("#" + parsed.fragment if parsed.fragment else "")
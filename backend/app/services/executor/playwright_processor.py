@@ -2,7 +2,6 @@
 Playwright 处理器 - 在单独进程中处理 Playwright 任务
 """
 
-import os
 import json
 import time
 import asyncio
@@ -77,7 +76,19 @@ def process_playwright_task(task_data):
 
         with SyncComputerUseService() as sync_computer_use_service:
             browser = sync_computer_use_service.p.chromium.launch(headless=browser_headless)
-            page = browser.new_page()
+            # 需要加载保存的登录状态时在创建上下文时恢复（见 app/utils/storage_state.py），不需要刷新页面
+            saved_state = None
+            if load_saved_storage:
+                from app.utils.storage_state import read_state, restore_script, state_path
+                saved_state = read_state(state_path(), target_url)
+            if saved_state:
+                print("   [子进程] 使用保存的登录状态创建页面")
+                page = browser.new_page(storage_state=saved_state["storage_state"])
+                init_script = restore_script(saved_state)
+                if init_script:
+                    page.context.add_init_script(init_script)
+            else:
+                page = browser.new_page()
 
             # 先导航到目标页面
             print(f"   [子进程] 正在导航到: {target_url}")
@@ -85,29 +96,6 @@ def process_playwright_task(task_data):
             page.wait_for_load_state("networkidle")
             time.sleep(2)
 
-            # 如果需要加载保存的storage
-            if load_saved_storage:
-                print("   [子进程] 正在加载保存的 cookies 和 storage...")
-                from app.utils.browser_util import get_browser_util
-                browser_util = get_browser_util()
-
-                # 获取会话存储路径
-                session_storage_path = os.getenv('SESSION_STORAGE_PATH', os.getcwd())
-
-                # 使用browser_util加载storage
-                browser_util.load_storage(
-                    page,
-                    cookies_path=os.path.join(session_storage_path, 'saved_cookies.json'),
-                    localstorage_path=os.path.join(session_storage_path, 'saved_localstorage.json'),
-                    sessionstorage_path=os.path.join(session_storage_path, 'saved_sessionstorage.json')
-                )
-
-                # 刷新页面使storage生效
-                print("   [子进程] 正在刷新页面使登录状态生效...")
-                page.reload(wait_until="domcontentloaded")
-                time.sleep(5)
-                print("   [子进程] ✅ 页面刷新完成")
-
             for i, action in enumerate(actions[1:], 1):  # 跳过第一个导航操作
                 is_last = i == len(actions) - 1
 
@@ -1,26 +1,26 @@
 import asyncio
-import io
+import logging
 import re
 import sys
 import os
-import concurrent.futures
-from typing import Dict, Any, Optional, List
-from contextlib import redirect_stdout
-from datetime import datetime
-import pytest
-import ipytest
-import nest_asyncio
+import time
+from typing import Dict, Any, Optional, List, Tuple
 from dotenv import load_dotenv
 
-from ..generator.test_generator import test_generator
-from ..captcha.captcha_service import captcha_service
-from ..llm.bailian_client import bailian_client
-from ..computer_use.computer_use_service import computer_use_service
-from ..agent_browser.agent_browser_service import AgentBrowserService
-from ..agent_browser.action_planner import ActionPlanner
+from ...core.metrics import (
+    BROWSER_LAUNCHES, INFLIGHT_JOBS, METRICS_EVENTS_ENV, SCRIPT_EXECUTION_SECONDS,
+    SCRIPT_GENERATION_SECONDS, STEP_DURATION_SECONDS, ingest_metric_event,
+)
+from ...core.tracing import current_span, record_span, traced
+
+# 生成器、LLM 客户端、浏览器服务依赖 langchain/openai/playwright，导入开销大，
+# 统一在首次使用的方法内部延迟导入，避免拖慢 API 进程启动
 
 load_dotenv()
 
+# 大段脚本、子进程输出只写 DEBUG 日志（由日志队列截断并异步落盘），不再直接 print
+logger = logging.getLogger(__name__)
+
 
 def _run_playwright_in_thread(task_func, *args, **kwargs):
     """
@@ -89,36 +89,95 @@ class TestExecutor:
             "captcha_input_selector": captcha_input_selector
         }
 
-    async def _detect_captcha_from_page(self, page_content: Dict[str, Any]) -> Dict[str, Any]:
+    @traced("detect_captcha")
+    async def _detect_captcha_from_page(
+        self,
+        page_content: Dict[str, Any],
+        page_analysis: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
         """
-        使用VL模型检测页面截图中是否有验证码，并读取DB配置的选择器
+        检测页面中是否有验证码，并读取DB配置的选择器
+        按成本从低到高：
+        1. 正则扫描页面 HTML（不调用模型），找到验证码图片即认为有验证码
+        2. 使用页面分析（analyze_page_content）同一次 VL 调用返回的 "captcha" 字段，
+           其中的验证码输入框（元素清单编号）在DB没有配置输入框选择器时作为 captcha_input_selector
+        3. 页面分析没有返回验证码信息（如 VL 分析失败降级为 HTML 分析）时，才单独调用 VL 检测截图
+        Args:
+            page_content: 页面内容
+            page_analysis: 页面分析结果
         Returns:
             {"has_captcha": bool, "captcha_type": str, "captcha_description": str,
-             "captcha_selector": str or None, "captcha_input_selector": str or None}
+             "captcha_selector": str or None, "captcha_input_selector": str or None, "source": str}
         """
-        from ..captcha.captcha_service import captcha_service
-
-        # 提取截图base64
-        screenshot_data = page_content.get('screenshot', '')
-        if screenshot_data.startswith('data:image'):
-            screenshot_base64 = screenshot_data.split(',')[1] if ',' in screenshot_data else screenshot_data
+        from ..captcha.captcha_service import CaptchaService, captcha_service
+
+        fused = (page_analysis or {}).get("captcha")
+        if not isinstance(fused, dict):
+            fused = None
+
+        dom_selector, _ = CaptchaService._find_captcha_traditional(page_content.get('html', ''))
+        if dom_selector:
+            # HTML 中已有验证码图片：类型和位置描述仍取页面分析的结果（有的话）
+            fused_type = (fused or {}).get("captcha_type")
+            detected = {
+                "has_captcha": True,
+                "captcha_type": fused_type if fused_type and fused_type != "none" else "text",
+                "captcha_description": (fused or {}).get("captcha_description") or f"HTML 中的验证码图片 {dom_selector}",
+                "source": "dom",
+            }
+        elif fused is not None:
+            detected = {
+                "has_captcha": bool(fused.get("has_captcha", False)),
+                "captcha_type": fused.get("captcha_type") or "none",
+                "captcha_description": fused.get("captcha_description", ""),
+                "source": "page_analysis",
+            }
         else:
-            screenshot_base64 = screenshot_data
+            # 提取截图base64
+            screenshot_data = page_content.get('screenshot', '')
+            if screenshot_data.startswith('data:image'):
+                screenshot_base64 = screenshot_data.split(',')[1] if ',' in screenshot_data else screenshot_data
+            else:
+                screenshot_base64 = screenshot_data
 
-        # VL检测验证码
-        vl_result = await captcha_service.detect_captcha_from_screenshot(screenshot_base64)
+            # VL检测验证码
+            vl_result = await captcha_service.detect_captcha_from_screenshot(screenshot_base64)
+            detected = {
+                "has_captcha": vl_result.get("has_captcha", False),
+                "captcha_type": vl_result.get("captcha_type", "none"),
+                "captcha_description": vl_result.get("captcha_description", ""),
+                "source": "vl",
+            }
 
         # 读取DB配置
         db_config = await self._read_captcha_config_from_db()
+        input_selector = db_config.get("captcha_input_selector")
+        if not input_selector and detected["has_captcha"]:
+            input_selector = self._captcha_input_from_analysis(fused, page_content)
+            if input_selector:
+                print(f"   [验证码] 页面分析指出的验证码输入框: {input_selector}")
 
         return {
-            "has_captcha": vl_result.get("has_captcha", False),
-            "captcha_type": vl_result.get("captcha_type", "none"),
-            "captcha_description": vl_result.get("captcha_description", ""),
+            **detected,
             "captcha_selector": db_config.get("captcha_selector"),
-            "captcha_input_selector": db_config.get("captcha_input_selector")
+            "captcha_input_selector": input_selector
         }
 
+    @staticmethod
+    def _captcha_input_from_analysis(fused: Optional[Dict[str, Any]], page_content: Dict[str, Any]) -> Optional[str]:
+        """页面分析返回的验证码输入框（元素清单中的编号或名称）对应的选择器，找不到时返回 None"""
+        from ..generator.page_model import build_page_model
+
+        ref = str((fused or {}).get("input_field") or "").strip().strip("[]")
+        if not ref:
+            return None
+        elements = page_content.get('page_model') or build_page_model(page_content.get('html', ''))
+        inputs = [e for e in elements if e["tag"] in ("input", "textarea") and e["role"] != "button"]
+        element = next((e for e in inputs if e["id"] == ref), None) or next(
+            (e for e in inputs if ref in (e["name"], e["field"], e["selector"])), None
+        )
+        return element["selector"] if element else None
+
     def _is_captcha_recognition_action(self, action: str) -> bool:
         """检测是否为验证码截图/VL模型识别动作"""
         a = action.lower()
@@ -135,6 +194,7 @@ class TestExecutor:
         a = action.lower()
         return '识别结果' in a
 
+    @traced("generate_script", mode="dom")
     async def generate_script_only(
         self,
         user_query: str,
@@ -142,7 +202,8 @@ class TestExecutor:
         auto_detect_captcha: bool = False,
         auto_cookie_localstorage: bool = True,
         load_saved_storage: bool = True,
-        page_content: Dict[str, Any] = None
+        page_content: Dict[str, Any] = None,
+        resource_profile: str = "none"
     ) -> Dict[str, Any]:
         """
         只生成测试脚本，不执行测试 - 用于批量生成用例
@@ -153,9 +214,13 @@ class TestExecutor:
             auto_cookie_localstorage: 是否自动加载和保存cookie/localstorage
             load_saved_storage: 是否加载保存的cookie/localstorage/sessionstorage
             page_content: 页面内容（如果提供，则不重新获取）
+            resource_profile: 资源拦截方案（见 app/utils/resource_profiles.py）
         Returns:
             包含脚本的字典
         """
+        from ..generator.test_generator import test_generator
+        from ..llm.bailian_client import bailian_client
+
         result = {
             "status": "success",
             "actions": [],
@@ -164,6 +229,9 @@ class TestExecutor:
             "error": None
         }
 
+        start_time = time.perf_counter()
+        INFLIGHT_JOBS.inc(kind="generation")
+
         try:
             print("\n===== 开始生成测试脚本 =====")
             print(f"用户查询: {user_query}")
@@ -172,7 +240,7 @@ class TestExecutor:
             # 步骤1: 获取页面内容（截图和HTML）- 如果未提供则获取
             print("\n步骤1: 获取页面内容...")
             if page_content is None:
-                page_content = await test_generator.get_page_content(target_url)
+                page_content = await test_generator.get_page_content(target_url, resource_profile=resource_profile)
                 print(f"✅ 页面标题: {page_content.get('title', 'N/A')}")
             else:
                 print(f"✅ 使用已获取的页面内容: {page_content.get('title', 'N/A')}")
@@ -182,10 +250,10 @@ class TestExecutor:
             page_analysis = await test_generator.analyze_page_content(page_content, user_query)
             print(f"✅ 页面类型: {page_analysis.get('page_type', 'N/A')}")
 
-            # 步骤2.5: VL验证码检测 + 读取DB配置选择器
-            print("\n步骤2.5: VL验证码检测...")
-            captcha_info = await self._detect_captcha_from_page(page_content)
-            print(f"✅ 验证码检测结果: has_captcha={captcha_info['has_captcha']}, type={captcha_info['captcha_type']}")
+            # 步骤2.5: 验证码检测（HTML 预筛 + 页面分析结果）+ 读取DB配置选择器
+            print("\n步骤2.5: 验证码检测...")
+            captcha_info = await self._detect_captcha_from_page(page_content, page_analysis)
+            print(f"✅ 验证码检测结果: has_captcha={captcha_info['has_captcha']}, type={captcha_info['captcha_type']}, 来源={captcha_info['source']}")
             if captcha_info['captcha_selector']:
                 print(f"   DB配置 captcha_selector: {captcha_info['captcha_selector']}")
             if captcha_info['captcha_input_selector']:
@@ -193,7 +261,9 @@ class TestExecutor:
 
             # 步骤2.6: 提取表单选择器
             print("\n步骤2.6: 提取表单选择器...")
-            form_selectors = test_generator.extract_form_selectors(page_content.get('html', ''))
+            form_selectors = page_content.get('form_selectors')
+            if form_selectors is None:
+                form_selectors = test_generator.extract_form_selectors(page_content.get('html', ''))
             print(f"✅ 提取到 {len(form_selectors)} 个表单选择器")
             for name, selector in form_selectors.items():
                 print(f"   {name}: {selector}")
@@ -208,11 +278,16 @@ class TestExecutor:
 
             # 步骤4: 生成完整脚本（使用页面HTML作为上下文）
             print("\n步骤4: 生成完整测试脚本...")
+            codegen_stats = {}
             final_script = await self._generate_complete_script(
                 target_url, actions, auto_detect_captcha, auto_cookie_localstorage, load_saved_storage,
-                page_content.get('html', ''), captcha_info=captcha_info, form_selectors=form_selectors
+                page_content.get('html', ''), captcha_info=captcha_info, form_selectors=form_selectors,
+                codegen_stats=codegen_stats, page_model=page_content.get('page_model'),
+                raw_html=page_content.get('raw_html', ''), resource_profile=resource_profile
             )
             result["script"] = final_script
+            if codegen_stats:
+                result["codegen_stats"] = codegen_stats
             print("✅ 脚本生成完成")
 
             # 步骤5: 生成测试名称
@@ -232,7 +307,13 @@ class TestExecutor:
             print(f"\n❌ 生成脚本时出现错误: {str(e)}")
             print(f"\n错误详情:\n{error_detail}")
             return result
+        finally:
+            INFLIGHT_JOBS.dec(kind="generation")
+            SCRIPT_GENERATION_SECONDS.observe(
+                time.perf_counter() - start_time, mode="dom", status=result["status"]
+            )
 
+    @traced("execute_workflow")
     async def execute_workflow(
         self,
         user_query: str,
@@ -259,6 +340,10 @@ class TestExecutor:
             "report": ""
         }
 
+        from ..generator.test_generator import test_generator
+        from ..llm.bailian_client import bailian_client
+        from ...utils import run_artifacts
+
         try:
             print("\n===== 开始执行测试工作流 =====")
             print(f"用户查询: {user_query}")
@@ -279,14 +364,16 @@ class TestExecutor:
             print(f"✅ 发现 {len(page_analysis.get('forms', []))} 个表单")
             print(f"✅ 发现 {len(page_analysis.get('buttons', []))} 个按钮")
 
-            # 步骤2.5: VL验证码检测 + 读取DB配置选择器
-            print("\n步骤2.5: VL验证码检测...")
-            captcha_info = await self._detect_captcha_from_page(page_content)
-            print(f"✅ 验证码检测结果: has_captcha={captcha_info['has_captcha']}, type={captcha_info['captcha_type']}")
+            # 步骤2.5: 验证码检测（HTML 预筛 + 页面分析结果）+ 读取DB配置选择器
+            print("\n步骤2.5: 验证码检测...")
+            captcha_info = await self._detect_captcha_from_page(page_content, page_analysis)
+            print(f"✅ 验证码检测结果: has_captcha={captcha_info['has_captcha']}, type={captcha_info['captcha_type']}, 来源={captcha_info['source']}")
 
             # 步骤2.6: 提取表单选择器
             print("\n步骤2.6: 提取表单选择器...")
-            form_selectors = test_generator.extract_form_selectors(page_content.get('html', ''))
+            form_selectors = page_content.get('form_selectors')
+            if form_selectors is None:
+                form_selectors = test_generator.extract_form_selectors(page_content.get('html', ''))
             print(f"✅ 提取到 {len(form_selectors)} 个表单选择器")
 
             # 步骤3: 基于页面分析生成操作步骤
@@ -303,11 +390,13 @@ class TestExecutor:
             print("\n步骤4: 生成完整测试脚本...")
             final_script = await self._generate_complete_script(
                 target_url, actions, auto_detect_captcha, auto_cookie_localstorage,
-                html_content=page_content.get('html', ''), captcha_info=captcha_info, form_selectors=form_selectors
+                html_content=page_content.get('html', ''), captcha_info=captcha_info, form_selectors=form_selectors,
+                page_model=page_content.get('page_model'), raw_html=page_content.get('raw_html', '')
             )
             result["script"] = final_script
             print("✅ 脚本生成完成")
-            print(f"\n生成的脚本预览:\n{final_script[:1000]}..." if len(final_script) > 1000 else f"\n生成的脚本:\n{final_script}")
+            print(f"   脚本长度: {len(final_script)} 字符")
+            logger.debug("生成的脚本:\n%s", final_script)
 
             # 步骤3: 生成测试名称
             print("\n步骤3: 生成测试名称...")
@@ -320,6 +409,7 @@ class TestExecutor:
             print("   正在执行测试（只打开一次浏览器）...")
             execution_output = await self._execute_test(final_script)
             result["execution_output"] = execution_output
+            result["artifacts"] = run_artifacts.parse_artifacts_event(execution_output)
             print("✅ 测试执行完成")
 
             # 步骤5: 生成报告
@@ -340,6 +430,7 @@ class TestExecutor:
             print(f"\n错误详情:\n{error_detail}")
             return result
 
+    @traced("generate_actions_with_context")
     async def _generate_actions_with_context(
         self,
         user_query: str,
@@ -414,6 +505,7 @@ class TestExecutor:
 用户查询: {user_query}
 输出:"""
 
+        from ..llm.bailian_client import bailian_client
         response = await bailian_client.generate_text(prompt, system_prompt)
 
         # 解析JSON响应
@@ -429,6 +521,7 @@ class TestExecutor:
                 "验证测试已成功完成"
             ]
 
+    @traced("assemble_script")
     async def _generate_complete_script(
         self,
         target_url: str,
@@ -438,7 +531,11 @@ class TestExecutor:
         load_saved_storage: bool = True,
         html_content: str = "",
         captcha_info: Dict[str, Any] = None,
-        form_selectors: Dict[str, str] = None
+        form_selectors: Dict[str, str] = None,
+        codegen_stats: Dict[str, Any] = None,
+        page_model: List[Dict[str, Any]] = None,
+        raw_html: str = "",
+        resource_profile: str = "none"
     ) -> str:
         """
         生成完整的测试脚本（一次性生成所有操作）
@@ -451,6 +548,10 @@ class TestExecutor:
             html_content: 页面HTML内容
             captcha_info: VL验证码检测结果 + DB配置选择器
             form_selectors: 从DOM提取的表单选择器
+            codegen_stats: 传入字典时填入代码生成统计（批量模式下包含节省的 token 和耗时）
+            page_model: 页面元素清单（get_page_content 返回的 page_model），用作提示词中的页面表示
+            raw_html: 未清理的页面HTML（get_page_content 返回的 raw_html），用于离线校验生成代码的选择器
+            resource_profile: 资源拦截方案（见 app/utils/resource_profiles.py）
         Returns:
             完整的测试脚本
             auto_cookie_localstorage: 是否自动加载和保存cookie/localstorage
@@ -458,20 +559,35 @@ class TestExecutor:
         Returns:
             完整的测试脚本
         """
+        from ..generator.test_generator import test_generator
+        from ..generator.codegen_memo import current_codegen_memo, dom_fingerprint
+        from ..generator.selector_validator import changes_page
+        from ...core.config import settings
+
         # 获取浏览器配置
         browser_headless = False
+        batch_codegen = False
+        live_tracking = False
         from ...core.database import get_db
         from ...models.global_config import GlobalConfig, ConfigKeys
         from sqlalchemy import select
 
         async for db in get_db():
             result = await db.execute(
-                select(GlobalConfig).where(GlobalConfig.config_key == ConfigKeys.BROWSER_HEADLESS)
+                select(GlobalConfig).where(GlobalConfig.config_key.in_([
+                    ConfigKeys.BROWSER_HEADLESS, ConfigKeys.DOM_BATCH_CODEGEN, ConfigKeys.DOM_LIVE_TRACKING
+                ]))
             )
-            config = result.scalar_one_or_none()
-            if config:
-                browser_headless = config.config_value.lower() == "true"
+            configs = {c.config_key: c.config_value for c in result.scalars().all()}
+            if configs.get(ConfigKeys.BROWSER_HEADLESS):
+                browser_headless = configs[ConfigKeys.BROWSER_HEADLESS].lower() == "true"
+            if configs.get(ConfigKeys.DOM_BATCH_CODEGEN):
+                batch_codegen = configs[ConfigKeys.DOM_BATCH_CODEGEN].lower() == "true"
+            if configs.get(ConfigKeys.DOM_LIVE_TRACKING):
+                live_tracking = configs[ConfigKeys.DOM_LIVE_TRACKING].lower() == "true"
             break
+        # 实时跟踪需要按顺序执行每一步，优先于批量生成
+        batch_codegen = batch_codegen and not live_tracking
 
         # 构建操作代码
         action_codes = []
@@ -480,57 +596,6 @@ class TestExecutor:
         action_codes.append("                # 等待页面加载")
         action_codes.append("                await page.wait_for_timeout(2000)")
 
-        # 如果需要自动加载 Cookie/LocalStorage/SessionStorage，添加加载代码
-        if auto_cookie_localstorage and load_saved_storage:
-            action_codes.append("                # 加载保存的 cookies、localStorage 和 sessionStorage")
-            action_codes.append("                import os, json")
-            
-            # 获取会话存储路径
-            session_storage_path = os.getenv('SESSION_STORAGE_PATH', '')
-            if session_storage_path:
-                action_codes.append(f"                session_storage_path = '{session_storage_path}'")
-                action_codes.append("                cookie_file = os.path.join(session_storage_path, 'saved_cookies.json')")
-                action_codes.append("                ls_file = os.path.join(session_storage_path, 'saved_localstorage.json')")
-                action_codes.append("                ss_file = os.path.join(session_storage_path, 'saved_sessionstorage.json')")
-            else:
-                action_codes.append("                cookie_file = 'saved_cookies.json'")
-                action_codes.append("                ls_file = 'saved_localstorage.json'")
-                action_codes.append("                ss_file = 'saved_sessionstorage.json'")
-            
-            action_codes.append("                print(f'当前工作目录: {os.getcwd()}')")
-            action_codes.append("                print(f'Cookie文件路径: {cookie_file}')")
-            action_codes.append("                print(f'Cookie文件存在: {os.path.exists(cookie_file)}')")
-            action_codes.append("                print(f'LocalStorage文件存在: {os.path.exists(ls_file)}')")
-            action_codes.append("                print(f'SessionStorage文件存在: {os.path.exists(ss_file)}')")
-            action_codes.append("                if os.path.exists(cookie_file):")
-            action_codes.append("                    with open(cookie_file, 'r', encoding='utf-8') as f:")
-            action_codes.append("                        cookies = json.load(f)")
-            action_codes.append(f"                    print(f'加载了 {{len(cookies)}} 个cookies')")
-            action_codes.append("                    await page.context.add_cookies(cookies)")
-            action_codes.append("                    print('Cookies 已加载')")
-            action_codes.append("                if os.path.exists(ls_file):")
-            action_codes.append("                    with open(ls_file, 'r', encoding='utf-8') as f:")
-            action_codes.append("                        ls_data = f.read()")
-            action_codes.append("                    try:")
-            action_codes.append("                        ls_data_obj = json.loads(ls_data)")
-            action_codes.append(f"                        print(f'LocalStorage数据: {{ls_data_obj}}')")
-            action_codes.append("                        await page.evaluate(\"data => { localStorage.clear(); for (const key in data) { localStorage.setItem(key, data[key]); } }\", ls_data_obj)")
-            action_codes.append("                    except json.JSONDecodeError:")
-            action_codes.append("                        print(f'LocalStorage解析失败，使用原始字符串: {{ls_data[:100]}}')")
-            action_codes.append("                        await page.evaluate(\"data => { localStorage.clear(); for (const key in data) { localStorage.setItem(key, data[key]); } }\", ls_data)")
-            action_codes.append("                    print('LocalStorage 已加载')")
-            action_codes.append("                if os.path.exists(ss_file):")
-            action_codes.append("                    with open(ss_file, 'r', encoding='utf-8') as f:")
-            action_codes.append("                        ss_data = f.read()")
-            action_codes.append("                    try:")
-            action_codes.append("                        ss_data_obj = json.loads(ss_data)")
-            action_codes.append(f"                        print(f'SessionStorage数据: {{ss_data_obj}}')")
-            action_codes.append("                        await page.evaluate(\"data => { sessionStorage.clear(); for (const key in data) { sessionStorage.setItem(key, data[key]); } }\", ss_data_obj)")
-            action_codes.append("                    except json.JSONDecodeError:")
-            action_codes.append("                        print(f'SessionStorage解析失败，使用原始字符串: {{ss_data[:100]}}')")
-            action_codes.append("                        await page.evaluate(\"data => { sessionStorage.clear(); for (const key in data) { sessionStorage.setItem(key, data[key]); } }\", ss_data)")
-            action_codes.append("                    print('SessionStorage 已加载')")
-
         # 如果需要自动检测验证码，检测是否有验证码相关操作，预先注入 sys.path 设置代码
         # 使用VL检测结果（captcha_info）来决定是否注入验证码处理代码
         if captcha_info is None:
@@ -544,7 +609,8 @@ class TestExecutor:
 
         # 为每个操作生成代码
         # 使用获取到的HTML内容作为DOM状态
-        dom_state = html_content[:5000] if html_content else ""  # 限制长度避免超出token限制
+        # DOM状态按操作描述精简（BM25 挑选相关片段，保留表单控件），避免直接截断丢掉目标元素
+        dom_state = ""
         aggregated_actions = ""
 
         # 决定是否需要验证码处理：VL检测到验证码 OR LLM生成了验证码步骤 OR auto_detect_captcha
@@ -574,6 +640,53 @@ class TestExecutor:
         captcha_sel_repr = repr(cfg_captcha_selector) if cfg_captcha_selector else "None"
         captcha_input_sel_repr = repr(cfg_captcha_input_selector) if cfg_captcha_input_selector else "None"
 
+        # 需要调用 LLM 生成代码的操作（验证码识别/填写由 browser_util 处理）
+        def _needs_codegen(action_desc):
+            if self._is_captcha_recognition_action(action_desc) or self._is_captcha_fill_action(action_desc):
+                return False
+            return not (need_captcha_handling and any(k in action_desc.lower() for k in ['验证码', 'captcha']))
+
+        codegen_actions = [
+            {"index": i, "action": action, "is_last": i == len(actions) - 1}
+            for i, action in enumerate(actions[1:], 1) if _needs_codegen(action)
+        ]
+
+        # 场景内复用：之前的用例在同一页面上为相同操作生成并验证过的代码直接复用，不再调用LLM
+        memo = current_codegen_memo() if not live_tracking else None
+        page_fingerprint = dom_fingerprint(page_model, html_content) if memo is not None else ""
+        memo_codes: Dict[int, str] = {}
+        if memo is not None:
+            for a in codegen_actions:
+                code = memo.get("code", a["action"], page_fingerprint, a["is_last"])
+                if code is not None:
+                    memo_codes[a["index"]] = code
+            if memo_codes:
+                print(f"   [代码复用] {len(memo_codes)} 个操作复用本场景之前用例生成的代码: {sorted(memo_codes)}")
+                codegen_actions = [a for a in codegen_actions if a["index"] not in memo_codes]
+        batch_indexes = {a["index"] for a in codegen_actions}
+
+        # 批量模式：DOM 只发送一次，一次调用生成所有操作的代码，验证失败的操作再逐个生成
+        batch_snippets: Dict[int, str] = {}
+        batch_result = None
+        fallback_actions = []
+        fallback_ms = 0.0
+        fallback_prompt_chars = 0
+        estimated_single_prompt_chars = 0
+        if batch_codegen and len(codegen_actions) > 1:
+            print(f"   [批量生成] 一次调用生成 {len(codegen_actions)} 个操作的代码")
+            try:
+                batch_dom_state = test_generator.distill_dom_state(
+                    html_content, "\n".join(a["action"] for a in codegen_actions), form_selectors,
+                    page_model=page_model
+                )
+                batch_result = await test_generator.generate_playwright_code_batch(
+                    codegen_actions, batch_dom_state, form_selectors=form_selectors
+                )
+                batch_snippets = batch_result["snippets"]
+                print(f"   [批量生成] 返回 {len(batch_snippets)}/{len(codegen_actions)} 个代码片段，耗时 {batch_result['duration_ms']:.0f}ms")
+            except Exception as e:
+                print(f"   ⚠️ [批量生成] 失败，改为逐个生成: {e}")
+
         def _inject_captcha_code(action_codes_list, action_idx, action_desc, is_auto=False):
             """注入 detect_and_solve_captcha 代码块"""
             prefix = "[自动验证码处理] " if is_auto else ""
@@ -591,86 +704,223 @@ class TestExecutor:
             action_codes_list.append(f"                await asyncio.sleep(3)")
             action_codes_list.append(f"                print('[TEST] Action {action_idx} completed: captcha handling')")
 
-        for i, action in enumerate(actions[1:], 1):  # 跳过第一个导航操作
-            is_last = i == len(actions) - 1
-
-            # 验证码截图/VL模型识别动作：注入 browser_util.detect_and_solve_captcha 代码
-            if self._is_captcha_recognition_action(action):
-                print(f"   [验证码] 操作 {i} 为验证码识别，注入browser_util代码: {action}")
-                _inject_captcha_code(action_codes, i, action)
-                aggregated_actions += f"\n# browser_util.detect_and_solve_captcha(page) 已处理验证码"
-                captcha_injected = True
-                continue
-
-            # 填写验证码识别结果动作：detect_and_solve_captcha 已包含此步骤，跳过
-            if self._is_captcha_fill_action(action):
-                print(f"   [验证码] 操作 {i} 为填写识别结果，已由detect_and_solve_captcha处理，跳过: {action}")
-                action_codes.append(f"                # Action {i}: {action} (已由验证码识别步骤自动处理，跳过)")
-                action_codes.append(f"                print('[TEST] Action {i} skipped: captcha fill already handled')")
-                continue
-
-            # 验证码相关操作（宽松匹配）
-            if need_captcha_handling and any(k in action.lower() for k in ['验证码', 'captcha']):
-                print(f"   [验证码] 操作 {i} 可能与验证码相关，注入 detect_and_solve_captcha: {action}")
-                _inject_captcha_code(action_codes, i, action)
-                aggregated_actions += f"\n# browser_util.detect_and_solve_captcha(page) 已处理验证码"
-                captcha_injected = True
-                continue
-
-            # 在登录/提交按钮点击之前自动注入验证码处理
-            # 条件：(VL检测到验证码 OR auto_detect_captcha) AND 是登录操作 AND 尚未注入
-            is_login_action = any(k in action.lower() for k in [
-                '登录', '登入', 'login', 'sign in', 'signin', '提交', 'submit', '确认登录'
-            ]) and any(k in action.lower() for k in ['点击', 'click', '按钮', 'button', '提交'])
-            if need_captcha_handling and is_login_action and not captcha_injected:
-                print(f"   [验证码] 操作 {i} 为登录按钮，在点击前自动注入 detect_and_solve_captcha")
-                _inject_captcha_code(action_codes, i, "在登录前自动检测并填写验证码", is_auto=True)
-                captcha_injected = True
+        # 离线选择器校验：在获取的页面上检查生成代码的定位器，多匹配自动取第一个；
+        # 页面还没有被之前的操作改变时，匹配不到元素的代码带错误重新生成
+        selector_dom = None
+        if settings.SELECTOR_VALIDATION and not live_tracking and (raw_html or html_content):
+            from ..generator.selector_validator import DomIndex
+            selector_dom = DomIndex(raw_html or html_content)
+        dom_is_current = bool(raw_html)  # 清理后的HTML缺少 placeholder 等属性，只检查多匹配
+        selector_fixes = 0
+        selector_rejections = 0
+
+        # 实时跟踪模式：从浏览器池租用页面，生成的每段代码都先在页面上执行，下一步使用执行后的DOM
+        live_page = None
+        live_state: Dict[str, Any] = {}
+        if live_tracking:
+            from .browser_pool import browser_pool
+            print("   [实时跟踪] 从浏览器池租用页面，逐个执行生成的代码")
+            live_page = await browser_pool.acquire(browser_headless)
 
-            print(f"   正在生成操作 {i}/{len(actions) - 1}: {action}")
+        try:
+            if live_page is not None:
+                live_state = await self._open_live_page(live_page, target_url, load_saved_storage)
+
+            for i, action in enumerate(actions[1:], 1):  # 跳过第一个导航操作
+                is_last = i == len(actions) - 1
+                selector_feedback = None
+                verified = True
+
+                # 验证码截图/VL模型识别动作：注入 browser_util.detect_and_solve_captcha 代码
+                if self._is_captcha_recognition_action(action):
+                    print(f"   [验证码] 操作 {i} 为验证码识别，注入browser_util代码: {action}")
+                    _inject_captcha_code(action_codes, i, action)
+                    aggregated_actions += f"\n# browser_util.detect_and_solve_captcha(page) 已处理验证码"
+                    captcha_injected = True
+                    if live_page is not None:
+                        await self._solve_captcha_live(live_page, live_state, captcha_info)
+                    continue
+
+                # 填写验证码识别结果动作：detect_and_solve_captcha 已包含此步骤，跳过
+                if self._is_captcha_fill_action(action):
+                    print(f"   [验证码] 操作 {i} 为填写识别结果，已由detect_and_solve_captcha处理，跳过: {action}")
+                    action_codes.append(f"                # Action {i}: {action} (已由验证码识别步骤自动处理，跳过)")
+                    action_codes.append(f"                print('[TEST] Action {i} skipped: captcha fill already handled')")
+                    continue
+
+                # 验证码相关操作（宽松匹配）
+                if need_captcha_handling and any(k in action.lower() for k in ['验证码', 'captcha']):
+                    print(f"   [验证码] 操作 {i} 可能与验证码相关，注入 detect_and_solve_captcha: {action}")
+                    _inject_captcha_code(action_codes, i, action)
+                    aggregated_actions += f"\n# browser_util.detect_and_solve_captcha(page) 已处理验证码"
+                    captcha_injected = True
+                    if live_page is not None:
+                        await self._solve_captcha_live(live_page, live_state, captcha_info)
+                    continue
+
+                # 在登录/提交按钮点击之前自动注入验证码处理
+                # 条件：(VL检测到验证码 OR auto_detect_captcha) AND 是登录操作 AND 尚未注入
+                is_login_action = any(k in action.lower() for k in [
+                    '登录', '登入', 'login', 'sign in', 'signin', '提交', 'submit', '确认登录'
+                ]) and any(k in action.lower() for k in ['点击', 'click', '按钮', 'button', '提交'])
+                if need_captcha_handling and is_login_action and not captcha_injected:
+                    print(f"   [验证码] 操作 {i} 为登录按钮，在点击前自动注入 detect_and_solve_captcha")
+                    _inject_captcha_code(action_codes, i, "在登录前自动检测并填写验证码", is_auto=True)
+                    captcha_injected = True
+                    if live_page is not None:
+                        await self._solve_captcha_live(live_page, live_state, captcha_info)
+
+                if live_page is None:
+                    dom_state = test_generator.distill_dom_state(html_content, action, form_selectors, page_model=page_model)
+
+                if batch_result is not None and i in batch_indexes:
+                    # 逐个生成时该操作的提示词大小，用于估算批量生成节省的 token
+                    estimated_single_prompt_chars += sum(len(part) for part in test_generator.build_playwright_code_prompt(
+                        action, dom_state, aggregated_actions, is_last, form_selectors
+                    ))
+
+                if live_page is not None:
+                    # 实时跟踪：生成后立即在页面上执行，失败时带错误重新生成，仍失败则停止生成
+                    action_code = await self._generate_live_action_code(
+                        live_page, live_state, i, action, is_last, aggregated_actions, form_selectors
+                    )
+                else:
+                    action_code = memo_codes.get(i) or batch_snippets.get(i)
+                if action_code is not None:
+                    source = "复用" if i in memo_codes else "批量生成"
+                    is_valid, error = await test_generator.validate_generated_code(action_code)
+                    if is_valid and selector_dom is not None:
+                        is_valid, error, checked_code = test_generator.validate_generated_selectors(
+                            action_code, selector_dom, dom_is_current
+                        )
+                        if not is_valid:
+                            selector_rejections += 1
+                            selector_feedback = f"{action_code.strip()}\n# 错误: {error}"
+                        elif checked_code != action_code:
+                            selector_fixes += 1
+                            action_code = checked_code
+                    if not is_valid:
+                        print(f"   ⚠️ 操作 {i} {source}的代码验证失败，改为单独生成: {error}")
+                        logger.debug("操作 %s %s的代码:\n%s", i, source, action_code)
+                        memo_codes.pop(i, None)
+                        action_code = None
+
+                if action_code is None:
+                    print(f"   正在生成操作 {i}/{len(actions) - 1}: {action}")
+                    if batch_result is not None and i in batch_indexes:
+                        fallback_actions.append(i)
+                        fallback_prompt_chars += sum(len(part) for part in test_generator.build_playwright_code_prompt(
+                            action, dom_state, aggregated_actions, is_last, form_selectors
+                        ))
+                    fallback_start = time.perf_counter()
+
+                    verified = True
+                    for attempt in range(settings.SELECTOR_VALIDATION_RETRIES + 1):
+                        # 生成代码（传入表单选择器帮助LLM生成更准确的代码）
+                        action_code = await test_generator.generate_playwright_code(
+                            action,
+                            dom_state,
+                            aggregated_actions,
+                            is_last,
+                            form_selectors=form_selectors,
+                            error_feedback=selector_feedback
+                        )
 
-            # 生成代码（传入表单选择器帮助LLM生成更准确的代码）
-            action_code = await test_generator.generate_playwright_code(
-                action,
-                dom_state,
-                aggregated_actions,
-                is_last,
-                form_selectors=form_selectors
-            )
+                        # 验证代码
+                        is_valid, error = await test_generator.validate_generated_code(action_code)
+                        if not is_valid or selector_dom is None:
+                            break
+                        selectors_ok, selector_error, checked_code = test_generator.validate_generated_selectors(
+                            action_code, selector_dom, dom_is_current
+                        )
+                        if checked_code != action_code:
+                            selector_fixes += 1
+                            action_code = checked_code
+                        if selectors_ok:
+                            break
+                        selector_rejections += 1
+                        print(f"   ⚠️ 操作 {i} 第 {attempt + 1} 次生成的代码选择器校验失败: {selector_error}")
+                        selector_feedback = f"{action_code.strip()}\n# 错误: {selector_error}"
+                    else:
+                        print(f"   ⚠️ 操作 {i} 重新生成后选择器仍未通过校验，保留最后一次生成的代码")
+                        verified = False
+                    fallback_ms += (time.perf_counter() - fallback_start) * 1000
 
-            # 验证代码
-            is_valid, error = await test_generator.validate_generated_code(action_code)
-            if not is_valid:
-                print(f"   ⚠️ 操作 {i} 代码验证失败: {error}")
-                print(f"   生成的代码:\n{action_code}")
-                continue
+                    if not is_valid:
+                        print(f"   ⚠️ 操作 {i} 代码验证失败: {error}")
+                        logger.debug("操作 %s 生成的代码:\n%s", i, action_code)
+                        continue
 
-            # 添加操作注释和代码（使用16空格缩进）
-            action_codes.append(f"                # Action {i}: {action}")
-            action_codes.append(f"                print('[TEST] Action {i} started')")
-            print(f"   生成的代码预览:\n{action_code[:200]}..." if len(action_code) > 200 else f"   生成的代码:\n{action_code}")
+                # 添加操作注释和代码（使用16空格缩进）
+                action_codes.append(f"                # Action {i}: {action}")
+                action_codes.append(f"                print('[TEST] Action {i} started')")
+                logger.debug("操作 %s 生成的代码:\n%s", i, action_code)
 
-            # 添加操作代码（缩进处理 - 16空格）
-            for line in action_code.strip().split('\n'):
-                action_codes.append(f"                {line}")
+                # 添加操作代码（缩进处理 - 16空格）
+                for line in action_code.strip().split('\n'):
+                    action_codes.append(f"                {line}")
 
-            # 添加3秒延迟（使用 asyncio.sleep 更明显）
-            action_codes.append("                await asyncio.sleep(3)")
-            action_codes.append(f"                print('[TEST] Action {i} completed')")
+                # 添加3秒延迟（使用 asyncio.sleep 更明显）
+                action_codes.append("                await asyncio.sleep(3)")
+                action_codes.append(f"                print('[TEST] Action {i} completed')")
 
-            aggregated_actions += "\n" + action_code
+                aggregated_actions += "\n" + action_code
+                if memo is not None and i not in memo_codes and verified:
+                    memo.put("code", action, page_fingerprint, action_code, is_last)
+                if dom_is_current and changes_page(action_code):
+                    dom_is_current = False
 
-            # DOM状态保持不变（使用初始HTML）
-            # 因为我们在生成代码时无法获取执行后的实际DOM
+                # 非实时跟踪模式下DOM状态保持不变（使用初始HTML），因为生成代码时不执行操作；
+                # 实时跟踪模式在 _generate_live_action_code 中用执行后的页面刷新DOM状态
+        finally:
+            if live_page is not None:
+                await browser_pool.release(live_page)
+
+        if live_page is not None:
+            print(f"   [实时跟踪] 执行代码片段 {live_state['snippets_executed']} 个，"
+                  f"LLM调用 {live_state['llm_calls']} 次，重试 {live_state['retries']} 次")
+            if codegen_stats is not None:
+                codegen_stats.update({
+                    "mode": "live",
+                    "snippets_executed": live_state["snippets_executed"],
+                    "llm_calls": live_state["llm_calls"],
+                    "retries": live_state["retries"],
+                    "selector_rejections": live_state["selector_rejections"],
+                })
+
+        if selector_dom is not None:
+            print(f"   [选择器校验] 自动修正 {selector_fixes} 个操作，拒绝 {selector_rejections} 次生成结果")
+            if codegen_stats is not None:
+                codegen_stats.update({"selector_fixes": selector_fixes, "selector_rejections": selector_rejections})
+
+        if batch_result is not None:
+            stats = self._batch_codegen_savings(
+                batch_result, len(codegen_actions), fallback_actions, fallback_ms,
+                fallback_prompt_chars, estimated_single_prompt_chars,
+                list(test_generator.single_codegen_ms)
+            )
+            print(f"   [批量生成] LLM调用 {stats['llm_calls']} 次（逐个生成需 {len(codegen_actions)} 次），"
+                  f"回退 {len(fallback_actions)} 个操作，节省 token≈{stats['prompt_tokens_saved']}，"
+                  f"节省耗时≈{stats['time_saved_ms']}ms")
+            span = current_span()
+            if span is not None:
+                for key in ("llm_calls", "prompt_tokens_saved", "time_saved_ms"):
+                    span.set_attribute(f"codegen.{key}", stats[key])
+            if codegen_stats is not None:
+                codegen_stats.update(stats)
 
         # 构建完整脚本
         actions_str = '\n'.join(action_codes)
+        storage_imports, page_setup, save_storage = self._storage_state_code(
+            target_url, auto_cookie_localstorage, load_saved_storage
+        )
+        resource_imports = self._resource_profile_imports()
 
         script = f'''import pytest
 from playwright.async_api import async_playwright, expect
 import asyncio
 import traceback
-
+{storage_imports}{resource_imports}
 @pytest.mark.asyncio
 async def test_generated():
     print("[TEST] Test started")
@@ -680,66 +930,41 @@ async def test_generated():
             print("[TEST] Launching browser")
             # Launch browser
             browser = await p.chromium.launch(headless={browser_headless})
-            page = await browser.new_page()
+            {page_setup}
+            resource_stats = await apply_resource_profile(page, {resource_profile!r}, "{target_url}")
+            network_replay = await apply_network_mode(page)
+            run_trace = await start_run_trace(page)
             print("[TEST] Browser launched")
 
-            # Action 0: Navigate to target page
-            print("[TEST] Navigating to: {target_url}")
-            await page.goto("{target_url}")
-            print("[TEST] Page loaded")
-            
-            # Wait for page to be fully loaded
-            await page.wait_for_load_state("networkidle")
-            print("[TEST] Page network idle")
-            
-            # Additional wait to ensure page is visible
-            await asyncio.sleep(3)
-            print("[TEST] Initial wait completed")
-            
+            # 打开页面失败时同样保存失败产物、输出资源统计
             try:
+                # Action 0: Navigate to target page
+                print("[TEST] Navigating to: {target_url}")
+                await page.goto("{target_url}")
+                print("[TEST] Page loaded")
+
+                # Wait for page to be fully loaded
+                await page.wait_for_load_state("networkidle")
+                print("[TEST] Page network idle")
+
+                # Additional wait to ensure page is visible
+                await asyncio.sleep(3)
+                print("[TEST] Initial wait completed")
+
                 # Execute all actions
 {actions_str}
             except Exception as e:
                 print(f"[TEST] ERROR during actions: {{e}}")
                 print(f"[TEST] Traceback: {{traceback.format_exc()}}")
-                # Take screenshot on error
-                try:
-                    await page.screenshot(path="error_screenshot.png")
-                    print("[TEST] Screenshot saved to error_screenshot.png")
-                except:
-                    pass
+                # Keep screenshot and trace on error
+                await keep_failure_artifacts(run_trace)
+                await report_resource_stats(resource_stats)
+                await finish_network_mode(network_replay)
                 raise
-
-            # Final wait before closing
-            print("[TEST] Final wait before closing")
-            await asyncio.sleep(30)  # Wait 30 seconds for debugging
-            
-            # Save cookies, localStorage and sessionStorage if enabled
-            if {auto_cookie_localstorage}:
-                import os
-                session_storage_path = os.getenv('SESSION_STORAGE_PATH', '')
-                if session_storage_path:
-                    cookie_file = os.path.join(session_storage_path, 'saved_cookies.json')
-                    ls_file = os.path.join(session_storage_path, 'saved_localstorage.json')
-                    ss_file = os.path.join(session_storage_path, 'saved_sessionstorage.json')
-                else:
-                    cookie_file = 'saved_cookies.json'
-                    ls_file = 'saved_localstorage.json'
-                    ss_file = 'saved_sessionstorage.json'
-                
-                cookies = await page.context.cookies()
-                with open(cookie_file, 'w', encoding='utf-8') as f:
-                    json.dump(cookies, f, ensure_ascii=False, indent=2)
-                print(f'[TEST] Cookies saved to {{cookie_file}}')
-                ls_data = await page.evaluate('() => JSON.stringify(localStorage)')
-                with open(ls_file, 'w', encoding='utf-8') as f:
-                    f.write(ls_data)
-                print(f'[TEST] LocalStorage saved to {{ls_file}}')
-                ss_data = await page.evaluate('() => JSON.stringify(sessionStorage)')
-                with open(ss_file, 'w', encoding='utf-8') as f:
-                    f.write(ss_data)
-                print(f'[TEST] SessionStorage saved to {{ss_file}}')
-            
+{save_storage}
+            await discard_run_trace(run_trace)
+            await report_resource_stats(resource_stats)
+            await finish_network_mode(network_replay)
             # Close browser
             print("[TEST] Closing browser")
             await browser.close()
@@ -759,6 +984,238 @@ if __name__ == "__main__":
 '''
         return script
 
+    @staticmethod
+    def _storage_state_code(target_url: str, auto_cookie_localstorage: bool, load_saved_storage: bool) -> Tuple[str, str, str]:
+        """
+        生成脚本中保存和恢复登录状态的代码（见 app/utils/storage_state.py）
+        登录状态在创建上下文时通过 storage_state 恢复，打开页面时已是登录后的状态，不需要刷新页面
+        Returns:
+            (模块级导入代码, 创建页面的代码, 结束时保存登录状态的代码)
+        """
+        from ...core.config import settings
+
+        if not auto_cookie_localstorage:
+            return "", "page = await browser.new_page()", ""
+
+        session_storage_path = os.getenv('SESSION_STORAGE_PATH', '')
+        storage_imports = f"""
+# 登录状态的保存和恢复（cookies、localStorage、sessionStorage 保存在同一个文件中）
+import os as _os, sys as _sys
+_app_path = _os.getenv('PYTHON_PATH', '') or r'{settings.BASE_DIR}'
+if _app_path not in _sys.path:
+    _sys.path.insert(0, _app_path)
+from app.utils.storage_state import new_page_with_saved_state, save_state, state_path
+SAVED_STATE_PATH = state_path(r'{session_storage_path}')
+"""
+        page_setup = (
+            f'page = await new_page_with_saved_state(browser, SAVED_STATE_PATH, "{target_url}")'
+            if load_saved_storage else "page = await browser.new_page()"
+        )
+        save_storage = """
+            # 保存登录状态
+            await save_state(page, SAVED_STATE_PATH)
+"""
+        return storage_imports, page_setup, save_storage
+
+    @staticmethod
+    def _resource_profile_imports() -> str:
+        """
+        生成脚本中资源拦截方案、传输统计、HAR 录制/回放和失败产物的导入代码
+        （见 app/utils/resource_profiles.py、app/utils/har_replay.py、app/utils/run_artifacts.py）
+        """
+        from ...core.config import settings
+
+        return f"""
+# 资源拦截方案（按场景配置拦截图片、字体、第三方请求等），统计传输字节数和页面加载耗时；
+# 执行器选择录制/回放模式时通过环境变量录制或回放 HAR；
+# 始终记录 Playwright trace，只在失败时保存到本次执行的产物目录
+import os as _os, sys as _sys
+_app_path = _os.getenv('PYTHON_PATH', '') or r'{settings.BASE_DIR}'
+if _app_path not in _sys.path:
+    _sys.path.insert(0, _app_path)
+from app.utils.resource_profiles import apply_resource_profile, report_resource_stats
+from app.utils.har_replay import apply_network_mode, finish_network_mode
+from app.utils.run_artifacts import start_run_trace, discard_run_trace, keep_failure_artifacts
+"""
+
+    @staticmethod
+    def _batch_codegen_savings(
+        batch_result: Dict[str, Any],
+        codegen_count: int,
+        fallback_actions: List[int],
+        fallback_ms: float,
+        fallback_prompt_chars: int,
+        estimated_single_prompt_chars: int,
+        single_call_samples: List[float]
+    ) -> Dict[str, Any]:
+        """
+        估算批量生成相对逐个生成节省的 prompt token 和耗时
+
+        逐个生成的 prompt 大小按实际会发送的提示词字符数计算，再用批量调用实测的
+        token/字符比换算；逐个生成的耗时用最近的单次调用耗时均值估算，没有样本时
+        以批量调用耗时作为单次调用耗时。
+        """
+        batch_chars = batch_result["prompt_chars"] or 1
+        batch_tokens = batch_result.get("prompt_tokens")
+        tokens_per_char = batch_tokens / batch_chars if batch_tokens else 0.25
+
+        actual_prompt_tokens = (batch_tokens or batch_chars * tokens_per_char) + fallback_prompt_chars * tokens_per_char
+        estimated_prompt_tokens = estimated_single_prompt_chars * tokens_per_char
+
+        actual_ms = batch_result["duration_ms"] + fallback_ms
+        single_ms = sum(single_call_samples) / len(single_call_samples) if single_call_samples else batch_result["duration_ms"]
+        estimated_ms = single_ms * codegen_count
+
+        return {
+            "mode": "batch",
+            "actions": codegen_count,
+            "batch_snippets": len(batch_result["snippets"]),
+            "fallback_actions": fallback_actions,
+            "llm_calls": 1 + len(fallback_actions),
+            "prompt_tokens": round(actual_prompt_tokens),
+            "completion_tokens": batch_result.get("completion_tokens"),
+            "estimated_single_prompt_tokens": round(estimated_prompt_tokens),
+            "prompt_tokens_saved": round(estimated_prompt_tokens - actual_prompt_tokens),
+            "duration_ms": round(actual_ms),
+            "estimated_single_duration_ms": round(estimated_ms),
+            "time_saved_ms": round(estimated_ms - actual_ms),
+        }
+
+    async def _open_live_page(self, live_page, target_url: str, load_saved_storage: bool) -> Dict[str, Any]:
+        """实时跟踪模式：打开目标页面（按需加载保存的登录状态），返回初始DOM状态"""
+        if load_saved_storage:
+            # 租用的上下文已经创建，在第一次导航前加入登录状态，打开页面时即生效
+            from app.utils.storage_state import apply_saved_state, read_state, state_path
+
+            try:
+                await live_page.call(
+                    lambda page, state: apply_saved_state(page.context, state),
+                    read_state(state_path(), target_url)
+                )
+            except Exception as e:
+                print(f"   ⚠️ [实时跟踪] 加载保存的登录状态失败: {e}")
+        await live_page.goto(target_url)
+
+        live_state = {
+            "url": None, "clean_html": "", "diff": "", "page_model": None, "dom_index": None,
+            "snippets_executed": 0, "llm_calls": 0, "retries": 0, "selector_rejections": 0
+        }
+        await self._refresh_live_dom(live_page, live_state)
+        return live_state
+
+    async def _refresh_live_dom(self, live_page, live_state: Dict[str, Any]) -> None:
+        """读取页面当前DOM，并记录与上一步相比的变化，供下一步代码生成使用"""
+        from ..generator.page_model import page_model_from_tree
+        from ..generator.selector_validator import DomIndex
+        from ..generator.test_generator import test_generator
+
+        url, html = await live_page.content()
+        clean_html, diff = test_generator.describe_dom_change(
+            live_state["clean_html"], html, navigated=url != live_state["url"]
+        )
+        # 原始HTML解析一次，同时用于页面模型和选择器校验
+        dom_index = DomIndex(html)
+        page_model = page_model_from_tree(dom_index.root) if dom_index.root is not None else []
+        live_state.update(url=url, clean_html=clean_html, diff=diff, page_model=page_model, dom_index=dom_index)
+
+    async def _solve_captcha_live(self, live_page, live_state: Dict[str, Any], captcha_info: Dict[str, Any]) -> None:
+        """实时跟踪模式：在租用的页面上同样执行验证码识别填写，保证后续步骤基于登录后的页面"""
+        from app.utils.browser_util import get_browser_util
+
+        try:
+            await live_page.call(
+                get_browser_util().detect_and_solve_captcha,
+                captcha_selector=captcha_info.get("captcha_selector"),
+                captcha_input_selector=captcha_info.get("captcha_input_selector")
+            )
+        except Exception as e:
+            print(f"   ⚠️ [实时跟踪] 验证码处理失败（非致命）: {e}")
+        await self._refresh_live_dom(live_page, live_state)
+
+    async def _generate_live_action_code(
+        self,
+        live_page,
+        live_state: Dict[str, Any],
+        index: int,
+        action: str,
+        is_last: bool,
+        previous_actions: str,
+        form_selectors: Dict[str, str] = None
+    ) -> str:
+        """
+        实时跟踪模式：生成一个操作的代码并立即在页面上执行
+        执行成功后刷新DOM状态并返回代码；失败时把代码和错误交给LLM重新生成，
+        重试用完仍失败则抛出异常，不再继续生成注定失败的脚本。
+        执行前先在当前DOM上校验选择器，匹配不到元素的代码不执行（避免等到超时），直接重新生成。
+        场景内之前的用例在相同页面上为相同操作执行成功的代码先直接复用
+        """
+        from ..generator.codegen_memo import current_codegen_memo, dom_fingerprint
+        from ..generator.test_generator import test_generator
+        from ...core.config import settings
+        from ...core.tracing import start_span
+
+        memo = current_codegen_memo()
+        fingerprint = dom_fingerprint(live_state["page_model"], live_state["clean_html"]) if memo is not None else ""
+        memo_code = memo.get("live_code", action, fingerprint, is_last) if memo is not None else None
+        if memo_code is not None:
+            reusable = True
+            if settings.SELECTOR_VALIDATION:
+                reusable, _, memo_code = test_generator.validate_generated_selectors(
+                    memo_code, live_state["dom_index"], require_match=True
+                )
+            if reusable:
+                ok, error = await live_page.run_snippet(memo_code)
+                await self._refresh_live_dom(live_page, live_state)
+                if ok:
+                    print(f"   [代码复用] 操作 {index} 复用本场景之前用例执行成功的代码: {action}")
+                    live_state["snippets_executed"] += 1
+                    return memo_code
+                print(f"   ⚠️ 操作 {index} 复用的代码执行失败，重新生成: {error}")
+
+        error_feedback = None
+        error = ""
+        for attempt in range(settings.LIVE_CODEGEN_MAX_RETRIES + 1):
+            print(f"   正在生成操作 {index}（实时跟踪，第 {attempt + 1} 次）: {action}")
+            action_code = await test_generator.generate_playwright_code(
+                action,
+                test_generator.distill_dom_state(
+                    live_state["clean_html"], action, form_selectors, diff=live_state["diff"],
+                    page_model=live_state["page_model"]
+                ),
+                previous_actions,
+                is_last,
+                form_selectors=form_selectors,
+                error_feedback=error_feedback
+            )
+            live_state["llm_calls"] += 1
+            is_valid, error = await test_generator.validate_generated_code(action_code)
+            if is_valid and settings.SELECTOR_VALIDATION:
+                is_valid, error, action_code = test_generator.validate_generated_selectors(
+                    action_code, live_state["dom_index"], require_match=True
+                )
+                if not is_valid:
+                    live_state["selector_rejections"] += 1
+            if is_valid:
+                with start_span("live_snippet", action_index=index, attempt=attempt + 1) as span:
+                    ok, error = await live_page.run_snippet(action_code)
+                    if span is not None:
+                        span.set_attribute("ok", ok)
+                await self._refresh_live_dom(live_page, live_state)
+                if ok:
+                    live_state["snippets_executed"] += 1
+                    if memo is not None:
+                        memo.put("live_code", action, fingerprint, action_code, is_last)
+                    return action_code
+
+            print(f"   ⚠️ 操作 {index} 第 {attempt + 1} 次生成的代码执行失败: {error}")
+            logger.debug("操作 %s 执行失败的代码:\n%s", index, action_code)
+            if attempt < settings.LIVE_CODEGEN_MAX_RETRIES:
+                live_state["retries"] += 1
+            error_feedback = f"{action_code.strip()}\n# 执行错误: {error}"
+
+        raise RuntimeError(f"操作 {index}「{action}」在实时页面上执行失败，停止生成: {error}")
+
+    @traced("generate_script", mode="computer_use")
     async def generate_script_with_computer_use(
         self,
         user_query: str,
@@ -766,7 +1223,8 @@ if __name__ == "__main__":
         auto_detect_captcha: bool = False,
         auto_cookie_localstorage: bool = True,
         load_saved_storage: bool = True,
-        page_content: Dict[str, Any] = None
+        page_content: Dict[str, Any] = None,
+        resource_profile: str = "none"
     ) -> Dict[str, Any]:
         """
         使用 Computer-Use 方案生成测试脚本（基于截图 + 坐标定位）
@@ -777,6 +1235,7 @@ if __name__ == "__main__":
             auto_cookie_localstorage: 是否自动加载和保存cookie/localstorage
             load_saved_storage: 是否加载保存的cookie/localstorage/sessionstorage
             page_content: 页面内容（如果提供，则不重新获取）
+            resource_profile: 资源拦截方案（见 app/utils/resource_profiles.py）
         Returns:
             包含脚本的字典
         """
@@ -788,6 +1247,12 @@ if __name__ == "__main__":
             "error": None
         }
 
+        from ..generator.test_generator import test_generator
+        from ..llm.bailian_client import bailian_client
+
+        start_time = time.perf_counter()
+        INFLIGHT_JOBS.inc(kind="generation")
+
         try:
             print("\n===== 开始使用 Computer-Use 方案生成测试脚本 =====")
             print(f"用户查询: {user_query}")
@@ -796,7 +1261,7 @@ if __name__ == "__main__":
             # 步骤1: 获取页面内容（截图和HTML）- 如果未提供则获取
             print("\n步骤1: 获取页面内容...")
             if page_content is None:
-                page_content = await test_generator.get_page_content(target_url)
+                page_content = await test_generator.get_page_content(target_url, resource_profile=resource_profile)
                 print(f"✅ 页面标题: {page_content.get('title', 'N/A')}")
             else:
                 print(f"✅ 使用已获取的页面内容: {page_content.get('title', 'N/A')}")
@@ -806,10 +1271,10 @@ if __name__ == "__main__":
             page_analysis = await test_generator.analyze_page_content(page_content, user_query)
             print(f"✅ 页面类型: {page_analysis.get('page_type', 'N/A')}")
 
-            # 步骤2.5: VL验证码检测 + 读取DB配置选择器
-            print("\n步骤2.5: VL验证码检测...")
-            captcha_info = await self._detect_captcha_from_page(page_content)
-            print(f"✅ 验证码检测结果: has_captcha={captcha_info['has_captcha']}, type={captcha_info['captcha_type']}")
+            # 步骤2.5: 验证码检测（HTML 预筛 + 页面分析结果）+ 读取DB配置选择器
+            print("\n步骤2.5: 验证码检测...")
+            captcha_info = await self._detect_captcha_from_page(page_content, page_analysis)
+            print(f"✅ 验证码检测结果: has_captcha={captcha_info['has_captcha']}, type={captcha_info['captcha_type']}, 来源={captcha_info['source']}")
 
             # 步骤3: 基于页面分析生成操作步骤
             print("\n步骤3: 生成操作步骤...")
@@ -823,7 +1288,7 @@ if __name__ == "__main__":
             print("\n步骤4: 使用 Computer-Use 方案生成完整测试脚本...")
             final_script = await self._generate_computer_use_script(
                 target_url, actions, auto_detect_captcha, auto_cookie_localstorage, load_saved_storage,
-                captcha_info=captcha_info
+                captcha_info=captcha_info, resource_profile=resource_profile
             )
             result["script"] = final_script
             print("✅ 脚本生成完成")
@@ -845,7 +1310,13 @@ if __name__ == "__main__":
             print(f"\n❌ 生成脚本时出现错误: {str(e)}")
             print(f"\n错误详情:\n{error_detail}")
             return result
+        finally:
+            INFLIGHT_JOBS.dec(kind="generation")
+            SCRIPT_GENERATION_SECONDS.observe(
+                time.perf_counter() - start_time, mode="computer_use", status=result["status"]
+            )
 
+    @traced("computer_use_operations")
     async def _generate_computer_use_script(
         self,
         target_url: str,
@@ -853,7 +1324,8 @@ if __name__ == "__main__":
         auto_detect_captcha: bool = False,
         auto_cookie_localstorage: bool = True,
         load_saved_storage: bool = True,
-        captcha_info: Dict[str, Any] = None
+        captcha_info: Dict[str, Any] = None,
+        resource_profile: str = "none"
     ) -> str:
         """
         使用 Computer-Use 方案生成测试脚本（纯坐标方式）
@@ -864,6 +1336,7 @@ if __name__ == "__main__":
             auto_cookie_localstorage: 是否自动加载和保存cookie/localstorage
             load_saved_storage: 是否加载保存的cookie/localstorage/sessionstorage
             captcha_info: VL验证码检测结果 + DB配置选择器
+            resource_profile: 资源拦截方案（见 app/utils/resource_profiles.py）
         Returns:
             完整的测试脚本
         """
@@ -893,20 +1366,6 @@ if __name__ == "__main__":
         action_codes.append("                # 等待页面加载")
         action_codes.append("                await page.wait_for_timeout(2000)")
 
-        # 如果需要自动加载 Cookie/LocalStorage，添加加载代码
-        if auto_cookie_localstorage and load_saved_storage:
-            action_codes.append(f"                # 加载保存的 cookies、localStorage 和 sessionStorage（使用 browser_util）")
-            action_codes.append(f"                try:")
-            action_codes.append(f"                    from app.utils.browser_util import get_browser_util")
-            action_codes.append(f"                    browser_util = get_browser_util()")
-            action_codes.append(f"                    await browser_util.load_storage(")
-            action_codes.append(f"                        cookies_path=os.path.join(SESSION_STORAGE_PATH, 'saved_cookies.json'),")
-            action_codes.append(f"                        localstorage_path=os.path.join(SESSION_STORAGE_PATH, 'saved_localstorage.json'),")
-            action_codes.append(f"                        sessionstorage_path=os.path.join(SESSION_STORAGE_PATH, 'saved_sessionstorage.json')")
-            action_codes.append(f"                    )")
-            action_codes.append(f"                except Exception as e:")
-            action_codes.append(f"                    print(f'加载 storage 失败: {{e}}')")
-
         # 使用线程池运行 Playwright，允许使用不同的事件循环策略
         print(f"\n   开始使用 Computer-Use 方案生成操作代码...")
 
@@ -915,6 +1374,7 @@ if __name__ == "__main__":
         # 定义在线程中执行的异步函数
         async def run_playwright_operations():
             from app.services.computer_use.computer_use_service import ComputerUseService
+            from app.services.generator.test_generator import test_generator
             from playwright.async_api import async_playwright
             import time
 
@@ -930,8 +1390,14 @@ if __name__ == "__main__":
             need_captcha = vl_has_captcha or auto_detect_captcha
 
             async with async_playwright() as p:
+                BROWSER_LAUNCHES.inc(source="computer_use_generation")
                 browser = await p.chromium.launch(headless=browser_headless)
-                page = await browser.new_page()
+                if load_saved_storage:
+                    # 登录状态在创建上下文时生效，打开页面时已是登录后的状态，不需要刷新
+                    from app.utils.storage_state import new_page_with_saved_state
+                    page = await new_page_with_saved_state(browser, url=target_url)
+                else:
+                    page = await browser.new_page()
 
                 # 导航到目标页面
                 print(f"   正在导航到: {target_url}")
@@ -939,25 +1405,6 @@ if __name__ == "__main__":
                 await page.wait_for_load_state("networkidle")
                 await page.wait_for_timeout(2000)
 
-                # 如果需要加载保存的storage
-                if load_saved_storage:
-                    print("   正在加载保存的 cookies 和 storage...")
-                    from app.utils.browser_util import get_browser_util
-                    browser_util = get_browser_util()
-
-                    session_storage_path = os.getenv('SESSION_STORAGE_PATH', os.getcwd())
-                    await browser_util.load_storage(
-                        page,
-                        cookies_path=os.path.join(session_storage_path, 'saved_cookies.json'),
-                        localstorage_path=os.path.join(session_storage_path, 'saved_localstorage.json'),
-                        sessionstorage_path=os.path.join(session_storage_path, 'saved_sessionstorage.json')
-                    )
-
-                    print("   正在刷新页面使登录状态生效...")
-                    await page.reload(wait_until="domcontentloaded")
-                    await page.wait_for_timeout(5000)
-                    print("   ✅ 页面刷新完成")
-
                 computer_use_service = ComputerUseService()
 
                 # 处理每个操作
@@ -1063,7 +1510,7 @@ if __name__ == "__main__":
                         if not action_result.get("element_found"):
                             # Computer-Use 未找到元素，回退到 DOM 选择器模式
                             print(f"   ⚠️ 操作 {i} Computer-Use未找到元素，回退到DOM选择器: {action_result.get('reasoning', '')}")
-                            dom_state = (await page.content())[:5000]
+                            dom_state = test_generator.distill_dom_state(await page.content(), action, clean=True)
                             action_code = await test_generator.generate_playwright_code(
                                 action, dom_state, aggregated_actions, is_last
                             )
@@ -1109,9 +1556,13 @@ if __name__ == "__main__":
 
         # 在线程中运行 Playwright
         try:
+            import contextvars
             from concurrent.futures import ThreadPoolExecutor
             with ThreadPoolExecutor(max_workers=1) as executor:
-                future = executor.submit(_run_playwright_in_thread, run_playwright_operations)
+                # 复制当前上下文，线程中的 span 挂在本次生成的 trace 下
+                future = executor.submit(
+                    contextvars.copy_context().run, _run_playwright_in_thread, run_playwright_operations
+                )
                 action_codes_from_playwright = future.result(timeout=300)
         except Exception as e:
             print(f"   ❌ Playwright 处理错误: {e}")
@@ -1128,6 +1579,11 @@ if __name__ == "__main__":
         python_path = os.getenv('PYTHON_PATH', '')
         session_storage_path = os.getenv('SESSION_STORAGE_PATH', '.')
 
+        storage_imports, page_setup, save_storage = self._storage_state_code(
+            target_url, auto_cookie_localstorage, load_saved_storage
+        )
+        resource_imports = self._resource_profile_imports()
+
         # 生成完整脚本
         script = f'''import sys
 import os
@@ -1147,7 +1603,7 @@ import traceback
 import json
 import time
 from datetime import datetime
-
+{storage_imports}{resource_imports}
 # 全局步骤结果列表
 step_results = []
 
@@ -1200,21 +1656,25 @@ async def test_generated():
         async with async_playwright() as p:
             print(json.dumps({{"event": "browser_launch_start"}}, ensure_ascii=False))
             browser = await p.chromium.launch(headless={browser_headless})
-            page = await browser.new_page()
+            {page_setup}
+            resource_stats = await apply_resource_profile(page, {resource_profile!r}, "{target_url}")
+            network_replay = await apply_network_mode(page)
+            run_trace = await start_run_trace(page)
             print(json.dumps({{"event": "browser_launch_end", "status": "success"}}, ensure_ascii=False))
 
-            # Action 0: Navigate to target page
-            log_step_start(0, "Navigate to {target_url}", "navigation")
-            try:
-                await page.goto("{target_url}")
-                await page.wait_for_load_state("networkidle")
-                await asyncio.sleep(3)
-                log_step_end(0, "passed", {{"url": "{target_url}"}})
-            except Exception as e:
-                log_step_end(0, "failed", error_message=str(e))
-                raise
-            
+            # 打开页面失败时同样保存失败产物、输出资源统计
             try:
+                # Action 0: Navigate to target page
+                log_step_start(0, "Navigate to {target_url}", "navigation")
+                try:
+                    await page.goto("{target_url}")
+                    await page.wait_for_load_state("networkidle")
+                    await asyncio.sleep(3)
+                    log_step_end(0, "passed", {{"url": "{target_url}"}})
+                except Exception as e:
+                    log_step_end(0, "failed", error_message=str(e))
+                    raise
+
                 # Execute all actions
 {actions_str}
             except Exception as e:
@@ -1223,32 +1683,16 @@ async def test_generated():
                     "error": str(e),
                     "traceback": traceback.format_exc()
                 }}, ensure_ascii=False))
-                try:
-                    await page.screenshot(path="error_screenshot.png")
-                    print(json.dumps({{"event": "screenshot_saved", "path": "error_screenshot.png"}}, ensure_ascii=False))
-                except:
-                    pass
+                await keep_failure_artifacts(run_trace)
+                await report_resource_stats(resource_stats)
+                await finish_network_mode(network_replay)
                 raise
 
             print(json.dumps({{"event": "test_completed", "total_duration_ms": int((time.time() - test_start_time) * 1000)}}, ensure_ascii=False))
-            
-            # Save cookies, localStorage and sessionStorage if enabled
-            if {auto_cookie_localstorage}:
-                cookies = await page.context.cookies()
-                cookies_path = os.path.join(SESSION_STORAGE_PATH, 'saved_cookies.json')
-                with open(cookies_path, 'w', encoding='utf-8') as f:
-                    json.dump(cookies, f, ensure_ascii=False, indent=2)
-                
-                ls_data = await page.evaluate('() => JSON.stringify(localStorage)')
-                ls_path = os.path.join(SESSION_STORAGE_PATH, 'saved_localstorage.json')
-                with open(ls_path, 'w', encoding='utf-8') as f:
-                    f.write(ls_data)
-                
-                ss_data = await page.evaluate('() => JSON.stringify(sessionStorage)')
-                ss_path = os.path.join(SESSION_STORAGE_PATH, 'saved_sessionstorage.json')
-                with open(ss_path, 'w', encoding='utf-8') as f:
-                    f.write(ss_data)
-            
+{save_storage}
+            await discard_run_trace(run_trace)
+            await report_resource_stats(resource_stats)
+            await finish_network_mode(network_replay)
             await browser.close()
             
     except Exception as e:
@@ -1269,6 +1713,7 @@ if __name__ == "__main__":
 '''
         return script
 
+    @traced("generate_actions_from_snapshot")
     async def _generate_actions_from_snapshot(
         self,
         user_query: str,
@@ -1343,6 +1788,7 @@ if __name__ == "__main__":
 用户查询: {user_query}
 输出:"""
 
+        from ..llm.bailian_client import bailian_client
         response = await bailian_client.generate_text(prompt, system_prompt)
 
         import json
@@ -1356,6 +1802,7 @@ if __name__ == "__main__":
                 "验证测试已成功完成"
             ]
 
+    @traced("generate_script", mode="agent_browser")
     async def generate_script_with_agent_browser(
         self,
         user_query: str,
@@ -1378,6 +1825,11 @@ if __name__ == "__main__":
             "error": None,
         }
 
+        from ..llm.bailian_client import bailian_client
+
+        start_time = time.perf_counter()
+        INFLIGHT_JOBS.inc(kind="generation")
+
         try:
             print("\n===== 开始使用 agent-browser 方案生成测试脚本 =====")
             print(f"用户查询: {user_query}")
@@ -1442,7 +1894,13 @@ if __name__ == "__main__":
             print(f"\n❌ agent-browser 生成错误: {str(e)}")
             print(f"\n错误详情:\n{error_detail}")
             return result
+        finally:
+            INFLIGHT_JOBS.dec(kind="generation")
+            SCRIPT_GENERATION_SECONDS.observe(
+                time.perf_counter() - start_time, mode="agent_browser", status=result["status"]
+            )
 
+    @traced("agent_browser_operations")
     async def _generate_agent_browser_script(
         self,
         target_url: str,
@@ -1458,6 +1916,10 @@ if __name__ == "__main__":
         使用 agent-browser 真实浏览器生成 Python 测试脚本。
         流程：open → snapshot → LLM 生成动作列表 → 逐步 snapshot+plan+执行 → 收集 element info → 组装脚本 → close
         """
+        from ..agent_browser.agent_browser_service import AgentBrowserService
+        from ..agent_browser.action_planner import ActionPlanner
+        from ..generator.codegen_memo import current_codegen_memo, dom_fingerprint
+
         ab_service = AgentBrowserService()
         action_planner = ActionPlanner()
 
@@ -1489,6 +1951,7 @@ if __name__ == "__main__":
 
                 # ===== 2. 打开浏览器 =====
                 print(f"[AgentBrowser] 正在打开浏览器: {target_url}")
+                BROWSER_LAUNCHES.inc(source="agent_browser_generation")
                 open_result = await ab_service.open(target_url, headless=browser_headless)
                 if not open_result.get("success", True) and open_result.get("error"):
                     raise RuntimeError(f"agent-browser open 失败: {open_result['error']}")
@@ -1587,12 +2050,19 @@ if __name__ == "__main__":
                         snap = await ab_service.snapshot(interactive=True)
                         snapshot_text = snap.get("data", {}).get("snapshot", "") or snap.get("snapshot", "") or snap.get("raw_output", "")
 
-                        # 用 LLM 规划操作
-                        plan = await action_planner.plan_action(
-                            action, snapshot_text, aggregated,
-                            default_username=default_username,
-                            default_password=default_password,
-                        )
+                        # 用 LLM 规划操作（场景内之前的用例在相同快照上规划过的操作直接复用）
+                        memo = current_codegen_memo()
+                        snapshot_fingerprint = dom_fingerprint(text=snapshot_text) if memo is not None else ""
+                        plan = memo.get("plan", action, snapshot_fingerprint) if memo is not None else None
+                        plan_reused = plan is not None
+                        if plan_reused:
+                            print(f"   [代码复用] 操作 {i} 复用本场景之前用例的规划: {action}")
+                        else:
+                            plan = await action_planner.plan_action(
+                                action, snapshot_text, aggregated,
+                                default_username=default_username,
+                                default_password=default_password,
+                            )
 
                         if plan.get("error"):
                             print(f"   ⚠️ 操作 {i} ActionPlanner 错误: {plan.get('reasoning', '')}")
@@ -1647,10 +2117,11 @@ if __name__ == "__main__":
 
                         # 在真实浏览器上执行操作（推进页面状态）
                         try:
+                            exec_result = None
                             if cmd == "click" and ref:
-                                await ab_service.click(ref)
+                                exec_result = await ab_service.click(ref)
                             elif cmd == "fill" and ref:
-                                await ab_service.fill(ref, value)
+                                exec_result = await ab_service.fill(ref, value)
                             elif cmd == "press":
                                 await ab_service.press_key(value or "Escape")
                             elif cmd == "wait":
@@ -1658,6 +2129,9 @@ if __name__ == "__main__":
                             elif cmd == "screenshot":
                                 await ab_service.screenshot()
                             await ab_service.wait(2000)
+                            # 只复用在真实浏览器上执行成功的规划
+                            if memo is not None and not plan_reused and (exec_result or {}).get("success", True):
+                                memo.put("plan", action, snapshot_fingerprint, plan)
                         except Exception as exec_err:
                             print(f"   ⚠️ 操作 {i} 执行失败（不影响脚本生成）: {exec_err}")
 
@@ -1859,17 +2333,21 @@ if __name__ == "__main__":
             print(f"   执行操作时出错: {e}")
             # 不中断流程，继续处理下一个操作
 
-    async def _execute_test(self, script: str) -> str:
+    @traced("execute_script_subprocess")
+    async def _execute_test(self, script: str, extra_env: Optional[Dict[str, str]] = None) -> str:
         """
         执行测试脚本
         Args:
             script: 测试脚本
+            extra_env: 额外传给脚本子进程的环境变量（如 HAR 录制/回放模式）
         Returns:
-            执行输出
+            执行输出（失败时保存的 trace 和截图用 run_artifacts.parse_artifacts_event 读取）
         """
         import tempfile
         import os
         import subprocess
+        from ...core.config import settings
+        from ...utils import run_artifacts
 
         # 使用 backend/app/temp/ 目录保存临时脚本，方便排查问题
         temp_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'temp')
@@ -1887,6 +2365,11 @@ if __name__ == "__main__":
             # 使用 run_in_executor 在后台线程中执行 subprocess
             import concurrent.futures
             
+            # 子进程内的 LLM/VL 调用以事件行输出指标，执行结束后汇总到本进程；
+            # 失败时 trace 和截图保存到本次执行的产物目录（通过时不写文件）
+            _, artifact_env = run_artifacts.prepare(settings.FAILURE_TRACE_ENABLED)
+            env = dict(os.environ, **{METRICS_EVENTS_ENV: "1"}, **artifact_env, **(extra_env or {}))
+
             def run_subprocess():
                 return subprocess.run(
                     [sys.executable, temp_script_path],
@@ -1895,22 +2378,37 @@ if __name__ == "__main__":
                     timeout=300,  # 5分钟超时
                     encoding='utf-8',
                     errors='replace',
-                    cwd=os.getcwd()  # 使用当前工作目录
+                    cwd=os.getcwd(),  # 使用当前工作目录
+                    env=env
                 )
             
             print("   等待测试执行完成（最多5分钟）...")
             
             # 在线程池中执行 subprocess
+            BROWSER_LAUNCHES.inc(source="test_script")
+            start_time = time.perf_counter()
             loop = asyncio.get_event_loop()
-            with concurrent.futures.ThreadPoolExecutor() as pool:
-                result = await loop.run_in_executor(pool, run_subprocess)
+            try:
+                with INFLIGHT_JOBS.track_inprogress(kind="execution"):
+                    with concurrent.futures.ThreadPoolExecutor() as pool:
+                        result = await loop.run_in_executor(pool, run_subprocess)
+            except subprocess.TimeoutExpired:
+                SCRIPT_EXECUTION_SECONDS.observe(time.perf_counter() - start_time, status="timeout")
+                raise
+            SCRIPT_EXECUTION_SECONDS.observe(
+                time.perf_counter() - start_time,
+                status="success" if result.returncode == 0 else "failed"
+            )
 
             output = result.stdout + "\n" + result.stderr
+            self._record_execution_metrics(result.stdout)
+            self._settle_captcha_answers(result.stdout, result.returncode)
 
-            print(f"   测试执行完成，返回码: {result.returncode}")
-            print(f"   标准输出:\n{result.stdout[:5000]}")
+            print(f"   测试执行完成，返回码: {result.returncode}，stdout {len(result.stdout)} 字符，stderr {len(result.stderr)} 字符")
+            logger.debug("测试脚本标准输出:\n%s", result.stdout)
             if result.stderr:
-                print(f"   标准错误:\n{result.stderr[:2000]}")
+                log_level = logging.WARNING if result.returncode != 0 else logging.DEBUG
+                logger.log(log_level, "测试脚本标准错误:\n%s", result.stderr)
 
             return output
         except subprocess.TimeoutExpired:
@@ -1928,6 +2426,81 @@ if __name__ == "__main__":
             except:
                 pass
 
+    def _record_execution_metrics(self, stdout: str):
+        """从脚本输出中汇总步骤耗时和子进程上报的指标事件，并把步骤补录为子 span"""
+        import json
+
+        step_starts = {}
+        for line in stdout.split('\n'):
+            line = line.strip()
+            if not line.startswith('{"event": "'):
+                continue
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            event = data.get("event")
+            if event == "metric":
+                ingest_metric_event(data)
+                if data.get("name") == "page_resources":
+                    # 本次运行的传输字节数和页面加载耗时记在执行脚本的 span 上
+                    span = current_span()
+                    if span is not None:
+                        for key in ("profile", "transfer_bytes", "load_ms", "blocked", "requests"):
+                            span.set_attribute(f"resources.{key}", data.get(key))
+            elif event == "step_start":
+                step_starts[data.get("step_number")] = data
+            elif event == "step_end" and data.get("execution_duration_ms") is not None:
+                STEP_DURATION_SECONDS.observe(
+                    data["execution_duration_ms"] / 1000, status=data.get("status", "unknown")
+                )
+                start = step_starts.get(data.get("step_number"))
+                if start and start.get("timestamp"):
+                    record_span(
+                        f"step {data.get('step_number')}: {start.get('step_name', '')}",
+                        start["timestamp"],
+                        data["execution_duration_ms"],
+                        status=data.get("status", "passed"),
+                        step_type=start.get("step_type", "action")
+                    )
+
+    def _settle_captcha_answers(self, stdout: str, returncode: int):
+        """
+        处理脚本用过的缓存验证码答案（见 app/utils/captcha_cache.py）和记下的验证码定位（见 app/utils/captcha_memory.py）：
+        执行失败时清除答案、丢弃定位，答案错误导致登录失败时下次执行会重新识别；
+        执行通过时确认定位和答案，用 VL 模型识别的验证码学习字形（见 app/utils/captcha_recognizer.py）
+        """
+        from ...utils import captcha_cache, captcha_memory
+
+        keys = captcha_cache.parse_used_keys(stdout)
+        locators = captcha_memory.parse_events(stdout)
+        if not keys and not locators:
+            return
+        failed = returncode != 0 or '"event": "test_failed"' in stdout or any(
+            s.get("event") == "step_end" and s.get("status") == "failed" for s in self._parse_step_results(stdout)
+        )
+        if failed:
+            if captcha_cache.evict(keys):
+                print(f"   脚本执行失败，已清除使用过的缓存验证码答案 {len(keys)} 个")
+            if captcha_memory.discard(locators):
+                print(f"   脚本执行失败，已丢弃记下的验证码定位 {len(locators)} 个")
+            return
+        if captcha_memory.confirm(locators):
+            print(f"   登录成功，已确认记下的验证码定位 {len(locators)} 个")
+        pending = captcha_cache.confirm(keys)
+        if not pending:
+            return
+        from ...utils.captcha_recognizer import get_local_recognizer
+
+        for item in pending:
+            try:
+                learned = get_local_recognizer().learn(item["image"], item["answer"])
+            except Exception as e:
+                print(f"   从验证码学习字形失败: {e}")
+                continue
+            if learned:
+                print(f"   登录成功，已从验证码学习字形: {item['answer']}")
+
     def _parse_step_results(self, execution_output: str) -> List[Dict[str, Any]]:
         """
         解析测试脚本输出的步骤结果
@@ -1957,14 +2530,20 @@ if __name__ == "__main__":
 
         return step_results
 
-    async def execute_saved_script(self, script: str) -> Dict[str, Any]:
+    @traced("execute_saved_script")
+    async def execute_saved_script(self, script: str, network_mode: str = "live",
+                                   case_id: Optional[int] = None) -> Dict[str, Any]:
         """
         执行已保存的测试脚本（不重新生成）
         Args:
             script: 已保存的测试脚本
+            network_mode: 网络模式 live / record 录制 HAR / replay 回放 HAR（见 app/utils/har_replay.py）
+            case_id: 用例ID（录制和回放的 HAR 按用例保存）
         Returns:
-            执行结果
+            执行结果，录制和回放时 "har" 中包含录制状态和是否过期
         """
+        from ...utils import har_replay, run_artifacts
+
         result = {
             "status": "success",
             "script": script,
@@ -1976,12 +2555,19 @@ if __name__ == "__main__":
             print("\n===== 开始执行已保存的测试脚本 =====")
             print("   直接执行已保存的脚本...")
             
-            execution_output = await self._execute_test(script)
+            network_mode, network_env = har_replay.prepare(case_id, network_mode)
+            execution_output = await self._execute_test(script, extra_env=network_env)
             result["execution_output"] = execution_output
+            result["artifacts"] = run_artifacts.parse_artifacts_event(execution_output)
+            if result["artifacts"]:
+                print(f"   失败产物已保存: {result['artifacts']['dir']}")
             
             # 解析步骤结果
             step_results = self._parse_step_results(execution_output)
             result["step_results"] = step_results
+            # 步骤截图按内容去重、重新编码后入库（VL 验证已在脚本中用原图完成）
+            from ..screenshot.screenshot_store import screenshot_store
+            await asyncio.to_thread(screenshot_store.ingest_step_results, step_results)
             
             # 检查执行结果
             # 基于解析出的步骤事件判断（更精确，不会被日志中的 "Error" 文本误触发）
@@ -1999,6 +2585,13 @@ if __name__ == "__main__":
             if has_test_failed_event or has_test_failed_json or has_pytest_failure:
                 result["status"] = "failed"
                 result["error"] = "Test execution failed"
+
+            if network_mode != "live":
+                result["har"] = har_replay.finish(
+                    case_id, network_mode, script, execution_output, result["status"] == "success"
+                )
+                if result["har"].get("stale"):
+                    print(f"   ⚠️ [HAR] 用例 {case_id} 的录制已过期: {'；'.join(result['har']['reasons'])}，建议重新录制")
             
             print("✅ 测试执行完成")
             print("\n===== 测试执行完成 =====")
@@ -2013,6 +2606,112 @@ if __name__ == "__main__":
             print(f"\n错误详情:\n{error_detail}")
             return result
 
+    async def prepare_shared_login_prefix(self, scripts: Dict[Any, str], scenario_id: Optional[int] = None) -> Dict[Any, Dict[str, Any]]:
+        """
+        场景执行前：把登录前置步骤相同的用例分组，每组的前置步骤只执行一次（见 login_prefix）；
+        会话池中有该前置步骤的已登录会话时直接租用，不再执行前置步骤（见 session_pool）
+        只拆分两个及以上用例共用、且登录后离开了起始页面的前置步骤，其余用例（包括错误密码等反向用例）按完整脚本执行
+        Args:
+            scripts: 用例ID -> 保存的脚本
+            scenario_id: 场景ID（登录后的状态放入会话池时记录，后台用该场景的登录步骤刷新会话）
+        Returns:
+            用例ID -> {"script": 从登录后开始的后续脚本, "prefix": 该组前置步骤的执行信息}；
+            不在任何组中、所在组前置步骤执行失败或登录后仍停留在起始页面的用例不出现在结果中，按完整脚本执行
+        """
+        import tempfile
+        from .login_prefix import build_prefix_script, build_suffix_script, parse_state_event, plan_shared_prefix
+        from ..session.session_pool import session_pool
+
+        temp_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'temp')
+        os.makedirs(temp_dir, exist_ok=True)
+
+        shared: Dict[Any, Dict[str, Any]] = {}
+        for group in plan_shared_prefix(scripts):
+            case_ids = group["case_ids"]
+            prefix_len = group["prefix_len"]
+            start_url = group["parts"][case_ids[0]]["url"]
+            lease = await session_pool.lease(group["login_key"])
+            if lease:
+                prefix = {
+                    "case_ids": case_ids,
+                    "result": {"step_results": []},
+                    "url": lease["url"],
+                    "start_url": start_url,
+                    "state_path": lease["state_path"],
+                    "duration_ms": 0,
+                    "report_id": None,
+                    "lease": lease,
+                }
+                for case_id in case_ids:
+                    shared[case_id] = {
+                        "script": build_suffix_script(group["parts"][case_id], prefix_len, lease["state_path"], lease["url"]),
+                        "prefix": prefix,
+                    }
+                continue
+
+            print(f"   [共享登录] 用例 {case_ids} 的前 {prefix_len} 个操作相同，只执行一次")
+            fd, state_path = tempfile.mkstemp(prefix="shared_state_", suffix=".json", dir=temp_dir)
+            os.close(fd)
+
+            start_time = time.perf_counter()
+            prefix_result = await self.execute_saved_script(
+                build_prefix_script(group["parts"][case_ids[0]], prefix_len, state_path)
+            )
+            url = parse_state_event(prefix_result.get("execution_output", ""))
+            if prefix_result.get("status") != "success" or not url:
+                print(f"   ⚠️ [共享登录] 前置步骤执行失败，这些用例按完整脚本执行: {prefix_result.get('error')}")
+                try:
+                    os.unlink(state_path)
+                except OSError:
+                    pass
+                continue
+
+            if url == start_url:
+                # 登录后仍停留在起始页面时无法确认登录成功（可能停在了登录页），不拆分也不放入会话池
+                print(f"   ⚠️ [共享登录] 前置步骤执行后仍停留在 {url}，这些用例按完整脚本执行")
+                try:
+                    os.unlink(state_path)
+                except OSError:
+                    pass
+                continue
+
+            prefix = {
+                "case_ids": case_ids,
+                "result": prefix_result,
+                "url": url,
+                "start_url": start_url,
+                "state_path": state_path,
+                "duration_ms": int((time.perf_counter() - start_time) * 1000),
+                "report_id": None,  # 记录前置步骤结果的报告（组内第一个执行的用例）
+            }
+            print(f"   [共享登录] 前置步骤完成（{prefix['duration_ms']}ms），后续用例从 {url} 开始")
+            await session_pool.add(group["login_key"], state_path, url, scenario_id)
+            for case_id in case_ids:
+                shared[case_id] = {
+                    "script": build_suffix_script(group["parts"][case_id], prefix_len, state_path, url),
+                    "prefix": prefix,
+                }
+        return shared
+
+    async def release_shared_login_prefix(self, shared: Dict[Any, Dict[str, Any]]) -> None:
+        """
+        场景执行结束后删除保存的登录状态（包含 cookies 等凭据），归还租用的会话
+        Args:
+            shared: prepare_shared_login_prefix 的结果；用例被登录页拦下时（prefix["login_wall"]）租用的会话标记为失效，
+                用例本身的失败不影响会话
+        """
+        from ..session.session_pool import session_pool
+
+        prefixes = {id(item["prefix"]): item["prefix"] for item in shared.values()}
+        for prefix in prefixes.values():
+            if prefix.get("lease"):
+                await session_pool.release(prefix["lease"], valid=not prefix.get("login_wall"))
+                continue
+            try:
+                os.unlink(prefix["state_path"])
+            except OSError:
+                pass
+
     async def _generate_report(self, result: Dict[str, Any]) -> str:
         """
         生成测试报告
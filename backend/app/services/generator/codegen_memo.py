@@ -0,0 +1,99 @@
+"""
+场景内的代码生成复用
+
+同一个场景生成的多个用例，开头几步几乎总是相同的（打开页面、输入用户名、输入密码、
+处理验证码、点击登录），逐个用例生成时这些步骤会向 LLM 发出相同的请求。
+在一次场景生成期间用 (操作类型, 归一化的操作描述, 页面指纹) 记住验证通过的代码
+（DOM 模式）或操作规划（agent-browser 模式），后面的用例直接复用。
+
+用 contextvars 维护当前的复用表，只在 codegen_memo_scope() 范围内生效：
+
+    with codegen_memo_scope():
+        for case in cases:
+            await test_executor.generate_script_only(...)
+
+范围之外 current_codegen_memo() 返回 None，代码生成行为不变。
+"""
+import contextvars
+import hashlib
+import json
+import re
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+_current_memo: contextvars.ContextVar[Optional["CodegenMemo"]] = contextvars.ContextVar("codegen_memo", default=None)
+
+_QUOTES_RE = re.compile(r"[\"“”‘’「」『』]")
+_WHITESPACE_RE = re.compile(r"\s+")
+_TRAILING_PUNCT = "。.；;，,！!"
+
+
+def normalize_action(action: str) -> str:
+    """归一化操作描述：统一引号和空白、去掉末尾标点（大小写不变，输入的数据可能区分大小写）"""
+    text = _QUOTES_RE.sub("'", action or "")
+    text = _WHITESPACE_RE.sub(" ", text).strip().rstrip(_TRAILING_PUNCT).strip()
+    return text
+
+
+def dom_fingerprint(page_model: Optional[List[Dict[str, Any]]] = None, text: str = "") -> str:
+    """
+    页面指纹
+    有页面模型时只取可交互元素的结构（标签、类型、角色、名称、选择器），忽略元素的值和非交互内容；
+    否则对文本（HTML 或无障碍树快照，快照中的 @eN 引用会随元素变化）合并空白后计算
+    """
+    if page_model:
+        material = json.dumps(
+            [[e.get("tag"), e.get("type"), e.get("role"), e.get("name"), e.get("selector")]
+             for e in page_model if not e.get("context")],
+            ensure_ascii=False
+        )
+    else:
+        material = _WHITESPACE_RE.sub(" ", text or "").strip()
+    return hashlib.sha1(material.encode("utf-8")).hexdigest()[:16]
+
+
+class CodegenMemo:
+    """一次场景生成期间的复用表：(类型, 归一化操作, 页面指纹, 附加条件) -> 验证通过的代码或规划"""
+
+    def __init__(self):
+        self._entries: Dict[Tuple, Any] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(kind: str, action: str, fingerprint: str, extra: Tuple) -> Tuple:
+        return (kind, normalize_action(action), fingerprint) + tuple(extra)
+
+    def get(self, kind: str, action: str, fingerprint: str, *extra) -> Any:
+        value = self._entries.get(self._key(kind, action, fingerprint, extra))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, kind: str, action: str, fingerprint: str, value: Any, *extra) -> None:
+        if value is not None:
+            self._entries[self._key(kind, action, fingerprint, extra)] = value
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def current_codegen_memo() -> Optional[CodegenMemo]:
+    """当前场景生成的复用表，不在 codegen_memo_scope() 内时为 None"""
+    return _current_memo.get()
+
+
+@contextmanager
+def codegen_memo_scope() -> Iterator[CodegenMemo]:
+    """在范围内生成的用例共享一个复用表，结束时输出命中统计"""
+    memo = CodegenMemo()
+    token = _current_memo.set(memo)
+    try:
+        yield memo
+    finally:
+        _current_memo.reset(token)
+        stats = memo.stats()
+        if stats["hits"] or stats["misses"]:
+            print(f"   [代码复用] 缓存 {stats['entries']} 项，命中 {stats['hits']} 次（节省 LLM 调用），未命中 {stats['misses']} 次")
@@ -0,0 +1,197 @@
+"""
+DOM 精简：按操作描述挑选相关的 DOM 片段放入提示词
+
+把清理后的 HTML 切成元素级的片段，用 BM25 按操作描述打分，在 token 预算内
+优先放入得分高的片段，最后按文档顺序输出，被省略的部分用注释标出。
+extract_form_selectors 找到的表单控件（用户名、密码、验证码、登录按钮等）总是保留。
+"""
+import math
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+import lxml.html
+
+from ...core.config import settings
+
+# 交互元素即使很大也作为一个整体片段（超长时截断），不再往下拆
+INTERACTIVE_TAGS = {"input", "button", "a", "select", "textarea", "label", "option"}
+SKIP_TAGS = {"head", "script", "style", "noscript", "template", "svg"}
+OMITTED_MARKER = "<!-- … -->"
+
+_TOKEN_RE = re.compile(r"[A-Za-z]+|\d+|[一-鿿]+")
+_CAMEL_RE = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])")
+_SELECTOR_RE = re.compile(
+    r"^(?P<tag>[a-zA-Z]+)?"
+    r"(?:#(?P<id>[\w-]+)|\.(?P<cls>[\w-]+)|\[(?P<attr>[\w-]+)=['\"]?(?P<value>[^'\"\]]*)['\"]?\]|:has-text\(['\"](?P<text>[^'\"]*)['\"]\))?$"
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：ASCII 约 4 字符一个 token，中文约 1 字一个 token"""
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return (len(text) - non_ascii) // 4 + non_ascii
+
+
+def tokenize(text: str) -> List[str]:
+    """英文按单词（拆分驼峰）、中文按单字 + 双字切分"""
+    tokens = []
+    for word in _TOKEN_RE.findall(text):
+        if word[0] >= "一":
+            tokens.extend(word)
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        elif word.isdigit():
+            tokens.append(word)
+        else:
+            parts = _CAMEL_RE.findall(word) or [word]
+            tokens.extend(p.lower() for p in parts if len(p) > 1)
+            if len(parts) > 1:
+                tokens.append(word.lower())
+    return tokens
+
+
+def split_dom_chunks(html: str, max_chunk_chars: int = None) -> List[Dict[str, Any]]:
+    """
+    把 HTML 切成元素级片段
+    元素序列化后不超过 max_chunk_chars 时作为一个片段，否则拆到子元素；
+    大容器自身的直接文本单独成为一个片段
+    Returns:
+        [{"order": 文档顺序, "element": lxml 元素, "html": 片段HTML, "text_only": 是否只是容器的文本}]
+    """
+    max_chunk_chars = max_chunk_chars or settings.DOM_CHUNK_MAX_CHARS
+    try:
+        root = lxml.html.fromstring(html)
+    except Exception:
+        return []
+
+    chunks: List[Dict[str, Any]] = []
+
+    def add(element, markup: str, text_only: bool = False):
+        chunks.append({"order": len(chunks), "element": element, "html": markup.strip(), "text_only": text_only})
+
+    def walk(element):
+        if not isinstance(element.tag, str) or element.tag in SKIP_TAGS:
+            return
+        markup = lxml.html.tostring(element, encoding="unicode", with_tail=False)
+        is_root = element.tag in ("html", "body")
+        if not is_root and (len(markup) <= max_chunk_chars or len(element) == 0 or element.tag in INTERACTIVE_TAGS):
+            add(element, markup[:max_chunk_chars])
+            return
+        own_text = (element.text or "").strip()
+        if own_text and not is_root:
+            add(element, f"<{element.tag}>{own_text[:max_chunk_chars]}</{element.tag}>", text_only=True)
+        for child in element:
+            walk(child)
+            tail = (child.tail or "").strip()
+            if tail:
+                add(element, tail[:max_chunk_chars], text_only=True)
+
+    walk(root)
+    return chunks
+
+
+def _matches_selector(element, selector: str) -> bool:
+    """匹配 extract_form_selectors 生成的简单选择器（tag#id、tag.class、tag[attr=v]、tag:has-text(t)）"""
+    match = _SELECTOR_RE.match(selector.strip())
+    if not match or not isinstance(element.tag, str):
+        return False
+    if match.group("tag") and element.tag != match.group("tag").lower():
+        return False
+    if match.group("id"):
+        return element.get("id") == match.group("id")
+    if match.group("cls"):
+        return match.group("cls") in (element.get("class") or "").split()
+    if match.group("attr"):
+        return element.get(match.group("attr")) == match.group("value")
+    if match.group("text") is not None:
+        return match.group("text") in (element.text_content() or "")
+    return bool(match.group("tag"))
+
+
+def _own_elements(chunk: Dict[str, Any]):
+    """片段包含的元素（整体片段为元素及其后代，拆分出的文本片段不包含元素）"""
+    if chunk.get("text_only"):
+        return []
+    return chunk["element"].iter()
+
+
+def bm25_scores(query_tokens: List[str], docs: List[List[str]], k1: float = 1.5, b: float = 0.75) -> List[float]:
+    """BM25 打分，返回每个文档（token 列表）与 query 的相关性得分"""
+    n = len(docs)
+    avg_len = sum(len(d) for d in docs) / n if n else 0
+    doc_freq: Dict[str, int] = {}
+    for doc in docs:
+        for token in set(doc):
+            doc_freq[token] = doc_freq.get(token, 0) + 1
+
+    scores = []
+    unique_query = set(query_tokens)
+    for doc in docs:
+        tf: Dict[str, int] = {}
+        for token in doc:
+            if token in unique_query:
+                tf[token] = tf.get(token, 0) + 1
+        score = 0.0
+        for token, freq in tf.items():
+            idf = math.log(1 + (n - doc_freq[token] + 0.5) / (doc_freq[token] + 0.5))
+            score += idf * freq * (k1 + 1) / (freq + k1 * (1 - b + b * len(doc) / (avg_len or 1)))
+        scores.append(score)
+    return scores
+
+
+def distill_dom(
+    html: str,
+    query: str,
+    token_budget: int = None,
+    keep_selectors: Optional[Iterable[str]] = None,
+    max_chunk_chars: int = None
+) -> str:
+    """
+    在 token 预算内挑选与 query 最相关的 DOM 片段
+    Args:
+        html: 清理后的 HTML
+        query: 操作描述（多个操作可以拼接在一起）
+        token_budget: token 预算，默认 settings.DOM_PROMPT_TOKEN_BUDGET
+        keep_selectors: 必须保留的表单控件选择器（extract_form_selectors 的结果）
+        max_chunk_chars: 单个片段的最大字符数
+    Returns:
+        按文档顺序拼接的片段，省略处用注释标出
+    """
+    if not html:
+        return ""
+    token_budget = token_budget or settings.DOM_PROMPT_TOKEN_BUDGET
+    if estimate_tokens(html) <= token_budget:
+        return html
+
+    chunks = split_dom_chunks(html, max_chunk_chars)
+    if not chunks:
+        return html[:token_budget * 2]
+
+    keep_selectors = [s for s in (keep_selectors or []) if s]
+    docs = [tokenize(re.sub(r"[<>=\"'/]", " ", c["html"])) for c in chunks]
+    scores = bm25_scores(tokenize(query), docs)
+
+    def priority(idx: int):
+        chunk = chunks[idx]
+        keep = any(_matches_selector(el, s) for el in _own_elements(chunk) for s in keep_selectors)
+        interactive = chunk["element"].tag in INTERACTIVE_TAGS
+        return (not keep, -scores[idx], not interactive, chunk["order"])
+
+    selected = set()
+    used = 0
+    for idx in sorted(range(len(chunks)), key=priority):
+        cost = estimate_tokens(chunks[idx]["html"]) + 1
+        if used + cost > token_budget:
+            continue
+        selected.add(idx)
+        used += cost
+
+    parts = []
+    previous = -1
+    for idx in sorted(selected):
+        if idx != previous + 1:
+            parts.append(OMITTED_MARKER)
+        parts.append(chunks[idx]["html"])
+        previous = idx
+    if previous != len(chunks) - 1:
+        parts.append(OMITTED_MARKER)
+    return "\n".join(parts)
@@ -0,0 +1,323 @@
+"""
+页面模型：从页面HTML中一次性提取可交互元素清单，作为提示词中的页面表示
+
+每个元素分配一个短编号（e1、e2 ...），记录标签、类型、角色、名称（label/placeholder/
+aria-label/文本）、分类（沿用 extract_form_selectors 的 username_input、login_button 等）、
+最稳定的选择器和可见性。提示词中只放这份清单，生成的代码用 "@e3" 引用元素，
+resolve_element_refs 再把编号替换回选择器。
+
+尽量传入未经 _clean_html 清理的原始HTML：清理会移除 data-testid、aria-*、style 等属性，
+选择器和可见性判断会退化。
+"""
+import json
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+import lxml.html
+
+PAGE_MODEL_HEADER = "<!-- 页面元素清单：[编号] 标签 属性 \"名称\" -> 选择器 -->"
+
+INTERACTIVE_TAGS = {"input", "button", "a", "select", "textarea"}
+INTERACTIVE_ROLES = {
+    "button", "link", "checkbox", "radio", "switch", "tab", "menuitem", "option",
+    "combobox", "textbox", "searchbox", "listbox", "slider", "spinbutton",
+}
+# 非交互但常用于断言的元素（标题、表格、带 data-testid 的元素）
+CONTEXT_TAGS = {"h1", "h2", "h3", "table"}
+SKIP_TAGS = {"head", "script", "style", "noscript", "template", "svg"}
+IMPLICIT_ROLES = {
+    "button": "button", "select": "combobox", "textarea": "textbox",
+}
+INPUT_ROLES = {
+    "checkbox": "checkbox", "radio": "radio", "submit": "button", "button": "button",
+    "reset": "button", "image": "button", "search": "searchbox", "range": "slider", "number": "spinbutton",
+}
+
+_DYNAMIC_ID_RE = re.compile(r"^(el-id-|rc[_-]|__)|\d{4,}")
+_HIDDEN_STYLE_RE = re.compile(r"display\s*:\s*none|visibility\s*:\s*hidden", re.I)
+_REF_RE = re.compile(r"""(["'])@(e\d+)\1""")
+_LINE_RE = re.compile(r"^\[(e\d+)\].* -> (.+)$")
+
+_CAPTCHA_KEYWORDS = ["captcha", "verify_code", "verifycode", "vcode", "yzm", "验证码"]
+
+
+def classify_input_field(elem_id: str, elem_name: str, elem_placeholder: str, input_type: str, elem_class: str) -> Optional[str]:
+    """根据属性分类输入框，返回描述性名称"""
+    # 合并所有文本用于关键词匹配
+    all_text = f"{elem_id} {elem_name} {elem_placeholder} {elem_class}".lower()
+
+    if input_type == 'password' or 'password' in all_text or '密码' in all_text:
+        return 'password_input'
+    if any(k in all_text for k in ['username', 'user_name', 'userid', 'user_id', '用户名', 'loginname', 'login_name', 'account']):
+        return 'username_input'
+    if input_type == 'email' or 'email' in all_text or '邮箱' in all_text:
+        return 'email_input'
+    if any(k in all_text for k in _CAPTCHA_KEYWORDS):
+        return 'captcha_input'
+    if any(k in all_text for k in ['phone', 'mobile', 'tel', '手机', '电话']):
+        return 'phone_input'
+    if input_type == 'search' or 'search' in all_text or '搜索' in all_text:
+        return 'search_input'
+    # 通用名称
+    if elem_name:
+        return f"input_{elem_name}"
+    if elem_id:
+        return f"input_{elem_id}"
+    return None
+
+
+def classify_button(elem_text: str, elem_class: str) -> Optional[str]:
+    """根据文本和 class 分类按钮，返回 login_button / submit_button / register_button，其他返回 None"""
+    text_lower = elem_text.lower()
+    class_lower = elem_class.lower()
+    if any(k in text_lower or k in class_lower for k in ['登录', 'login', 'signin', 'sign in', '登 录']):
+        return 'login_button'
+    if any(k in text_lower or k in class_lower for k in ['提交', 'submit']):
+        return 'submit_button'
+    if any(k in text_lower or k in class_lower for k in ['注册', 'register', 'signup']):
+        return 'register_button'
+    return None
+
+
+def _classify_element(element, tag: str, input_type: str, name: str) -> Optional[str]:
+    """在表单分类的基础上补充复选框、验证码图片的分类"""
+    attrs = f"{element.get('id', '')} {element.get('name', '')} {element.get('class', '')} {name}".lower()
+    if tag == "input" and input_type in ("checkbox", "radio"):
+        if any(k in attrs for k in ["remember", "记住", "自动登录"]):
+            return "remember_checkbox"
+        if any(k in attrs for k in ["agree", "agreement", "同意", "协议"]):
+            return "agreement_checkbox"
+        return None
+    if tag == "input" and input_type not in ("submit", "button", "image", "reset", "file"):
+        return classify_input_field(
+            element.get("id", ""), element.get("name", ""), element.get("placeholder", ""), input_type, element.get("class", "")
+        )
+    if tag == "button" or (tag == "input" and input_type in ("submit", "button")) or element.get("role") == "button":
+        return classify_button(name, element.get("class", ""))
+    if tag == "img" and any(k in attrs or k in (element.get("src") or "").lower() for k in _CAPTCHA_KEYWORDS):
+        return "captcha_image"
+    return None
+
+
+def _text(element, limit: int = 40) -> str:
+    return re.sub(r"\s+", " ", element.text_content() or "").strip()[:limit]
+
+
+def own_hidden(element) -> bool:
+    """元素自身带 hidden 属性、aria-hidden=true 或内联 display:none / visibility:hidden"""
+    if element.get("hidden") is not None or element.get("aria-hidden") == "true":
+        return True
+    style = element.get("style")
+    return bool(style) and bool(_HIDDEN_STYLE_RE.search(style))
+
+
+def _accessible_name(element, tag: str, labels: Dict[str, str], label_ancestor=None) -> str:
+    """元素的可读名称：aria-label > label[for] > 外层 label > placeholder > 文本 > value/title/alt"""
+    if element.get("aria-label"):
+        return element.get("aria-label").strip()
+    elem_id = element.get("id")
+    if elem_id and elem_id in labels:
+        return labels[elem_id]
+    if label_ancestor is not None:
+        return _text(label_ancestor)
+    if element.get("placeholder"):
+        return element.get("placeholder").strip()
+    if tag not in ("input", "select", "textarea", "img", "table"):
+        text = _text(element)
+        if text:
+            return text
+    for attr in ("value", "title", "alt"):
+        if tag == "input" and attr == "value" and (element.get("type") or "").lower() not in ("submit", "button", "reset"):
+            continue
+        if element.get(attr):
+            return element.get(attr).strip()[:40]
+    return ""
+
+
+def _quotable(value: str) -> bool:
+    return bool(value) and "'" not in value and "\n" not in value
+
+
+def _best_selector(element, tag: str, name: str) -> str:
+    """最稳定的选择器（优先级: data-testid > 稳定 id > name > placeholder > aria-label > 文本 > 标签）"""
+    for attr in ("data-testid", "data-test", "data-cy"):
+        value = element.get(attr)
+        if _quotable(value):
+            return f"[{attr}='{value}']"
+    elem_id = element.get("id", "")
+    if elem_id and not _DYNAMIC_ID_RE.search(elem_id) and re.match(r"^[A-Za-z][\w-]*$", elem_id):
+        return f"{tag}#{elem_id}"
+    for attr in ("name", "placeholder", "aria-label"):
+        value = element.get(attr)
+        if _quotable(value):
+            return f"{tag}[{attr}='{value}']"
+    if tag in ("button", "a") or element.get("role"):
+        text = _text(element, 20)
+        if _quotable(text):
+            return f"{tag}:has-text('{text}')"
+    if tag == "input" and _quotable(element.get("type")):
+        return f"input[type='{element.get('type')}']"
+    if tag == "img" and _quotable(element.get("alt")):
+        return f"img[alt='{element.get('alt')}']"
+    classes = (element.get("class") or "").split()
+    if classes and re.match(r"^[A-Za-z][\w-]*$", classes[0]):
+        return f"{tag}.{classes[0]}"
+    return tag
+
+
+def build_page_model(html: str) -> List[Dict[str, Any]]:
+    """
+    一次遍历提取页面元素清单
+    Args:
+        html: 页面HTML（最好是未清理的原始HTML）
+    Returns:
+        [{"id": "e1", "tag", "type", "role", "name", "field", "selector", "visible", "disabled", "href", "context"}]
+        context 为 True 表示标题、表格等非交互元素（用于断言）
+    """
+    if not html:
+        return []
+    try:
+        doc = lxml.html.fromstring(html)
+    except Exception:
+        return []
+    return page_model_from_tree(doc)
+
+
+def page_model_from_tree(doc) -> List[Dict[str, Any]]:
+    """从已解析的文档树提取页面元素清单（只读，不修改树），返回格式同 build_page_model"""
+    labels = {}
+    for label in doc.iter("label"):
+        if label.get("for"):
+            labels[label.get("for")] = _text(label)
+
+    elements: List[Dict[str, Any]] = []
+    # 按文档顺序遍历时父元素先于子元素，隐藏状态和外层 label 从父元素继承，不必逐个回溯祖先
+    inherited: Dict[Any, tuple] = {}
+    for element in doc.iter():
+        tag = element.tag if isinstance(element.tag, str) else ""
+        if not tag or tag in SKIP_TAGS:
+            continue
+        parent_hidden, label_ancestor = inherited.get(element.getparent(), (False, None))
+        hidden = parent_hidden or own_hidden(element)
+        inherited[element] = (hidden, element if tag == "label" else label_ancestor)
+        role = (element.get("role") or "").lower()
+        input_type = (element.get("type") or "text").lower() if tag == "input" else ""
+        if input_type == "hidden":
+            continue
+        is_captcha_img = tag == "img" and _classify_element(element, tag, "", element.get("alt", "")) == "captcha_image"
+        interactive = tag in INTERACTIVE_TAGS or role in INTERACTIVE_ROLES or is_captcha_img
+        if tag == "a" and element.get("href") is None and not role:
+            interactive = False
+        context = not interactive and (tag in CONTEXT_TAGS or element.get("data-testid") is not None)
+        if not interactive and not context:
+            continue
+
+        name = _accessible_name(element, tag, labels, label_ancestor)
+        if tag == "input":
+            implicit_role = INPUT_ROLES.get(input_type, "textbox")
+        elif tag == "a":
+            implicit_role = "link"
+        else:
+            implicit_role = IMPLICIT_ROLES.get(tag, "")
+        elements.append({
+            "id": f"e{len(elements) + 1}",
+            "tag": tag,
+            "type": input_type or None,
+            "role": role or implicit_role or None,
+            "name": name,
+            "field": _classify_element(element, tag, input_type, name),
+            "selector": _best_selector(element, tag, name),
+            "visible": not hidden,
+            "disabled": element.get("disabled") is not None,
+            "href": element.get("href") if tag == "a" else None,
+            "context": context,
+        })
+
+    # 选择器重复时加 nth 区分，保证每个编号对应唯一元素
+    counts: Dict[str, int] = {}
+    for item in elements:
+        counts[item["selector"]] = counts.get(item["selector"], 0) + 1
+    seen: Dict[str, int] = {}
+    for item in elements:
+        selector = item["selector"]
+        if counts[selector] > 1:
+            item["selector"] = f"{selector} >> nth={seen.get(selector, 0)}"
+            seen[selector] = seen.get(selector, 0) + 1
+    return elements
+
+
+def render_element(item: Dict[str, Any]) -> str:
+    parts = [f"[{item['id']}]", item["tag"]]
+    if item.get("type") and item["type"] != "text":
+        parts.append(f"type={item['type']}")
+    if item.get("role") and item["role"] not in (item["tag"], item.get("type"), "textbox", "link") and not item.get("context"):
+        parts.append(f"role={item['role']}")
+    if item.get("name"):
+        parts.append(json.dumps(item["name"], ensure_ascii=False))
+    if item.get("field"):
+        parts.append(f"field={item['field']}")
+    if item.get("href"):
+        parts.append(f"href={item['href'][:60]}")
+    if not item.get("visible", True):
+        parts.append("(hidden)")
+    if item.get("disabled"):
+        parts.append("(disabled)")
+    return " ".join(parts) + f" -> {item['selector']}"
+
+
+def render_page_model(
+    elements: List[Dict[str, Any]],
+    query: str = "",
+    token_budget: int = None,
+    keep_fields: Optional[Iterable[str]] = None
+) -> str:
+    """
+    渲染提示词中的元素清单；超出 token 预算时按与 query 的相关性（BM25）挑选，
+    表单控件（field 在 keep_fields 中，默认所有已分类元素）总是保留
+    """
+    from .dom_distiller import bm25_scores, estimate_tokens, tokenize
+    from ...core.config import settings
+
+    lines = [render_element(item) for item in elements]
+    token_budget = token_budget or settings.DOM_PROMPT_TOKEN_BUDGET
+    if estimate_tokens("\n".join(lines)) > token_budget:
+        keep_fields = set(keep_fields) if keep_fields is not None else None
+        scores = bm25_scores(tokenize(query), [tokenize(line) for line in lines])
+
+        def priority(idx: int):
+            field = elements[idx].get("field")
+            keep = bool(field) and (keep_fields is None or field in keep_fields)
+            return (not keep, -scores[idx], not elements[idx].get("visible", True), idx)
+
+        selected, used = set(), 0
+        for idx in sorted(range(len(lines)), key=priority):
+            cost = estimate_tokens(lines[idx]) + 1
+            if used + cost <= token_budget:
+                selected.add(idx)
+                used += cost
+        omitted = len(lines) - len(selected)
+        lines = [lines[idx] for idx in sorted(selected)]
+        lines.append(f"<!-- 另有 {omitted} 个与当前操作无关的元素已省略 -->")
+    return PAGE_MODEL_HEADER + "\n" + "\n".join(lines)
+
+
+def is_page_model(dom_state: str) -> bool:
+    """提示词中的 DOM 状态是否包含元素清单"""
+    return PAGE_MODEL_HEADER in (dom_state or "")
+
+
+def resolve_element_refs(code: str, dom_state: str) -> str:
+    """把生成代码中的 "@e3" 元素编号替换为清单中对应的选择器，找不到的编号保持原样"""
+    if not code or not is_page_model(dom_state):
+        return code
+    selectors = {}
+    for line in dom_state.splitlines():
+        match = _LINE_RE.match(line.strip())
+        if match:
+            selectors[match.group(1)] = match.group(2)
+
+    def replace(match):
+        selector = selectors.get(match.group(2))
+        return json.dumps(selector, ensure_ascii=False) if selector else match.group(0)
+
+    return _REF_RE.sub(replace, code)
@@ -0,0 +1,550 @@
+"""
+生成代码的离线选择器校验
+
+从生成代码的 AST 中提取定位器（page.fill/click 等的选择器参数、page.locator、get_by_role、
+get_by_placeholder、get_by_text 等，以及它们的链式调用），在页面获取时保存的 DOM 上求值：
+- 严格模式的操作（click、fill、expect(...) 等）匹配到多个元素时，自动加 .first
+  （字符串选择器追加 ">> nth=0"）
+- require_match 时，在片段中第一个会改变页面的操作（click、press、goto 等）之前执行的操作
+  匹配不到任何元素，视为无效代码，由调用方带着错误重新生成
+
+选择器引擎：CSS（lxml.cssselect，支持 Playwright 的 :has-text/:text/:text-is/:visible 扩展，
+扩展只能出现在最后一个复合选择器上）、xpath=、text=、id=、data-testid=、>> 链和 nth=；
+角色按 HTML 隐式角色和显式 role 属性推断。无法在静态 DOM 上判断的定位器（动态参数、frame、
+不支持的引擎等）跳过，不影响结果。
+"""
+import ast
+import json
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import lxml.html
+
+from .page_model import IMPLICIT_ROLES, INPUT_ROLES, own_hidden
+
+# 定位器上的严格模式操作：匹配到多个元素时 Playwright 会报错
+STRICT_ACTIONS = {
+    "click", "dblclick", "tap", "fill", "type", "press", "press_sequentially", "clear",
+    "check", "uncheck", "set_checked", "hover", "focus", "blur", "select_option", "select_text",
+    "set_input_files", "text_content", "inner_text", "inner_html", "input_value", "get_attribute",
+    "is_visible", "is_hidden", "is_enabled", "is_disabled", "is_checked", "is_editable",
+    "wait_for", "scroll_into_view_if_needed", "screenshot", "bounding_box", "dispatch_event",
+    "drag_to", "evaluate", "highlight",
+}
+# page 上以选择器字符串为第一个参数的严格模式操作
+PAGE_SELECTOR_ACTIONS = {
+    "click", "dblclick", "tap", "fill", "type", "press", "check", "uncheck", "set_checked", "hover",
+    "focus", "select_option", "set_input_files", "text_content", "inner_text", "inner_html",
+    "input_value", "get_attribute", "is_visible", "is_hidden", "is_enabled", "is_disabled",
+    "is_checked", "is_editable", "dispatch_event",
+}
+# 会等待元素出现的调用：当前 DOM 中不存在是正常的，只检查多匹配
+WAITING_ACTIONS = {"wait_for", "wait_for_selector"}
+# 会改变页面的操作：之后的定位器不再基于已获取的 DOM
+DOM_CHANGING_ACTIONS = {
+    "click", "dblclick", "tap", "press", "press_sequentially", "check", "uncheck", "set_checked",
+    "select_option", "goto", "reload", "go_back", "go_forward", "dispatch_event", "set_input_files",
+    "drag_to", "evaluate",
+}
+LOCATOR_METHODS = {
+    "locator", "get_by_role", "get_by_text", "get_by_label", "get_by_placeholder",
+    "get_by_test_id", "get_by_title", "get_by_alt_text", "filter", "nth",
+}
+HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+EXTRA_ROLES = {
+    "table": "table", "tr": "row", "td": "cell", "th": "columnheader", "ul": "list", "ol": "list",
+    "li": "listitem", "nav": "navigation", "dialog": "dialog", "option": "option", "main": "main",
+    "form": "form", "article": "article", "aside": "complementary",
+}
+
+_EXTENSION_RE = re.compile(r":(has-text|text-is|text|visible)(?:\((['\"])(.*?)\2\))?")
+_COMBINATOR_RE = re.compile(r"[\s>+~]")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+class _Unknown(Exception):
+    """定位器无法在静态 DOM 上求值"""
+
+
+def _norm(text: str) -> str:
+    return _WHITESPACE_RE.sub(" ", text or "").strip()
+
+
+def _text_matches(actual: str, expected, exact: bool = False) -> bool:
+    """Playwright 的文本匹配：默认忽略大小写的子串匹配，exact 为完全匹配，正则为 search"""
+    actual = _norm(actual)
+    if isinstance(expected, re.Pattern):
+        return bool(expected.search(actual))
+    expected = _norm(expected)
+    return actual == expected if exact else expected.lower() in actual.lower()
+
+
+def _split_chain(selector: str) -> List[str]:
+    """按引号外的 >> 拆分选择器链"""
+    parts, current, quote, i = [], [], None, 0
+    while i < len(selector):
+        ch = selector[i]
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in "'\"":
+            quote = ch
+        elif selector.startswith(">>", i):
+            parts.append("".join(current).strip())
+            current = []
+            i += 2
+            continue
+        current.append(ch)
+        i += 1
+    parts.append("".join(current).strip())
+    return [p for p in parts if p]
+
+
+@lru_cache(maxsize=256)
+def _compile_css(css: str):
+    from lxml.cssselect import CSSSelector
+
+    try:
+        return CSSSelector(css, translator="html")
+    except Exception as e:
+        raise _Unknown(f"不支持的CSS: {css}") from e
+
+
+class DomIndex:
+    """已获取页面的 DOM，解析一次，供多个代码片段的选择器校验复用"""
+
+    def __init__(self, html: str):
+        self.root = None
+        if html:
+            try:
+                self.root = lxml.html.fromstring(html)
+            except Exception:
+                self.root = None
+        self._hidden: Optional[Dict[Any, bool]] = None
+
+    def is_hidden(self, element) -> bool:
+        if self._hidden is None:
+            self._hidden = {}
+            for node in self.root.iter():
+                if isinstance(node.tag, str):
+                    self._hidden[node] = self._hidden.get(node.getparent(), False) or own_hidden(node)
+        return self._hidden.get(element, False)
+
+    def _elements(self, scope: List, include_self: bool) -> List:
+        seen, result = set(), []
+        for element in scope:
+            for node in element.iter():
+                if not isinstance(node.tag, str) or node in seen or (node is element and not include_self):
+                    continue
+                if node.tag in ("head", "script", "style", "noscript", "template"):
+                    continue
+                seen.add(node)
+                result.append(node)
+        return result
+
+    # ---- 选择器字符串 ----
+
+    def select(self, scope: List, selector: str, from_document: bool) -> List:
+        current, include_self = scope, from_document
+        for part in _split_chain(selector):
+            if part.startswith("nth="):
+                try:
+                    index = int(part[4:])
+                except ValueError:
+                    raise _Unknown(part)
+                current = [current[index]] if -len(current) <= index < len(current) else []
+            else:
+                current = self._select_part(current, part, include_self)
+            include_self = False
+        return current
+
+    def _select_part(self, scope: List, part: str, include_self: bool) -> List:
+        if part.startswith(("xpath=", "//", "..")):
+            expression = part[6:] if part.startswith("xpath=") else part
+            found = []
+            for element in scope:
+                try:
+                    found.extend(n for n in element.xpath(expression) if hasattr(n, "tag") and n not in found)
+                except Exception as e:
+                    raise _Unknown(part) from e
+            return found
+        if part.startswith("text="):
+            value = part[5:]
+            exact = len(value) >= 2 and value[0] == value[-1] and value[0] in "'\""
+            return self.by_text(scope, value[1:-1] if exact else value, exact, include_self)
+        if len(part) >= 2 and part[0] == part[-1] and part[0] in "'\"":
+            return self.by_text(scope, part[1:-1], True, include_self)
+        for attr in ("id", "data-testid", "data-test-id", "data-test"):
+            if part.startswith(attr + "="):
+                value = part[len(attr) + 1:].strip("'\"")
+                return [e for e in self._elements(scope, include_self) if e.get(attr) == value]
+        if part.startswith("css="):
+            part = part[4:]
+        elif re.match(r"^[a-z_][\w-]*=", part):
+            raise _Unknown(f"不支持的选择器引擎: {part}")
+        return self._css(scope, part, include_self)
+
+    def _css(self, scope: List, selector: str, include_self: bool) -> List:
+        extensions = []
+        for match in _EXTENSION_RE.finditer(selector):
+            if _COMBINATOR_RE.search(selector[match.end():]) or "," in selector:
+                raise _Unknown(f"扩展伪类不在最后一个复合选择器上: {selector}")
+            extensions.append((match.group(1), match.group(3)))
+        css = _EXTENSION_RE.sub("", selector).strip()
+        if not css or css[-1] in " >+~":
+            css += "*"
+        compiled = _compile_css(css)
+        allowed = set(self._elements(scope, include_self))
+        found = [e for e in compiled(self.root) if e in allowed]
+        for kind, arg in extensions:
+            if kind == "visible":
+                found = [e for e in found if not self.is_hidden(e)]
+            elif arg is None:
+                raise _Unknown(selector)
+            elif kind == "has-text":
+                found = [e for e in found if _text_matches(e.text_content(), arg)]
+            elif kind == "text-is":
+                found = [e for e in found if _text_matches(e.text_content(), arg, exact=True)]
+            else:
+                found = self._smallest([e for e in found if _text_matches(e.text_content(), arg)], arg, False)
+        return found
+
+    # ---- get_by_* ----
+
+    def _smallest(self, candidates: List, text, exact: bool) -> List:
+        """只保留没有子元素同样匹配文本的元素（与 Playwright 文本引擎一致，取最内层元素）"""
+        matched = set(candidates)
+        return [
+            e for e in candidates
+            if not any(child in matched or (isinstance(child.tag, str) and _text_matches(child.text_content(), text, exact))
+                       for child in e)
+        ]
+
+    def by_text(self, scope: List, text, exact: bool, include_self: bool = True) -> List:
+        candidates = [e for e in self._elements(scope, include_self) if _text_matches(e.text_content(), text, exact)]
+        if exact:
+            return candidates
+        return self._smallest(candidates, text, exact)
+
+    def _label_text(self, element) -> str:
+        if element.get("aria-label"):
+            return element.get("aria-label")
+        if element.get("aria-labelledby"):
+            texts = [self.root.get_element_by_id(i, None) for i in element.get("aria-labelledby").split()]
+            return " ".join(t.text_content() for t in texts if t is not None)
+        element_id = element.get("id")
+        if element_id:
+            for label in self.root.iter("label"):
+                if label.get("for") == element_id:
+                    return label.text_content()
+        parent = element.getparent()
+        while parent is not None:
+            if parent.tag == "label":
+                return parent.text_content()
+            parent = parent.getparent()
+        return ""
+
+    def role_of(self, element) -> str:
+        role = (element.get("role") or "").split()
+        if role:
+            return role[0].lower()
+        tag = element.tag
+        if tag == "input":
+            input_type = (element.get("type") or "text").lower()
+            if input_type == "hidden":
+                return ""
+            return INPUT_ROLES.get(input_type, "textbox")
+        if tag == "a":
+            return "link" if element.get("href") is not None else ""
+        if tag in HEADING_TAGS:
+            return "heading"
+        if tag == "img":
+            return "img" if element.get("alt") != "" else "presentation"
+        if tag == "select":
+            return "listbox" if element.get("multiple") is not None or int(element.get("size") or 1) > 1 else "combobox"
+        return IMPLICIT_ROLES.get(tag) or EXTRA_ROLES.get(tag, "")
+
+    def accessible_name(self, element, role: str) -> str:
+        name = self._label_text(element)
+        if name.strip():
+            return name
+        if element.tag == "input":
+            input_type = (element.get("type") or "text").lower()
+            if input_type in ("submit", "button", "reset"):
+                return element.get("value") or ("Submit" if input_type == "submit" else "")
+            if input_type == "image":
+                return element.get("alt") or ""
+            return element.get("title") or element.get("placeholder") or ""
+        if element.tag in ("select", "textarea"):
+            return element.get("title") or element.get("placeholder") or ""
+        if element.tag == "img":
+            return element.get("alt") or element.get("title") or ""
+        return element.text_content() or element.get("title") or ""
+
+    def by_role(self, scope: List, role: str, name=None, exact: bool = False, include_hidden: bool = False) -> List:
+        found = []
+        for element in self._elements(scope, True):
+            if self.role_of(element) != role:
+                continue
+            if not include_hidden and self.is_hidden(element):
+                continue
+            if name is not None and not _text_matches(self.accessible_name(element, role), name, exact):
+                continue
+            found.append(element)
+        return found
+
+    def by_attr_text(self, scope: List, attr: str, text, exact: bool) -> List:
+        return [e for e in self._elements(scope, True) if e.get(attr) is not None and _text_matches(e.get(attr), text, exact)]
+
+    def by_label(self, scope: List, text, exact: bool) -> List:
+        return [
+            e for e in self._elements(scope, True)
+            if e.tag in ("input", "select", "textarea", "button") and _text_matches(self._label_text(e), text, exact)
+            and (e.get("type") or "").lower() != "hidden"
+        ]
+
+
+class _Usage:
+    """代码中一次对定位器的使用"""
+
+    def __init__(self, node, method: str, strict: bool, waiting: bool, order: Tuple[int, int], selector_arg: bool = False):
+        self.node = node  # 定位器表达式（或 page.xxx 的选择器参数）
+        self.selector_arg = selector_arg
+        self.method = method
+        self.strict = strict
+        self.waiting = waiting
+        self.order = order
+
+
+class _Analyzer:
+    def __init__(self, code: str, dom: DomIndex):
+        self.code = code
+        self.dom = dom
+        self.tree = ast.parse(code)
+        self.assignments: Dict[str, List[Tuple[int, ast.AST]]] = {}
+        for node in ast.walk(self.tree):
+            if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+                self.assignments.setdefault(node.targets[0].id, []).append((node.lineno, node.value))
+
+    def _assigned(self, name: str, lineno: int):
+        candidates = [value for line, value in self.assignments.get(name, []) if line <= lineno]
+        return candidates[-1] if candidates else None
+
+    def _value(self, node, lineno: int):
+        """解析常量参数：字符串、数字、布尔、re.compile(...)、常量变量"""
+        if isinstance(node, ast.Constant):
+            return node.value
+        if isinstance(node, ast.Name):
+            value = self._assigned(node.id, lineno)
+            if value is not None and not isinstance(value, ast.Name):
+                return self._value(value, lineno)
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == "compile"
+                and isinstance(node.func.value, ast.Name) and node.func.value.id == "re" and node.args):
+            pattern = self._value(node.args[0], lineno)
+            flags = re.I if any(isinstance(a, ast.Attribute) and a.attr in ("I", "IGNORECASE") for a in node.args[1:]) else 0
+            if isinstance(pattern, str):
+                return re.compile(pattern, flags)
+        raise _Unknown(ast.get_source_segment(self.code, node))
+
+    def _kwargs(self, call: ast.Call, lineno: int) -> Dict[str, Any]:
+        return {kw.arg: self._value(kw.value, lineno) for kw in call.keywords if kw.arg}
+
+    def is_locator(self, node, lineno: int, depth: int = 0) -> bool:
+        if depth > 10:
+            return False
+        if isinstance(node, ast.Name):
+            value = self._assigned(node.id, lineno)
+            return value is not None and self.is_locator(value, lineno, depth + 1)
+        if isinstance(node, ast.Attribute) and node.attr in ("first", "last"):
+            return self.is_locator(node.value, lineno, depth + 1)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr in LOCATOR_METHODS:
+            base = node.func.value
+            return (isinstance(base, ast.Name) and base.id == "page" and node.func.attr not in ("filter", "nth")) \
+                or self.is_locator(base, lineno, depth + 1)
+        return False
+
+    def evaluate(self, node, lineno: int) -> List:
+        """在 DOM 上求值定位器表达式，返回匹配的元素"""
+        if isinstance(node, ast.Name) and node.id == "page":
+            return [self.dom.root]
+        if isinstance(node, ast.Name):
+            return self.evaluate(self._assigned(node.id, lineno), lineno)
+        if isinstance(node, ast.Attribute):
+            found = self.evaluate(node.value, lineno)
+            return found[:1] if node.attr == "first" else found[-1:]
+
+        method = node.func.attr
+        base = node.func.value
+        from_document = isinstance(base, ast.Name) and base.id == "page"
+        scope = self.evaluate(base, lineno)
+        args = [self._value(a, lineno) for a in node.args]
+        kwargs = self._kwargs(node, lineno)
+        exact = bool(kwargs.get("exact"))
+        if method == "nth":
+            index = args[0] if args else kwargs.get("index", 0)
+            return [scope[index]] if -len(scope) <= index < len(scope) else []
+        if method == "filter":
+            if set(kwargs) - {"has_text", "has_not_text"}:
+                raise _Unknown("filter")
+            found = scope
+            if "has_text" in kwargs:
+                found = [e for e in found if _text_matches(e.text_content(), kwargs["has_text"])]
+            if "has_not_text" in kwargs:
+                found = [e for e in found if not _text_matches(e.text_content(), kwargs["has_not_text"])]
+            return found
+        if method == "locator":
+            if set(kwargs) - {"has_text", "has_not_text"}:
+                raise _Unknown("locator(has=...)")
+            found = self.dom.select(scope, args[0], from_document)
+            if "has_text" in kwargs:
+                found = [e for e in found if _text_matches(e.text_content(), kwargs["has_text"])]
+            if "has_not_text" in kwargs:
+                found = [e for e in found if not _text_matches(e.text_content(), kwargs["has_not_text"])]
+            return found
+        if method == "get_by_role":
+            if set(kwargs) - {"name", "exact", "include_hidden"}:
+                raise _Unknown("get_by_role 的状态参数")
+            return self.dom.by_role(scope, args[0], kwargs.get("name"), exact, bool(kwargs.get("include_hidden")))
+        text = args[0] if args else kwargs.get("text", kwargs.get("test_id"))
+        if method == "get_by_text":
+            return self.dom.by_text(scope, text, exact)
+        if method == "get_by_placeholder":
+            return self.dom.by_attr_text(scope, "placeholder", text, exact)
+        if method == "get_by_title":
+            return self.dom.by_attr_text(scope, "title", text, exact)
+        if method == "get_by_alt_text":
+            return self.dom.by_attr_text(scope, "alt", text, exact)
+        if method == "get_by_test_id":
+            return [e for e in self.dom._elements(scope, True) if e.get("data-testid") == text]
+        if method == "get_by_label":
+            return self.dom.by_label(scope, text, exact)
+        raise _Unknown(method)
+
+    def usages(self) -> Tuple[List[_Usage], Optional[Tuple[int, int]]]:
+        """提取所有定位器使用，以及第一个改变页面的操作的位置"""
+        usages = []
+        first_change = None
+        for node in ast.walk(self.tree):
+            if not isinstance(node, ast.Call) or not isinstance(node.func, ast.Attribute):
+                continue
+            method = node.func.attr
+            target = node.func.value
+            order = (node.lineno, node.col_offset)
+            if method in DOM_CHANGING_ACTIONS and (first_change is None or order < first_change):
+                first_change = order
+            if isinstance(target, ast.Name) and target.id == "page":
+                if (method in PAGE_SELECTOR_ACTIONS or method == "wait_for_selector") and node.args:
+                    usages.append(_Usage(node.args[0], method, method != "wait_for_selector",
+                                         method == "wait_for_selector", order, selector_arg=True))
+            elif method in STRICT_ACTIONS and self.is_locator(target, node.lineno):
+                usages.append(_Usage(target, method, True, method in WAITING_ACTIONS, order))
+            elif (method.startswith(("to_", "not_to_")) and isinstance(target, ast.Call)
+                  and isinstance(target.func, ast.Name) and target.func.id == "expect" and target.args
+                  and self.is_locator(target.args[0], node.lineno)):
+                usages.append(_Usage(target.args[0], f"expect().{method}", True, True, order))
+        usages.sort(key=lambda u: u.order)
+        return usages, first_change
+
+
+def _fix_edit(analyzer: _Analyzer, usage: _Usage) -> Optional[Tuple[int, int, int, str]]:
+    """
+    为匹配到多个元素的严格操作生成修改：(行号, 起始字节, 结束字节, 替换文本)
+    定位器表达式后追加 .first，字符串选择器追加 >> nth=0
+    """
+    node = usage.node
+    if isinstance(node, ast.Name):
+        value = analyzer._assigned(node.id, usage.order[0])
+        if value is None:
+            return None
+        node = value
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        if node.lineno != node.end_lineno:
+            return None
+        replacement = json.dumps(node.value + " >> nth=0", ensure_ascii=False)
+        return node.lineno, node.col_offset, node.end_col_offset, replacement
+    if isinstance(node, (ast.Call, ast.Attribute)):
+        return node.end_lineno, node.end_col_offset, node.end_col_offset, ".first"
+    return None
+
+
+def _apply_edits(code: str, edits: List[Tuple[int, int, int, str]]) -> str:
+    """按字节偏移（AST 的列偏移为 UTF-8 字节）从后往前应用修改"""
+    lines = code.splitlines(keepends=True)
+    for lineno, start, end, text in sorted(set(edits), key=lambda e: (e[0], e[1]), reverse=True):
+        raw = lines[lineno - 1].encode("utf-8")
+        lines[lineno - 1] = (raw[:start] + text.encode("utf-8") + raw[end:]).decode("utf-8")
+    return "".join(lines)
+
+
+def changes_page(code: str) -> bool:
+    """代码中是否有会改变页面的操作（之后的代码不再基于已获取的 DOM）"""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return True
+    return any(
+        isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr in DOM_CHANGING_ACTIONS
+        for node in ast.walk(tree)
+    )
+
+
+def validate_selectors(code: str, dom: DomIndex, require_match: bool = False) -> Dict[str, Any]:
+    """
+    校验生成代码中的定位器
+    Args:
+        code: 生成的代码（需已通过语法检查）
+        dom: 已获取页面的 DomIndex
+        require_match: DOM 是否就是代码开始执行时的页面；为 True 时第一个改变页面的操作之前
+                       匹配不到元素的操作视为错误
+    Returns:
+        {"ok": 是否通过, "code": 自动修正后的代码, "errors": [错误], "fixes": [修正说明],
+         "checked": 已校验的定位器数, "skipped": 无法静态判断而跳过的定位器数}
+    """
+    result = {"ok": True, "code": code, "errors": [], "fixes": [], "checked": 0, "skipped": 0}
+    if dom is None or dom.root is None:
+        return result
+    try:
+        analyzer = _Analyzer(code, dom)
+    except SyntaxError:
+        return result
+
+    usages, first_change = analyzer.usages()
+    edits = []
+    fixed_nodes = set()
+    for usage in usages:
+        lineno = usage.order[0]
+        try:
+            node = usage.node
+            if usage.selector_arg:
+                selector = analyzer._value(node, lineno)
+                if not isinstance(selector, str):
+                    raise _Unknown(selector)
+                found = dom.select([dom.root], selector, True)
+            else:
+                found = analyzer.evaluate(node, lineno)
+        except (_Unknown, AttributeError, IndexError, TypeError, ValueError):
+            result["skipped"] += 1
+            continue
+        result["checked"] += 1
+        description = ast.get_source_segment(code, usage.node) or ""
+
+        before_change = first_change is None or usage.order <= first_change
+        if not found and require_match and before_change and not usage.waiting:
+            result["ok"] = False
+            result["errors"].append(f"第 {lineno} 行 {usage.method}: 定位器 {description} 在当前页面中未匹配到任何元素")
+        elif len(found) > 1 and usage.strict and id(usage.node) not in fixed_nodes:
+            edit = _fix_edit(analyzer, usage)
+            if edit:
+                edits.append(edit)
+                fixed_nodes.add(id(usage.node))
+                result["fixes"].append(f"第 {lineno} 行 {usage.method}: 定位器 {description} 匹配到 {len(found)} 个元素，已改为第一个")
+
+    if edits:
+        fixed = _apply_edits(code, edits)
+        try:
+            ast.parse(fixed)
+            result["code"] = fixed
+        except SyntaxError:
+            result["fixes"] = []
+    return result
@@ -6,6 +6,7 @@ import time
 import json
 from ...core.config import settings
 from ...core.llm_logger import llm_logger
+from ...core.tracing import traced
 
 
 class BailianClient:
@@ -46,6 +47,7 @@ class BailianClient:
                 result.append(msg)
         return result
 
+    @traced("llm.generate_text")
     async def generate_text(self, prompt: str, system_prompt: Optional[str] = None) -> str:
         """
         生成文本
@@ -85,9 +87,10 @@ class BailianClient:
             return response.content
         except Exception as e:
             duration_ms = (time.time() - start_time) * 1000
-            llm_logger.log_error(self.llm_model, e)
+            llm_logger.log_error(self.llm_model, e, duration_ms)
             raise
 
+    @traced("llm.generate_actions")
     async def generate_actions(self, user_query: str, target_url: str) -> List[str]:
         """
         将用户查询转换为操作步骤
@@ -152,6 +155,7 @@ class BailianClient:
                 "验证测试已成功完成"
             ]
 
+    @traced("llm.generate_test_name")
     async def generate_test_name(self, user_query: str, actions: List[str]) -> str:
         """
         生成测试用例名称
@@ -175,6 +179,7 @@ class BailianClient:
             test_name = "test_" + test_name[1:]
         return test_name
 
+    @traced("vl.recognize_captcha")
     async def recognize_captcha(self, image_base64: str) -> str:
         """
         识别验证码
@@ -258,10 +263,11 @@ class BailianClient:
             return captcha_text
         except Exception as e:
             duration_ms = (time.time() - start_time) * 1000
-            llm_logger.log_error(self.vl_model, e)
+            llm_logger.log_error(self.vl_model, e, duration_ms)
             print(f"验证码识别错误: {e}")
             return ""
 
+    @traced("vl.generate_text_with_image")
     async def generate_text_with_image(
         self,
         prompt: str,
@@ -342,7 +348,7 @@ class BailianClient:
             return response.choices[0].message.content
         except Exception as e:
             duration_ms = (time.time() - start_time) * 1000
-            llm_logger.log_error(self.vl_model, e)
+            llm_logger.log_error(self.vl_model, e, duration_ms)
             raise
 
 
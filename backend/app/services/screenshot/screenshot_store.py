@@ -0,0 +1,301 @@
+"""
+按内容寻址的步骤截图存储
+
+agent-browser 方案的脚本每一步都截一张全尺寸 PNG（SESSION_STORAGE_PATH/screenshots/<session_id>/step_N.png），
+连续几步的页面经常完全一样，报告列表又只显示 80x60 的缩略图。脚本执行结束后（VL 验证已经用原图做完），
+执行器把步骤截图存入本存储，TestStepResult.screenshot_path 记录存储后的路径：
+
+    screenshots/objects/<哈希前两位>/<哈希>.<webp|jpg|png>   按像素内容的 sha256 去重，按 SCREENSHOT_FORMAT 和
+                                                              SCREENSHOT_QUALITY 重新编码，原图入库后删除
+    screenshots/thumbs/<原图相对路径>.<扩展名>               第一次请求缩略图时生成（宽 SCREENSHOT_THUMB_WIDTH）
+
+- 存储后的文件内容不会再变，/api/screenshots 对其返回长期缓存的 Cache-Control 和以哈希为值的 ETag
+- 后台每 SCREENSHOT_GC_INTERVAL 秒清理一次：删除没有 TestStepResult 引用的截图和原图不存在的缩略图，
+  修改时间在 SCREENSHOT_GC_GRACE 秒以内的文件不删除（执行中的脚本刚写入、报告还没保存）
+"""
+import asyncio
+import hashlib
+import os
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from ...core.config import settings
+
+OBJECTS_DIR = "objects"
+THUMBS_DIR = "thumbs"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+MUTABLE_CACHE_CONTROL = "public, max-age=3600"
+
+_EXTENSIONS = {"webp": ".webp", "jpeg": ".jpg", "png": ".png"}
+_MEDIA_TYPES = {".webp": "image/webp", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png"}
+
+
+class ScreenshotStore:
+    """步骤截图的内容寻址存储、缩略图和后台清理"""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._format: Optional[str] = None
+
+    @property
+    def root(self) -> str:
+        return os.path.join(settings.SESSION_STORAGE_PATH or ".", "screenshots")
+
+    @property
+    def image_format(self) -> str:
+        """编码格式（Pillow 不支持 WebP 时用 JPEG）"""
+        if self._format is None:
+            image_format = (settings.SCREENSHOT_FORMAT or "webp").lower()
+            if image_format == "jpg":
+                image_format = "jpeg"
+            if image_format not in _EXTENSIONS:
+                print(f"[ScreenshotStore] 未知的截图格式 {image_format}，使用 webp")
+                image_format = "webp"
+            if image_format == "webp":
+                from PIL import features
+                if not features.check("webp"):
+                    print("[ScreenshotStore] Pillow 不支持 WebP，使用 JPEG")
+                    image_format = "jpeg"
+            self._format = image_format
+        return self._format
+
+    @staticmethod
+    def media_type(path: str) -> str:
+        return _MEDIA_TYPES.get(os.path.splitext(path)[1].lower(), "application/octet-stream")
+
+    def is_stored(self, path: str) -> bool:
+        """是否为存储后的截图（内容不会再变）"""
+        objects_dir = os.path.realpath(os.path.join(self.root, OBJECTS_DIR))
+        return os.path.realpath(path).startswith(objects_dir + os.sep)
+
+    # ---- 入库 ----
+
+    def _encode(self, image, target: str) -> None:
+        """按配置的格式编码写入（先写临时文件再替换，并发入库同一张图时不会读到半个文件）"""
+        image_format = self.image_format
+        if image_format == "jpeg" and image.mode != "RGB":
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        options: Dict[str, Any] = {"optimize": True}
+        if image_format == "webp":
+            options = {"quality": settings.SCREENSHOT_QUALITY, "method": 4}
+        elif image_format == "jpeg":
+            options["quality"] = settings.SCREENSHOT_QUALITY
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temp_path = f"{target}.{os.getpid()}.tmp"
+        image.save(temp_path, format=image_format.upper(), **options)
+        os.replace(temp_path, target)
+
+    def _remove_source(self, path: str) -> None:
+        """删除存储目录中的原图，目录空了一并删除（存储目录之外的文件不动）"""
+        real_root = os.path.realpath(self.root)
+        real_path = os.path.realpath(path)
+        if not real_path.startswith(real_root + os.sep) or self.is_stored(path):
+            return
+        try:
+            os.unlink(path)
+            directory = os.path.dirname(real_path)
+            if directory != real_root and not os.listdir(directory):
+                os.rmdir(directory)
+        except OSError:
+            pass
+
+    def ingest(self, path: str) -> Optional[Dict[str, Any]]:
+        """
+        截图入库
+        Returns:
+            {"path": 存储后的路径, "duplicate": 是否已有相同内容, "original_bytes", "stored_bytes"}，
+            文件不存在或不是图片时返回 None（保留原路径）
+        """
+        if not path or not os.path.isfile(path) or self.is_stored(path):
+            return None
+        from PIL import Image
+
+        try:
+            original_bytes = os.path.getsize(path)
+            with Image.open(path) as image:
+                image.load()
+                # 按像素内容计算哈希：同一页面的截图编码不同也能去重
+                digest = hashlib.sha256(
+                    f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode("ascii") + image.tobytes()
+                ).hexdigest()
+                target = os.path.join(self.root, OBJECTS_DIR, digest[:2], digest + _EXTENSIONS[self.image_format])
+                duplicate = os.path.exists(target)
+                if duplicate:
+                    # 刷新修改时间，清理时按最近一次引用计算保留期
+                    os.utime(target)
+                else:
+                    self._encode(image, target)
+        except Exception as e:
+            print(f"[ScreenshotStore] 截图入库失败 {path}: {e}")
+            return None
+        self._remove_source(path)
+        return {
+            "path": target,
+            "duplicate": duplicate,
+            "original_bytes": original_bytes,
+            "stored_bytes": os.path.getsize(target),
+        }
+
+    def ingest_step_results(self, step_results: List[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        把步骤结果中的截图入库，并把 output_data.screenshot_path 改为存储后的路径
+        Returns:
+            {"screenshots", "duplicates", "original_bytes", "stored_bytes"}
+        """
+        summary = {"screenshots": 0, "duplicates": 0, "original_bytes": 0, "stored_bytes": 0}
+        stored: Dict[str, Dict[str, Any]] = {}
+        for step in step_results:
+            output_data = step.get("output_data")
+            if step.get("event") != "step_end" or not isinstance(output_data, dict):
+                continue
+            path = output_data.get("screenshot_path")
+            if not path:
+                continue
+            if path not in stored:
+                result = self.ingest(path)
+                if result is None:
+                    continue
+                stored[path] = result
+                summary["screenshots"] += 1
+                summary["duplicates"] += int(result["duplicate"])
+                summary["original_bytes"] += result["original_bytes"]
+                summary["stored_bytes"] += 0 if result["duplicate"] else result["stored_bytes"]
+            output_data["screenshot_path"] = stored[path]["path"]
+        if summary["screenshots"]:
+            print(f"   [截图存储] 入库 {summary['screenshots']} 张（重复 {summary['duplicates']} 张），"
+                  f"{summary['original_bytes']} 字节 -> 新增 {summary['stored_bytes']} 字节")
+        return summary
+
+    # ---- 缩略图 ----
+
+    def thumbnail(self, path: str) -> str:
+        """返回截图的缩略图路径，第一次请求时生成（生成失败时返回原图）"""
+        relative = os.path.relpath(os.path.realpath(path), os.path.realpath(self.root))
+        stem = os.path.splitext(relative)[0]
+        thumb_path = os.path.join(self.root, THUMBS_DIR, stem + _EXTENSIONS[self.image_format])
+        if os.path.exists(thumb_path) and os.path.getmtime(thumb_path) >= os.path.getmtime(path):
+            return thumb_path
+        from PIL import Image
+
+        try:
+            with Image.open(path) as image:
+                image.load()
+                width = settings.SCREENSHOT_THUMB_WIDTH
+                if image.width > width:
+                    image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+                self._encode(image, thumb_path)
+        except Exception as e:
+            print(f"[ScreenshotStore] 生成缩略图失败 {path}: {e}")
+            return path
+        return thumb_path
+
+    # ---- 缓存头 ----
+
+    def cache_headers(self, path: str) -> Dict[str, str]:
+        """
+        响应的 ETag 和 Cache-Control
+        存储后的截图和它们的缩略图内容不变，ETag 为内容哈希，允许长期缓存；
+        旧的原图按修改时间和大小生成弱 ETag，缓存一小时
+        """
+        stem = os.path.splitext(os.path.basename(path))[0]
+        thumbs_dir = os.path.realpath(os.path.join(self.root, THUMBS_DIR, OBJECTS_DIR))
+        immutable = self.is_stored(path) or os.path.realpath(path).startswith(thumbs_dir + os.sep)
+        if immutable:
+            thumb = os.path.realpath(path).startswith(thumbs_dir + os.sep)
+            return {"ETag": f'"{stem}{"-thumb" if thumb else ""}"', "Cache-Control": IMMUTABLE_CACHE_CONTROL}
+        stat = os.stat(path)
+        return {"ETag": f'W/"{int(stat.st_mtime)}-{stat.st_size}"', "Cache-Control": MUTABLE_CACHE_CONTROL}
+
+    # ---- 清理 ----
+
+    def collect(self, referenced: Set[str]) -> Dict[str, int]:
+        """
+        删除没有被引用的截图（存储后的截图和旧的原图）和原图不存在的缩略图
+        Args:
+            referenced: TestStepResult.screenshot_path 中的路径
+        Returns:
+            {"removed": 删除的文件数, "freed_bytes": 释放的字节数}
+        """
+        root = os.path.realpath(self.root)
+        if not os.path.isdir(root):
+            return {"removed": 0, "freed_bytes": 0}
+        referenced_real = {os.path.realpath(path) for path in referenced if path}
+        thumbs_dir = os.path.join(root, THUMBS_DIR)
+        cutoff = time.time() - settings.SCREENSHOT_GC_GRACE
+        removed = 0
+        freed_bytes = 0
+        for directory, _, files in os.walk(root, topdown=False):
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if stat.st_mtime > cutoff:
+                    continue
+                if directory == thumbs_dir or directory.startswith(thumbs_dir + os.sep):
+                    source_stem = os.path.splitext(os.path.relpath(path, thumbs_dir))[0]
+                    keep = any(os.path.exists(os.path.join(root, source_stem + ext)) for ext in _MEDIA_TYPES)
+                else:
+                    keep = path in referenced_real
+                if keep:
+                    continue
+                try:
+                    os.unlink(path)
+                    removed += 1
+                    freed_bytes += stat.st_size
+                except OSError:
+                    pass
+            if directory != root and directory != thumbs_dir:
+                try:
+                    os.rmdir(directory)  # 只删除空目录
+                except OSError:
+                    pass
+        return {"removed": removed, "freed_bytes": freed_bytes}
+
+    async def collect_garbage(self) -> Dict[str, int]:
+        """按数据库中的引用清理截图"""
+        from sqlalchemy import select
+
+        from ...core.database import async_session_maker
+        from ...models.test_case import TestStepResult
+
+        async with async_session_maker() as db:
+            result = await db.execute(
+                select(TestStepResult.screenshot_path).where(TestStepResult.screenshot_path.isnot(None)).distinct()
+            )
+            referenced = set(result.scalars().all())
+        summary = await asyncio.to_thread(self.collect, referenced)
+        if summary["removed"]:
+            print(f"   [截图存储] 清理 {summary['removed']} 个没有引用的文件，释放 {summary['freed_bytes']} 字节")
+        return summary
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(settings.SCREENSHOT_GC_INTERVAL)
+            try:
+                await self.collect_garbage()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"   ⚠️ [截图存储] 后台清理失败: {e}")
+
+    def start(self) -> None:
+        """启动后台清理（应用启动时调用）"""
+        if settings.SCREENSHOT_GC_INTERVAL > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# 创建全局实例
+screenshot_store = ScreenshotStore()
@@ -1,6 +1,5 @@
 from typing import Dict, Any, Optional
 from playwright.async_api import Page, BrowserContext
-import json
 from datetime import datetime, timedelta
 
 
@@ -10,7 +9,7 @@ class SessionManager:
     @staticmethod
     async def save_session(page: Page, name: str, description: str = "", save_all: bool = True) -> Dict[str, Any]:
         """
-        保存当前页面的会话状态
+        保存当前页面的会话状态（基于 storage_state，见 app/utils/storage_state.py）
         Args:
             page: Playwright 页面对象
             name: 会话名称
@@ -19,8 +18,8 @@ class SessionManager:
         Returns:
             会话数据字典
         """
-        context = page.context
-        
+        from app.utils.storage_state import capture_state, url_origin
+
         session_data = {
             "name": name,
             "description": description,
@@ -30,69 +29,80 @@ class SessionManager:
             "local_storage": None,
             "session_storage": None
         }
-        
-        # 保存 cookies
-        if save_all:
-            cookies = await context.cookies()
-            session_data["cookies"] = cookies
-        
-        # 保存 localStorage
-        if save_all:
-            try:
-                local_storage = await page.evaluate("() => { return JSON.stringify(localStorage); }")
-                session_data["local_storage"] = json.loads(local_storage) if local_storage else {}
-            except Exception as e:
-                print(f"保存 localStorage 失败: {e}")
-                session_data["local_storage"] = {}
-        
-        # 保存 sessionStorage
+
         if save_all:
-            try:
-                session_storage = await page.evaluate("() => { return JSON.stringify(sessionStorage); }")
-                session_data["session_storage"] = json.loads(session_storage) if session_storage else {}
-            except Exception as e:
-                print(f"保存 sessionStorage 失败: {e}")
-                session_data["session_storage"] = {}
-        
+            # 一次 storage_state 调用得到 cookies 和 localStorage，只保留当前页面所在源的 storage
+            state = await capture_state(page)
+            origin = url_origin(page.url)
+            session_data["cookies"] = state["storage_state"].get("cookies", [])
+            session_data["local_storage"] = next(
+                ({e["name"]: e["value"] for e in item.get("localStorage", [])}
+                 for item in state["storage_state"].get("origins", []) if item.get("origin") == origin),
+                {}
+            )
+            session_data["session_storage"] = state["session_storage"].get(origin, {})
+
         return session_data
-    
+
+    @staticmethod
+    def to_storage_state(session_data: Dict[str, Any]) -> Dict[str, Any]:
+        """把会话数据转换为登录状态（见 app/utils/storage_state.py），localStorage 和 sessionStorage 归属到会话 URL 所在的源"""
+        from app.utils.storage_state import STATE_VERSION, url_origin
+
+        origin = url_origin(session_data.get("url"))
+        local_storage = session_data.get("local_storage") or {}
+        session_storage = session_data.get("session_storage") or {}
+        return {
+            "version": STATE_VERSION,
+            "saved_at": session_data.get("created_at"),
+            "url": session_data.get("url"),
+            "storage_state": {
+                "cookies": session_data.get("cookies") or [],
+                "origins": [{
+                    "origin": origin,
+                    "localStorage": [{"name": k, "value": str(v)} for k, v in local_storage.items()],
+                }] if origin and local_storage else [],
+            },
+            "session_storage": {origin: session_storage} if origin and session_storage else {},
+        }
+
+    @staticmethod
+    async def new_page(browser, session_data: Dict[str, Any], **kwargs) -> Page:
+        """
+        用会话创建新上下文和页面：storage_state 作为创建上下文的参数，sessionStorage 由初始化脚本写入，
+        打开页面时已是登录后的状态，不需要刷新
+        """
+        from app.utils.storage_state import restore_script
+
+        state = SessionManager.to_storage_state(session_data)
+        page = await browser.new_page(storage_state=state["storage_state"], **kwargs)
+        script = restore_script(state)
+        if script:
+            await page.context.add_init_script(script)
+        return page
+
     @staticmethod
     async def restore_session(page: Page, session_data: Dict[str, Any]) -> bool:
         """
-        恢复会话状态到页面
+        恢复会话状态到已创建的页面（新建页面时优先使用 new_page）
+        在页面打开任何地址之前调用时下一次导航即生效；已经打开页面时刷新一次使状态生效
         Args:
             page: Playwright 页面对象
             session_data: 会话数据
         Returns:
             是否成功
         """
+        from app.utils.storage_state import apply_saved_state
+
         try:
-            context = page.context
-            
-            # 恢复 cookies
-            if session_data.get("cookies"):
-                await context.add_cookies(session_data["cookies"])
-            
-            # 恢复 localStorage
-            if session_data.get("local_storage"):
-                local_storage_data = session_data["local_storage"]
-                if local_storage_data:
-                    await page.evaluate(f"(data) => {{ localStorage.clear(); Object.entries(data).forEach(([k, v]) => localStorage.setItem(k, v)); }}", local_storage_data)
-            
-            # 恢复 sessionStorage
-            if session_data.get("session_storage"):
-                session_storage_data = session_data["session_storage"]
-                if session_storage_data:
-                    await page.evaluate(f"(data) => {{ sessionStorage.clear(); Object.entries(data).forEach(([k, v]) => sessionStorage.setItem(k, v)); }}", session_storage_data)
-            
-            # 刷新页面以应用 cookies
-            await page.reload(wait_until="domcontentloaded")
-            
+            await apply_saved_state(page.context, SessionManager.to_storage_state(session_data))
+            if page.url and page.url != "about:blank":
+                await page.reload(wait_until="domcontentloaded")
             return True
         except Exception as e:
             print(f"恢复会话失败: {e}")
             return False
-    
+
     @staticmethod
     async def clear_session(page: Page) -> None:
         """
@@ -0,0 +1,422 @@
+"""
+已登录会话池
+
+场景执行时登录步骤往往比用例本身还慢（输入账号密码、识别验证码），而保存的会话文件
+（saved_cookies.json 等）没有人检查是否还有效，过期后用例执行到一半才被登录页拦下。
+
+会话池在 TestSession 表中为每个登录前置步骤（见 login_prefix，按登录前置步骤的指纹区分，
+同一目标地址用不同账号登录是不同的前置步骤）保持 SESSION_POOL_SIZE 个已登录会话：
+- 会话记录的 name 为 "会话池:<登录前置步骤指纹>"，target_url 为登录后的页面，
+  login_scenario_id 为提供登录步骤的场景
+- 场景执行时先从池中租用会话，用例直接从登录后的页面开始；池中没有可用会话时执行登录前置步骤，
+  登录后的状态再放回池中
+- 后台定期检查：先看 cookie / JWT 的过期时间，再用一次不启动浏览器的 HTTP 请求确认没有被重定向到登录页；
+  即将过期或已失效的会话用场景的登录步骤重新登录
+- 超过 SESSION_POOL_IDLE_TIMEOUT 没有被租用的登录前置步骤不再维护，池中的会话被删除
+"""
+import asyncio
+import base64
+import json
+import os
+import re
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+from sqlalchemy import delete, select, update
+
+from ...core.config import settings
+from ...core.database import async_session_maker
+from ...models.test_session import TestSession
+from ..executor.login_prefix import LOGIN_PATH_RE
+from ...utils.storage_state import STATE_VERSION, read_state, url_origin, write_state
+
+POOL_NAME_PREFIX = "会话池:"
+POOL_DESCRIPTION = "会话池自动维护的登录会话"
+
+_AUTH_NAME_RE = re.compile(r"sess|token|auth|jwt|sid|login|user", re.IGNORECASE)
+_JWT_RE = re.compile(r"eyJ[\w-]+\.eyJ[\w-]+\.[\w-]+")
+_MAX_REDIRECTS = 5
+
+
+def _temp_dir() -> str:
+    temp_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'temp')
+    os.makedirs(temp_dir, exist_ok=True)
+    return temp_dir
+
+
+def _jwt_expiry(value: str) -> Optional[float]:
+    """读取 JWT 的 exp（不校验签名，只用于判断何时需要刷新）"""
+    match = _JWT_RE.search(value or "")
+    if not match:
+        return None
+    payload = match.group(0).split(".")[1]
+    try:
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    except (ValueError, json.JSONDecodeError):
+        return None
+    exp = claims.get("exp") if isinstance(claims, dict) else None
+    return float(exp) if isinstance(exp, (int, float)) else None
+
+
+def estimate_expiry(cookies: List[Dict[str, Any]], storage: Dict[str, Any], now: Optional[float] = None) -> datetime:
+    """
+    估计会话的过期时间（UTC）
+    取登录相关 cookie 的过期时间和 cookie / localStorage 中 JWT 的 exp 中最早的一个，
+    都没有（只有会话 cookie）时按 SESSION_POOL_MAX_AGE 计算
+    """
+    now = time.time() if now is None else now
+    candidates = []
+    for cookie in cookies or []:
+        expires = cookie.get("expires")
+        if _AUTH_NAME_RE.search(cookie.get("name", "")) and isinstance(expires, (int, float)) and expires > 0:
+            candidates.append(float(expires))
+        exp = _jwt_expiry(str(cookie.get("value", "")))
+        if exp:
+            candidates.append(exp)
+    for value in (storage or {}).values():
+        exp = _jwt_expiry(str(value))
+        if exp:
+            candidates.append(exp)
+    expiry = min(candidates) if candidates else now + settings.SESSION_POOL_MAX_AGE
+    return datetime.utcfromtimestamp(min(expiry, now + settings.SESSION_POOL_MAX_AGE))
+
+
+def read_storage_state(state_path: str, url: str) -> Dict[str, Any]:
+    """读取登录状态文件（见 app/utils/storage_state.py）：cookies 和目标页面所在源的 localStorage、sessionStorage"""
+    state = read_state(state_path, url)
+    if state is None:
+        raise ValueError(f"登录状态文件不存在或版本不兼容: {state_path}")
+    origin = url_origin(url)
+    local_storage = {}
+    for item in state.get("storage_state", {}).get("origins", []):
+        if item.get("origin") == origin:
+            local_storage = {entry["name"]: entry["value"] for entry in item.get("localStorage", [])}
+    session_storage = (state.get("session_storage") or {}).get(origin) or {}
+    return {
+        "cookies": state.get("storage_state", {}).get("cookies", []),
+        "local_storage": local_storage,
+        "session_storage": session_storage,
+    }
+
+
+def write_storage_state(session: TestSession) -> str:
+    """把会话写成登录状态文件（见 app/utils/storage_state.py），返回文件路径（包含凭据，用完由调用方删除）"""
+    fd, state_path = tempfile.mkstemp(prefix="pool_state_", suffix=".json", dir=_temp_dir())
+    os.close(fd)
+    origin = url_origin(session.target_url)
+    origins = []
+    if session.local_storage and origin:
+        origins.append({
+            "origin": origin,
+            "localStorage": [{"name": k, "value": str(v)} for k, v in session.local_storage.items()],
+        })
+    write_state(state_path, {
+        "version": STATE_VERSION,
+        "saved_at": None,
+        "url": session.target_url,
+        "storage_state": {"cookies": session.cookies or [], "origins": origins},
+        "session_storage": {origin: session.session_storage} if session.session_storage and origin else {},
+    })
+    return state_path
+
+
+def _unlink(path: Optional[str]) -> None:
+    if path:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+class SessionPool:
+    """按登录前置步骤指纹维护的已登录会话池"""
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._leased: set = set()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return settings.SESSION_POOL_SIZE > 0
+
+    @staticmethod
+    def _expiring(session: TestSession) -> bool:
+        margin = timedelta(seconds=settings.SESSION_POOL_REFRESH_MARGIN)
+        return session.expires_at is None or session.expires_at <= datetime.utcnow() + margin
+
+    async def lease(self, login_key: str) -> Optional[Dict[str, Any]]:
+        """
+        租用一个有效的会话
+        Returns:
+            {"session_id", "state_path": storage_state 文件, "url": 登录后的页面, "login_key"}，没有可用会话时返回 None
+        """
+        if not self.enabled:
+            return None
+        async with self._lock:
+            async with async_session_maker() as db:
+                result = await db.execute(
+                    select(TestSession)
+                    .where(TestSession.name == POOL_NAME_PREFIX + login_key)
+                    .where(TestSession.is_active == True)  # noqa: E712
+                    .order_by(TestSession.last_used_at)
+                )
+                session = next(
+                    (s for s in result.scalars().all() if s.id not in self._leased and not self._expiring(s)),
+                    None
+                )
+                if session is None:
+                    return None
+                session.last_used_at = datetime.utcnow()
+                await db.commit()
+                self._leased.add(session.id)
+                lease = {
+                    "session_id": session.id,
+                    "state_path": write_storage_state(session),
+                    "url": session.target_url,
+                    "login_key": login_key,
+                }
+        print(f"   [会话池] 租用会话 #{lease['session_id']}，从 {lease['url']} 开始")
+        return lease
+
+    async def release(self, lease: Dict[str, Any], valid: bool = True) -> None:
+        """归还会话；使用该会话的用例被登录页拦下时（valid=False）标记为失效，由后台重新登录"""
+        _unlink(lease.get("state_path"))
+        self._leased.discard(lease["session_id"])
+        if valid:
+            return
+        async with async_session_maker() as db:
+            session = await db.get(TestSession, lease["session_id"])
+            if session is not None:
+                session.is_active = False
+                await db.commit()
+        print(f"   [会话池] 会话 #{lease['session_id']} 可能已失效，等待重新登录")
+
+    async def add(self, login_key: str, state_path: str, url: str, scenario_id: Optional[int] = None) -> Optional[int]:
+        """把执行登录前置步骤得到的状态放入池中（池已满时不放入），返回会话ID"""
+        if not self.enabled:
+            return None
+        try:
+            state = read_storage_state(state_path, url)
+        except (OSError, ValueError) as e:
+            print(f"   ⚠️ [会话池] 读取登录状态失败: {e}")
+            return None
+        async with async_session_maker() as db:
+            result = await db.execute(
+                select(TestSession)
+                .where(TestSession.name == POOL_NAME_PREFIX + login_key)
+                .where(TestSession.is_active == True)  # noqa: E712
+            )
+            if len(result.scalars().all()) >= settings.SESSION_POOL_SIZE:
+                return None
+            session = TestSession(
+                name=POOL_NAME_PREFIX + login_key,
+                description=POOL_DESCRIPTION,
+                target_url=url,
+                login_scenario_id=scenario_id,
+                is_active=True,
+                last_used_at=datetime.utcnow(),
+            )
+            self._apply_state(session, state, url)
+            db.add(session)
+            await db.commit()
+            print(f"   [会话池] 新增会话 #{session.id}，预计 {session.expires_at:%Y-%m-%d %H:%M:%S} (UTC) 过期")
+            return session.id
+
+    @staticmethod
+    def _apply_state(session: TestSession, state: Dict[str, Any], url: str) -> None:
+        session.cookies = state["cookies"]
+        session.local_storage = state["local_storage"]
+        session.session_storage = state.get("session_storage") or {}
+        session.target_url = url
+        session.is_active = True
+        session.expires_at = estimate_expiry(
+            state["cookies"], {**state["local_storage"], **(state.get("session_storage") or {})}
+        )
+
+    async def probe(self, session: TestSession) -> bool:
+        """
+        低成本检查会话是否有效：未到过期时间，且带 cookie 请求登录后的页面没有返回 401/403、
+        没有被重定向到登录页或其它源（如单点登录）
+        cookie 按记录的域名和路径放入 cookie jar，只跟随同源的重定向
+        （网络错误时无法判断，视为有效，由执行结果决定）
+        """
+        if self._expiring(session):
+            return False
+        import httpx
+
+        host = urlparse(session.target_url).hostname or ""
+        jar = httpx.Cookies()
+        for cookie in session.cookies or []:
+            if cookie.get("name"):
+                jar.set(cookie["name"], str(cookie.get("value", "")),
+                        domain=cookie.get("domain") or host, path=cookie.get("path") or "/")
+        origin = url_origin(session.target_url)
+        url = session.target_url
+        try:
+            async with httpx.AsyncClient(cookies=jar, follow_redirects=False, timeout=10) as client:
+                for _ in range(_MAX_REDIRECTS):
+                    response = await client.get(url)
+                    if not response.is_redirect:
+                        break
+                    url = str(response.url.join(response.headers.get("location", "")))
+                    if url_origin(url) != origin:
+                        return False
+                else:
+                    return False
+        except httpx.HTTPError:
+            return True
+        if response.status_code in (401, 403):
+            return False
+        start_path = urlparse(session.target_url).path
+        final_path = urlparse(url).path
+        return not (final_path != start_path and LOGIN_PATH_RE.search(final_path))
+
+    async def _login(self, login_key: str, scenario_id: Optional[int]) -> Optional[Dict[str, Any]]:
+        """用场景中登录前置步骤指纹相同的用例脚本重新登录，返回 {"state", "url"}"""
+        from ...models.test_case import TestCase
+        from ..executor.login_prefix import build_login_script, parse_state_event
+        from ..executor.test_executor import test_executor
+
+        if scenario_id is None:
+            return None
+        async with async_session_maker() as db:
+            result = await db.execute(select(TestCase.script).where(TestCase.scenario_id == scenario_id))
+            scripts = [s for s in result.scalars().all() if s and s.strip()]
+
+        fd, state_path = tempfile.mkstemp(prefix="pool_login_", suffix=".json", dir=_temp_dir())
+        os.close(fd)
+        try:
+            login = next(
+                (login for login in (build_login_script(s, state_path) for s in scripts)
+                 if login and login["login_key"] == login_key),
+                None
+            )
+            if login is None:
+                print(f"   ⚠️ [会话池] 场景 #{scenario_id} 中没有找到对应的登录步骤")
+                return None
+            execution = await test_executor.execute_saved_script(login["script"])
+            url = parse_state_event(execution.get("execution_output", ""))
+            if execution.get("status") != "success" or not url:
+                print(f"   ⚠️ [会话池] 重新登录失败: {execution.get('error')}")
+                return None
+            return {"state": read_storage_state(state_path, url), "url": url}
+        except (OSError, ValueError) as e:
+            print(f"   ⚠️ [会话池] 读取登录状态失败: {e}")
+            return None
+        finally:
+            _unlink(state_path)
+
+    async def maintain(self) -> None:
+        """
+        检查池中的会话：超过 SESSION_POOL_IDLE_TIMEOUT 没有被租用的登录前置步骤删除其会话，
+        其余的失效或即将过期的重新登录，不足 SESSION_POOL_SIZE 个的补足
+        （每次读写单独打开数据库会话，重新登录和 HTTP 检查期间不占用数据库连接）
+        """
+        async with async_session_maker() as db:
+            result = await db.execute(
+                select(TestSession).where(TestSession.name.like(POOL_NAME_PREFIX + "%")).order_by(TestSession.id)
+            )
+            sessions = result.scalars().all()
+        by_key: Dict[str, List[TestSession]] = {}
+        for session in sessions:
+            by_key.setdefault(session.name[len(POOL_NAME_PREFIX):], []).append(session)
+
+        idle_before = datetime.utcnow() - timedelta(seconds=settings.SESSION_POOL_IDLE_TIMEOUT)
+        for login_key, group in by_key.items():
+            last_used = max(s.last_used_at or s.created_at or datetime.min for s in group)
+            if last_used < idle_before and not any(s.id in self._leased for s in group):
+                await self._delete([s.id for s in group])
+                print(f"   [会话池] 登录前置步骤 {login_key} 空闲超过 {settings.SESSION_POOL_IDLE_TIMEOUT} 秒，删除 {len(group)} 个会话")
+                continue
+
+            scenario_id = next((s.login_scenario_id for s in group if s.login_scenario_id), None)
+            valid = 0
+            stale = []
+            for session in group:
+                if session.id in self._leased:
+                    if session.is_active:
+                        valid += 1
+                elif session.is_active and await self.probe(session):
+                    valid += 1
+                else:
+                    stale.append(session.id)
+            await self._deactivate(stale)
+
+            # 优先复用失效的记录，再新建记录补足；登录失败时本轮不再重试该前置步骤
+            while valid < settings.SESSION_POOL_SIZE:
+                login = await self._login(login_key, scenario_id)
+                if login is None:
+                    break
+                session_id = await self._store_login(
+                    login_key, stale.pop(0) if stale else None, login, scenario_id, last_used
+                )
+                valid += 1
+                print(f"   [会话池] 会话 #{session_id} 已重新登录")
+
+            # 会话已补足时多余的失效记录不再保留；登录失败时保留，下一轮继续重试
+            if valid >= settings.SESSION_POOL_SIZE and stale:
+                await self._delete(stale)
+
+    async def _deactivate(self, session_ids: List[int]) -> None:
+        if not session_ids:
+            return
+        async with async_session_maker() as db:
+            await db.execute(update(TestSession).where(TestSession.id.in_(session_ids)).values(is_active=False))
+            await db.commit()
+
+    async def _delete(self, session_ids: List[int]) -> None:
+        if not session_ids:
+            return
+        async with async_session_maker() as db:
+            await db.execute(delete(TestSession).where(TestSession.id.in_(session_ids)))
+            await db.commit()
+
+    async def _store_login(self, login_key: str, session_id: Optional[int], login: Dict[str, Any],
+                           scenario_id: Optional[int], last_used: datetime) -> int:
+        """把重新登录得到的状态写入失效的记录（已被删除时新建），返回会话ID"""
+        async with async_session_maker() as db:
+            session = await db.get(TestSession, session_id) if session_id is not None else None
+            if session is None:
+                # 新建的记录沿用该前置步骤最后一次被租用的时间，后台补足会话不算作使用
+                session = TestSession(
+                    name=POOL_NAME_PREFIX + login_key,
+                    description=POOL_DESCRIPTION,
+                    login_scenario_id=scenario_id,
+                    last_used_at=last_used,
+                )
+                db.add(session)
+            self._apply_state(session, login["state"], login["url"])
+            await db.commit()
+            return session.id
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(settings.SESSION_POOL_PROBE_INTERVAL)
+            try:
+                await self.maintain()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"   ⚠️ [会话池] 后台检查失败: {e}")
+
+    def start(self) -> None:
+        """启动后台检查（应用启动时调用）"""
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# 创建全局实例
+session_pool = SessionPool()
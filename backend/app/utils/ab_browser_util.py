@@ -3,6 +3,7 @@ Agent-Browser CLI 工具类（同步版本）
 供生成的测试脚本在运行时 import 调用，通过 subprocess 调用 agent-browser CLI。
 """
 
+import asyncio
 import base64
 import json
 import os
@@ -13,6 +14,10 @@ import time
 import uuid
 from typing import Dict, Any, Optional, List
 
+# 快照中的图片行：- img "验证码" [ref=e5] 或 - img [ref=e5]
+_SNAPSHOT_IMAGE_RE = re.compile(r'^\s*-\s*(?:img|image)\b(?:\s+"(?P<name>[^"]*)")?[^\n]*?\[ref=(?P<ref>e\d+)\]')
+_CAPTCHA_NAME_RE = re.compile(r"验证码|captcha|verify|vcode|checkcode|kaptcha|yzm", re.I)
+
 
 class AgentBrowserUtil:
     """同步 agent-browser CLI 工具类"""
@@ -309,125 +314,255 @@ class AgentBrowserUtil:
 
     def detect_and_solve_captcha(self) -> bool:
         """
-        截图 → VL 识别验证码文本 → snapshot 找输入框 → fill。
+        snapshot 找验证码图片和输入框 → 截图后在内存中裁剪出验证码 → 识别 → fill。
         流程:
-          1. agent-browser screenshot <path> → 全页截图保存到本地
-          2. base64 编码 → VL 模型直接识别验证码文本（一步完成检测+识别）
-          3. agent-browser snapshot → 找到验证码输入框 ref
-          4. agent-browser fill @ref <text> → 填入
+          1. agent-browser snapshot（完整快照，包含图片）→ 找到验证码图片 ref 和输入框 ref
+          2. agent-browser get box @图片ref + agent-browser screenshot → Pillow 在内存中裁剪出验证码
+          3. 只把裁剪出的小图交给识别：缓存答案 → 本地识别 → VL 模型（与 BrowserUtil 相同）
+          4. agent-browser fill @输入框ref <text> → 填入
+        快照中找不到验证码图片或裁剪失败时，退回整页截图由 VL 模型同时找出并识别验证码。
         """
         try:
-            from openai import OpenAI
-
-            api_key = os.getenv("BAILIAN_API_KEY", "")
-            base_url = os.getenv("BAILIAN_BASE_URL", "")
-            vl_model = os.getenv("BAILIAN_VL_MODEL", "qwen-vl-plus")
-
-            if not api_key or not base_url:
-                print("[AgentBrowserUtil] 未配置 BAILIAN_API_KEY 或 BAILIAN_BASE_URL，跳过验证码检测")
+            from . import captcha_cache
+
+            # 1. 一次完整快照同时找验证码图片和输入框
+            snapshot_text = self._extract_snapshot_text(self.snapshot(interactive=False))
+            image_ref = self._find_captcha_image_ref(snapshot_text)
+            input_ref = self._find_captcha_input_ref(snapshot_text)
+
+            # 同一会话中再次处理验证码，说明上一次填写的答案没能登录成功，不再复用
+            if captcha_cache.evict_used(self.session_id):
+                print("[AgentBrowserUtil] 验证码再次出现，已清除上一次使用的缓存答案")
+
+            # 2. 裁剪出验证码  3. 识别
+            start = time.perf_counter()
+            crop = self._capture_captcha_crop(image_ref) if image_ref else None
+            if crop is not None:
+                from .browser_util import get_browser_util
+
+                captcha_text = asyncio.run(get_browser_util()._recognize_captcha_text(
+                    base64.b64encode(crop).decode("utf-8"), scope=self.session_id, capture="crop"
+                ))
+            else:
+                print("[AgentBrowserUtil] 快照中未找到验证码图片或裁剪失败，使用整页截图识别")
+                captcha_text = self._recognize_full_page()
+            print(f"[AgentBrowserUtil] 验证码识别耗时 {(time.perf_counter() - start) * 1000:.0f}ms"
+                  f"（{'裁剪' if crop is not None else '整页截图'}）: {captcha_text}")
+            if not captcha_text:
                 return False
 
-            # 1. 截图（位置参数）
-            captcha_temp_path = os.path.abspath(f"captcha_ab_{self.session_id}.png")
-            ss_result = self.screenshot(path=captcha_temp_path)
+            # 4. fill
+            if not input_ref:
+                input_ref = self._find_captcha_input_ref(self._extract_snapshot_text(self.snapshot()))
+            if input_ref:
+                self.fill(input_ref, captcha_text)
+                print(f"[AgentBrowserUtil] 验证码已填写: {captcha_text} -> {input_ref}")
+                return True
+            print(f"[AgentBrowserUtil] 未找到验证码输入框, snapshot:\n{snapshot_text[:500]}")
+            return False
 
-            # 如果指定路径不存在，尝试从响应中读取实际保存路径
-            actual_path = captcha_temp_path
-            if not os.path.exists(actual_path):
-                resp_path = ss_result.get("data", {}).get("path", "")
-                if resp_path and os.path.exists(resp_path):
-                    actual_path = resp_path
-                    print(f"[AgentBrowserUtil] 使用响应路径: {actual_path}")
-                else:
-                    print(f"[AgentBrowserUtil] 截图文件不存在: {captcha_temp_path}, 响应: {ss_result}")
-                    return False
+        except Exception as e:
+            print(f"[AgentBrowserUtil] 验证码处理失败: {e}")
+            import traceback
+            traceback.print_exc()
+            return False
 
-            with open(actual_path, "rb") as f:
-                screenshot_b64 = base64.b64encode(f.read()).decode("utf-8")
+    def _find_captcha_image_ref(self, snapshot_text: str) -> Optional[str]:
+        """
+        在完整快照中找验证码图片：名称含验证码关键词的图片优先，
+        否则取快照中与验证码输入框相邻（前后 6 行内）的图片
+        """
+        lines = (snapshot_text or "").split("\n")
+        images = []
+        for index, line in enumerate(lines):
+            match = _SNAPSHOT_IMAGE_RE.search(line)
+            if match:
+                images.append((index, match.group("name") or "", f"@{match.group('ref')}"))
+        if not images:
+            return None
+        for _, name, ref in images:
+            if _CAPTCHA_NAME_RE.search(name):
+                return ref
+        input_lines = [k for k, line in enumerate(lines) if "textbox" in line and _CAPTCHA_NAME_RE.search(line)]
+        nearby = [(abs(index - k), ref) for index, _, ref in images for k in input_lines if abs(index - k) <= 6]
+        return min(nearby)[1] if nearby else None
+
+    def _find_captcha_input_ref(self, snapshot_text: str) -> Optional[str]:
+        """在快照中按名称找验证码输入框"""
+        captcha_names = ["验证码", "captcha", "code", "verify"]
+        for cname in captcha_names:
+            ref = self.find_element_in_snapshot(snapshot_text, name=cname, role="textbox")
+            if ref:
+                return ref
+        # 宽松搜索：不限 role
+        for cname in captcha_names:
+            ref = self.find_element_in_snapshot(snapshot_text, name=cname)
+            if ref:
+                return ref
+        return None
 
-            print(f"[AgentBrowserUtil] 截图已保存: {actual_path} ({len(screenshot_b64)} bytes base64)")
+    def _get_box(self, ref: str) -> Optional[Dict[str, float]]:
+        """agent-browser get box：元素在视口中的位置 {"x", "y", "width", "height"}"""
+        result = self._run_cli(["get", "box", ref], timeout=10)
+        pending = [result]
+        while pending:
+            item = pending.pop()
+            if isinstance(item, dict):
+                if all(isinstance(item.get(k), (int, float)) for k in ("x", "y", "width", "height")):
+                    return {k: float(item[k]) for k in ("x", "y", "width", "height")}
+                pending.extend(item.values())
+        return None
 
-            # 2. VL 一步识别验证码（检测+识别合并）
-            client = OpenAI(api_key=api_key, base_url=base_url)
-            response = client.chat.completions.create(
-                model=vl_model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": (
-                            "你是一个验证码识别专家。分析网页截图，找到验证码图片并识别其内容。\n"
-                            "如果是数学运算（如 2+3=?），请计算并返回结果数字。\n"
-                            "如果是文字/数字验证码，直接返回验证码文本。\n"
-                            "如果没有发现验证码，返回 NONE。\n"
-                            "只返回验证码值或 NONE，不要添加任何解释。"
-                        ),
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": "请识别这张网页截图中的验证码内容。只返回验证码的值（数字或文字），如果没有验证码返回NONE。"},
-                            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{screenshot_b64}"}},
-                        ],
-                    },
-                ],
-                temperature=0.0,
-                max_tokens=50,
-            )
-            captcha_text_raw = response.choices[0].message.content.strip()
-            print(f"[AgentBrowserUtil] VL 识别结果(原始): {captcha_text_raw}")
+    def _viewport_css_width(self) -> Optional[float]:
+        """agent-browser eval：页面视口的 CSS 像素宽度（window.innerWidth）"""
+        result = self._run_cli(["eval", "window.innerWidth"], timeout=10)
+        pending = [result.get("data")] if result.get("success", True) else []
+        while pending:
+            item = pending.pop()
+            if isinstance(item, bool):
+                continue
+            if isinstance(item, (int, float)) and item > 0:
+                return float(item)
+            if isinstance(item, str):
+                try:
+                    value = float(item)
+                except ValueError:
+                    continue
+                if value > 0:
+                    return value
+            elif isinstance(item, dict):
+                pending.extend(item.values())
+        return None
 
-            # 检查是否有验证码
-            if captcha_text_raw.upper() == "NONE" or not captcha_text_raw:
-                print("[AgentBrowserUtil] VL 未检测到验证码")
-                self._cleanup_temp(actual_path)
-                return False
+    def _take_screenshot(self) -> Optional[bytes]:
+        """视口截图，读入内存后删除临时文件"""
+        temp_path = os.path.abspath(f"captcha_ab_{self.session_id}.png")
+        result = self.screenshot(path=temp_path)
+        # 如果指定路径不存在，尝试从响应中读取实际保存路径
+        actual_path = temp_path
+        if not os.path.exists(actual_path):
+            resp_path = (result.get("data") or {}).get("path", "") if isinstance(result.get("data"), dict) else ""
+            if not resp_path or not os.path.exists(resp_path):
+                print(f"[AgentBrowserUtil] 截图文件不存在: {temp_path}, 响应: {result}")
+                return None
+            actual_path = resp_path
+        with open(actual_path, "rb") as f:
+            data = f.read()
+        self._cleanup_temp(actual_path)
+        return data
+
+    def _capture_captcha_crop(self, image_ref: str) -> Optional[bytes]:
+        """截取视口截图，在内存中按验证码图片的位置裁剪，返回 PNG 数据"""
+        import io
+        from PIL import Image
+
+        box = self._get_box(image_ref)
+        if not box:
+            return None
+        screenshot_bytes = self._take_screenshot()
+        if not screenshot_bytes:
+            return None
+        image = Image.open(io.BytesIO(screenshot_bytes))
+        # get box 返回 CSS 像素，截图按设备像素保存（HiDPI、缩放），按截图宽度 / 视口宽度换算
+        css_width = self._viewport_css_width()
+        if not css_width:
+            print("[AgentBrowserUtil] 无法读取视口宽度，不裁剪截图")
+            return None
+        scale = image.width / css_width
+        left, top = round(box["x"] * scale), round(box["y"] * scale)
+        right, bottom = round((box["x"] + box["width"]) * scale), round((box["y"] + box["height"]) * scale)
+        if left < 0 or top < 0 or right > image.width or bottom > image.height or right - left < 4 or bottom - top < 4:
+            print(f"[AgentBrowserUtil] 验证码图片不在视口内: {box}")
+            return None
+        buffer = io.BytesIO()
+        image.crop((left, top, right, bottom)).save(buffer, format="PNG")
+        crop = buffer.getvalue()
+        print(f"[AgentBrowserUtil] 裁剪出验证码 {right - left}x{bottom - top}: {len(crop)} 字节"
+              f"（整页截图 {len(screenshot_bytes)} 字节）")
+        return crop
+
+    def _recognize_full_page(self) -> Optional[str]:
+        """整页截图交给 VL 模型同时找出并识别验证码（相同截图的结果按内容哈希缓存）"""
+        from . import captcha_cache
+        from .browser_util import _record_captcha_recognition
+
+        api_key = os.getenv("BAILIAN_API_KEY", "")
+        base_url = os.getenv("BAILIAN_BASE_URL", "")
+        vl_model = os.getenv("BAILIAN_VL_MODEL", "qwen-vl-plus")
+        if not api_key or not base_url:
+            print("[AgentBrowserUtil] 未配置 BAILIAN_API_KEY 或 BAILIAN_BASE_URL，跳过验证码检测")
+            return None
 
-            # 提取数字/文本
-            captcha_text = captcha_text_raw
-            match = re.search(r"[=:]\s*(\d+)", captcha_text_raw)
-            if match:
-                captcha_text = match.group(1)
-            elif captcha_text_raw.isdigit():
-                captcha_text = captcha_text_raw
-            else:
-                numbers = re.findall(r"\d+", captcha_text_raw)
-                if numbers:
-                    captcha_text = numbers[-1]
-
-            print(f"[AgentBrowserUtil] 提取后的验证码: {captcha_text}")
-
-            # 3. snapshot 找验证码输入框 → fill
-            snap = self.snapshot()
-            snapshot_text = self._extract_snapshot_text(snap)
-            # 尝试多种名称匹配验证码输入框
-            captcha_names = ["验证码", "captcha", "code", "verify"]
-            ref = None
-            for cname in captcha_names:
-                ref = self.find_element_in_snapshot(snapshot_text, name=cname, role="textbox")
-                if ref:
-                    break
-            if not ref:
-                # 宽松搜索：不限 role
-                for cname in captcha_names:
-                    ref = self.find_element_in_snapshot(snapshot_text, name=cname)
-                    if ref:
-                        break
+        screenshot_bytes = self._take_screenshot()
+        if not screenshot_bytes:
+            return None
+        cached = captcha_cache.lookup(screenshot_bytes)
+        if cached:
+            print(f"[AgentBrowserUtil] 使用缓存的验证码答案: {cached['answer']}（{cached['age']} 秒前识别）")
+            captcha_cache.mark_used(cached["key"], self.session_id)
+            return cached["answer"]
+
+        screenshot_b64 = base64.b64encode(screenshot_bytes).decode("utf-8")
+        print(f"[AgentBrowserUtil] 上传整页截图识别验证码: {len(screenshot_b64)} 字节（base64）")
+        start = time.perf_counter()
+        captcha_text = self._recognize_captcha_by_vl(screenshot_b64, api_key, base_url, vl_model)
+        _record_captcha_recognition("vl", (time.perf_counter() - start) * 1000, "accepted" if captcha_text else "failed",
+                                    capture="full_page", upload_bytes=len(screenshot_b64))
+        if captcha_text:
+            captcha_cache.mark_used(captcha_cache.store(screenshot_bytes, captcha_text, "vl"), self.session_id)
+        return captcha_text
+
+    def _recognize_captcha_by_vl(self, screenshot_b64: str, api_key: str, base_url: str, vl_model: str) -> Optional[str]:
+        """VL 模型从网页截图中找到验证码并识别，没有验证码时返回 None"""
+        from openai import OpenAI
+
+        client = OpenAI(api_key=api_key, base_url=base_url)
+        response = client.chat.completions.create(
+            model=vl_model,
+            messages=[
+                {
+                    "role": "system",
+                    "content": (
+                        "你是一个验证码识别专家。分析网页截图，找到验证码图片并识别其内容。\n"
+                        "如果是数学运算（如 2+3=?），请计算并返回结果数字。\n"
+                        "如果是文字/数字验证码，直接返回验证码文本。\n"
+                        "如果没有发现验证码，返回 NONE。\n"
+                        "只返回验证码值或 NONE，不要添加任何解释。"
+                    ),
+                },
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": "请识别这张网页截图中的验证码内容。只返回验证码的值（数字或文字），如果没有验证码返回NONE。"},
+                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{screenshot_b64}"}},
+                    ],
+                },
+            ],
+            temperature=0.0,
+            max_tokens=50,
+        )
+        captcha_text_raw = response.choices[0].message.content.strip()
+        print(f"[AgentBrowserUtil] VL 识别结果(原始): {captcha_text_raw}")
+
+        # 检查是否有验证码
+        if captcha_text_raw.upper() == "NONE" or not captcha_text_raw:
+            print("[AgentBrowserUtil] VL 未检测到验证码")
+            return None
 
-            if ref:
-                self.fill(ref, captcha_text)
-                print(f"[AgentBrowserUtil] 验证码已填写: {captcha_text} -> {ref}")
-                self._cleanup_temp(actual_path)
-                return True
-            else:
-                print(f"[AgentBrowserUtil] 未找到验证码输入框, snapshot:\n{snapshot_text[:500]}")
-                self._cleanup_temp(actual_path)
-                return False
+        # 提取数字/文本
+        captcha_text = captcha_text_raw
+        match = re.search(r"[=:]\s*(\d+)", captcha_text_raw)
+        if match:
+            captcha_text = match.group(1)
+        elif captcha_text_raw.isdigit():
+            captcha_text = captcha_text_raw
+        else:
+            numbers = re.findall(r"\d+", captcha_text_raw)
+            if numbers:
+                captcha_text = numbers[-1]
 
-        except Exception as e:
-            print(f"[AgentBrowserUtil] 验证码处理失败: {e}")
-            import traceback
-            traceback.print_exc()
-            return False
+        print(f"[AgentBrowserUtil] 提取后的验证码: {captcha_text}")
+        return captcha_text
 
     def _cleanup_temp(self, path: str) -> None:
         """清理临时文件"""
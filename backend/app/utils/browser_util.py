@@ -4,13 +4,139 @@
 """
 
 import base64
-import json
 import os
 import re
+import time
 from typing import Optional
 from openai import OpenAI
 
 
+# 验证码元素探测：一次页面内求值给所有候选图片/输入框打分，返回得分最高的元素及其位置、
+# 可以记住的 CSS 选择器和页面表单布局（用于 captcha_memory 判断布局是否变化），
+# 并给它们加上标记属性，后续通过 [data-e2e-captcha="image"] 等选择器直接定位。
+# 配置的选择器可能是 text= / xpath= / >> 等 Playwright 选择器，先由 page.locator 解析，
+# 找到的元素加上 pin 属性后在页面内直接选中，找不到时才按打分挑选
+CAPTCHA_MARKER_ATTR = "data-e2e-captcha"
+CAPTCHA_PIN_ATTR = "data-e2e-captcha-pin"
+CAPTCHA_PROBE_JS = """({marker, pinAttr}) => {
+    const KEY = /captcha|verify|vcode|checkcode|kaptcha|randcode|validate|yzm|验证码/i;
+    const WEAK = /code/i;
+    const box = el => {
+        const r = el.getBoundingClientRect();
+        if (r.width < 2 || r.height < 2) return null;
+        const s = getComputedStyle(el);
+        if (s.visibility === 'hidden' || s.display === 'none' || parseFloat(s.opacity) === 0) return null;
+        return {x: r.x, y: r.y, width: r.width, height: r.height};
+    };
+    const attrs = el => el ? ['id', 'class', 'name', 'src', 'alt', 'title', 'placeholder', 'aria-label']
+        .map(a => el.getAttribute(a) || '').join(' ') : '';
+    const dist = (a, b) => Math.hypot(a.x + a.width / 2 - b.x - b.width / 2, a.y + a.height / 2 - b.y - b.height / 2);
+    const unique = sel => { try { return document.querySelectorAll(sel).length === 1; } catch (e) { return false; } };
+    const cssPath = el => {
+        if (el.id && unique('#' + CSS.escape(el.id))) return '#' + CSS.escape(el.id);
+        const tag = el.tagName.toLowerCase();
+        for (const a of ['name', 'placeholder', 'alt']) {
+            const v = el.getAttribute(a);
+            if (v && unique(tag + '[' + a + '="' + CSS.escape(v) + '"]')) return tag + '[' + a + '="' + CSS.escape(v) + '"]';
+        }
+        const parts = [];
+        for (let node = el; node && node !== document.body && node.parentElement; node = node.parentElement) {
+            if (node.id && unique('#' + CSS.escape(node.id))) { parts.unshift('#' + CSS.escape(node.id)); break; }
+            const same = Array.from(node.parentElement.children).filter(c => c.tagName === node.tagName);
+            parts.unshift(node.tagName.toLowerCase() + (same.length > 1 ? ':nth-of-type(' + (same.indexOf(node) + 1) + ')' : ''));
+        }
+        return parts.join(' > ');
+    };
+    document.querySelectorAll('[' + marker + ']').forEach(el => el.removeAttribute(marker));
+    const pinned = name => document.querySelector('[' + pinAttr + '="' + name + '"]');
+    const pinnedImage = pinned('image'), pinnedInput = pinned('input');
+    document.querySelectorAll('[' + pinAttr + ']').forEach(el => el.removeAttribute(pinAttr));
+
+    const inputs = [];
+    const inputCandidates = Array.from(document.querySelectorAll('input'));
+    if (pinnedInput) inputCandidates.push(pinnedInput);
+    for (const el of new Set(inputCandidates)) {
+        const type = (el.getAttribute('type') || 'text').toLowerCase();
+        if (el !== pinnedInput && !['text', 'tel', 'number'].includes(type)) continue;
+        const b = box(el);
+        if (!b) continue;
+        const text = attrs(el);
+        let score = el === pinnedInput ? 100 : 0;
+        score += KEY.test(text) ? 10 : (WEAK.test(text) ? 3 : 0);
+        const maxlength = parseInt(el.getAttribute('maxlength') || '0', 10);
+        if (maxlength >= 4 && maxlength <= 6) score += 2;
+        inputs.push({el, box: b, score});
+    }
+    const keyInputs = inputs.filter(c => c.score >= 10);
+
+    const candidates = Array.from(document.querySelectorAll('img, canvas'));
+    if (pinnedImage) candidates.push(pinnedImage);
+    const images = [];
+    for (const el of new Set(candidates)) {
+        const b = box(el);
+        if (!b) continue;
+        let score = el === pinnedImage ? 100 : 0;
+        if (KEY.test(attrs(el))) score += 10;
+        else if (KEY.test(attrs(el.parentElement))) score += 6;
+        const ratio = b.width / b.height;
+        if (b.width >= 40 && b.width <= 300 && b.height >= 15 && b.height <= 120 && ratio >= 1.2 && ratio <= 8) score += 2;
+        if (keyInputs.some(c => dist(c.box, b) < 400)) score += 4;
+        images.push({el, box: b, score});
+    }
+    const pick = (list, min) => list.filter(c => c.score >= min).sort((a, b) => b.score - a.score)[0] || null;
+    const image = pick(images, 6);
+    if (image) {
+        for (const c of inputs) if (dist(c.box, image.box) < 400) c.score += 5;
+    }
+    const input = pick(inputs, 10);
+    const layout = [window.innerWidth, window.innerHeight];
+    for (const el of document.querySelectorAll('input, button, select, textarea, img, canvas')) {
+        const b = box(el);
+        if (b && layout.length < 120) layout.push([el.tagName.toLowerCase(), el.getAttribute('type') || '', el.getAttribute('name') || '',
+            el.id || '', Math.round(b.width / 10), Math.round(b.height / 10)]);
+    }
+    const result = {candidates: images.length + inputs.length, layout};
+    for (const [name, c] of [['image', image], ['input', input]]) {
+        if (!c) { result[name] = null; continue; }
+        const css = cssPath(c.el);
+        c.el.setAttribute(marker, name);
+        result[name] = {tag: c.el.tagName.toLowerCase(), score: c.score, box: c.box, css,
+                        selector: '[' + marker + '="' + name + '"]'};
+    }
+    return result;
+}"""
+
+# 页面内求值失败时逐个尝试的常见验证码选择器（配置的选择器优先）
+CAPTCHA_IMAGE_SELECTORS = [
+    'img[id*="captcha"]',
+    'img[class*="captcha"]',
+    'img[src*="captcha"]',
+    '.captcha img',
+    '#captcha img',
+    'img[alt*="验证码"]',
+]
+CAPTCHA_INPUT_SELECTORS = [
+    'input[name*="captcha"]',
+    'input[id*="captcha"]',
+    'input[placeholder*="captcha"]',
+    'input[placeholder*="验证码"]',
+    'input[name*="code"]',
+    'input[name*="verify"]',
+    'input[type="text"][maxlength="4"]',
+    'input[type="text"][maxlength="5"]',
+    'input[type="text"][maxlength="6"]',
+]
+
+
+def _record_captcha_recognition(backend: str, duration_ms: float, status: str, **kwargs) -> None:
+    """记录验证码识别指标（测试脚本子进程中输出为事件行，由执行器汇总）"""
+    try:
+        from ..core.metrics import record_captcha_recognition
+        record_captcha_recognition(backend, duration_ms, status, **kwargs)
+    except Exception:
+        pass
+
+
 class BrowserUtil:
     """浏览器测试工具类"""
 
@@ -224,115 +350,153 @@ class BrowserUtil:
         Returns:
             是否成功处理验证码
         """
-        try:
-            # === 第一步：查找验证码图片 ===
-            # 优先级：1. 用户提供的config选择器 2. 硬编码CSS选择器 3. VL视觉定位
-            img_selectors = [
-                captcha_selector,
-                'img[id*="captcha"]',
-                'img[class*="captcha"]',
-                'img[src*="captcha"]',
-                '.captcha img',
-                '#captcha img',
-                'img[alt*="验证码"]'
-            ]
-
-            captcha_img = None
-            used_img_selector = None
-            for selector in img_selectors:
-                if not selector:
-                    continue
-                try:
-                    img = page.locator(selector).first
-                    if await img.is_visible(timeout=1000):
-                        captcha_img = img
-                        used_img_selector = selector
-                        print(f'[BrowserUtil] 找到验证码图片: {selector}')
-                        break
-                except:
-                    continue
+        from . import captcha_cache, captcha_memory
 
-            # VL视觉定位回退：如果CSS选择器都没找到，用VL模型定位
-            if not captcha_img:
-                print('[BrowserUtil] CSS选择器未找到验证码图片，尝试VL视觉定位...')
-                try:
-                    found, element_info = await self.find_element_by_description(page, "验证码图片（CAPTCHA图片，通常包含数字或字母或数学运算）")
-                    if found and element_info:
-                        x, y = element_info['x'], element_info['y']
-                        print(f'[BrowserUtil] VL定位到验证码图片坐标: ({x}, {y})')
-                        # 使用坐标截取验证码区域 - 先对整个页面截图，再裁剪
-                        screenshot_bytes = await page.screenshot()
-                        from PIL import Image
-                        import io
-                        full_img = Image.open(io.BytesIO(screenshot_bytes))
-                        # 以坐标为中心裁剪一块区域（验证码通常不超过200x80）
-                        crop_w, crop_h = 200, 80
-                        left = max(0, x - crop_w // 2)
-                        top = max(0, y - crop_h // 2)
-                        right = min(full_img.width, x + crop_w // 2)
-                        bottom = min(full_img.height, y + crop_h // 2)
-                        captcha_crop = full_img.crop((left, top, right, bottom))
-                        buf = io.BytesIO()
-                        captcha_crop.save(buf, format='PNG')
-                        captcha_bytes_vl = buf.getvalue()
-                        captcha_base64 = base64.b64encode(captcha_bytes_vl).decode('utf-8')
-                        # 跳到识别步骤
-                        captcha_text = await self._recognize_captcha_text(captcha_base64)
-                        if captcha_text:
-                            # 找输入框并填写
-                            captcha_input = await self._find_captcha_input(page, captcha_input_selector)
-                            if captcha_input:
-                                await captcha_input.fill(captcha_text)
-                                print(f'[BrowserUtil] 验证码已填写(VL定位): {captcha_text}')
-                                return True
-                except Exception as vl_err:
-                    print(f'[BrowserUtil] VL视觉定位验证码失败: {vl_err}')
-
-            if not captcha_img:
-                print('[BrowserUtil] 未找到验证码图片')
+        try:
+            # === 第一步：一次页面内求值找出验证码图片和输入框 ===
+            # 优先级：1. 用户提供的config选择器 2. 之前在该页面记住的选择器 3. 属性/尺寸/位置打分
+            #        4. 页面布局未变化时记住的VL定位坐标 5. VL视觉定位
+            learned = captcha_memory.get(page.url) or {}
+            probe = await self.probe_captcha_elements(
+                page,
+                captcha_selector or (learned.get("image") or {}).get("selector"),
+                captcha_input_selector or (learned.get("input") or {}).get("selector"),
+            )
+            if not probe.get("image") and not probe.get("input"):
+                # 页面上没有任何像验证码的元素，直接返回，不再等待也不调用VL
+                print('[BrowserUtil] 未发现验证码元素，跳过验证码处理')
                 return False
+            # 同一页面上再次出现验证码，说明上一次填写的答案没能登录成功，不再复用
+            scope = captcha_memory.page_key(page.url)
+            if captcha_cache.evict_used(scope):
+                print('[BrowserUtil] 验证码再次出现，已清除上一次使用的缓存答案')
+            if captcha_memory.evict_used(scope):
+                print('[BrowserUtil] 验证码再次出现，已清除上一次记下的验证码定位')
+                learned = {}
+            if learned:
+                captcha_memory.mark_used(page.url, learned)
+            # 逐个尝试选择器的结果没有页面布局，不比较也不记住布局指纹
+            fingerprint = captcha_memory.layout_fingerprint(probe["layout"]) if probe.get("layout") else None
+            same_layout = fingerprint is not None and learned.get("fingerprint") == fingerprint
+            used_vl = False
 
             # === 第二步：截图并识别验证码 ===
-            captcha_bytes = await captcha_img.screenshot()
-            captcha_base64 = base64.b64encode(captcha_bytes).decode('utf-8')
-            captcha_text = await self._recognize_captcha_text(captcha_base64)
+            if probe.get("image"):
+                print(f'[BrowserUtil] 找到验证码图片: {probe["image"]["css"]} 得分 {probe["image"]["score"]}')
+                captcha_bytes = await page.locator(probe["image"]["selector"]).first.screenshot()
+                image_locator = {"selector": probe["image"]["css"], "box": probe["image"]["box"]}
+            else:
+                box = (learned.get("image") or {}).get("box") if same_layout else None
+                if box:
+                    print('[BrowserUtil] 页面布局未变化，使用记住的验证码图片位置')
+                else:
+                    print('[BrowserUtil] 只找到验证码输入框，尝试VL视觉定位验证码图片...')
+                    # 验证码通常不超过200x80，以定位到的坐标为中心截取
+                    box = await self._locate_by_vl(page, "验证码图片（CAPTCHA图片，通常包含数字或字母或数学运算）", 200, 80)
+                    used_vl = True
+                if not box:
+                    print('[BrowserUtil] 未找到验证码图片')
+                    return False
+                captcha_bytes = await page.screenshot(clip=box)
+                image_locator = {"selector": None, "box": box}
 
+            captcha_base64 = base64.b64encode(captcha_bytes).decode('utf-8')
+            captcha_text = await self._recognize_captcha_text(captcha_base64, scope)
             if not captcha_text:
                 print('[BrowserUtil] 验证码识别失败')
                 return False
 
-            # === 第三步：查找验证码输入框并填写 ===
-            captcha_input = await self._find_captcha_input(page, captcha_input_selector)
-
-            if captcha_input and await captcha_input.is_visible(timeout=1000):
-                await captcha_input.fill(captcha_text)
-                print(f'[BrowserUtil] 验证码已填写: {captcha_text}')
-                return True
-
-            # VL回退：用VL模型定位输入框
-            print('[BrowserUtil] CSS选择器未找到验证码输入框，尝试VL视觉定位...')
-            try:
-                found, element_info = await self.find_element_by_description(page, "验证码输入框（用于输入验证码的文本框）")
-                if found and element_info:
-                    x, y = element_info['x'], element_info['y']
-                    print(f'[BrowserUtil] VL定位到验证码输入框坐标: ({x}, {y})')
-                    await page.mouse.click(x, y)
-                    await page.wait_for_timeout(300)
-                    await page.keyboard.press("Control+a")
-                    await page.keyboard.type(captcha_text, delay=50)
-                    print(f'[BrowserUtil] 验证码已填写(VL定位输入框): {captcha_text}')
-                    return True
-            except Exception as vl_err:
-                print(f'[BrowserUtil] VL视觉定位输入框失败: {vl_err}')
-
-            return False
+            # === 第三步：填写验证码 ===
+            if probe.get("input"):
+                print(f'[BrowserUtil] 找到验证码输入框: {probe["input"]["css"]} 得分 {probe["input"]["score"]}')
+                await page.locator(probe["input"]["selector"]).first.fill(captcha_text)
+                input_locator = {"selector": probe["input"]["css"], "box": probe["input"]["box"]}
+            else:
+                box = (learned.get("input") or {}).get("box") if same_layout else None
+                if box:
+                    print('[BrowserUtil] 页面布局未变化，使用记住的验证码输入框位置')
+                else:
+                    print('[BrowserUtil] 未找到验证码输入框，尝试VL视觉定位...')
+                    box = await self._locate_by_vl(page, "验证码输入框（用于输入验证码的文本框）", 100, 30)
+                    used_vl = True
+                if not box:
+                    print('[BrowserUtil] 未找到验证码输入框')
+                    return False
+                await page.mouse.click(box["x"] + box["width"] / 2, box["y"] + box["height"] / 2)
+                await page.wait_for_timeout(300)
+                await page.keyboard.press("Control+a")
+                await page.keyboard.type(captcha_text, delay=50)
+                input_locator = {"selector": None, "box": box}
+            print(f'[BrowserUtil] 验证码已填写: {captcha_text}')
+
+            # === 记下这次的定位，脚本执行通过后确认，下次执行优先使用 ===
+            if same_layout and not used_vl:
+                captcha_memory.record_hit(page.url)
+            elif fingerprint:
+                captcha_memory.remember(page.url, fingerprint, "vl" if used_vl else "probe",
+                                        image=image_locator, input_box=input_locator)
+            return True
 
         except Exception as e:
             print(f'[BrowserUtil] 验证码处理失败: {e}')
             return False
 
-    async def _recognize_captcha_text(self, captcha_base64: str) -> Optional[str]:
-        """识别验证码图片中的文本"""
+    async def _locate_by_vl(self, page, description: str, width: int, height: int) -> Optional[dict]:
+        """用VL模型定位元素，返回以定位坐标为中心、给定大小的区域（页面坐标），定位失败时返回 None"""
+        try:
+            found, element_info = await self.find_element_by_description(page, description)
+        except Exception as vl_err:
+            print(f'[BrowserUtil] VL视觉定位失败: {vl_err}')
+            return None
+        if not found or not element_info:
+            return None
+        x, y = element_info['x'], element_info['y']
+        print(f'[BrowserUtil] VL定位到坐标: ({x}, {y})')
+        return {"x": max(0, x - width // 2), "y": max(0, y - height // 2), "width": width, "height": height}
+
+    async def _recognize_captcha_text(self, captcha_base64: str, scope: str = "", capture: str = "element") -> Optional[str]:
+        """
+        识别验证码图片中的文本
+        先查按图片内容缓存的答案（见 captcha_cache.py），再用本地识别器（见 captcha_recognizer.py），
+        置信度达到阈值时直接使用，否则调用 VL 模型；
+        VL 模型识别出的验证码图片随缓存条目保存，脚本执行通过（登录成功）后由执行器用于学习字形，
+        之后同一网站的验证码本地就能认出
+        Args:
+            scope: 作用域（页面），同一作用域再次处理验证码时清除这次使用的缓存答案
+            capture: 图片来源（element 元素截图 / crop 从截图中裁剪），记录在指标中
+        """
+        from . import captcha_cache, captcha_recognizer
+
+        image_bytes = base64.b64decode(captcha_base64)
+        cached = captcha_cache.lookup(image_bytes)
+        if cached:
+            print(f'[BrowserUtil] 使用缓存的验证码答案: {cached["answer"]}（{cached["source"]}，{cached["age"]} 秒前识别）')
+            captcha_cache.mark_used(cached["key"], scope)
+            return cached["answer"]
+
+        local = None
+        try:
+            local = captcha_recognizer.recognize_locally(image_bytes)
+        except Exception as e:
+            print(f'[BrowserUtil] 本地验证码识别失败: {e}')
+        if local is not None:
+            _record_captcha_recognition("local", local["duration_ms"], "accepted" if local["accepted"] else "low_confidence",
+                                        capture=capture)
+            if local["accepted"]:
+                print(f'[BrowserUtil] 本地识别验证码: {local["text"]} -> {local["answer"]}（置信度 {local["confidence"]}）')
+                return local["answer"]
+            print(f'[BrowserUtil] 本地识别置信度不足（{local["text"] or "无结果"}，{local["confidence"]}），调用VL模型识别')
+
+        start = time.perf_counter()
+        captcha_text = await self._recognize_captcha_by_vl(captcha_base64)
+        _record_captcha_recognition("vl", (time.perf_counter() - start) * 1000, "accepted" if captcha_text else "failed",
+                                    capture=capture, upload_bytes=len(captcha_base64))
+        if captcha_text:
+            captcha_cache.mark_used(captcha_cache.store(image_bytes, captcha_text, "vl", glyph=local is not None), scope)
+        return captcha_text
+
+    async def _recognize_captcha_by_vl(self, captcha_base64: str) -> Optional[str]:
+        """用VL模型识别验证码图片中的文本"""
         try:
             client = OpenAI(api_key=self.api_key, base_url=self.base_url)
             response = client.chat.completions.create(
@@ -375,149 +539,117 @@ class BrowserUtil:
             print(f'[BrowserUtil] 验证码识别失败: {e}')
             return None
 
-    async def _find_captcha_input(self, page, captcha_input_selector: str = None):
+    async def probe_captcha_elements(self, page, captcha_selector: str = None, captcha_input_selector: str = None) -> dict:
         """
-        查找验证码输入框
-        优先级：1. 用户提供的config选择器 2. 硬编码CSS选择器
+        在页面内一次求值给所有候选验证码图片（img / canvas）和输入框打分
+        config选择器先用 page.locator 解析（支持 text= / xpath= / >> 等 Playwright 选择器），找到的元素直接选中；
+        找不到时按 id/class/src/placeholder 等属性中的验证码关键词、尺寸、图片与输入框的距离打分。
+        页面内求值失败时不当作没有验证码，改为逐个尝试选择器（_probe_by_selectors）
+
+        Returns:
+            {"image": {"tag", "score", "box", "css", "selector"} 或 None, "input": 同上, "candidates": 候选元素数,
+             "layout": 页面表单布局（逐个尝试选择器时为 None）}；
+            selector 可直接用于 page.locator
         """
-        # 构建选择器列表，config选择器优先
-        input_selectors = []
-        if captcha_input_selector:
-            input_selectors.append(captcha_input_selector)
-        input_selectors.extend([
-            'input[name*="captcha"]',
-            'input[id*="captcha"]',
-            'input[placeholder*="captcha"]',
-            'input[placeholder*="验证码"]',
-            'input[name*="code"]',
-            'input[name*="verify"]',
-            'input[type="text"][maxlength="4"]',
-            'input[type="text"][maxlength="5"]',
-            'input[type="text"][maxlength="6"]'
-        ])
-
-        for selector in input_selectors:
-            try:
-                elements = page.locator(selector)
-                if await elements.count() > 0:
-                    captcha_input = elements.first
-                    if await captcha_input.is_visible(timeout=1000):
-                        print(f'[BrowserUtil] 找到验证码输入框: {selector}')
-                        return captcha_input
-            except:
-                continue
-        return None
+        for name, selector in (("image", captcha_selector), ("input", captcha_input_selector)):
+            if selector:
+                await self._pin_configured_element(page, selector, name)
+        try:
+            return await page.evaluate(CAPTCHA_PROBE_JS, {"marker": CAPTCHA_MARKER_ATTR, "pinAttr": CAPTCHA_PIN_ATTR})
+        except Exception as e:
+            print(f'[BrowserUtil] 验证码元素探测失败，改为逐个尝试选择器: {e}')
+            return await self._probe_by_selectors(page, captcha_selector, captcha_input_selector)
+
+    @staticmethod
+    async def _pin_configured_element(page, selector: str, name: str) -> bool:
+        """用 page.locator 解析配置的选择器，找到可见元素时加上 pin 属性，由探测脚本直接选中"""
+        try:
+            locator = page.locator(selector).first
+            if await locator.count() and await locator.is_visible():
+                await locator.evaluate("(el, [attr, name]) => el.setAttribute(attr, name)", [CAPTCHA_PIN_ATTR, name])
+                return True
+            print(f'[BrowserUtil] 验证码选择器没有找到可见元素，改为按属性打分: {selector}')
+        except Exception as e:
+            print(f'[BrowserUtil] 解析验证码选择器失败（{selector}），改为按属性打分: {e}')
+        return False
+
+    @staticmethod
+    async def _probe_by_selectors(page, captcha_selector: str = None, captcha_input_selector: str = None) -> dict:
+        """按 config选择器、常见验证码选择器的顺序逐个尝试，返回和 probe_captcha_elements 相同结构的结果（没有布局）"""
+        result = {"candidates": 0, "layout": None}
+        for name, configured, selectors in (("image", captcha_selector, CAPTCHA_IMAGE_SELECTORS),
+                                            ("input", captcha_input_selector, CAPTCHA_INPUT_SELECTORS)):
+            result[name] = None
+            for selector in ([configured] if configured else []) + selectors:
+                try:
+                    locator = page.locator(selector).first
+                    if not await locator.count() or not await locator.is_visible():
+                        continue
+                    box = await locator.bounding_box()
+                except Exception:
+                    continue
+                if box:
+                    result[name] = {"tag": None, "score": 100 if selector == configured else 10, "box": box,
+                                    "css": selector, "selector": selector}
+                    result["candidates"] += 1
+                    break
+        return result
+
+    async def _find_captcha_input(self, page, captcha_input_selector: str = None, probe: dict = None):
+        """
+        查找验证码输入框（使用 probe_captcha_elements 的结果，没有传入时重新探测）
+        优先级：1. 用户提供的config选择器 2. 属性/尺寸/位置打分
+        """
+        if probe is None:
+            probe = await self.probe_captcha_elements(page, None, captcha_input_selector)
+        if not probe.get("input"):
+            return None
+        print(f'[BrowserUtil] 找到验证码输入框: 得分 {probe["input"]["score"]}')
+        return page.locator(probe["input"]["selector"]).first
 
     async def load_storage(self, page, cookies_path: str = 'saved_cookies.json',
                           localstorage_path: str = 'saved_localstorage.json',
                           sessionstorage_path: str = 'saved_sessionstorage.json'):
         """
-        加载保存的cookies和storage
+        加载保存的登录状态（兼容旧脚本的调用方式，见 storage_state）
+
+        新脚本在创建上下文时通过 storage_state 恢复登录状态，不需要调用本方法；
+        旧脚本在打开页面后调用，cookies 立即生效，localStorage / sessionStorage 在脚本随后的刷新时写入。
 
         Args:
             page: Playwright page对象
-            cookies_path: cookies文件路径
-            localstorage_path: localStorage文件路径
-            sessionstorage_path: sessionStorage文件路径
+            cookies_path: cookies文件路径（登录状态文件保存在同一目录）
+            localstorage_path: 旧版本的localStorage文件路径（没有登录状态文件时读取）
+            sessionstorage_path: 旧版本的sessionStorage文件路径（没有登录状态文件时读取）
         """
-        import os
+        from .storage_state import apply_saved_state, read_state, state_path
 
-        # 加载cookies
-        if os.path.exists(cookies_path):
-            try:
-                with open(cookies_path, 'r', encoding='utf-8') as f:
-                    cookies = json.load(f)
-                await page.context.add_cookies(cookies)
-                print(f'[BrowserUtil] Cookies已加载: {len(cookies)}个')
-            except Exception as e:
-                print(f'[BrowserUtil] 加载Cookies失败: {e}')
-
-        # 加载localStorage
-        if os.path.exists(localstorage_path):
-            try:
-                with open(localstorage_path, 'r', encoding='utf-8') as f:
-                    ls_data = f.read()
-                try:
-                    ls_data_obj = json.loads(ls_data)
-                    await page.evaluate("""data => {
-                        localStorage.clear();
-                        for (const key in data) {
-                            localStorage.setItem(key, data[key]);
-                        }
-                    }""", ls_data_obj)
-                except json.JSONDecodeError:
-                    await page.evaluate("""data => {
-                        localStorage.clear();
-                        for (const key in data) {
-                            localStorage.setItem(key, data[key]);
-                        }
-                    }""", ls_data)
-                print('[BrowserUtil] LocalStorage已加载')
-            except Exception as e:
-                print(f'[BrowserUtil] 加载LocalStorage失败: {e}')
-
-        # 加载sessionStorage
-        if os.path.exists(sessionstorage_path):
-            try:
-                with open(sessionstorage_path, 'r', encoding='utf-8') as f:
-                    ss_data = f.read()
-                try:
-                    ss_data_obj = json.loads(ss_data)
-                    await page.evaluate("""data => {
-                        sessionStorage.clear();
-                        for (const key in data) {
-                            sessionStorage.setItem(key, data[key]);
-                        }
-                    }""", ss_data_obj)
-                except json.JSONDecodeError:
-                    await page.evaluate("""data => {
-                        sessionStorage.clear();
-                        for (const key in data) {
-                            sessionStorage.setItem(key, data[key]);
-                        }
-                    }""", ss_data)
-                print('[BrowserUtil] SessionStorage已加载')
-            except Exception as e:
-                print(f'[BrowserUtil] 加载SessionStorage失败: {e}')
+        state = read_state(state_path(os.path.dirname(os.path.abspath(cookies_path))), page.url)
+        try:
+            if await apply_saved_state(page.context, state):
+                print(f'[BrowserUtil] 登录状态已加载: Cookies {len(state["storage_state"].get("cookies", []))}个')
+        except Exception as e:
+            print(f'[BrowserUtil] 加载登录状态失败: {e}')
 
     async def save_storage(self, page, cookies_path: str = 'saved_cookies.json',
                           localstorage_path: str = 'saved_localstorage.json',
                           sessionstorage_path: str = 'saved_sessionstorage.json'):
         """
-        保存cookies和storage到文件
+        保存登录状态（兼容旧脚本的调用方式，见 storage_state）
+        cookies、localStorage 和 sessionStorage 一起写入 cookies_path 所在目录的登录状态文件
 
         Args:
             page: Playwright page对象
-            cookies_path: cookies文件路径
-            localstorage_path: localStorage文件路径
-            sessionstorage_path: sessionStorage文件路径
+            cookies_path: cookies文件路径（登录状态文件保存在同一目录）
+            localstorage_path: 不再单独保存，保留参数以兼容旧脚本
+            sessionstorage_path: 不再单独保存，保留参数以兼容旧脚本
         """
-        # 保存cookies
-        try:
-            cookies = await page.context.cookies()
-            with open(cookies_path, 'w', encoding='utf-8') as f:
-                json.dump(cookies, f, ensure_ascii=False, indent=2)
-            print(f'[BrowserUtil] Cookies已保存: {len(cookies)}个')
-        except Exception as e:
-            print(f'[BrowserUtil] 保存Cookies失败: {e}')
-
-        # 保存localStorage
-        try:
-            ls_data = await page.evaluate('() => JSON.stringify(localStorage)')
-            with open(localstorage_path, 'w', encoding='utf-8') as f:
-                f.write(ls_data)
-            print('[BrowserUtil] LocalStorage已保存')
-        except Exception as e:
-            print(f'[BrowserUtil] 保存LocalStorage失败: {e}')
+        from .storage_state import save_state, state_path
 
-        # 保存sessionStorage
         try:
-            ss_data = await page.evaluate('() => JSON.stringify(sessionStorage)')
-            with open(sessionstorage_path, 'w', encoding='utf-8') as f:
-                f.write(ss_data)
-            print('[BrowserUtil] SessionStorage已保存')
+            await save_state(page, state_path(os.path.dirname(os.path.abspath(cookies_path))))
         except Exception as e:
-            print(f'[BrowserUtil] 保存SessionStorage失败: {e}')
+            print(f'[BrowserUtil] 保存登录状态失败: {e}')
 
 
 # 全局实例（单例模式）
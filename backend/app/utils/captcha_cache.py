@@ -0,0 +1,236 @@
+"""
+按图片内容复用验证码答案
+
+有的网站登录失败后仍返回同一张验证码图片，并行执行的多个用例也经常拿到相同的图片，
+每次都调用 VL 模型识别要多花几秒。这里按验证码图片内容的哈希短时间缓存 VL 模型的识别结果：
+
+    {
+        图片 sha256: {"answer": 识别结果, "source": 识别方式, "saved_at": 时间戳,
+                      "glyph_image": 等待学习字形的图片（base64，可选）}
+    }
+
+- 缓存文件为 SESSION_STORAGE_PATH/captcha_answers.json（可用 CAPTCHA_ANSWER_CACHE_PATH 指定），
+  测试脚本子进程、后端服务（captcha_service）和 agent-browser 脚本共用
+- 条目在 CAPTCHA_ANSWER_CACHE_TTL 秒（默认 300）后过期，设为 0 时不使用缓存
+- 查询只读文件；写入和清除在 O_EXCL 创建的 .lock 文件保护下读-改-写，并发的进程不会互相覆盖更新
+- 本地识别器的结果不缓存（重新识别只要几十毫秒）
+
+答案错误时不能继续复用，以下情况清除用过的条目：
+- 同一个进程在同一个页面上再次处理验证码（验证码又出现了，说明上一次登录没有成功）：evict_used
+- 测试脚本执行失败：脚本使用缓存答案时输出 {"event": "captcha_answer", "key": ...} 事件行，
+  执行器在脚本失败时清除这些条目（无法区分登录失败和之后的步骤失败，一律清除）：parse_used_keys + evict
+
+VL 模型的答案确认正确后才用来学习字形（见 captcha_recognizer.py），错误的答案不会污染学到的字形：
+测试脚本识别时把图片随条目保存（store(..., glyph=True)），验证码没有再次出现、脚本执行通过时
+执行器取出图片学习（confirm）；条目被清除时图片一起删除，不会被学习。
+
+只依赖标准库，生成的测试脚本也直接导入本模块。
+"""
+import base64
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+CACHE_FILE_NAME = "captcha_answers.json"
+DEFAULT_TTL = 300
+ANSWER_EVENT = "captcha_answer"
+LOCK_TIMEOUT = 5.0
+LOCK_STALE_SECONDS = 30.0
+
+# 本进程用过的条目：作用域（页面、会话等）-> [图片哈希]
+_used: Dict[str, List[str]] = {}
+
+
+def cache_path() -> str:
+    return os.getenv('CAPTCHA_ANSWER_CACHE_PATH', '') or os.path.join(
+        os.getenv('SESSION_STORAGE_PATH', '') or os.getcwd(), CACHE_FILE_NAME
+    )
+
+
+def ttl() -> int:
+    try:
+        return int(os.getenv('CAPTCHA_ANSWER_CACHE_TTL', '') or DEFAULT_TTL)
+    except ValueError:
+        return DEFAULT_TTL
+
+
+def image_key(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def _load() -> Dict[str, Dict]:
+    path = cache_path()
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    now = time.time()
+    return {key: entry for key, entry in data.items()
+            if isinstance(entry, dict) and now - entry.get("saved_at", 0) < ttl()}
+
+
+@contextmanager
+def file_lock(path: str):
+    """
+    跨进程锁住 path 文件的读-改-写（用 O_EXCL 创建 .lock 文件，Windows 和 Linux 相同），
+    验证码定位记录（captcha_memory）也用它
+    持有锁的进程崩溃留下的锁文件超过 LOCK_STALE_SECONDS 后删除；等待超过 LOCK_TIMEOUT 时不加锁继续，
+    最多丢失一次更新，不影响脚本执行
+    """
+    lock_path = f"{path}.lock"
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    fd = None
+    while fd is None:
+        try:
+            directory = os.path.dirname(lock_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > LOCK_STALE_SECONDS:
+                    os.unlink(lock_path)
+                    continue
+            except OSError:
+                continue
+            if time.monotonic() >= deadline:
+                print(f'[CaptchaCache] 等待文件锁超时，不加锁继续: {lock_path}')
+                break
+            time.sleep(0.01)
+        except OSError as e:
+            print(f'[CaptchaCache] 创建文件锁失败（{lock_path}）: {e}')
+            break
+    try:
+        yield
+    finally:
+        if fd is not None:
+            os.close(fd)
+            try:
+                os.unlink(lock_path)
+            except OSError:
+                pass
+
+
+def _locked():
+    return file_lock(cache_path())
+
+
+def _save(data: Dict[str, Dict]) -> None:
+    path = cache_path()
+    directory = os.path.dirname(path)
+    try:
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f'[CaptchaCache] 保存验证码答案缓存失败: {e}')
+
+
+def lookup(image_bytes: bytes) -> Optional[Dict]:
+    """返回未过期的缓存条目（附带 "key" 和识别后经过的秒数 "age"），没有时返回 None；只读，不写文件"""
+    if ttl() <= 0:
+        return None
+    key = image_key(image_bytes)
+    entry = _load().get(key)
+    if entry is None:
+        return None
+    return {**entry, "key": key, "age": int(time.time() - entry.get("saved_at", 0))}
+
+
+def store(image_bytes: bytes, answer: str, source: str, glyph: bool = False) -> Optional[str]:
+    """
+    缓存识别结果，返回图片哈希（未启用缓存或答案为空时返回 None）
+    glyph: 同时保存图片，答案确认正确后（confirm）用于学习字形
+    """
+    if ttl() <= 0 or not answer:
+        return None
+    key = image_key(image_bytes)
+    entry = {"answer": answer, "source": source, "saved_at": time.time()}
+    if glyph:
+        entry["glyph_image"] = base64.b64encode(image_bytes).decode('ascii')
+    with _locked():
+        data = _load()
+        data[key] = entry
+        _save(data)
+    return key
+
+
+def mark_used(key: str, scope: str = "", emit_event: bool = True) -> None:
+    """
+    记录本次登录使用了该条目
+    emit_event: 输出事件行（测试脚本中使用，执行器在脚本失败时据此清除条目）
+    """
+    if not key:
+        return
+    _used.setdefault(scope, []).append(key)
+    if emit_event:
+        print(json.dumps({"event": ANSWER_EVENT, "key": key}), flush=True)
+
+
+def evict(keys: List[str]) -> int:
+    """清除条目，返回清除的条数"""
+    keys = [key for key in keys if key]
+    if not keys:
+        return 0
+    with _locked():
+        data = _load()
+        count = sum(1 for key in set(keys) if data.pop(key, None) is not None)
+        if count:
+            _save(data)
+    return count
+
+
+def confirm(keys: List[str]) -> List[Dict]:
+    """
+    确认条目的答案正确（使用这些答案的脚本执行通过），取出等待学习字形的图片
+    Returns:
+        [{"key", "answer", "image": 图片字节}]，每张图片只返回一次
+    """
+    keys = [key for key in keys if key]
+    if not keys:
+        return []
+    pending = []
+    with _locked():
+        data = _load()
+        for key in dict.fromkeys(keys):
+            entry = data.get(key)
+            if entry and entry.get("glyph_image"):
+                try:
+                    image = base64.b64decode(entry.pop("glyph_image"))
+                except ValueError:
+                    continue
+                pending.append({"key": key, "answer": entry["answer"], "image": image})
+        if pending:
+            _save(data)
+    return pending
+
+
+def evict_used(scope: str = "") -> int:
+    """清除本进程在该作用域中用过的条目（再次遇到验证码，说明用这些答案的登录没有成功）"""
+    return evict(_used.pop(scope, []))
+
+
+def parse_used_keys(output: str) -> List[str]:
+    """从测试脚本的输出中读取使用过的缓存条目"""
+    keys = []
+    for line in (output or "").split("\n"):
+        line = line.strip()
+        if line.startswith("{") and ANSWER_EVENT in line:
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if data.get("event") == ANSWER_EVENT and data.get("key"):
+                keys.append(data["key"])
+    return keys
@@ -0,0 +1,252 @@
+"""
+按页面记住的验证码定位
+
+CSS 选择器和属性打分找不到验证码图片或输入框时，detect_and_solve_captcha 要调用 VL 模型定位，
+每次执行都要多花一到两次 VL 调用。这里按 源 + 页面路径 记住上一次成功处理验证码时的定位：
+
+    {
+        "https://example.com/#/login": {
+            "fingerprint": 页面表单布局指纹,
+            "image": {"selector": CSS 选择器或 null, "box": {"x", "y", "width", "height"}},
+            "input": 同上,
+            "source": "probe"（属性打分找到）或 "vl"（VL 模型定位）,
+            "hits": 复用次数,
+            "updated_at": 最后更新时间,
+            "token": 记录编号,
+            "pending": {"token", "fingerprint", "image", "input", "source", "saved_at"}（等待确认的定位，可选）
+        }
+    }
+
+- 之后的执行先用记住的选择器探测（和配置的选择器一样优先）
+- 只有 VL 能定位的验证码记住坐标，布局指纹不变时直接使用，指纹变化时才重新调用 VL
+
+选错的定位不能当作配置的选择器一样优先使用，新的定位先作为 pending 保存，确认后 get 才返回：
+- 测试脚本记下定位时输出 {"event": "captcha_locator", "key": 页面, "token": 记录编号} 事件行，
+  执行器在脚本执行通过时确认（confirm），执行失败时丢弃（discard）：parse_events
+- 同一个进程在同一个页面上再次处理验证码（验证码又出现了，说明上一次没有登录成功）时，
+  丢弃本进程记下的定位，本进程用过的已确认定位也一起清除，下次重新探测：evict_used
+- 读-改-写在 captcha_cache.file_lock 的文件锁保护下进行，并发的脚本不会互相覆盖更新
+
+记录保存在 SESSION_STORAGE_PATH/captcha_locators.json（可用 CAPTCHA_LOCATOR_MEMORY_PATH 指定），
+测试脚本子进程和后端服务读写同一个文件，通过配置接口 /api/configs/captcha-locators 查看和清除。
+只依赖标准库，生成的测试脚本也直接导入本模块。
+"""
+import hashlib
+import json
+import os
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+from .captcha_cache import file_lock
+
+MEMORY_FILE_NAME = "captcha_locators.json"
+LOCATOR_EVENT = "captcha_locator"
+
+# 本进程处理过验证码的页面 -> {"pending": 记下的定位编号, "confirmed": 用过的已确认定位编号}
+_used: Dict[str, Dict[str, Optional[str]]] = {}
+
+
+def memory_path() -> str:
+    return os.getenv('CAPTCHA_LOCATOR_MEMORY_PATH', '') or os.path.join(
+        os.getenv('SESSION_STORAGE_PATH', '') or os.getcwd(), MEMORY_FILE_NAME
+    )
+
+
+def page_key(url: str) -> str:
+    """源 + 页面路径（去掉查询参数；hash 路由的单页应用保留 # 后的路径）"""
+    parsed = urlparse(url or "")
+    key = f"{parsed.scheme}://{parsed.netloc}{parsed.path or '/'}"
+    route = parsed.fragment.split("?")[0]
+    return f"{key}#{route}" if route.startswith("/") else key
+
+
+def layout_fingerprint(layout: Any) -> str:
+    """页面表单布局指纹（layout 为探测脚本返回的表单控件结构）"""
+    return hashlib.sha1(json.dumps(layout, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+def load_all() -> Dict[str, Dict[str, Any]]:
+    path = memory_path()
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _save_all(data: Dict[str, Dict[str, Any]]) -> None:
+    path = memory_path()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f'[CaptchaMemory] 保存验证码定位失败: {e}')
+
+
+def get(url: str) -> Optional[Dict[str, Any]]:
+    """已确认的定位（不含等待确认的 pending），没有时返回 None"""
+    entry = load_all().get(page_key(url))
+    if not entry or not entry.get("fingerprint"):
+        return None
+    return {name: value for name, value in entry.items() if name != "pending"}
+
+
+def remember(url: str, fingerprint: str, source: str,
+             image: Optional[Dict[str, Any]] = None, input_box: Optional[Dict[str, Any]] = None,
+             emit_event: bool = True) -> str:
+    """
+    记下这次处理验证码时的定位，确认（confirm）后才会被 get 返回
+    image / input_box 为 {"selector", "box"}，为 None 的部分确认时保留原来的记录
+    emit_event: 输出事件行（测试脚本中使用，执行器据此确认或丢弃）
+    Returns:
+        记录编号
+    """
+    key = page_key(url)
+    token = uuid.uuid4().hex[:12]
+    pending = {"token": token, "fingerprint": fingerprint, "source": source, "saved_at": datetime.now().isoformat()}
+    if image:
+        pending["image"] = image
+    if input_box:
+        pending["input"] = input_box
+    with file_lock(memory_path()):
+        data = load_all()
+        data.setdefault(key, {})["pending"] = pending
+        _save_all(data)
+    _used.setdefault(key, {})["pending"] = token
+    if emit_event:
+        print(json.dumps({"event": LOCATOR_EVENT, "key": key, "token": token}), flush=True)
+    return token
+
+
+def mark_used(url: str, entry: Dict[str, Any]) -> None:
+    """记录本进程使用了该页面已确认的定位（get 的返回值），验证码再次出现时由 evict_used 清除"""
+    _used.setdefault(page_key(url), {})["confirmed"] = entry.get("token")
+
+
+def record_hit(url: str) -> None:
+    with file_lock(memory_path()):
+        data = load_all()
+        entry = data.get(page_key(url))
+        if entry is None or not entry.get("fingerprint"):
+            return
+        entry["hits"] = entry.get("hits", 0) + 1
+        _save_all(data)
+
+
+def confirm(events: List[Dict[str, str]]) -> int:
+    """确认记下的定位（使用这些定位的脚本执行通过），返回确认的条数"""
+    if not events:
+        return 0
+    count = 0
+    with file_lock(memory_path()):
+        data = load_all()
+        for item in events:
+            entry = data.get(item["key"]) or {}
+            pending = entry.get("pending")
+            if not pending or pending.get("token") != item["token"]:
+                continue
+            del entry["pending"]
+            if entry.get("fingerprint") != pending["fingerprint"]:
+                entry = {"hits": 0}
+            entry.update({
+                "fingerprint": pending["fingerprint"],
+                "source": pending["source"],
+                "token": pending["token"],
+                "updated_at": datetime.now().isoformat(),
+            })
+            for name in ("image", "input"):
+                if pending.get(name):
+                    entry[name] = pending[name]
+            data[item["key"]] = entry
+            count += 1
+        if count:
+            _save_all(data)
+    return count
+
+
+def discard(events: List[Dict[str, str]]) -> int:
+    """丢弃记下的定位（使用这些定位的脚本执行失败），返回丢弃的条数"""
+    if not events:
+        return 0
+    count = 0
+    with file_lock(memory_path()):
+        data = load_all()
+        for item in events:
+            entry = data.get(item["key"])
+            if entry and (entry.get("pending") or {}).get("token") == item["token"]:
+                del entry["pending"]
+                if not entry:
+                    del data[item["key"]]
+                count += 1
+        if count:
+            _save_all(data)
+    return count
+
+
+def evict_used(scope: str) -> int:
+    """
+    清除本进程在该页面（scope 为 page_key）记下和用过的定位（再次遇到验证码，说明上一次没有登录成功），
+    返回清除的条数
+    """
+    used = _used.pop(scope, None)
+    if not used:
+        return 0
+    count = 0
+    with file_lock(memory_path()):
+        data = load_all()
+        entry = data.get(scope)
+        if entry is None:
+            return 0
+        if "pending" in used and (entry.get("pending") or {}).get("token") == used["pending"]:
+            del entry["pending"]
+            count += 1
+        if "confirmed" in used and entry.get("fingerprint") and entry.get("token") == used["confirmed"]:
+            entry = {"pending": entry["pending"]} if "pending" in entry else {}
+            count += 1
+        if count:
+            if entry:
+                data[scope] = entry
+            else:
+                del data[scope]
+            _save_all(data)
+    return count
+
+
+def parse_events(output: str) -> List[Dict[str, str]]:
+    """从测试脚本的输出中读取记下的定位 [{"key", "token"}]"""
+    events = []
+    for line in (output or "").split("\n"):
+        line = line.strip()
+        if line.startswith("{") and LOCATOR_EVENT in line:
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if data.get("event") == LOCATOR_EVENT and data.get("key") and data.get("token"):
+                events.append({"key": data["key"], "token": data["token"]})
+    return events
+
+
+def forget(key: Optional[str] = None) -> int:
+    """清除某个页面（key 为 page_key 或页面 URL）或全部的记录，返回清除的条数"""
+    with file_lock(memory_path()):
+        data = load_all()
+        if key is None:
+            count = len(data)
+            data = {}
+        else:
+            key = key if key in data else page_key(key)
+            count = 1 if data.pop(key, None) is not None else 0
+        if count:
+            _save_all(data)
+    return count
@@ -0,0 +1,515 @@
+"""
+本地验证码识别（CPU，不调用网络）
+
+常见的 4~6 位字符验证码和 "7+8=?" 这类算术验证码，每次都调用 VL 模型识别要多花几秒。
+这里先用本地识别器识别，置信度达到阈值时直接使用结果，只有置信度低时才调用 VL 模型：
+
+- 二值化：按与背景色（出现最多的灰度）的差异取前景，阈值用 Otsu 法，浅色干扰线和噪点被过滤
+- 切分：8 连通域，水平方向重叠的连通域合并（"=" "?" "i" 等），过宽的连通域按列投影最低处切开
+- 匹配：每个字符缩放到 16x16 的灰度向量，与字形模板比较余弦相似度，再按宽高比和相对高度扣分
+  模板来自 Pillow 自带字体按不同字号渲染的字形，以及 VL 模型的答案确认正确（脚本执行通过）后从验证码中学到的字形
+  （保存在 SESSION_STORAGE_PATH/captcha_glyphs.json，同一个网站的字体会越认越准）
+- 算术：识别出 "数字 运算符 数字 =" 时计算结果（O/o 按 0、l/I 按 1、g 按 9、x/× 按乘号处理）
+
+置信度为各字符的匹配得分（相似度和与次优字符的差距）中的最小值，再按整体结构
+（能否解析为算术式、字符数是否在常见范围内、是否有强行切开的粘连字符）折算。
+
+环境变量：
+- CAPTCHA_LOCAL_RECOGNIZER: 设为 false 时不使用本地识别
+- CAPTCHA_LOCAL_MIN_CONFIDENCE: 直接使用本地结果的最低置信度（默认 0.8）
+- CAPTCHA_GLYPH_PATH: 学到的字形文件（默认 SESSION_STORAGE_PATH/captcha_glyphs.json）
+
+只依赖标准库和 Pillow，生成的测试脚本也直接导入本模块。
+各识别方式在样本集上的耗时和准确率见 benchmarks/captcha_bench.py。
+"""
+import io
+import json
+import math
+import os
+import re
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+GLYPH_FILE_NAME = "captcha_glyphs.json"
+DEFAULT_MIN_CONFIDENCE = 0.8
+GRID = 16
+# 学到的字形每个字符最多保留的数量
+MAX_LEARNED_PER_CHAR = 8
+# 二值化前把图片缩放到的最大高度（大图逐像素处理太慢，验证码字符 20~40 像素已足够）
+MAX_HEIGHT = 64
+
+DIGITS = "0123456789"
+LETTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+OPERATORS = "+-*x×÷/="
+TEMPLATE_CHARS = DIGITS + LETTERS + "+-*×÷=?"
+TEMPLATE_SIZES = (10, 14, 20, 28)
+
+# 算术式：数字 运算符 数字 [=] [?]
+_EXPRESSION_RE = re.compile(r"^(\d{1,3})([+\-*/÷×xX])(\d{1,3})=?\??$")
+# 算术式中容易认错的字母
+_EXPRESSION_FIXES = str.maketrans({"O": "0", "o": "0", "D": "0", "l": "1", "I": "1", "i": "1", "g": "9", "q": "9",
+                                   "Z": "2", "z": "2", "S": "5", "s": "5", "B": "8", "X": "*", "x": "*", "×": "*"})
+
+
+def enabled() -> bool:
+    return os.getenv('CAPTCHA_LOCAL_RECOGNIZER', 'true').lower() not in ('false', '0', 'no', 'off')
+
+
+def min_confidence() -> float:
+    try:
+        return float(os.getenv('CAPTCHA_LOCAL_MIN_CONFIDENCE', '') or DEFAULT_MIN_CONFIDENCE)
+    except ValueError:
+        return DEFAULT_MIN_CONFIDENCE
+
+
+def glyph_path() -> str:
+    return os.getenv('CAPTCHA_GLYPH_PATH', '') or os.path.join(
+        os.getenv('SESSION_STORAGE_PATH', '') or os.getcwd(), GLYPH_FILE_NAME
+    )
+
+
+def solve_expression(text: str) -> Optional[str]:
+    """把 "7+8=?" 这样的算术式算出结果，不是算术式（或除不尽）时返回 None"""
+    compact = re.sub(r"\s+", "", text or "")
+    match = _EXPRESSION_RE.match(compact)
+    if not match:
+        fixed = compact.translate(_EXPRESSION_FIXES)
+        # 只有确实像算术式（含运算符和等号/问号）时才按易混字母修正，避免把普通验证码当成算术式
+        if not re.search(r"[+\-*/÷]", fixed) or not re.search(r"[=?]$", fixed):
+            return None
+        match = _EXPRESSION_RE.match(fixed)
+        if not match:
+            return None
+    a, op, b = int(match.group(1)), match.group(2), int(match.group(3))
+    if op == "+":
+        return str(a + b)
+    if op == "-":
+        return str(a - b)
+    if op in "*×xX":
+        return str(a * b)
+    if b == 0 or a % b:
+        return None
+    return str(a // b)
+
+
+class CaptchaRecognizer:
+    """
+    验证码识别器接口
+    recognize 返回 {"text": 识别出的原文, "answer": 应填写的值, "confidence": 0~1,
+                    "backend": 识别器名称, "duration_ms": 耗时}，识别失败时 text/answer 为空字符串
+    """
+    name = ""
+
+    def recognize(self, image_bytes: bytes) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def _result(self, text: str, answer: str, confidence: float, start: float, **extra) -> Dict[str, Any]:
+        return {
+            "text": text,
+            "answer": answer,
+            "confidence": round(max(0.0, min(1.0, confidence)), 3),
+            "backend": self.name,
+            "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+            **extra,
+        }
+
+
+# ---- 图像处理 ----
+
+def _load_gray(image_bytes: bytes):
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(image_bytes))
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+        background.alpha_composite(image)
+        image = background
+    image = image.convert("L")
+    if image.height > MAX_HEIGHT:
+        image = image.resize((max(1, round(image.width * MAX_HEIGHT / image.height)), MAX_HEIGHT), Image.BILINEAR)
+    return image
+
+
+def _otsu(histogram: List[int]) -> int:
+    total = sum(histogram)
+    weighted_total = sum(i * h for i, h in enumerate(histogram))
+    best, threshold = -1.0, 0
+    weight, weighted = 0, 0
+    for i, h in enumerate(histogram):
+        weight += h
+        if weight == 0 or weight == total:
+            continue
+        weighted += i * h
+        mean_low = weighted / weight
+        mean_high = (weighted_total - weighted) / (total - weight)
+        between = weight * (total - weight) * (mean_low - mean_high) ** 2
+        if between > best:
+            best, threshold = between, i
+    return threshold
+
+
+def _ink_map(gray) -> Tuple[List[int], int, int]:
+    """
+    前景强度图（与背景灰度的差，0~255，背景为 0），按行展开
+    背景取出现最多的灰度；差值低于 Otsu 阈值的像素（背景、浅色干扰线）置 0
+    """
+    width, height = gray.size
+    pixels = list(gray.getdata())
+    histogram = gray.histogram()
+    background = max(range(256), key=lambda i: histogram[i])
+    diffs = [abs(p - background) for p in pixels]
+    diff_histogram = [0] * 256
+    for d in diffs:
+        diff_histogram[d] += 1
+    threshold = max(_otsu(diff_histogram), 24)
+    return [d if d > threshold else 0 for d in diffs], width, height
+
+
+def _components(ink: List[int], width: int, height: int) -> List[Dict[str, Any]]:
+    """8 连通域，返回 [{"x0", "x1", "y0", "y1", "pixels": [索引]}]"""
+    seen = bytearray(len(ink))
+    components = []
+    for start, value in enumerate(ink):
+        if not value or seen[start]:
+            continue
+        seen[start] = 1
+        stack, pixels = [start], []
+        while stack:
+            index = stack.pop()
+            pixels.append(index)
+            y, x = divmod(index, width)
+            for dy in (-1, 0, 1):
+                ny = y + dy
+                if ny < 0 or ny >= height:
+                    continue
+                for dx in (-1, 0, 1):
+                    nx = x + dx
+                    if 0 <= nx < width:
+                        neighbor = ny * width + nx
+                        if ink[neighbor] and not seen[neighbor]:
+                            seen[neighbor] = 1
+                            stack.append(neighbor)
+        xs = [i % width for i in pixels]
+        ys = [i // width for i in pixels]
+        components.append({"x0": min(xs), "x1": max(xs), "y0": min(ys), "y1": max(ys), "pixels": pixels})
+    return components
+
+
+def _merge(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
+    return {"x0": min(a["x0"], b["x0"]), "x1": max(a["x1"], b["x1"]),
+            "y0": min(a["y0"], b["y0"]), "y1": max(a["y1"], b["y1"]),
+            "pixels": a["pixels"] + b["pixels"]}
+
+
+def _segment(ink: List[int], width: int, height: int) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    切分字符，返回 (按从左到右排列的字符区域, 强行切开的粘连字符数)
+    """
+    components = _components(ink, width, height)
+    if not components:
+        return [], 0
+    # 远小于最大连通域的是噪点（"-" "." 等小字符的像素数仍明显多于孤立噪点），
+    # 但落在字符正上方/正下方的小点是 "?" "i" 等字符的一部分（小字号时只有一两个像素），并入该字符
+    largest = max(len(c["pixels"]) for c in components)
+    cores = [c for c in components if len(c["pixels"]) >= 3 and len(c["pixels"]) * 25 >= largest]
+    if not cores:
+        return [], 0
+    for speck in (c for c in components if not (len(c["pixels"]) >= 3 and len(c["pixels"]) * 25 >= largest)):
+        center = (speck["x0"] + speck["x1"]) / 2
+        owner = next((k for k, c in enumerate(cores) if c["x0"] <= center <= c["x1"]
+                      and speck["y0"] - c["y1"] <= 3 and c["y0"] - speck["y1"] <= 3), None)
+        if owner is not None:
+            cores[owner] = _merge(cores[owner], speck)
+    components = cores
+    # 水平方向重叠超过较窄者一半的连通域属于同一个字符
+    components.sort(key=lambda c: c["x0"])
+    merged: List[Dict[str, Any]] = []
+    for component in components:
+        if merged:
+            last = merged[-1]
+            overlap = min(last["x1"], component["x1"]) - max(last["x0"], component["x0"]) + 1
+            narrower = min(last["x1"] - last["x0"], component["x1"] - component["x0"]) + 1
+            if overlap * 2 >= narrower:
+                merged[-1] = _merge(last, component)
+                continue
+        merged.append(component)
+
+    # 过宽的区域是粘连的字符，按列投影最低处切开
+    line_height = max(c["y1"] - c["y0"] + 1 for c in merged)
+    glyphs, forced = [], 0
+    for region in merged:
+        pending = [region]
+        while pending:
+            part = pending.pop(0)
+            part_width = part["x1"] - part["x0"] + 1
+            if part_width <= line_height * 1.15 or part_width < 6:
+                glyphs.append(part)
+                continue
+            pieces = _split_wide(part, width, line_height)
+            if pieces is None:
+                glyphs.append(part)
+                continue
+            forced += 1
+            pending = pieces + pending
+    glyphs.sort(key=lambda g: g["x0"])
+    return glyphs, forced
+
+
+def _split_wide(region: Dict[str, Any], width: int, line_height: int) -> Optional[List[Dict[str, Any]]]:
+    columns: Dict[int, List[int]] = {}
+    for index in region["pixels"]:
+        columns.setdefault(index % width, []).append(index)
+    x0, x1 = region["x0"], region["x1"]
+    margin = max(2, round(line_height * 0.3))
+    candidates = range(x0 + margin, x1 - margin + 1)
+    if not candidates:
+        return None
+    middle = (x0 + x1) / 2
+    cut = min(candidates, key=lambda x: (len(columns.get(x, [])), abs(x - middle)))
+    left = [i for i in region["pixels"] if i % width < cut]
+    right = [i for i in region["pixels"] if i % width >= cut]
+    if not left or not right:
+        return None
+    return [_region_of(left, width), _region_of(right, width)]
+
+
+def _region_of(pixels: List[int], width: int) -> Dict[str, Any]:
+    xs = [i % width for i in pixels]
+    ys = [i // width for i in pixels]
+    return {"x0": min(xs), "x1": max(xs), "y0": min(ys), "y1": max(ys), "pixels": pixels}
+
+
+def _glyph_vector(ink: List[int], width: int, region: Dict[str, Any]) -> List[float]:
+    """把字符区域按原宽高比居中缩放到 GRID x GRID，返回归一化的强度向量"""
+    from PIL import Image
+
+    w = region["x1"] - region["x0"] + 1
+    h = region["y1"] - region["y0"] + 1
+    crop = Image.new("L", (w, h), 0)
+    data = crop.load()
+    for index in region["pixels"]:
+        y, x = divmod(index, width)
+        data[x - region["x0"], y - region["y0"]] = ink[index]
+    scale = (GRID - 2) / max(w, h)
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    canvas = Image.new("L", (GRID, GRID), 0)
+    canvas.paste(crop.resize(size, Image.BILINEAR), ((GRID - size[0]) // 2, (GRID - size[1]) // 2))
+    vector = [float(v) for v in canvas.getdata()]
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def _describe(ink: List[int], width: int, region: Dict[str, Any], line_height: int) -> Dict[str, Any]:
+    w = region["x1"] - region["x0"] + 1
+    h = region["y1"] - region["y0"] + 1
+    return {
+        "vector": _glyph_vector(ink, width, region),
+        "aspect": w / h,
+        "height": h / max(1, line_height),
+    }
+
+
+# ---- 字形模板 ----
+
+def _fonts():
+    """可用于渲染模板的字体：Pillow 自带字体的不同字号（旧版本 Pillow 只有一个位图字体）"""
+    from PIL import ImageFont
+
+    fonts = []
+    for size in TEMPLATE_SIZES:
+        try:
+            fonts.append(ImageFont.load_default(size=size))
+        except TypeError:
+            return [ImageFont.load_default()]
+    for name in ("DejaVuSans.ttf", "arial.ttf", "Arial.ttf"):
+        try:
+            fonts.extend(ImageFont.truetype(name, size) for size in TEMPLATE_SIZES[1:])
+            break
+        except OSError:
+            continue
+    return fonts
+
+
+def _render_templates() -> List[Dict[str, Any]]:
+    from PIL import Image, ImageDraw
+
+    templates = []
+    for font in _fonts():
+        # 参考高度：数字 8 的高度（验证码中最高的字符通常是数字或大写字母）
+        reference = None
+        for char in "8" + TEMPLATE_CHARS:
+            image = Image.new("L", (64, 64), 0)
+            ImageDraw.Draw(image).text((16, 16), char, fill=255, font=font)
+            bbox = image.getbbox()
+            if not bbox:
+                continue
+            ink = list(image.getdata())
+            region = _region_of([i for i, v in enumerate(ink) if v], 64)
+            if reference is None:
+                reference = region["y1"] - region["y0"] + 1
+                if char == "8":
+                    continue
+            templates.append({"char": char, **_describe(ink, 64, region, reference)})
+    return templates
+
+
+class LocalCaptchaRecognizer(CaptchaRecognizer):
+    """切分字符 + 模板匹配 + 算术求值"""
+    name = "local"
+
+    def __init__(self):
+        self._templates: Optional[List[Dict[str, Any]]] = None
+        self._learned_mtime: Optional[float] = None
+        self._learned: List[Dict[str, Any]] = []
+
+    # -- 模板 --
+
+    def templates(self) -> List[Dict[str, Any]]:
+        if self._templates is None:
+            self._templates = _render_templates()
+        return self._templates + self._load_learned()
+
+    def _load_learned(self) -> List[Dict[str, Any]]:
+        path = glyph_path()
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            self._learned, self._learned_mtime = [], None
+            return []
+        if mtime != self._learned_mtime:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self._learned = [
+                    {"char": char, "learned": True, **glyph}
+                    for char, glyphs in (data.get("glyphs") or {}).items() for glyph in glyphs
+                ]
+            except (OSError, ValueError, AttributeError):
+                self._learned = []
+            self._learned_mtime = mtime
+        return self._learned
+
+    def learn(self, image_bytes: bytes, text: str) -> bool:
+        """
+        用确认正确的答案（VL 模型识别、使用该答案的脚本执行通过，见 captcha_cache.confirm）学习验证码中的字形
+        只学习普通字符验证码（切分出的字符数和答案长度一致时），算术验证码的答案不是原文，不学习
+        """
+        text = (text or "").strip()
+        if not text or not text.isalnum() or not text.isascii():
+            return False
+        try:
+            ink, width, height = _ink_map(_load_gray(image_bytes))
+            regions, forced = _segment(ink, width, height)
+        except Exception:
+            return False
+        if forced or len(regions) != len(text):
+            return False
+        line_height = max(r["y1"] - r["y0"] + 1 for r in regions)
+        path = glyph_path()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        glyphs = data.setdefault("glyphs", {})
+        for char, region in zip(text, regions):
+            glyph = _describe(ink, width, region, line_height)
+            glyph["vector"] = [round(v, 4) for v in glyph["vector"]]
+            glyph["aspect"] = round(glyph["aspect"], 4)
+            glyph["height"] = round(glyph["height"], 4)
+            glyphs[char] = (glyphs.get(char, []) + [glyph])[-MAX_LEARNED_PER_CHAR:]
+        data["updated_at"] = datetime.now().isoformat()
+        directory = os.path.dirname(path)
+        try:
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        except OSError:
+            return False
+        return True
+
+    # -- 识别 --
+
+    @staticmethod
+    def _score(glyph: Dict[str, Any], template: Dict[str, Any]) -> float:
+        similarity = sum(a * b for a, b in zip(glyph["vector"], template["vector"]))
+        aspect_penalty = min(0.3, abs(math.log((glyph["aspect"] + 0.05) / (template["aspect"] + 0.05))) * 0.25)
+        height_penalty = min(0.3, abs(glyph["height"] - template["height"]) * 0.4)
+        return similarity - aspect_penalty - height_penalty
+
+    def _classify(self, glyph: Dict[str, Any], templates: List[Dict[str, Any]]) -> Tuple[str, float, float]:
+        """返回 (字符, 最优得分, 与次优的其它字符的得分差)"""
+        best: Dict[str, float] = {}
+        for template in templates:
+            score = self._score(glyph, template)
+            if template.get("learned"):
+                score += 0.02
+            if score > best.get(template["char"], -1.0):
+                best[template["char"]] = score
+        ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)
+        char, top = ranked[0]
+        runner_up = next((s for c, s in ranked[1:] if c.lower() != char.lower()), top - 1.0)
+        return char, top, top - runner_up
+
+    def recognize(self, image_bytes: bytes) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            ink, width, height = _ink_map(_load_gray(image_bytes))
+            regions, forced = _segment(ink, width, height)
+        except Exception as e:
+            return self._result("", "", 0.0, start, error=str(e))
+        if not regions or len(regions) > 10:
+            return self._result("", "", 0.0, start, glyphs=len(regions))
+
+        templates = self.templates()
+        line_height = max(r["y1"] - r["y0"] + 1 for r in regions)
+        chars, confidences = [], []
+        for region in regions:
+            char, top, margin = self._classify(_describe(ink, width, region, line_height), templates)
+            chars.append(char)
+            # 相似度 0.6 以下基本是认错、0.85 以上基本认对；和次优字符差距很小时（6/8、O/0 等）再打折扣
+            confidences.append(min(max(0.0, (top - 0.6) / 0.25), 1.0) * min(1.0, 0.7 + margin * 5))
+        text = "".join(chars)
+        confidence = min(confidences)
+
+        answer = solve_expression(text)
+        if answer is not None:
+            # 能解析为算术式本身就说明各字符基本认对了（认错的字符很难恰好组成合法的算术式）
+            confidence = math.sqrt(confidence)
+        else:
+            answer = text
+            if any(c in OPERATORS + "?" for c in text):
+                # 有运算符却不能算出结果，多半是认错了字符
+                confidence *= 0.3
+            elif not 4 <= len(text) <= 6:
+                confidence *= 0.6
+        if forced:
+            confidence *= 0.7 ** forced
+        return self._result(text, answer, confidence, start, glyphs=len(regions))
+
+
+_local_recognizer: Optional[LocalCaptchaRecognizer] = None
+
+
+def get_local_recognizer() -> LocalCaptchaRecognizer:
+    global _local_recognizer
+    if _local_recognizer is None:
+        _local_recognizer = LocalCaptchaRecognizer()
+    return _local_recognizer
+
+
+def recognize_locally(image_bytes: bytes) -> Optional[Dict[str, Any]]:
+    """
+    本地识别，置信度达到阈值时返回识别结果（附带 "accepted": True），否则返回带 "accepted": False 的结果；
+    未启用本地识别时返回 None
+    """
+    if not enabled():
+        return None
+    result = get_local_recognizer().recognize(image_bytes)
+    result["accepted"] = bool(result["answer"]) and result["confidence"] >= min_confidence()
+    return result
@@ -0,0 +1,281 @@
+"""
+HAR 录制和回放执行模式
+
+对较慢或不稳定的测试环境做回归时，可以在执行场景时选择网络模式：
+
+    live    正常访问网络（默认）
+    record  录制：用例通过时把网络请求保存为该用例的 HAR 文件
+    replay  回放：用 page.context.route_from_har 从 HAR 文件返回响应，没录到的请求照常访问网络
+
+HAR 文件按用例保存在 HAR_STORAGE_PATH（默认 SESSION_STORAGE_PATH/har）下：
+
+    case_<用例ID>.har    录制的网络请求
+    case_<用例ID>.json   {"recorded_at", "script_hash", "entries", "replays", "last_replay": {"at", "requests", "misses"}}
+
+录制时先写到临时文件，只有用例通过时才替换原来的 HAR，失败的录制不会覆盖可用的录制。
+回放时统计没有录到的请求数，和录制时间、录制后脚本是否修改一起判断录制是否过期（staleness），
+过期的录制仍然回放（没录到的请求会访问网络），由调用方提示重新录制。
+
+执行器通过环境变量把模式和 HAR 路径传给测试脚本子进程，脚本中调用 apply_network_mode / finish_network_mode。
+只依赖标准库，生成的测试脚本也直接导入本模块。
+"""
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+MODES = ("live", "record", "replay")
+MODE_ENV = "E2E_NETWORK_MODE"
+HAR_PATH_ENV = "E2E_HAR_PATH"
+REPLAY_EVENT = "har_replay"
+
+DEFAULT_MAX_AGE_DAYS = 7
+DEFAULT_MAX_MISS_RATIO = 0.1
+
+
+# ---- 执行器使用：HAR 文件和录制信息 ----
+
+def storage_dir() -> str:
+    return os.getenv('HAR_STORAGE_PATH', '') or os.path.join(
+        os.getenv('SESSION_STORAGE_PATH', '') or os.getcwd(), 'har'
+    )
+
+
+def har_path(case_id: Any) -> str:
+    return os.path.join(storage_dir(), f"case_{case_id}.har")
+
+
+def _meta_path(case_id: Any) -> str:
+    return os.path.join(storage_dir(), f"case_{case_id}.json")
+
+
+def script_hash(script: str) -> str:
+    return hashlib.sha1((script or "").encode("utf-8")).hexdigest()[:16]
+
+
+def load_meta(case_id: Any) -> Optional[Dict[str, Any]]:
+    path = _meta_path(case_id)
+    if not os.path.exists(path) or not os.path.exists(har_path(case_id)):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _save_meta(case_id: Any, meta: Dict[str, Any]) -> None:
+    path = _meta_path(case_id)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+    except OSError as e:
+        print(f'[HarReplay] 保存录制信息失败: {e}')
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, '') or default)
+    except ValueError:
+        return default
+
+
+def staleness(case_id: Any, script: str = "") -> Dict[str, Any]:
+    """
+    用例录制的状态
+    Returns:
+        {"exists": 是否有录制, "stale": 是否过期, "reasons": [过期原因], "recorded_at", "age_days",
+         "entries", "replays", "last_replay"}
+    """
+    meta = load_meta(case_id)
+    if meta is None:
+        return {"exists": False, "stale": True, "reasons": ["没有录制"]}
+
+    reasons = []
+    age_days = (time.time() - meta.get("recorded_ts", 0)) / 86400
+    max_age_days = _env_float('HAR_MAX_AGE_DAYS', DEFAULT_MAX_AGE_DAYS)
+    if max_age_days > 0 and age_days > max_age_days:
+        reasons.append(f"录制已超过 {max_age_days:g} 天")
+    if script and meta.get("script_hash") != script_hash(script):
+        reasons.append("录制后脚本已修改")
+    last_replay = meta.get("last_replay") or {}
+    if last_replay.get("requests"):
+        miss_ratio = last_replay.get("misses", 0) / last_replay["requests"]
+        if miss_ratio > _env_float('HAR_MAX_MISS_RATIO', DEFAULT_MAX_MISS_RATIO):
+            reasons.append(f"上次回放 {last_replay['misses']}/{last_replay['requests']} 个请求没有录到")
+
+    return {
+        "exists": True,
+        "stale": bool(reasons),
+        "reasons": reasons,
+        "recorded_at": meta.get("recorded_at"),
+        "age_days": round(age_days, 2),
+        "entries": meta.get("entries", 0),
+        "replays": meta.get("replays", 0),
+        "last_replay": last_replay or None,
+    }
+
+
+def prepare(case_id: Any, mode: str) -> Tuple[str, Dict[str, str]]:
+    """
+    准备一次执行的网络模式
+    Returns:
+        (实际使用的模式, 传给测试脚本子进程的环境变量)；回放但没有录制时按 live 执行
+    """
+    if mode not in MODES or mode == "live" or case_id is None:
+        return "live", {}
+    if mode == "replay":
+        if load_meta(case_id) is None:
+            print(f"   [HAR] 用例 {case_id} 没有录制，按正常网络执行")
+            return "live", {}
+        return "replay", {MODE_ENV: "replay", HAR_PATH_ENV: har_path(case_id)}
+    os.makedirs(storage_dir(), exist_ok=True)
+    temp_path = f"{har_path(case_id)}.recording"
+    if os.path.exists(temp_path):
+        os.unlink(temp_path)
+    return "record", {MODE_ENV: "record", HAR_PATH_ENV: temp_path}
+
+
+def finish(case_id: Any, mode: str, script: str, output: str, passed: bool) -> Dict[str, Any]:
+    """
+    执行结束后：录制模式下用例通过时保存 HAR 和录制信息，回放模式下记录没有录到的请求数
+    Returns:
+        {"mode", "saved"（录制模式）, "replay"（回放统计）, 以及 staleness() 的结果}
+    """
+    info: Dict[str, Any] = {"mode": mode}
+    if mode == "record":
+        temp_path = f"{har_path(case_id)}.recording"
+        saved = passed and os.path.exists(temp_path)
+        if saved:
+            os.replace(temp_path, har_path(case_id))
+            _save_meta(case_id, {
+                "recorded_at": datetime.now().isoformat(),
+                "recorded_ts": time.time(),
+                "script_hash": script_hash(script),
+                "entries": _count_entries(har_path(case_id)),
+                "replays": 0,
+                "last_replay": None,
+            })
+            print(f"   [HAR] 已保存用例 {case_id} 的录制")
+        elif not passed:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            print(f"   [HAR] 用例 {case_id} 未通过，不保存录制")
+        else:
+            print(f"   [HAR] 用例 {case_id} 的脚本没有录制 HAR（agent-browser 方案或本功能之前生成的脚本），请重新生成用例")
+        info["saved"] = saved
+    elif mode == "replay":
+        replay = parse_replay_event(output)
+        meta = load_meta(case_id)
+        if replay and meta is not None:
+            meta["replays"] = meta.get("replays", 0) + 1
+            meta["last_replay"] = {"at": datetime.now().isoformat(), "passed": passed, **replay}
+            _save_meta(case_id, meta)
+        info["replay"] = replay
+    info.update(staleness(case_id, script))
+    return info
+
+
+def forget(case_id: Any) -> bool:
+    """删除用例的录制"""
+    removed = False
+    for path in (har_path(case_id), _meta_path(case_id)):
+        if os.path.exists(path):
+            os.unlink(path)
+            removed = True
+    return removed
+
+
+def _count_entries(path: str) -> int:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return len(json.load(f).get("log", {}).get("entries", []))
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def parse_replay_event(output: str) -> Optional[Dict[str, int]]:
+    """从测试脚本的输出中读取回放统计"""
+    for line in (output or "").split("\n"):
+        line = line.strip()
+        if line.startswith("{") and REPLAY_EVENT in line:
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if data.get("event") == REPLAY_EVENT:
+                return {"requests": int(data.get("requests", 0)), "misses": int(data.get("misses", 0))}
+    return None
+
+
+# ---- 测试脚本使用 ----
+
+class NetworkReplay:
+    """测试脚本中一次执行的网络模式"""
+
+    def __init__(self, page, mode: str, path: str):
+        self.page = page
+        self.mode = mode
+        self.path = path
+        self.recorded: Set[Tuple[str, str]] = set()
+        self.requests = 0
+        self.misses: List[str] = []
+
+    def _on_request_finished(self, request) -> None:
+        # 只统计完成的请求（被资源拦截方案拦截的请求录制时也没有响应）
+        if request.url.startswith(("data:", "blob:")):
+            return
+        self.requests += 1
+        if (request.method, request.url) not in self.recorded:
+            self.misses.append(request.url)
+
+
+def _recorded_requests(path: str) -> Set[Tuple[str, str]]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = json.load(f).get("log", {}).get("entries", [])
+    except (OSError, ValueError, AttributeError):
+        return set()
+    return {(e["request"]["method"], e["request"]["url"]) for e in entries if "request" in e}
+
+
+async def apply_network_mode(page) -> Optional[NetworkReplay]:
+    """按执行器设置的环境变量录制或回放网络请求（在第一次导航前、资源拦截方案之后调用），正常网络时返回 None"""
+    mode = os.getenv(MODE_ENV, '')
+    path = os.getenv(HAR_PATH_ENV, '')
+    if mode not in ("record", "replay") or not path:
+        return None
+    state = NetworkReplay(page, mode, path)
+    context = page.context
+    if mode == "record":
+        # 只记录回放需要的内容，上下文关闭时写入文件
+        await context.route_from_har(path, update=True, update_content="embed", update_mode="minimal")
+    else:
+        state.recorded = _recorded_requests(path)
+        await context.route_from_har(path, not_found="fallback")
+        context.on("requestfinished", state._on_request_finished)
+    print(f"[HAR] 网络模式: {mode} ({path})", flush=True)
+    return state
+
+
+async def finish_network_mode(state: Optional[NetworkReplay]) -> None:
+    """
+    结束录制或回放（在保存登录状态之后、关闭浏览器之前调用）
+    录制模式下关闭上下文写入 HAR 文件，回放模式下输出没有录到的请求数
+    """
+    if state is None:
+        return
+    try:
+        if state.mode == "record":
+            await state.page.context.close()
+        else:
+            print(json.dumps({
+                "event": REPLAY_EVENT, "requests": state.requests, "misses": len(state.misses),
+                "missed_urls": state.misses[:20],
+            }, ensure_ascii=False), flush=True)
+    except Exception as e:
+        print(f"[HAR] 结束{state.mode}失败: {e}", flush=True)
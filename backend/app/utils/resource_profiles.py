@@ -0,0 +1,228 @@
+"""
+生成的测试脚本和页面内容获取使用的资源拦截方案
+
+页面加载时会下载所有图片、字体、视频、统计上报和第三方脚本，其中大部分与测试无关，
+却占了导航时间和 networkidle 等待的很大一部分。这里按场景选择的方案通过 page.route 拦截请求：
+
+    none            不拦截（不注册 route，保留浏览器 HTTP 缓存）
+    no-media        拦截图片、音视频、字体
+    no-third-party  拦截第三方域名的请求和统计/广告上报
+    aggressive      以上全部拦截（样式表保留：元素可见性判断和 Computer-Use 的坐标依赖页面布局）
+
+- 验证码请求始终放行：URL 中带 captcha、yzm、kaptcha、geetest 等关键字的请求，
+  以及匹配 RESOURCE_ALLOW_PATTERN（正则）的请求（验证码接口地址没有这些关键字时在这里配置）
+- 主框架的页面导航始终放行，导航到的站点（如单点登录跳转）之后也按第一方处理
+
+无论哪种方案都统计本次运行的请求数、拦截数、传输字节数（响应头 + 响应体）和首个页面的加载耗时，
+测试脚本结束时以指标事件行输出（见 app/core/metrics.py），页面内容获取随结果返回。
+
+只依赖标准库，生成的测试脚本也直接导入本模块。
+"""
+import asyncio
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+DEFAULT_PROFILE = "none"
+
+PROFILES: Dict[str, Dict[str, Any]] = {
+    "none": {
+        "description": "不拦截",
+        "resource_types": (),
+        "trackers": False,
+        "third_party": False,
+    },
+    "no-media": {
+        "description": "拦截图片、音视频、字体",
+        "resource_types": ("image", "media", "font"),
+        "trackers": False,
+        "third_party": False,
+    },
+    "no-third-party": {
+        "description": "拦截第三方域名的请求和统计/广告上报",
+        "resource_types": (),
+        "trackers": True,
+        "third_party": True,
+    },
+    "aggressive": {
+        "description": "拦截图片、音视频、字体、统计/广告上报和第三方请求",
+        "resource_types": ("image", "media", "font", "texttrack", "manifest"),
+        "trackers": True,
+        "third_party": True,
+    },
+}
+
+_CAPTCHA_URL_RE = re.compile(
+    r"captcha|yzm|kaptcha|geetest|verif(?:y|ication)code|checkcode|validatecode|vcode|authcode|验证码",
+    re.IGNORECASE
+)
+_TRACKER_HOST_RE = re.compile(
+    r"(?:^|\.)(?:google-analytics\.com|googletagmanager\.com|doubleclick\.net|googlesyndication\.com|"
+    r"hm\.baidu\.com|cnzz\.com|51\.la|growingio\.com|sensorsdata\.cn|umeng\.com|hotjar\.com|clarity\.ms|"
+    r"facebook\.net|segment\.io|mixpanel\.com|bat\.bing\.com)$",
+    re.IGNORECASE
+)
+# 两级公共后缀（按最后三段计算站点）
+_MULTI_PART_SUFFIXES = {
+    "com.cn", "net.cn", "org.cn", "gov.cn", "edu.cn", "ac.cn",
+    "com.hk", "com.tw", "co.uk", "org.uk", "ac.uk", "co.jp", "co.kr", "com.au",
+}
+
+
+def normalize_profile(name: Optional[str]) -> str:
+    """方案名称（未知名称按 none 处理）"""
+    name = (name or DEFAULT_PROFILE).strip().lower()
+    if name not in PROFILES:
+        print(f"[ResourceProfile] 未知的资源拦截方案 {name}，不拦截")
+        return DEFAULT_PROFILE
+    return name
+
+
+def site_of(url: str) -> str:
+    """URL 所属的站点（可注册域名，IP 和 localhost 按主机名）"""
+    host = (urlparse(url).hostname or "").lower()
+    if not host or ":" in host or host.replace(".", "").isdigit():
+        return host
+    labels = host.split(".")
+    count = 3 if ".".join(labels[-2:]) in _MULTI_PART_SUFFIXES else 2
+    return ".".join(labels[-count:])
+
+
+def is_captcha_request(url: str) -> bool:
+    if _CAPTCHA_URL_RE.search(url):
+        return True
+    allow_pattern = os.getenv('RESOURCE_ALLOW_PATTERN', '')
+    if allow_pattern:
+        try:
+            return re.search(allow_pattern, url) is not None
+        except re.error:
+            return False
+    return False
+
+
+def block_reason(profile: str, url: str, resource_type: str, first_party: set) -> Optional[str]:
+    """按方案判断是否拦截请求，返回拦截原因（放行时返回 None）"""
+    rules = PROFILES[profile]
+    if url.startswith(("data:", "blob:")) or is_captcha_request(url):
+        return None
+    if resource_type in rules["resource_types"]:
+        return resource_type
+    host = (urlparse(url).hostname or "").lower()
+    if rules["trackers"] and _TRACKER_HOST_RE.search(host):
+        return "tracker"
+    if rules["third_party"] and site_of(url) not in first_party:
+        return "third_party"
+    return None
+
+
+class ResourceStats:
+    """一次运行的请求、拦截、传输字节数和页面加载耗时统计"""
+
+    def __init__(self, profile: str, target_url: str = ""):
+        self.profile = profile
+        self.first_party = {site_of(target_url)} if target_url else set()
+        self.requests = 0
+        self.blocked: Dict[str, int] = {}
+        self.transfer_bytes = 0
+        self.loads: List[Dict[str, float]] = []
+        self.started_at = time.time()
+        self._pending: List[asyncio.Future] = []
+
+    async def _handle_route(self, route) -> None:
+        request = route.request
+        try:
+            if request.is_navigation_request() and request.frame.parent_frame is None:
+                self.first_party.add(site_of(request.url))
+                reason = None
+            else:
+                reason = block_reason(self.profile, request.url, request.resource_type, self.first_party)
+            if reason:
+                self.blocked[reason] = self.blocked.get(reason, 0) + 1
+                await route.abort("blockedbyclient")
+            else:
+                # 交给更早注册的处理，没有时照常请求（Playwright 先执行最后注册的 route，
+                # HAR 回放的 route_from_har 在本方案之后注册，已先于这里执行，没录到的请求才回退到这里）
+                await route.fallback()
+        except Exception:
+            # 页面已关闭或请求已被处理
+            pass
+
+    def _on_request(self, request) -> None:
+        self.requests += 1
+
+    def _on_request_finished(self, request) -> None:
+        self._pending.append(asyncio.ensure_future(self._add_sizes(request)))
+
+    async def _add_sizes(self, request) -> None:
+        try:
+            sizes = await request.sizes()
+            self.transfer_bytes += max(sizes.get("responseHeadersSize", 0), 0) + max(sizes.get("responseBodySize", 0), 0)
+        except Exception:
+            pass
+
+    def _on_load(self, page) -> None:
+        self._pending.append(asyncio.ensure_future(self._add_load(page)))
+
+    async def _add_load(self, page) -> None:
+        try:
+            timing = await page.evaluate("""() => {
+                const nav = performance.getEntriesByType('navigation')[0];
+                return nav ? {load_ms: nav.loadEventStart, dom_content_loaded_ms: nav.domContentLoadedEventEnd} : null;
+            }""")
+            if timing:
+                self.loads.append({key: round(value, 1) for key, value in timing.items()})
+        except Exception:
+            pass
+
+    async def finish(self) -> Dict[str, Any]:
+        """等待还没统计完的请求，返回汇总结果"""
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+            self._pending = []
+        first_load = self.loads[0] if self.loads else {}
+        return {
+            "profile": self.profile,
+            "requests": self.requests,
+            "blocked": sum(self.blocked.values()),
+            "blocked_by": dict(self.blocked),
+            "transfer_bytes": self.transfer_bytes,
+            "load_ms": first_load.get("load_ms"),
+            "dom_content_loaded_ms": first_load.get("dom_content_loaded_ms"),
+            "page_loads": len(self.loads),
+            "duration_ms": round((time.time() - self.started_at) * 1000),
+        }
+
+
+async def apply_resource_profile(page, profile: str = DEFAULT_PROFILE, target_url: str = "") -> ResourceStats:
+    """
+    在页面所在的上下文上应用资源拦截方案并开始统计（在第一次导航前调用）
+    none 方案不注册 route（注册后 Playwright 会停用 HTTP 缓存），只做统计
+    """
+    stats = ResourceStats(normalize_profile(profile), target_url)
+    context = page.context
+    if stats.profile != "none":
+        await context.route("**/*", stats._handle_route)
+    context.on("request", stats._on_request)
+    context.on("requestfinished", stats._on_request_finished)
+    page.on("load", stats._on_load)
+    return stats
+
+
+async def report_resource_stats(stats: Optional[ResourceStats], source: str = "test_script") -> Optional[Dict[str, Any]]:
+    """汇总本次运行的资源统计并记录指标（测试脚本子进程中输出为事件行，由执行器汇总），不抛出异常"""
+    if stats is None:
+        return None
+    try:
+        summary = await stats.finish()
+    except Exception:
+        return None
+    print(f"[ResourceProfile] 方案 {summary['profile']}: 请求 {summary['requests']} 个，拦截 {summary['blocked']} 个，"
+          f"传输 {summary['transfer_bytes']} 字节，首个页面加载 {summary['load_ms']}ms", flush=True)
+    try:
+        from ..core.metrics import record_page_resources
+        record_page_resources(source=source, **summary)
+    except Exception:
+        pass
+    return summary
@@ -0,0 +1,157 @@
+"""
+失败时保留的执行产物（Playwright trace 和失败截图）
+
+测试脚本打开页面后始终开启 Playwright tracing（截图、DOM 快照、源码），结束时：
+
+    通过  tracing.stop() 不指定路径，丢弃 trace，不写任何文件
+    失败  在本次执行的产物目录中保存 trace.zip 和 error_screenshot.png
+
+失败后不需要重跑，用 `playwright show-trace trace.zip`（或 https://trace.playwright.dev）
+查看每一步的截图、DOM 快照、网络请求和控制台输出。
+
+产物目录按执行创建在 ARTIFACT_STORAGE_PATH（默认 SESSION_STORAGE_PATH/artifacts）下：
+
+    run_<时间>_<随机串>/trace.zip
+    run_<时间>_<随机串>/error_screenshot.png
+
+执行器通过环境变量把产物目录传给测试脚本子进程（目录在失败时才创建），脚本保存产物后输出
+{"event": "failure_artifacts", "dir": ..., "trace": ..., "screenshot": ...} 事件行，
+执行器据此在测试报告中记录产物目录（TestReport.artifact_dir，相对 ARTIFACT_STORAGE_PATH）。
+
+只依赖标准库，生成的测试脚本也直接导入本模块。
+"""
+import json
+import os
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+ARTIFACT_DIR_ENV = "E2E_ARTIFACT_DIR"
+TRACE_ENV = "E2E_FAILURE_TRACE"
+ARTIFACTS_EVENT = "failure_artifacts"
+TRACE_FILE_NAME = "trace.zip"
+SCREENSHOT_FILE_NAME = "error_screenshot.png"
+
+
+# ---- 执行器使用 ----
+
+def storage_dir() -> str:
+    return os.getenv('ARTIFACT_STORAGE_PATH', '') or os.path.join(
+        os.getenv('SESSION_STORAGE_PATH', '') or os.getcwd(), 'artifacts'
+    )
+
+
+def new_run_dir() -> str:
+    """本次执行的产物目录（只生成路径，失败时才由测试脚本创建）"""
+    name = f"run_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+    return os.path.join(storage_dir(), name)
+
+
+def prepare(trace_enabled: bool = True) -> Tuple[str, Dict[str, str]]:
+    """
+    准备一次执行的产物目录
+    Returns:
+        (产物目录, 传给测试脚本子进程的环境变量)
+    """
+    run_dir = new_run_dir()
+    return run_dir, {ARTIFACT_DIR_ENV: run_dir, TRACE_ENV: "1" if trace_enabled else "0"}
+
+
+def parse_artifacts_event(output: str) -> Optional[Dict[str, Any]]:
+    """
+    从测试脚本的输出中读取保存的失败产物
+    Returns:
+        {"dir": 相对 storage_dir() 的目录, "trace": 文件名或 None, "screenshot": 文件名或 None}，没有保存时返回 None
+    """
+    for line in (output or "").split("\n"):
+        line = line.strip()
+        if line.startswith("{") and ARTIFACTS_EVENT in line:
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if data.get("event") == ARTIFACTS_EVENT and data.get("dir"):
+                run_dir = data["dir"]
+                try:
+                    relative_dir = os.path.relpath(run_dir, storage_dir())
+                except ValueError:
+                    relative_dir = run_dir
+                if relative_dir.startswith(".."):
+                    relative_dir = run_dir
+                return {
+                    "dir": relative_dir.replace("\\", "/"),
+                    "trace": os.path.basename(data["trace"]) if data.get("trace") else None,
+                    "screenshot": os.path.basename(data["screenshot"]) if data.get("screenshot") else None,
+                }
+    return None
+
+
+# ---- 测试脚本使用 ----
+
+class RunTrace:
+    """测试脚本中一次执行的 tracing 状态"""
+
+    def __init__(self, page, run_dir: str, tracing: bool):
+        self.page = page
+        self.run_dir = run_dir
+        self.tracing = tracing
+        self.finished = False
+
+
+async def start_run_trace(page) -> RunTrace:
+    """开始记录 trace（在第一次导航前、资源拦截方案和 HAR 模式之后调用）"""
+    run_dir = os.getenv(ARTIFACT_DIR_ENV, '') or os.path.join(
+        os.getcwd(), 'artifacts', f"run_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+    )
+    state = RunTrace(page, run_dir, os.getenv(TRACE_ENV, '1') != '0')
+    if state.tracing:
+        try:
+            await page.context.tracing.start(screenshots=True, snapshots=True, sources=True)
+        except Exception as e:
+            print(f"[Trace] 开启 tracing 失败: {e}", flush=True)
+            state.tracing = False
+    return state
+
+
+async def discard_run_trace(state: Optional[RunTrace]) -> None:
+    """执行通过：丢弃 trace，不写文件（在关闭上下文之前调用）"""
+    if state is None or state.finished:
+        return
+    state.finished = True
+    if state.tracing:
+        try:
+            await state.page.context.tracing.stop()
+        except Exception:
+            pass
+
+
+async def keep_failure_artifacts(state: Optional[RunTrace]) -> Optional[Dict[str, Any]]:
+    """
+    执行失败：在产物目录中保存失败截图和 trace，输出事件行（在关闭上下文之前调用，不抛出异常）
+    已经保存或丢弃过时不再处理（动作出错时保存后，外层的异常处理会再次调用）
+    """
+    if state is None or state.finished:
+        return None
+    state.finished = True
+    artifacts: Dict[str, Any] = {"event": ARTIFACTS_EVENT, "dir": state.run_dir, "trace": None, "screenshot": None}
+    try:
+        os.makedirs(state.run_dir, exist_ok=True)
+    except OSError as e:
+        print(f"[Trace] 创建产物目录失败: {e}", flush=True)
+        return None
+    screenshot_path = os.path.join(state.run_dir, SCREENSHOT_FILE_NAME)
+    try:
+        await state.page.screenshot(path=screenshot_path)
+        artifacts["screenshot"] = screenshot_path
+    except Exception as e:
+        print(f"[Trace] 保存失败截图失败: {e}", flush=True)
+    if state.tracing:
+        trace_path = os.path.join(state.run_dir, TRACE_FILE_NAME)
+        try:
+            await state.page.context.tracing.stop(path=trace_path)
+            artifacts["trace"] = trace_path
+        except Exception as e:
+            print(f"[Trace] 保存 trace 失败: {e}", flush=True)
+    if artifacts["trace"] or artifacts["screenshot"]:
+        print(json.dumps(artifacts, ensure_ascii=False), flush=True)
+    return artifacts
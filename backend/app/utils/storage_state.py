@@ -0,0 +1,215 @@
+"""
+登录状态的保存和恢复（基于 Playwright storage_state）
+
+登录状态保存在一个带版本号的文件中（默认 SESSION_STORAGE_PATH/saved_storage_state.json）：
+
+    {
+        "version": 1,
+        "saved_at": "2026-01-01T00:00:00",
+        "url": 保存时的页面,
+        "storage_state": {"cookies": [...], "origins": [{"origin", "localStorage": [{"name", "value"}]}]},
+        "session_storage": {origin: {key: value}}
+    }
+
+恢复时 storage_state 作为创建上下文的参数（cookies 和 localStorage 在第一次导航前就已生效），
+Playwright 不保存 sessionStorage，由上下文的初始化脚本在页面脚本运行前写入，不需要刷新页面。
+
+旧版本分别保存的 saved_cookies.json / saved_localstorage.json / saved_sessionstorage.json
+在没有新文件时仍可读取（localStorage 和 sessionStorage 归属到目标页面所在的源）。
+
+只依赖标准库，生成的测试脚本也直接导入本模块。
+"""
+import json
+import os
+import sys
+from datetime import datetime
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+
+STATE_FILE_NAME = "saved_storage_state.json"
+STATE_VERSION = 1
+LEGACY_FILE_NAMES = {
+    "cookies": "saved_cookies.json",
+    "local_storage": "saved_localstorage.json",
+    "session_storage": "saved_sessionstorage.json",
+}
+
+# 初始化脚本：每个标签页只写入一次，之后页面自己对 storage 的修改不会被覆盖
+_RESTORE_MARKER = "__e2e_state_restored__"
+_RESTORE_JS = """(data => {
+    const entry = data[location.origin];
+    if (!entry) return;
+    try {
+        if (sessionStorage.getItem(%(marker)s)) return;
+        for (const [k, v] of Object.entries(entry.sessionStorage || {})) sessionStorage.setItem(k, v);
+        for (const [k, v] of Object.entries(entry.localStorage || {})) localStorage.setItem(k, v);
+        sessionStorage.setItem(%(marker)s, "1");
+    } catch (e) {}
+})(%(data)s)"""
+
+
+def _log(message: str) -> None:
+    # 输出到 stderr：页面获取脚本的 stdout 只能是结果 JSON
+    print(f'[StorageState] {message}', file=sys.stderr)
+
+
+def url_origin(url: str) -> str:
+    """URL 所在的源（scheme://host[:port]），不是 http(s) 地址时为空字符串"""
+    parsed = urlparse(url or "")
+    return f"{parsed.scheme}://{parsed.netloc}" if parsed.scheme and parsed.netloc else ""
+
+
+def state_path(directory: str = "") -> str:
+    """登录状态文件的路径，directory 为空时使用 SESSION_STORAGE_PATH（未设置时为当前目录）"""
+    return os.path.join(directory or os.getenv('SESSION_STORAGE_PATH', '') or os.getcwd(), STATE_FILE_NAME)
+
+
+def _read_json(path: str) -> Any:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _read_legacy(directory: str, url: str) -> Optional[Dict[str, Any]]:
+    """读取旧版本分别保存的三个文件"""
+    paths = {key: os.path.join(directory, name) for key, name in LEGACY_FILE_NAMES.items()}
+    if not any(os.path.exists(p) for p in paths.values()):
+        return None
+    data = {}
+    for key, path in paths.items():
+        try:
+            data[key] = _read_json(path) if os.path.exists(path) else None
+        except (OSError, ValueError):
+            data[key] = None
+    origin = url_origin(url)
+    local_storage = data["local_storage"] if isinstance(data["local_storage"], dict) else {}
+    session_storage = data["session_storage"] if isinstance(data["session_storage"], dict) else {}
+    return {
+        "version": STATE_VERSION,
+        "saved_at": None,
+        "url": url,
+        "storage_state": {
+            "cookies": data["cookies"] if isinstance(data["cookies"], list) else [],
+            "origins": [{
+                "origin": origin,
+                "localStorage": [{"name": k, "value": str(v)} for k, v in local_storage.items()],
+            }] if origin and local_storage else [],
+        },
+        "session_storage": {origin: {k: str(v) for k, v in session_storage.items()}} if origin and session_storage else {},
+    }
+
+
+def read_state(path: str, url: str = "") -> Optional[Dict[str, Any]]:
+    """
+    读取登录状态文件，没有文件或版本不兼容时返回 None
+    Args:
+        path: 登录状态文件
+        url: 目标页面（读取旧版本文件时用于确定 localStorage / sessionStorage 所属的源）
+    """
+    if not os.path.exists(path):
+        return _read_legacy(os.path.dirname(path) or ".", url)
+    try:
+        state = _read_json(path)
+    except (OSError, ValueError) as e:
+        _log(f'读取登录状态失败: {e}')
+        return None
+    if not isinstance(state, dict) or state.get("version") != STATE_VERSION:
+        _log(f'登录状态文件版本不兼容，忽略: {path}')
+        return None
+    return state
+
+
+def write_state(path: str, state: Dict[str, Any]) -> None:
+    """写入登录状态文件（先写临时文件再替换，执行中断时不会留下不完整的文件）"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+
+def restore_script(state: Optional[Dict[str, Any]], include_local_storage: bool = False) -> Optional[str]:
+    """
+    写入 sessionStorage 的初始化脚本，没有需要写入的数据时返回 None
+    include_local_storage: 同时写入 localStorage（上下文已经创建、不能再传 storage_state 时使用）
+    """
+    if not state:
+        return None
+    data: Dict[str, Dict[str, Dict[str, str]]] = {}
+    for origin, items in (state.get("session_storage") or {}).items():
+        if items:
+            data.setdefault(origin, {})["sessionStorage"] = items
+    if include_local_storage:
+        for item in state.get("storage_state", {}).get("origins", []):
+            if item.get("localStorage"):
+                data.setdefault(item["origin"], {})["localStorage"] = {e["name"]: e["value"] for e in item["localStorage"]}
+    if not data:
+        return None
+    return _RESTORE_JS % {"marker": json.dumps(_RESTORE_MARKER), "data": json.dumps(data, ensure_ascii=False)}
+
+
+async def capture_state(page) -> Dict[str, Any]:
+    """读取页面所在上下文的 storage_state 和当前页面的 sessionStorage"""
+    storage_state = await page.context.storage_state()
+    session_storage = {}
+    try:
+        items = json.loads(await page.evaluate('() => JSON.stringify(sessionStorage)'))
+        items.pop(_RESTORE_MARKER, None)
+        if items and url_origin(page.url):
+            session_storage[url_origin(page.url)] = items
+    except Exception as e:
+        _log(f'读取 sessionStorage 失败: {e}')
+    return {
+        "version": STATE_VERSION,
+        "saved_at": datetime.now().isoformat(),
+        "url": page.url,
+        "storage_state": storage_state,
+        "session_storage": session_storage,
+    }
+
+
+async def save_state(page, path: str = "") -> Dict[str, Any]:
+    """保存页面的登录状态到文件（path 为空时使用默认路径）"""
+    state = await capture_state(page)
+    path = path or state_path()
+    write_state(path, state)
+    _log(f'登录状态已保存: {path}（Cookies {len(state["storage_state"].get("cookies", []))} 个）')
+    return state
+
+
+async def new_page_with_saved_state(browser, path: str = "", url: str = "", **kwargs):
+    """
+    用保存的登录状态创建新上下文和页面（没有保存的状态时为全新的页面）
+    Args:
+        browser: Playwright Browser
+        path: 登录状态文件（为空时使用默认路径）
+        url: 目标页面（读取旧版本文件时使用）
+        kwargs: 其它创建上下文的参数
+    """
+    state = read_state(path or state_path(), url)
+    if state:
+        kwargs["storage_state"] = state.get("storage_state")
+    page = await browser.new_page(**kwargs)
+    script = restore_script(state)
+    if script:
+        await page.context.add_init_script(script)
+    if state:
+        _log(f'已加载登录状态（Cookies {len(state["storage_state"].get("cookies", []))} 个）')
+    return page
+
+
+async def apply_saved_state(context, state: Optional[Dict[str, Any]]) -> bool:
+    """
+    把登录状态加到已经创建的上下文：cookies 立即生效，localStorage / sessionStorage 在下一次导航时由初始化脚本写入
+    （在第一次导航前调用时不需要额外刷新页面）
+    """
+    if not state:
+        return False
+    cookies = state.get("storage_state", {}).get("cookies", [])
+    if cookies:
+        await context.add_cookies(cookies)
+    script = restore_script(state, include_local_storage=True)
+    if script:
+        await context.add_init_script(script)
+    return True
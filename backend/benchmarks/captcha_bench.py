@@ -0,0 +1,409 @@
+"""
+验证码识别基准
+
+在带标注的验证码样本集上比较各识别方式的耗时和准确率：
+- local:   app/utils/captcha_recognizer.py 的本地识别（切分字符 + 模板匹配 + 算术求值）
+- vl:      BrowserUtil._recognize_captcha_text 调用 VL 模型（需要 BAILIAN_API_KEY，未配置时跳过）
+- cascade: 测试脚本实际使用的方式，本地置信度达到阈值时直接使用，否则调用 VL 模型
+
+样本集在 benchmarks/captcha_samples/（labels.json 为 文件名 -> {"text": 原文, "answer": 应填写的值, "style", "font"}），
+包含以下合成验证码：
+- fixture:   与夹具站点相同的样式（默认字体 10 号、浅色斜线）
+- arith:     较大字号的两位数算术式，彩色文字、干扰点和干扰线
+- alnum:     4 位字母数字，每个字符颜色和上下位置不同
+- distorted: 字符旋转、互相重叠并有深色干扰线，本地识别应给出低置信度并交给 VL 模型
+- arith_other / alnum_other: 与 arith / alnum 相同的样式，但用识别器模板之外的字体
+  （DejaVu Serif / Sans Mono Bold 等，系统没有这些字体时不生成）
+
+注意：fixture、arith、alnum、distorted 用 Pillow 自带字体绘制，识别器的字形模板也由同一字体渲染
+（font 为 "template"），这些样本上的准确率是同字体条件下的上限，不代表真实网站的效果；
+font 为 "other" 的样本才是与模板无关的独立样本，结果中分开统计。
+更可靠的评估是把真实网站的验证码截图放进其它目录，按同样格式写 labels.json（font 填 "other"），用 --samples 指定。
+
+答案比较不区分大小写（多数网站的字符验证码不区分大小写）。
+本地识别还会输出不同置信度阈值下直接采用的比例（覆盖率）和采用结果的准确率，用于选择 CAPTCHA_LOCAL_MIN_CONFIDENCE。
+
+用法（在 backend 目录下）:
+    python -m benchmarks.captcha_bench --rounds 3
+    python -m benchmarks.captcha_bench --generate   # 重新生成合成样本集
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+DEFAULT_SAMPLES = Path(__file__).resolve().parent / "captcha_samples"
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+BACKENDS = ("local", "vl", "cascade")
+THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.9)
+ALNUM_CHARS = "ABCDEFGHJKLMNPQRSTUVWXYZabdefhkmnprty23456789"
+
+
+# ---- 样本集 ----
+
+def _expression(rng: random.Random, max_operand: int):
+    op = rng.choice("+-*")
+    a, b = rng.randint(1, max_operand), rng.randint(1, max_operand)
+    if op == "-" and b > a:
+        a, b = b, a
+    if op == "*":
+        b = rng.randint(1, 9)
+    answer = {"+": a + b, "-": a - b, "*": a * b}[op]
+    return f"{a}{op}{b}=?", str(answer)
+
+
+def _dark(rng: random.Random):
+    return tuple(rng.randint(0, 110) for _ in range(3))
+
+
+def _light(rng: random.Random):
+    return tuple(rng.randint(170, 225) for _ in range(3))
+
+
+def _fixture_style(rng: random.Random):
+    from PIL import Image, ImageDraw
+
+    text, answer = _expression(rng, 9)
+    image = Image.new("RGB", (110, 36), (235, 240, 250))
+    draw = ImageDraw.Draw(image)
+    offset = rng.randint(0, 8)
+    for x in range(0, 110, 9):
+        draw.line([(x + offset, 0), (x + offset + 18, 36)], fill=(200, 205, 220))
+    draw.text((rng.randint(12, 30), rng.randint(8, 14)), text, fill=(30, 40, 90))
+    return image, text, answer
+
+
+def _arith_style(rng: random.Random):
+    from PIL import Image, ImageDraw, ImageFont
+
+    text, answer = _expression(rng, 30)
+    size = rng.randint(18, 26)
+    image = Image.new("RGB", (150, 44), tuple(rng.randint(235, 255) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(120):
+        draw.point((rng.randrange(150), rng.randrange(44)), fill=_light(rng))
+    for _ in range(3):
+        draw.line([(rng.randrange(150), rng.randrange(44)) for _ in range(2)], fill=_light(rng))
+    draw.text((rng.randint(6, 20), rng.randint(4, 12)), text, fill=_dark(rng), font=ImageFont.load_default(size=size))
+    return image, text, answer
+
+
+def _alnum_style(rng: random.Random):
+    from PIL import Image, ImageDraw, ImageFont
+
+    text = "".join(rng.choice(ALNUM_CHARS) for _ in range(4))
+    font = ImageFont.load_default(size=rng.randint(20, 28))
+    image = Image.new("RGB", (120, 44), tuple(rng.randint(230, 255) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(4):
+        draw.line([(rng.randrange(120), rng.randrange(44)) for _ in range(2)], fill=_light(rng), width=1)
+    x = rng.randint(6, 14)
+    for char in text:
+        draw.text((x, rng.randint(2, 10)), char, fill=_dark(rng), font=font)
+        x += int(draw.textlength(char, font=font)) + rng.randint(3, 7)
+    return image, text, text
+
+
+# 识别器模板（captcha_recognizer._fonts）之外的字体，按顺序取系统中存在的前两个
+OTHER_FONTS = ("DejaVuSerif.ttf", "DejaVuSansMono-Bold.ttf", "DejaVuSerif-Bold.ttf",
+               "LiberationSerif-Regular.ttf", "LiberationMono-Bold.ttf", "times.ttf", "courbd.ttf")
+
+
+def _other_fonts():
+    from PIL import ImageFont
+
+    available = []
+    for name in OTHER_FONTS:
+        try:
+            ImageFont.truetype(name, 20)
+        except OSError:
+            continue
+        available.append(name)
+    return available[:2]
+
+
+def _other_font(rng: random.Random, size: int):
+    from PIL import ImageFont
+
+    return ImageFont.truetype(rng.choice(_other_fonts()), size)
+
+
+def _arith_other_style(rng: random.Random):
+    from PIL import Image, ImageDraw
+
+    text, answer = _expression(rng, 30)
+    font = _other_font(rng, rng.randint(18, 26))
+    image = Image.new("RGB", (150, 44), tuple(rng.randint(235, 255) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(120):
+        draw.point((rng.randrange(150), rng.randrange(44)), fill=_light(rng))
+    for _ in range(3):
+        draw.line([(rng.randrange(150), rng.randrange(44)) for _ in range(2)], fill=_light(rng))
+    draw.text((rng.randint(6, 20), rng.randint(4, 12)), text, fill=_dark(rng), font=font)
+    return image, text, answer
+
+
+def _alnum_other_style(rng: random.Random):
+    from PIL import Image, ImageDraw
+
+    text = "".join(rng.choice(ALNUM_CHARS) for _ in range(4))
+    font = _other_font(rng, rng.randint(20, 28))
+    image = Image.new("RGB", (130, 44), tuple(rng.randint(230, 255) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(4):
+        draw.line([(rng.randrange(130), rng.randrange(44)) for _ in range(2)], fill=_light(rng), width=1)
+    x = rng.randint(6, 14)
+    for char in text:
+        draw.text((x, rng.randint(2, 10)), char, fill=_dark(rng), font=font)
+        x += int(draw.textlength(char, font=font)) + rng.randint(3, 7)
+    return image, text, text
+
+
+def _distorted_style(rng: random.Random):
+    from PIL import Image, ImageDraw, ImageFont
+
+    text = "".join(rng.choice(ALNUM_CHARS) for _ in range(4))
+    font = ImageFont.load_default(size=26)
+    image = Image.new("RGB", (120, 44), (240, 240, 240))
+    x = 4
+    for char in text:
+        glyph = Image.new("RGBA", (36, 36), (0, 0, 0, 0))
+        ImageDraw.Draw(glyph).text((6, 2), char, fill=_dark(rng) + (255,), font=font)
+        glyph = glyph.rotate(rng.uniform(-35, 35), resample=Image.BICUBIC)
+        image.paste(glyph, (x, rng.randint(0, 8)), glyph)
+        x += rng.randint(17, 23)
+    draw = ImageDraw.Draw(image)
+    for _ in range(3):
+        draw.line([(0, rng.randrange(44)), (120, rng.randrange(44))], fill=_dark(rng), width=2)
+    return image, text, text
+
+
+STYLES = {
+    "fixture": _fixture_style,
+    "arith": _arith_style,
+    "alnum": _alnum_style,
+    "distorted": _distorted_style,
+    "arith_other": _arith_other_style,
+    "alnum_other": _alnum_other_style,
+}
+# 用模板之外的字体绘制的样式（其余样式与识别器模板同字体）
+OTHER_FONT_STYLES = ("arith_other", "alnum_other")
+
+
+def generate_samples(directory: Path, per_style: int = 12, seed: int = 20261019):
+    """生成合成样本集（固定随机种子，重新生成的结果相同）"""
+    rng = random.Random(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    labels = {}
+    for style, draw in STYLES.items():
+        if style in OTHER_FONT_STYLES and not _other_fonts():
+            print(f"⚠️ 系统中没有 {', '.join(OTHER_FONTS)}，不生成 {style} 样本")
+            continue
+        for n in range(per_style):
+            image, text, answer = draw(rng)
+            name = f"{style}_{n:02d}.png"
+            image.save(directory / name, format="PNG", optimize=True)
+            labels[name] = {"text": text, "answer": answer, "style": style,
+                            "font": "other" if style in OTHER_FONT_STYLES else "template"}
+    (directory / "labels.json").write_text(json.dumps(labels, ensure_ascii=False, indent=2), encoding="utf-8")
+    return labels
+
+
+def load_samples(directory: Path):
+    labels_path = directory / "labels.json"
+    if not labels_path.exists():
+        return []
+    labels = json.loads(labels_path.read_text(encoding="utf-8"))
+    # 没有标注 font 的样本（如真实网站的截图）视为独立样本
+    return [
+        {"name": name, "image": (directory / name).read_bytes(), "font": "other", **label}
+        for name, label in sorted(labels.items()) if (directory / name).exists()
+    ]
+
+
+# ---- 各识别方式 ----
+
+def _local_backend():
+    from app.utils.captcha_recognizer import LocalCaptchaRecognizer
+
+    recognizer = LocalCaptchaRecognizer()
+    recognizer.templates()
+
+    def run(image: bytes):
+        result = recognizer.recognize(image)
+        return result["answer"], result["confidence"]
+
+    return run
+
+
+def _vl_backend():
+    if not os.getenv("BAILIAN_API_KEY"):
+        return None
+    from app.utils.browser_util import BrowserUtil
+
+    util = BrowserUtil()
+
+    def run(image: bytes):
+        answer = asyncio.run(util._recognize_captcha_by_vl(base64.b64encode(image).decode("utf-8")))
+        return answer or "", None
+
+    return run
+
+
+def _cascade_backend(local, vl, threshold: float):
+    def run(image: bytes):
+        answer, confidence = local(image)
+        if answer and confidence >= threshold:
+            return answer, confidence
+        if vl is None:
+            return "", confidence
+        return vl(image)[0], confidence
+
+    return run
+
+
+def _same(answer: str, expected: str) -> bool:
+    return (answer or "").strip().lower() == expected.strip().lower()
+
+
+def run_backend(run, samples, rounds: int):
+    latencies, records = [], []
+    for round_index in range(rounds):
+        for sample in samples:
+            start = time.perf_counter()
+            answer, confidence = run(sample["image"])
+            latencies.append((time.perf_counter() - start) * 1000)
+            if round_index == 0:
+                records.append({
+                    "name": sample["name"], "style": sample["style"], "font": sample["font"], "expected": sample["answer"],
+                    "answer": answer, "confidence": confidence, "correct": _same(answer, sample["answer"]),
+                })
+    ordered = sorted(latencies)
+    styles = {}
+    for record in records:
+        style = styles.setdefault(record["style"], {"samples": 0, "correct": 0})
+        style["samples"] += 1
+        style["correct"] += record["correct"]
+    for style in styles.values():
+        style["accuracy"] = round(style["correct"] / style["samples"], 3)
+    fonts = {}
+    for font in ("template", "other"):
+        matched = [r for r in records if r["font"] == font]
+        if matched:
+            fonts[font] = {"samples": len(matched), "accuracy": round(sum(r["correct"] for r in matched) / len(matched), 3)}
+    return {
+        "accuracy": round(sum(r["correct"] for r in records) / len(records), 3),
+        "fonts": fonts,
+        "latency_ms": {
+            "mean": round(statistics.mean(ordered), 2),
+            "p50": round(statistics.median(ordered), 2),
+            "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+            "max": round(ordered[-1], 2),
+        },
+        "styles": styles,
+        "records": records,
+    }
+
+
+def threshold_sweep(records):
+    """各置信度阈值下本地结果的覆盖率（直接采用的比例）和采用结果的准确率"""
+    sweep = {}
+    for threshold in THRESHOLDS:
+        accepted = [r for r in records if r["answer"] and r["confidence"] >= threshold]
+        sweep[str(threshold)] = {
+            "coverage": round(len(accepted) / len(records), 3),
+            "accepted_accuracy": round(sum(r["correct"] for r in accepted) / len(accepted), 3) if accepted else None,
+        }
+    return sweep
+
+
+def main():
+    parser = argparse.ArgumentParser(description="验证码识别基准（本地识别 vs VL 模型）")
+    parser.add_argument("--samples", default=str(DEFAULT_SAMPLES), help="样本目录（含 labels.json）")
+    parser.add_argument("--rounds", type=int, default=3, help="识别整个样本集的轮数（VL 只运行一轮）")
+    parser.add_argument("--generate", action="store_true", help="重新生成合成样本集后退出")
+    parser.add_argument("--output", default=None, help="结果 JSON 路径")
+    args = parser.parse_args()
+
+    samples_dir = Path(args.samples)
+    if args.generate:
+        labels = generate_samples(samples_dir)
+        print(f"已生成 {len(labels)} 个样本: {samples_dir}")
+        return
+
+    samples = load_samples(samples_dir)
+    if not samples:
+        print(f"❌ {samples_dir} 中没有样本（需要 labels.json），可以先运行 --generate")
+        sys.exit(1)
+
+    # 学到的字形会影响本地识别结果，基准使用空的字形文件
+    os.environ["CAPTCHA_GLYPH_PATH"] = os.path.join(tempfile.mkdtemp(prefix="captcha_bench_"), "glyphs.json")
+    from app.utils.captcha_recognizer import min_confidence
+
+    threshold = min_confidence()
+    local = _local_backend()
+    vl = _vl_backend()
+    if vl is None:
+        print("⚠️ 未配置 BAILIAN_API_KEY，跳过 VL 模型；cascade 中置信度不足的样本记为识别失败")
+
+    print(f"样本: {len(samples)} 个，{args.rounds} 轮，本地置信度阈值 {threshold}")
+    results = {"local": run_backend(local, samples, args.rounds)}
+    if vl is not None:
+        results["vl"] = run_backend(vl, samples, 1)
+    results["cascade"] = run_backend(_cascade_backend(local, vl, threshold), samples, 1 if vl else args.rounds)
+    results["local"]["threshold_sweep"] = threshold_sweep(results["local"]["records"])
+    results["cascade"]["vl_calls"] = sum(
+        1 for r in results["local"]["records"] if not (r["answer"] and r["confidence"] >= threshold)
+    )
+
+    from benchmarks.run_benchmark import _git_commit
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "git_commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "samples": {"path": args.samples, "count": len(samples)},
+        "rounds": args.rounds,
+        "min_confidence": threshold,
+        "vl_available": vl is not None,
+        "backends": results,
+    }
+    output = Path(args.output) if args.output else RESULTS_DIR / f"captcha_{report['git_commit']}_{datetime.now():%Y%m%d_%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    print("\n" + "=" * 60)
+    print("验证码识别基准结果")
+    print("=" * 60)
+    for backend in BACKENDS:
+        result = results.get(backend)
+        if result is None:
+            continue
+        styles = ", ".join(f"{name} {style['accuracy']:.0%}" for name, style in result["styles"].items())
+        print(f"{backend:8s} 准确率 {result['accuracy']:.1%}（{styles}），"
+              f"耗时 p50 {result['latency_ms']['p50']}ms / p95 {result['latency_ms']['p95']}ms")
+        fonts = result["fonts"]
+        if "template" in fonts:
+            print(f"         与模板同字体的样本 {fonts['template']['accuracy']:.1%}（上限，不代表真实网站）", end="")
+            print(f"，独立字体样本 {fonts['other']['accuracy']:.1%}" if "other" in fonts else "，没有独立字体样本")
+    print(f"cascade 调用 VL 模型 {results['cascade']['vl_calls']}/{len(samples)} 次")
+    for value, item in results["local"]["threshold_sweep"].items():
+        accuracy = f"{item['accepted_accuracy']:.1%}" if item["accepted_accuracy"] is not None else "-"
+        print(f"  阈值 {value}: 本地直接采用 {item['coverage']:.0%}，采用结果准确率 {accuracy}")
+    print(f"结果已保存: {output}")
+
+
+if __name__ == "__main__":
+    main()
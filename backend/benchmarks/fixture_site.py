@@ -0,0 +1,209 @@
+"""
+基准测试用的本地夹具站点
+
+覆盖生成/执行流程里最常见的几类页面：
+- /login       登录表单（用户名、密码、图片验证码），元素使用固定坐标，便于 computer-use 模式回放
+- /captcha.png 图片验证码，固定为算式 "3+4=?"，答案 7
+- /api/login   登录接口，可配置延迟（慢 XHR）
+- /app         单页应用，hash 路由 #/dashboard、#/orders
+- /api/orders  订单数据接口，可配置延迟（慢 XHR）
+
+只依赖标准库和 Pillow（requirements.txt 中已有）。
+"""
+import io
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+CAPTCHA_TEXT = "3+4=?"
+CAPTCHA_ANSWER = "7"
+USERNAME = "admin"
+PASSWORD = "bench123"
+
+LOGIN_PAGE = """<!DOCTYPE html>
+<html lang="zh-CN"><head><meta charset="utf-8"><title>夹具站点 - 登录</title>
+<style>
+body { margin: 0; font-family: sans-serif; width: 1280px; height: 720px; position: relative; }
+.field { position: absolute; left: 490px; width: 300px; height: 36px; box-sizing: border-box; }
+#username { top: 200px; } #password { top: 260px; } #captcha { top: 320px; width: 180px; }
+#captcha-img { position: absolute; left: 680px; top: 320px; width: 110px; height: 36px; }
+.login-button { position: absolute; left: 490px; top: 390px; width: 300px; height: 40px; }
+#message { position: absolute; left: 490px; top: 450px; color: #c00; }
+</style></head>
+<body>
+<h2 style="position:absolute;left:490px;top:120px">系统登录</h2>
+<form id="login-form" onsubmit="return false;">
+  <input class="field" id="username" name="username" type="text" placeholder="用户名" data-testid="username">
+  <input class="field" id="password" name="password" type="password" placeholder="密码" data-testid="password">
+  <input class="field" id="captcha" name="captcha" type="text" placeholder="验证码" data-testid="captcha">
+  <img id="captcha-img" class="captcha-img" src="/captcha.png" alt="验证码">
+  <button class="login-button" type="submit" data-testid="login-button">登 录</button>
+</form>
+<div id="message"></div>
+<script>
+document.getElementById('login-form').addEventListener('submit', async () => {
+  const body = {
+    username: document.getElementById('username').value,
+    password: document.getElementById('password').value,
+    captcha: document.getElementById('captcha').value
+  };
+  const resp = await fetch('/api/login', {method: 'POST', headers: {'Content-Type': 'application/json'}, body: JSON.stringify(body)});
+  const data = await resp.json();
+  if (data.success) {
+    localStorage.setItem('token', data.token);
+    sessionStorage.setItem('user', body.username);
+    location.href = '/app#/dashboard';
+  } else {
+    document.getElementById('message').textContent = data.message;
+  }
+});
+</script>
+</body></html>
+"""
+
+APP_PAGE = """<!DOCTYPE html>
+<html lang="zh-CN"><head><meta charset="utf-8"><title>夹具站点 - 控制台</title>
+<style>
+body { margin: 0; font-family: sans-serif; width: 1280px; }
+nav a { display: inline-block; margin: 16px; }
+</style></head>
+<body>
+<nav><a href="#/dashboard" data-testid="nav-dashboard">首页</a><a href="#/orders" data-testid="nav-orders">订单列表</a></nav>
+<main id="view"></main>
+<script>
+async function render() {
+  const view = document.getElementById('view');
+  if (!localStorage.getItem('token')) { location.href = '/login'; return; }
+  const route = location.hash.replace('#', '') || '/dashboard';
+  if (route === '/orders') {
+    view.innerHTML = '<h2>订单列表</h2><div id="loading">加载中...</div>';
+    const resp = await fetch('/api/orders');
+    const data = await resp.json();
+    view.innerHTML = '<h2>订单列表</h2><table id="orders" data-testid="orders-table">' +
+      data.orders.map(o => `<tr><td>${o.id}</td><td>${o.name}</td><td>${o.amount}</td></tr>`).join('') +
+      '</table>';
+  } else {
+    view.innerHTML = '<h2 id="welcome">欢迎回来，' + (sessionStorage.getItem('user') || '') + '</h2>';
+  }
+}
+window.addEventListener('hashchange', render);
+render();
+</script>
+</body></html>
+"""
+
+
+def _captcha_png() -> bytes:
+    """生成固定内容的验证码图片"""
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", (110, 36), (235, 240, 250))
+    draw = ImageDraw.Draw(image)
+    for x in range(0, 110, 9):
+        draw.line([(x, 0), (x + 18, 36)], fill=(200, 205, 220))
+    draw.text((22, 11), CAPTCHA_TEXT, fill=(30, 40, 90))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    server_version = "E2EFixture/1.0"
+    xhr_delay_ms = 800
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, data, status: int = 200):
+        self._send(status, json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8")
+
+    def _delay(self, query):
+        delay_ms = int(query.get("delay", [self.xhr_delay_ms])[0])
+        time.sleep(delay_ms / 1000)
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+        if parsed.path in ("/", "/login"):
+            self._send(200, LOGIN_PAGE.encode("utf-8"), "text/html; charset=utf-8")
+        elif parsed.path == "/app":
+            self._send(200, APP_PAGE.encode("utf-8"), "text/html; charset=utf-8")
+        elif parsed.path == "/captcha.png":
+            self._send(200, self.server.captcha_png, "image/png")
+        elif parsed.path == "/api/orders":
+            self._delay(query)
+            self._send_json({"orders": [
+                {"id": i, "name": f"订单-{i:03d}", "amount": round(i * 12.5, 2)} for i in range(1, 21)
+            ]})
+        else:
+            self._send(404, b"not found", "text/plain")
+
+    def do_POST(self):
+        parsed = urlparse(self.path)
+        if parsed.path != "/api/login":
+            self._send(404, b"not found", "text/plain")
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            body = {}
+        self._delay(parse_qs(parsed.query))
+        if body.get("captcha") != CAPTCHA_ANSWER:
+            self._send_json({"success": False, "message": "验证码错误"})
+        elif body.get("username") != USERNAME or body.get("password") != PASSWORD:
+            self._send_json({"success": False, "message": "用户名或密码错误"})
+        else:
+            self._send_json({"success": True, "token": "bench-token"})
+
+
+class FixtureSite:
+    """在后台线程运行的夹具站点"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, xhr_delay_ms: int = 800):
+        handler = type("BoundFixtureHandler", (FixtureHandler,), {"xhr_delay_ms": xhr_delay_ms})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.httpd.captcha_png = _captcha_png()
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FixtureSite":
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="fixture-site", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="基准测试夹具站点")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--xhr-delay-ms", type=int, default=800)
+    args = parser.parse_args()
+
+    site = FixtureSite(port=args.port, xhr_delay_ms=args.xhr_delay_ms).start()
+    print(f"夹具站点已启动: {site.base_url}/login （用户名 {USERNAME} / 密码 {PASSWORD} / 验证码 {CAPTCHA_ANSWER}）")
+    try:
+        site.thread.join()
+    except KeyboardInterrupt:
+        site.stop()
@@ -0,0 +1,246 @@
+"""
+HTML 清理微基准
+
+对比页面获取后处理HTML的两种方式：
+- legacy: Cleaner.clean_html + 全局 \\s+ 替换，extract_form_selectors 再解析一次清理后的HTML，
+          build_page_model 再解析一次原始HTML（共三次解析、两次序列化）
+- single: TestGenerator.prepare_page_html，一次解析同时得到清理后的HTML、表单选择器、页面模型和统计
+
+语料为 --corpus 目录下保存的真实页面（*.html，可以在浏览器中“另存为”，或在 Playwright 中保存
+page.content() 的结果）。页面可能含有业务数据，目录 benchmarks/pages/ 不入库。
+目录为空时使用合成的后台管理类页面，并在结果中标注 synthetic。
+
+每种方式在独立子进程中运行：
+- 吞吐：多轮处理整个语料的 MB/s
+- Python 堆峰值：tracemalloc 统计的单页处理峰值
+- RSS 增长：处理过程中进程最大常驻内存相对导入完成后的增长（包含 libxml2 的内存，Windows 下不可用）
+
+用法（在 backend 目录下）:
+    python -m benchmarks.html_cleaning_bench --corpus benchmarks/pages --rounds 5
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import statistics
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+DEFAULT_CORPUS = Path(__file__).resolve().parent / "pages"
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+PIPELINES = ("legacy", "single")
+
+
+def _max_rss_kb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def synthetic_corpus(count: int = 6):
+    """合成后台管理类SPA页面：导航菜单、内联脚本和样式、大表格、表单、弹窗模板"""
+    from benchmarks.fixture_site import LOGIN_PAGE
+
+    pages = []
+    for n in range(count):
+        rows = 200 * (n + 1)
+        menu = "".join(
+            f'<li class="el-menu-item" role="menuitem" data-v-7a{n}c><i class="el-icon-menu"></i>'
+            f'<span>菜单 {i}</span></li>\n' for i in range(60)
+        )
+        table = "".join(
+            f'<tr class="el-table__row" data-v-7a{n}c>\n  <td class="cell" style="width: 120px;">{i}</td>'
+            f'<td class="cell">订单-{i:05d}</td><td class="cell">  {i * 12.5:.2f}  </td>'
+            f'<td><button type="button" class="el-button el-button--text" onclick="edit({i})"><span>编辑</span></button>'
+            f'<a href="/orders/{i}" class="link">详情</a></td></tr>\n' for i in range(rows)
+        )
+        scripts = "".join(f"<script>window.__chunk{i} = {json.dumps(['x' * 200] * 20)};</script>\n" for i in range(30))
+        styles = "".join(f"<style>.c{i} {{ color: #{i:06x}; margin: 0 auto; }}</style>\n" for i in range(30))
+        body = (
+            f'<div id="app"><aside><ul class="el-menu" role="menubar">{menu}</ul></aside>'
+            f'<main><form class="el-form search-form"><input class="el-input__inner" placeholder="订单号" name="orderNo">'
+            f'<select name="status"><option>全部</option><option>已支付</option></select>'
+            f'<button class="el-button el-button--primary" type="submit"><span>查询</span></button></form>'
+            f'<table class="el-table">{table}</table></main>'
+            f'<template id="dialog"><div class="el-dialog"><input name="remark"></div></template>'
+            f'<span title="\xa0">\u3000</span><a href="#" title="合计\u2003{n}\xa0条">合计</a></div>'
+        )
+        pages.append((f"synthetic_{n}.html", LOGIN_PAGE.replace("</head>", styles + "</head>").replace(
+            '<div id="message"></div>', '<div id="message"></div>' + body + scripts
+        )))
+    return pages
+
+
+def load_corpus(corpus_dir: Path):
+    files = sorted(corpus_dir.glob("*.html")) + sorted(corpus_dir.glob("*.htm")) if corpus_dir.exists() else []
+    return [(f.name, f.read_text(encoding="utf-8", errors="replace")) for f in files]
+
+
+def _legacy_pipeline():
+    """user-035 之前的处理方式"""
+    from lxml.html.clean import Cleaner
+    from app.services.generator.page_model import build_page_model
+    from app.services.generator.test_generator import test_generator
+
+    def run(html: str):
+        cleaner = Cleaner(
+            javascript=True, style=True, inline_style=True, comments=True,
+            safe_attrs_only=True, forms=False, page_structure=False,
+        )
+        cleaned = re.sub(r"\s+", " ", cleaner.clean_html(html)).strip()
+        form_selectors = test_generator.extract_form_selectors(cleaned)
+        page_model = build_page_model(html)
+        return cleaned, form_selectors, page_model
+    return run
+
+
+def _single_pipeline():
+    from app.services.generator.test_generator import test_generator
+
+    def run(html: str):
+        prepared = test_generator.prepare_page_html(html)
+        return prepared["html"], prepared["form_selectors"], prepared["page_model"]
+    return run
+
+
+def _worker(pipeline: str, pages, rounds: int, queue):
+    """在子进程中运行一种处理方式，结果放入 queue"""
+    import logging
+    import tracemalloc
+
+    logging.disable(logging.CRITICAL)
+    run = _legacy_pipeline() if pipeline == "legacy" else _single_pipeline()
+    rss_before = _max_rss_kb()
+    for _, html in pages:  # 预热（正则编译、缓存），同时计入 RSS 增长
+        run(html)
+
+    round_seconds = []
+    per_page_ms = {name: [] for name, _ in pages}
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for name, html in pages:
+            t0 = time.perf_counter()
+            run(html)
+            per_page_ms[name].append((time.perf_counter() - t0) * 1000)
+        round_seconds.append(time.perf_counter() - started)
+    rss_after = _max_rss_kb()
+
+    peak_bytes = {}
+    for name, html in pages:
+        tracemalloc.start()
+        run(html)
+        peak_bytes[name] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    total_mb = sum(len(html.encode("utf-8")) for _, html in pages) / 1024 / 1024
+    best = min(round_seconds)
+    queue.put({
+        "throughput_mb_s": round(total_mb / best, 2) if best else None,
+        "round_ms": {
+            "best": round(best * 1000, 1),
+            "median": round(statistics.median(round_seconds) * 1000, 1),
+        },
+        "per_page_median_ms": {name: round(statistics.median(v), 2) for name, v in per_page_ms.items()},
+        "python_heap_peak_kb": {name: round(v / 1024, 1) for name, v in peak_bytes.items()},
+        "python_heap_peak_kb_max": round(max(peak_bytes.values()) / 1024, 1) if peak_bytes else None,
+        "rss_growth_kb": rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+    })
+
+
+def run_pipeline(pipeline: str, pages, rounds: int):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_worker, args=(pipeline, pages, rounds, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def check_equivalence(pages):
+    """两种方式的输出必须一致"""
+    legacy, single = _legacy_pipeline(), _single_pipeline()
+    return [name for name, html in pages if legacy(html) != single(html)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTML 清理微基准（legacy 三次解析 vs 单次解析）")
+    parser.add_argument("--corpus", default=str(DEFAULT_CORPUS), help="保存的页面目录（*.html）")
+    parser.add_argument("--rounds", type=int, default=5, help="处理整个语料的轮数")
+    parser.add_argument("--output", default=None, help="结果 JSON 路径")
+    args = parser.parse_args()
+
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    pages = load_corpus(Path(args.corpus))
+    synthetic = not pages
+    if synthetic:
+        print(f"⚠️ {args.corpus} 中没有页面，使用合成页面（结果仅供参考，请保存真实页面后重新运行）")
+        pages = synthetic_corpus()
+
+    total_mb = sum(len(html.encode("utf-8")) for _, html in pages) / 1024 / 1024
+    print(f"语料: {len(pages)} 个页面，共 {total_mb:.2f} MB，{args.rounds} 轮")
+
+    mismatched = check_equivalence(pages)
+    if mismatched:
+        print(f"⚠️ 以下页面两种方式的输出不一致: {mismatched}")
+
+    results = {}
+    for pipeline in PIPELINES:
+        print(f"运行 {pipeline} ...")
+        results[pipeline] = run_pipeline(pipeline, pages, args.rounds)
+
+    legacy, single = results["legacy"], results["single"]
+    comparison = {
+        "throughput_speedup": round(single["throughput_mb_s"] / legacy["throughput_mb_s"], 2)
+        if legacy["throughput_mb_s"] and single["throughput_mb_s"] else None,
+        "python_heap_peak_reduction": round(1 - single["python_heap_peak_kb_max"] / legacy["python_heap_peak_kb_max"], 3)
+        if legacy["python_heap_peak_kb_max"] else None,
+    }
+
+    from benchmarks.run_benchmark import _git_commit
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "git_commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "corpus": {
+            "path": args.corpus,
+            "synthetic": synthetic,
+            "pages": {name: len(html) for name, html in pages},
+            "total_mb": round(total_mb, 3),
+        },
+        "rounds": args.rounds,
+        "outputs_identical": not mismatched,
+        "pipelines": results,
+        "comparison": comparison,
+    }
+    output = Path(args.output) if args.output else RESULTS_DIR / f"html_cleaning_{report['git_commit']}_{datetime.now():%Y%m%d_%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    print("\n" + "=" * 60)
+    print("HTML 清理微基准结果")
+    print("=" * 60)
+    for pipeline in PIPELINES:
+        result = results[pipeline]
+        print(f"{pipeline:8s} 吞吐 {result['throughput_mb_s']} MB/s, 每轮 {result['round_ms']['best']}ms, "
+              f"Python 堆峰值 {result['python_heap_peak_kb_max']} KB, RSS 增长 {result['rss_growth_kb']} KB")
+    reduction = comparison["python_heap_peak_reduction"]
+    print(f"吞吐提升 {comparison['throughput_speedup']}x，Python 堆峰值降低 {reduction:.1%}" if reduction is not None
+          else f"吞吐提升 {comparison['throughput_speedup']}x")
+    print(f"结果已保存: {output}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+请求日志开销基准
+
+在进程内通过 ASGI 直接请求 /health，分别在 LOG_REQUESTS 关闭和开启（异步队列）
+两种情况下统计请求延迟的 p50/p99，结果写入 benchmarks/results/。
+
+用法（在 backend 目录下）:
+    python -m benchmarks.logging_latency_bench [--requests 2000] [--concurrency 20]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+from app.main import app
+from app.core.config import settings
+from app.core.logging_config import get_logging_stats, shutdown_logging
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_round(client: httpx.AsyncClient, total: int, concurrency: int) -> list:
+    """并发发送请求，返回每个请求的耗时（毫秒）"""
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.get("/health")
+            latencies.append((time.perf_counter() - start) * 1000)
+            assert response.status_code == 200
+
+    await asyncio.gather(*(one() for _ in range(total)))
+    return latencies
+
+
+async def main(total: int, concurrency: int):
+    transport = httpx.ASGITransport(app=app)
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # 预热
+        settings.LOG_REQUESTS = False
+        await run_round(client, 100, concurrency)
+
+        for label, enabled in (("logging_off", False), ("logging_on", True)):
+            settings.LOG_REQUESTS = enabled
+            latencies = await run_round(client, total, concurrency)
+            results[label] = {
+                "requests": total,
+                "p50_ms": round(statistics.median(latencies), 3),
+                "p99_ms": round(percentile(latencies, 99), 3),
+                "max_ms": round(max(latencies), 3),
+            }
+
+    results["logging_queue"] = get_logging_stats()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="请求日志开销基准")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args.requests, args.concurrency))
+    results["timestamp"] = datetime.now().isoformat()
+    results["concurrency"] = args.concurrency
+    shutdown_logging()
+
+    result_file = RESULTS_DIR / f"logging_latency_{datetime.now():%Y%m%d_%H%M%S}.json"
+    result_file.parent.mkdir(parents=True, exist_ok=True)
+    result_file.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    print("=" * 60)
+    print("请求日志开销基准")
+    print("=" * 60)
+    for label in ("logging_off", "logging_on"):
+        r = results[label]
+        print(f"{label:12s} p50={r['p50_ms']}ms  p99={r['p99_ms']}ms  max={r['max_ms']}ms")
+    print(f"丢弃的日志记录: {results['logging_queue']['dropped_records']}")
+    print(f"结果已保存: {result_file}")
+    print("=" * 60)
@@ -0,0 +1,276 @@
+"""
+离线基准测试
+
+启动本地夹具站点和模型桩服务，把 BAILIAN_BASE_URL 指向桩服务、数据库指向临时
+SQLite，然后分别以 DOM、computer-use、agent-browser 三种模式生成并执行测试脚本，
+统计：
+- 生成吞吐（用例/分钟）和每次生成耗时
+- 脚本执行墙钟时间
+- 各阶段耗时（来自链路追踪 span：页面获取、VL 分析、动作生成、代码生成、子进程执行等）
+
+结果写入 benchmarks/results/<commit>_<时间>.json，便于跨提交比较。
+
+用法（在 backend 目录下）:
+    python -m benchmarks.run_benchmark --modes dom,computer_use --iterations 3 --latency-ms 300
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+from benchmarks.fixture_site import FixtureSite, USERNAME, PASSWORD
+from benchmarks.stub_llm import DEFAULT_RECORDINGS, StubBackend, StubLLMServer
+
+MODES = ("dom", "computer_use", "agent_browser")
+USER_QUERY = f"使用用户名'{USERNAME}'、密码'{PASSWORD}'和验证码登录系统，进入订单列表页面并验证订单表格加载完成"
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+            capture_output=True, text=True, timeout=10
+        ).stdout.strip() or "unknown"
+    except Exception:
+        return "unknown"
+
+
+def _summary(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.mean(ordered), 1),
+        "p50_ms": round(statistics.median(ordered), 1),
+        "max_ms": round(ordered[-1], 1),
+        "total_ms": round(sum(ordered), 1),
+    }
+
+
+def _stage_latency(trace_id: str):
+    """按 span 名称汇总一次基准运行中各阶段的耗时"""
+    from app.core.tracing import flush, load_trace
+
+    flush()
+    spans = load_trace(trace_id) or []
+    stages = {}
+    for span in spans:
+        if span["parent_span_id"] is None or span["end_ns"] is None:
+            continue
+        stages.setdefault(span["name"], []).append((span["end_ns"] - span["start_ns"]) / 1e6)
+    return {name: _summary(values) for name, values in sorted(stages.items())}
+
+
+async def _seed_configs(target_url: str):
+    from sqlalchemy import select
+    from app.core.database import async_session_maker, init_db
+    from app.models.global_config import ConfigKeys, GlobalConfig
+
+    await init_db()
+    values = {
+        ConfigKeys.TARGET_URL: target_url,
+        ConfigKeys.DEFAULT_USERNAME: USERNAME,
+        ConfigKeys.DEFAULT_PASSWORD: PASSWORD,
+        ConfigKeys.BROWSER_HEADLESS: "true",
+        ConfigKeys.CAPTCHA_SELECTOR: "#captcha-img",
+        ConfigKeys.CAPTCHA_INPUT_SELECTOR: "#captcha",
+    }
+    async with async_session_maker() as db:
+        for key, value in values.items():
+            existing = (await db.execute(select(GlobalConfig).where(GlobalConfig.config_key == key))).scalar_one_or_none()
+            if existing:
+                existing.config_value = value
+            else:
+                db.add(GlobalConfig(config_key=key, config_value=value))
+        await db.commit()
+
+
+def _mode_unavailable(mode: str):
+    """返回模式不可用的原因，可用时返回 None"""
+    if mode == "agent_browser" and not shutil.which("agent-browser"):
+        return "未找到 agent-browser CLI"
+    return None
+
+
+async def run_mode(mode: str, target_url: str, iterations: int, execute: bool):
+    from app.core.tracing import start_span
+    from app.services.executor.test_executor import test_executor
+    from app.services.generator.test_generator import test_generator
+
+    reason = _mode_unavailable(mode)
+    if reason:
+        return {"status": "skipped", "reason": reason}
+
+    generate = {
+        "dom": test_executor.generate_script_only,
+        "computer_use": test_executor.generate_script_with_computer_use,
+        "agent_browser": test_executor.generate_script_with_agent_browser,
+    }[mode]
+
+    generation_ms, execution_ms, errors = [], [], []
+    generated, executed_ok, steps = 0, 0, 0
+    script = ""
+
+    with start_span(f"benchmark.{mode}", mode=mode) as root:
+        started = time.perf_counter()
+        page_content = None
+        if mode != "agent_browser":
+            # 与场景接口一致：页面内容只获取一次，多个用例共享
+            try:
+                page_content = await test_generator.get_page_content(target_url, load_saved_storage=False)
+            except Exception as e:
+                errors.append(f"page_capture: {e}")
+
+        if page_content is not None or mode == "agent_browser":
+            for _ in range(iterations):
+                t0 = time.perf_counter()
+                result = await generate(
+                    USER_QUERY, target_url,
+                    auto_detect_captcha=True,
+                    auto_cookie_localstorage=False,
+                    load_saved_storage=False,
+                    page_content=page_content,
+                )
+                generation_ms.append((time.perf_counter() - t0) * 1000)
+                if result.get("status") == "success" and result.get("script"):
+                    generated += 1
+                    script = result["script"]
+                else:
+                    errors.append(f"generation: {result.get('error')}")
+
+        if execute and script:
+            for _ in range(iterations):
+                t0 = time.perf_counter()
+                result = await test_executor.execute_saved_script(script)
+                execution_ms.append((time.perf_counter() - t0) * 1000)
+                steps += len([s for s in result.get("step_results", []) if s.get("event") == "step_end"])
+                if result.get("status") == "success":
+                    executed_ok += 1
+                else:
+                    errors.append(f"execution: {result.get('error')}")
+        wall_ms = (time.perf_counter() - started) * 1000
+
+    generation_seconds = sum(generation_ms) / 1000
+    return {
+        "status": "ok" if generated else "failed",
+        "wall_ms": round(wall_ms, 1),
+        "generated_scripts": generated,
+        "generation_throughput_per_min": round(generated / generation_seconds * 60, 2) if generation_seconds else 0,
+        "generation": _summary(generation_ms),
+        "executions_succeeded": executed_ok,
+        "execution": _summary(execution_ms),
+        "steps_reported": steps,
+        "stages": _stage_latency(root.trace_id) if root else {},
+        "trace_id": root.trace_id if root else None,
+        "errors": errors[:10],
+    }
+
+
+async def run_all(args, site: FixtureSite, stub: StubLLMServer):
+    target_url = f"{site.base_url}/login"
+    await _seed_configs(target_url)
+
+    results = {}
+    for mode in args.modes:
+        print(f"\n========== 基准模式: {mode} ==========")
+        results[mode] = await run_mode(mode, target_url, args.iterations, not args.no_execute)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线基准测试（夹具站点 + 模型桩服务）")
+    parser.add_argument("--modes", default=",".join(MODES), help="逗号分隔: dom,computer_use,agent_browser")
+    parser.add_argument("--iterations", type=int, default=3, help="每种模式生成/执行的次数")
+    parser.add_argument("--latency-ms", type=float, default=300, help="桩服务每次回复的延迟")
+    parser.add_argument("--jitter-ms", type=float, default=50, help="桩服务延迟抖动")
+    parser.add_argument("--xhr-delay-ms", type=int, default=800, help="夹具站点慢接口的延迟")
+    parser.add_argument("--recordings", default=str(DEFAULT_RECORDINGS), help="录制/规则文件")
+    parser.add_argument("--no-execute", action="store_true", help="只测生成，不执行脚本")
+    parser.add_argument("--output", default=None, help="结果 JSON 路径")
+    args = parser.parse_args()
+    args.modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    unknown = [m for m in args.modes if m not in MODES]
+    if unknown:
+        parser.error(f"未知模式: {unknown}")
+
+    site = FixtureSite(xhr_delay_ms=args.xhr_delay_ms).start()
+    backend = StubBackend(args.recordings, args.latency_ms, args.jitter_ms)
+    stub = StubLLMServer(backend).start()
+
+    # 必须在导入 app 之前设置，Settings 在导入时读取环境变量
+    work_dir = Path(tempfile.mkdtemp(prefix="e2e-bench-"))
+    os.environ.update({
+        "BAILIAN_BASE_URL": stub.base_url,
+        "BAILIAN_API_KEY": "sk-bench",
+        "DATABASE_URL": f"sqlite+aiosqlite:///{work_dir / 'bench.db'}",
+        "SESSION_STORAGE_PATH": str(work_dir / "session"),
+        "PYTHON_PATH": str(BACKEND_DIR),
+        "LOG_DIR": str(work_dir / "logs"),
+        "LOG_LEVEL": "WARNING",
+        "LLM_LOG_PAYLOADS": "false",
+        "TRACE_MIN_SPANS": "1",
+    })
+    (work_dir / "session").mkdir(exist_ok=True)
+
+    print(f"夹具站点: {site.base_url}  模型桩服务: {stub.base_url}  工作目录: {work_dir}")
+    try:
+        results = asyncio.run(run_all(args, site, stub))
+    finally:
+        site.stop()
+        stub.stop()
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "git_commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "config": {
+            "iterations": args.iterations,
+            "latency_ms": args.latency_ms,
+            "jitter_ms": args.jitter_ms,
+            "xhr_delay_ms": args.xhr_delay_ms,
+            "execute": not args.no_execute,
+            "recordings": os.path.relpath(args.recordings, BACKEND_DIR),
+        },
+        "modes": results,
+        "stub_calls": backend.stats,
+        "stub_unmatched": len(backend.unmatched),
+    }
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{report['git_commit']}_{datetime.now():%Y%m%d_%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    print("\n" + "=" * 60)
+    print("基准测试结果")
+    print("=" * 60)
+    for mode, result in results.items():
+        if result["status"] == "skipped":
+            print(f"{mode:14s} 跳过: {result['reason']}")
+            continue
+        gen = result["generation"] or {}
+        exe = result["execution"] or {}
+        print(f"{mode:14s} 生成 {result['generated_scripts']} 个, 吞吐 {result['generation_throughput_per_min']}/min, "
+              f"生成 p50 {gen.get('p50_ms')}ms, 执行 p50 {exe.get('p50_ms')}ms")
+        for error in result["errors"][:3]:
+            print(f"{'':14s} ⚠️ {error[:160]}")
+    print(f"结果已保存: {output}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""
+OpenAI 兼容的本地模型桩服务
+
+实现 POST /v1/chat/completions，按以下顺序给出回复：
+1. 录制回放：请求（模型 + 消息文本，图片忽略）的哈希命中录制文件中的 recordings
+2. 规则匹配：按顺序匹配 rules，第一条命中的规则给出回复
+3. 默认回复：default_response
+
+每个回复都会按配置的延迟（全局 latency_ms ± jitter_ms，或规则自带的 latency_ms）
+等待后返回，用来模拟真实模型的耗时。
+
+规则字段：
+- name:       规则名称，用于统计
+- model:      "llm" / "vl"（带图片或模型名含 vl 的请求视为 vl），省略表示不限
+- contains:   消息文本必须全部包含的子串列表
+- action:     对提示词中的操作描述做正则匹配（代码生成的 <Action>、computer-use 的目标元素、
+              agent-browser 的“要执行的操作”）
+- response:   字符串或 JSON 对象；字符串中的 {ref:名称} 会替换为快照里该名称元素的 @eN 引用
+- latency_ms: 该规则的固定延迟
+
+录制模式（--record --upstream URL）会把请求转发给真实服务，并把回复写入录制文件，
+之后即可离线回放。
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+DEFAULT_RECORDINGS = Path(__file__).parent / "recordings" / "fixture_site.json"
+
+_ACTION_PATTERNS = [
+    re.compile(r"<Action>:\s*\n(.*?)\n---", re.S),
+    re.compile(r'找到并定位这个元素："(.*?)"'),
+    re.compile(r"要执行的操作：(.*)"),
+]
+_REF_PATTERNS = [
+    '@(e\\d+)\\s+\\w+\\s+"{name}"',
+    '\\w+\\s+"{name}"[^\\n]*\\[ref=(e\\d+)\\]',
+]
+
+
+def _message_text(messages: List[Dict[str, Any]]) -> (str, bool):
+    """拼接消息中的文本，返回 (文本, 是否带图片)"""
+    parts, has_image = [], False
+    for message in messages:
+        content = message.get("content", "")
+        if isinstance(content, list):
+            for item in content:
+                if item.get("type") == "text":
+                    parts.append(item.get("text", ""))
+                elif item.get("type") == "image_url":
+                    has_image = True
+        else:
+            parts.append(str(content))
+    return "\n".join(parts), has_image
+
+
+def request_key(model: str, messages: List[Dict[str, Any]]) -> str:
+    text, _ = _message_text(messages)
+    return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()[:32]
+
+
+def extract_action(text: str) -> str:
+    for pattern in _ACTION_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            return match.group(1).strip()
+    return ""
+
+
+def _resolve_refs(response: str, text: str) -> str:
+    def replace(match):
+        name = re.escape(match.group(1))
+        for template in _REF_PATTERNS:
+            found = re.search(template.format(name=name), text)
+            if found:
+                return "@" + found.group(1)
+        return ""
+    return re.sub(r"\{ref:([^}]+)\}", replace, response)
+
+
+class StubBackend:
+    """录制/规则数据和统计"""
+
+    def __init__(self, recordings_path: Path = DEFAULT_RECORDINGS, latency_ms: float = 0,
+                 jitter_ms: float = 0, upstream: Optional[str] = None, api_key: str = ""):
+        self.recordings_path = Path(recordings_path)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.upstream = upstream.rstrip("/") if upstream else None
+        self.api_key = api_key
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {}
+        self.unmatched: List[str] = []
+
+        data = {}
+        if self.recordings_path.exists():
+            data = json.loads(self.recordings_path.read_text(encoding="utf-8"))
+        self.recordings: Dict[str, Dict[str, Any]] = data.get("recordings", {})
+        self.rules: List[Dict[str, Any]] = data.get("rules", [])
+        self.default_response: str = data.get("default_response", "{}")
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+
+    def _delay(self, rule: Optional[Dict[str, Any]] = None):
+        latency = rule.get("latency_ms") if rule and "latency_ms" in rule else self.latency_ms
+        if self.jitter_ms:
+            latency += random.uniform(-self.jitter_ms, self.jitter_ms)
+        if latency > 0:
+            time.sleep(latency / 1000)
+
+    def _match_rule(self, text: str, is_vl: bool) -> Optional[Dict[str, Any]]:
+        action = extract_action(text)
+        for rule in self.rules:
+            kind = rule.get("model")
+            if kind == "vl" and not is_vl or kind == "llm" and is_vl:
+                continue
+            if not all(needle in text for needle in rule.get("contains", [])):
+                continue
+            if rule.get("action") and not re.search(rule["action"], action):
+                continue
+            return rule
+        return None
+
+    def _forward(self, payload: Dict[str, Any]) -> str:
+        request = urllib.request.Request(
+            f"{self.upstream}/chat/completions",
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json", "Authorization": f"Bearer {self.api_key}"},
+        )
+        with urllib.request.urlopen(request, timeout=300) as resp:
+            data = json.loads(resp.read())
+        return data["choices"][0]["message"]["content"]
+
+    def complete(self, payload: Dict[str, Any]) -> str:
+        model = payload.get("model", "")
+        messages = payload.get("messages", [])
+        text, has_image = _message_text(messages)
+        is_vl = has_image or "vl" in model.lower()
+        key = request_key(model, messages)
+
+        if self.upstream:
+            content = self._forward(payload)
+            with self._lock:
+                self.recordings[key] = {"model": model, "preview": text[-120:], "response": content}
+                self._save()
+            self._count("recorded")
+            return content
+
+        recorded = self.recordings.get(key)
+        if recorded is not None:
+            self._delay()
+            self._count("recording")
+            return recorded["response"]
+
+        rule = self._match_rule(text, is_vl)
+        self._delay(rule)
+        if rule is None:
+            self._count("default")
+            with self._lock:
+                self.unmatched.append(text[-200:])
+            return self.default_response
+
+        self._count(rule.get("name", "rule"))
+        response = rule["response"]
+        if not isinstance(response, str):
+            response = json.dumps(response, ensure_ascii=False)
+        return _resolve_refs(response, text)
+
+    def _save(self):
+        self.recordings_path.parent.mkdir(parents=True, exist_ok=True)
+        data = {"recordings": self.recordings, "rules": self.rules, "default_response": self.default_response}
+        self.recordings_path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = "E2EStubLLM/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, data, status: int = 200):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        backend: StubBackend = self.server.backend
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json({"object": "list", "data": [{"id": "stub", "object": "model"}]})
+        elif self.path.rstrip("/").endswith("/stats"):
+            self._send_json({"stats": backend.stats, "unmatched": backend.unmatched[-20:]})
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json({"error": "not found"}, 404)
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        backend: StubBackend = self.server.backend
+        content = backend.complete(payload)
+
+        text, _ = _message_text(payload.get("messages", []))
+        prompt_tokens = max(1, len(text) // 4)
+        completion_tokens = max(1, len(content) // 4)
+        self._send_json({
+            "id": f"chatcmpl-stub-{int(time.time() * 1000)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+
+class StubLLMServer:
+    """在后台线程运行的模型桩服务"""
+
+    def __init__(self, backend: StubBackend, host: str = "127.0.0.1", port: int = 0):
+        self.backend = backend
+        self.httpd = ThreadingHTTPServer((host, port), StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.backend = backend
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "StubLLMServer":
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="stub-llm", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的本地模型桩服务")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--recordings", default=str(DEFAULT_RECORDINGS))
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--record", action="store_true", help="转发到真实服务并录制回复")
+    parser.add_argument("--upstream", default="https://dashscope.aliyuncs.com/compatible-mode/v1")
+    parser.add_argument("--api-key", default="")
+    args = parser.parse_args()
+
+    backend = StubBackend(
+        args.recordings, args.latency_ms, args.jitter_ms,
+        upstream=args.upstream if args.record else None, api_key=args.api_key,
+    )
+    server = StubLLMServer(backend, port=args.port).start()
+    print(f"模型桩服务已启动: {server.base_url}（{'录制' if args.record else '回放'}模式）")
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,143 @@
+"""
+API 进程启动耗时基准
+
+通过 `python -X importtime -c "import app.main"` 统计导入耗时，结果写入
+logs/startup_importtime.json。超过阈值或重量级依赖被提前加载时以非零状态退出，
+也可以被 pytest 收集为 test_startup_import_time 用例。
+
+用法:
+    python test_startup_time.py [--runs 5] [--threshold-ms 1500]
+阈值也可通过环境变量 STARTUP_IMPORT_THRESHOLD_MS 设置。
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULT_FILE = os.path.join(BACKEND_DIR, "logs", "startup_importtime.json")
+DEFAULT_THRESHOLD_MS = float(os.getenv("STARTUP_IMPORT_THRESHOLD_MS", "1500"))
+
+# 这些依赖只应在生成/执行接口首次调用时加载
+HEAVY_MODULES = [
+    "langchain_openai",
+    "langchain_core",
+    "openai",
+    "playwright",
+    "lxml",
+    "pytest",
+    "ipytest",
+    "nest_asyncio",
+]
+
+_LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+def measure_once(target: str = "app.main") -> dict:
+    """在子进程中导入一次目标模块，解析 importtime 输出"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+        encoding="utf-8",
+        errors="replace",
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"导入 {target} 失败:\n{proc.stderr[-2000:]}")
+
+    modules = {}
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        modules[name] = {"self_us": int(self_us), "cumulative_us": int(cumulative_us)}
+        # 顶层模块（缩进最小）的累计耗时之和即整个导入耗时
+        if len(indent) == 1:
+            total_us += int(cumulative_us)
+
+    return {
+        "total_ms": total_us / 1000,
+        "target_ms": modules.get(target, {}).get("cumulative_us", 0) / 1000,
+        "modules": modules,
+    }
+
+
+def run_benchmark(runs: int = 5, threshold_ms: float = DEFAULT_THRESHOLD_MS) -> dict:
+    """多次测量取中位数，返回结果并写入 JSON 文件"""
+    samples = [measure_once() for _ in range(runs)]
+    totals = [s["total_ms"] for s in samples]
+    last = samples[-1]["modules"]
+
+    top_modules = sorted(
+        ((name, info["self_us"] / 1000) for name, info in last.items()),
+        key=lambda item: item[1],
+        reverse=True,
+    )[:15]
+    loaded_heavy = [
+        name for name in HEAVY_MODULES
+        if any(mod == name or mod.startswith(name + ".") for mod in last)
+    ]
+
+    result = {
+        "timestamp": datetime.now().isoformat(),
+        "python": sys.version.split()[0],
+        "runs": runs,
+        "threshold_ms": threshold_ms,
+        "total_ms_median": round(statistics.median(totals), 1),
+        "total_ms_min": round(min(totals), 1),
+        "total_ms_max": round(max(totals), 1),
+        "app_main_ms_median": round(statistics.median(s["target_ms"] for s in samples), 1),
+        "module_count": len(last),
+        "top_self_ms": [{"module": name, "self_ms": round(ms, 1)} for name, ms in top_modules],
+        "heavy_modules_loaded": loaded_heavy,
+    }
+    result["passed"] = result["total_ms_median"] <= threshold_ms and not loaded_heavy
+
+    os.makedirs(os.path.dirname(RESULT_FILE), exist_ok=True)
+    with open(RESULT_FILE, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    return result
+
+
+def test_startup_import_time():
+    result = run_benchmark(runs=3)
+    assert not result["heavy_modules_loaded"], f"启动时加载了重量级依赖: {result['heavy_modules_loaded']}"
+    assert result["total_ms_median"] <= result["threshold_ms"], (
+        f"启动导入耗时 {result['total_ms_median']}ms 超过阈值 {result['threshold_ms']}ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API 进程启动导入耗时基准")
+    parser.add_argument("--runs", type=int, default=5, help="测量次数")
+    parser.add_argument("--threshold-ms", type=float, default=DEFAULT_THRESHOLD_MS, help="中位数耗时阈值(毫秒)")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.runs, args.threshold_ms)
+
+    print("=" * 60)
+    print("启动导入耗时基准")
+    print("=" * 60)
+    print(f"总耗时(中位数): {result['total_ms_median']}ms  (min {result['total_ms_min']}ms / max {result['total_ms_max']}ms)")
+    print(f"app.main 累计: {result['app_main_ms_median']}ms，模块数: {result['module_count']}")
+    print(f"阈值: {result['threshold_ms']}ms")
+    print("自身耗时最高的模块:")
+    for item in result["top_self_ms"][:10]:
+        print(f"  {item['self_ms']:>8.1f}ms  {item['module']}")
+    if result["heavy_modules_loaded"]:
+        print(f"❌ 启动时加载了重量级依赖: {', '.join(result['heavy_modules_loaded'])}")
+    print(f"结果已保存: {RESULT_FILE}")
+    print("=" * 60)
+
+    if not result["passed"]:
+        print("❌ 启动耗时预算未通过")
+        sys.exit(1)
+    print("✅ 启动耗时预算通过")
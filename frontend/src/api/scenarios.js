@@ -32,8 +32,9 @@ export const scenariosApi = {
   },
 
   // 执行场景所有用例
-  execute(id) {
-    return api.post(`/scenarios/${id}/execute`)
+  // networkMode: live 正常执行 / record 录制 HAR / replay 回放 HAR
+  execute(id, networkMode = 'live') {
+    return api.post(`/scenarios/${id}/execute`, null, { params: { network_mode: networkMode } })
   },
 
   // 获取场景下的用例列表